@@ -0,0 +1,362 @@
+"""End-to-end benchmark: drive a workflow with synthetic messages and measure throughput, latency and CPU per hop.
+
+The workflow file has the format of etc/workflow.yml, plus two optional sections (see benchmarks/workflows/):
+
+    Generator:   parameters of benchmarks.generator.MessageGenerator (template, cardinality, nxdomain_ratio, seed)
+    StandIns:    dns_latency, misp_latency (seconds per request) and misp_hit_ratio
+
+The processors without a src_queue are replaced by the message generator. All other processors are the real, in-repo
+ones, wired with lib.workflow, but RabbitMQ, redis, DNS and MISP are the stand-ins of benchmarks/standins.py. A sink
+queue is bound behind the last processors. The latency of a message is the time from its generation until it
+arrives in the sink.
+
+Everything runs in one thread, so the CPU time of a hop is exactly the CPU time spent in its message callback
+(decoding, process(), encoding and publishing). Without --rate, the generator sends --batch messages and then waits
+until the workflow is idle (closed loop). With --rate, messages are sent at that rate whether or not the workflow
+keeps up (open loop), so the latency includes the time the messages wait in the queues.
+
+With --trace-rate, the generator samples messages for tracing like a Collector does, and the sink ends their paths
+(see lib/tracing.py).
+
+USAGE example:
+    python -m benchmarks.e2e -f benchmarks/workflows/dns.yml -n 20000 --json var/bench/dns.json
+    python -m benchmarks.e2e -f benchmarks/workflows/dns.yml -n 20000 --trace-rate 0.01 && python -m lib.tracing
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import yaml
+
+from benchmarks.generator import MessageGenerator
+from benchmarks.standins import FakeMISP, FakeRedis, FakeResolver, InMemoryBroker
+from lib.config import use_config_file
+from lib.mq import MQ, Producer
+from lib.processor.pipeline import Pipeline
+from lib.tracing import Tracer
+from lib.utils.cache import Cache, set_cache
+from lib.workflow import LaunchSpec, Workflow, load_processor_class
+
+BENCH_DIR = Path(__file__).resolve().parent
+BENCH_CONFIG = BENCH_DIR / "config.yml"
+SINK = "bench.sink"
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile (p in 0..100) of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(math.ceil(round(p / 100.0 * len(sorted_values), 9)) - 1, 0)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+class Hop:
+    """CPU and wall clock time spent in the message callback of one processor (or fused chain)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.messages = 0
+        self.cpu = 0.0
+        self.wall = 0.0
+        self._busy = False
+
+    def wrap(self, callback):
+        def timed(channel, method, properties, body):
+            c0, t0 = time.process_time(), time.perf_counter()
+            self._busy = True
+            try:
+                callback(channel, method, properties, body)
+            finally:
+                self._busy = False
+                self.cpu += time.process_time() - c0
+                self.wall += time.perf_counter() - t0
+                self.messages += 1
+        return timed
+
+    def wrap_flush(self, flush):
+        """Batching processors (see Processor.batch_size) also work when their batch timer fires."""
+        def timed():
+            if self._busy:                  # a full batch, in the message callback
+                return flush()
+            c0, t0 = time.process_time(), time.perf_counter()
+            try:
+                flush()
+            finally:
+                self.cpu += time.process_time() - c0
+                self.wall += time.perf_counter() - t0
+        return timed
+
+    def report(self) -> dict:
+        n = max(self.messages, 1)
+        return {"messages": self.messages, "cpu_us_per_msg": 1e6 * self.cpu / n, "wall_us_per_msg": 1e6 * self.wall / n}
+
+
+def _uuid_of(msg) -> Optional[str]:
+    if isinstance(msg, dict):
+        return (msg.get("meta") or {}).get("uuid")
+    if isinstance(msg, list) and msg:
+        return _uuid_of(msg[-1])    # processors which (still) return a (found, msg) tuple
+    return None
+
+
+class Bench:
+    """One benchmark setup: the stand-ins, the wired workflow and the measurements. Use it as a context manager, the
+    stand-ins are installed process-wide (MQ.connection_factory, the default config file, the cache, ...) and
+    removed again on exit."""
+
+    def __init__(self, wf: dict, config_file: Path = BENCH_CONFIG, fuse: Optional[bool] = None,
+                 trace_rate: Optional[float] = None):
+        """
+        :param wf: the parsed workflow file
+        :param config_file: the config.yml for the processors
+        :param fuse: override the fuse option of the workflow
+        :param trace_rate: fraction of the generated messages to trace. Default: ``tracing: sample_rate`` of the
+            config file
+        """
+        self.wf = dict(wf)
+        self.trace_rate = trace_rate
+        if fuse is not None:
+            self.wf["Options"] = dict(self.wf.get("Options") or {}, fuse = fuse)
+        self.config_file = config_file
+        standins = self.wf.get("StandIns") or {}
+        self.broker = InMemoryBroker()
+        self.redis = FakeRedis()
+        self.resolver = FakeResolver(latency = standins.get("dns_latency", 0.0))
+        self.generator = MessageGenerator(**(self.wf.get("Generator") or {}))
+        iocs = self.generator.pools["ipv4"][:int(len(self.generator.pools["ipv4"]) * standins.get("misp_hit_ratio", 0))]
+        self.misp = FakeMISP(iocs, latency = standins.get("misp_latency", 0.0))
+        self.hops: Dict[str, Hop] = {}
+        self.sent_at: Dict[str, float] = {}
+        self.latencies: List[float] = []
+        self._stack = ExitStack()
+
+    def _patch(self, obj, attr: str, value):
+        old = getattr(obj, attr)
+        setattr(obj, attr, value)
+        self._stack.callback(setattr, obj, attr, old)
+
+    def __enter__(self) -> "Bench":
+        import lib.config
+        import lib.utils.cache
+        self._patch(MQ, "connection_factory", self.broker.connect)
+        self._stack.callback(use_config_file, lib.config.CONFIG_FILE_PATH_STR)
+        use_config_file(self.config_file)
+        self._stack.callback(set_cache, lib.utils.cache._cache)
+        set_cache(Cache(client = self.redis))
+        os.makedirs("var/log", exist_ok = True)
+        # the processors configure the yellowsub loggers from the benchmark config.yml: undo that on exit
+        root_logger = logging.getLogger("yellowsub")
+        self._stack.callback(self._restore_logger, root_logger, list(root_logger.handlers), root_logger.level,
+                             root_logger.propagate)
+        try:
+            from processors.enrichers.gethostbyname import gethostbyname
+            self._patch(gethostbyname, "get_ips_by_dns_lookup", self.resolver.resolve)
+            self._patch(gethostbyname, "resolver_from_config", lambda config: self.resolver)
+        except ImportError:
+            pass
+        try:
+            from processors.enrichers.mispattributesearcher import mispattributesearcher
+            self._patch(mispattributesearcher, "PyMISP", self.misp)
+        except ImportError:
+            pass
+        try:
+            self._wire()
+        except BaseException:
+            self._stack.close()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+
+    @staticmethod
+    def _restore_logger(logger: logging.Logger, handlers: list, level: int, propagate: bool):
+        for h in list(logger.handlers):
+            if h not in handlers:
+                logger.removeHandler(h)
+                h.close()
+        logger.setLevel(level)
+        logger.propagate = propagate
+
+    def _wire(self):
+        w = Workflow.from_dict(self.wf, known_types = ("generator",))
+        successors = {src for src, dst in w.edges}
+        specs = w.launch_specs()
+
+        # the sink gets everything the last processors of the workflow send out
+        sink_exchanges, wired = set(), []
+        for spec in specs:
+            tail = spec.chain[-1].processor_id if spec.chain else spec.processor_id
+            if spec.src_queue and tail not in successors:
+                if not spec.dst_exchanges:
+                    spec = spec._replace(dst_exchanges = (SINK,))
+                    w.exchanges[SINK] = "fanout"
+                sink_exchanges.update(spec.dst_exchanges)
+            wired.append(spec)
+        mq = MQ("benchmark")
+        mq.connect()
+        w.provision(mq)
+        mq.channel.queue_declare(queue = SINK)
+        for ex in sink_exchanges:
+            mq.channel.queue_bind(queue = SINK, exchange = ex)
+        mq.channel.basic_consume(queue = SINK, on_message_callback = self._sink)
+
+        self.sources: List[Producer] = []
+        self.processors = []
+        for spec in wired:
+            exchange_type = spec.options.get("exchange_type", "fanout")
+            if not spec.src_queue:
+                if spec.dst_exchanges:
+                    producer = Producer(spec.processor_id, spec.dst_exchanges[0], exchange_type, declare = False,
+                                        flow_control = spec.options.get("flow_control"))
+                    producer.dst_exchanges = spec.dst_exchanges
+                    producer.tracer = Tracer(spec.processor_id, sample_rate = self.trace_rate)
+                    self.sources.append(producer)
+                continue
+            p = self._instantiate(spec)
+            p.connect(spec.src_queue, spec.dst_exchanges, exchange_type, spec.options.get("flow_control"))
+            hop = self.hops.setdefault(spec.processor_id, Hop(spec.processor_id))
+            p.consumer.cb_function = hop.wrap(p.consumer.cb_function)
+            if getattr(p, "batch_size", 1) > 1:
+                p.flush = hop.wrap_flush(p.flush)
+            p.start()       # registers the consumer, the broker stand-in does not block
+            self.processors.append(p)
+        if not self.sources:
+            raise ValueError("the workflow has no processor without src_queue for the generator to stand in for")
+        self.sink_tracer = Tracer("bench.sink")
+        self.workflow = w
+
+    @staticmethod
+    def _instantiate(spec: LaunchSpec):
+        if spec.chain:
+            return Pipeline([load_processor_class(m.type)(m.processor_id) for m in spec.chain])
+        return load_processor_class(spec.type)(spec.processor_id)
+
+    def _sink(self, channel, method, properties, body: bytes):
+        trace = self.sink_tracer.begin(getattr(properties, "headers", None))
+        if trace:
+            self.sink_tracer.finish(trace)
+        uid = _uuid_of(json.loads(body))
+        if uid in self.sent_at:
+            self.latencies.append(time.perf_counter() - self.sent_at[uid])
+
+    def _inject(self, hop: Hop):
+        msg = self.generator.message()
+        c0, t0 = time.process_time(), time.perf_counter()
+        self.sent_at[msg["meta"]["uuid"]] = t0
+        for producer in self.sources:
+            trace = producer.tracer.sample()
+            for exchange in producer.dst_exchanges:
+                producer.produce(msg, exchange = exchange, trace = trace)
+        hop.cpu += time.process_time() - c0
+        hop.wall += time.perf_counter() - t0
+        hop.messages += 1
+
+    def run(self, count: int, batch: int = 1, rate: Optional[float] = None) -> dict:
+        """Send count messages through the workflow and return the report."""
+        for hop in self.hops.values():
+            hop.messages, hop.cpu, hop.wall = 0, 0.0, 0.0
+        self.sent_at, self.latencies = {}, []
+        published0, delivered0, dropped0 = self.broker.published, self.broker.delivered, self.broker.dropped
+        source = Hop("generator")
+        broker = self.broker
+        sent = 0
+        c_start, t_start = time.process_time(), time.perf_counter()
+        while sent < count or broker.pending():
+            if rate:
+                due = min(count, int((time.perf_counter() - t_start) * rate) + 1)
+            else:
+                due = sent if broker.pending() else min(count, sent + batch)
+            while sent < due:
+                self._inject(source)
+                sent += 1
+            if not broker.deliver_one() and rate and sent < count:
+                time.sleep(max(t_start + sent / rate - time.perf_counter(), 0))
+        wall = time.perf_counter() - t_start
+        cpu = time.process_time() - c_start
+
+        lat = sorted(self.latencies)
+        return {
+            "workflow": self.wf.get("name", ""),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fused": self.workflow.fuse,
+            "messages": count,
+            "batch": None if rate else batch,
+            "rate": rate,
+            "seconds": wall,
+            "throughput": count / wall if wall else 0.0,
+            "cpu_seconds": cpu,
+            "latency_ms": {"p50": 1e3 * percentile(lat, 50), "p99": 1e3 * percentile(lat, 99),
+                           "p999": 1e3 * percentile(lat, 99.9), "max": 1e3 * (lat[-1] if lat else 0.0),
+                           "arrivals": len(lat)},
+            "hops": dict([("generator", source.report())], **{name: hop.report() for name, hop in self.hops.items()}),
+            "broker": {"published": broker.published - published0, "delivered": broker.delivered - delivered0,
+                       "dropped": broker.dropped - dropped0},
+        }
+
+
+def format_report(r: dict) -> str:
+    """A human readable version of a report."""
+    lines = [
+        "workflow %s (fused: %s), python %s" % (r["workflow"], r["fused"], r["python"]),
+        "%d messages in %.3fs: %.0f msgs/s, %.1f us CPU per message" % (
+            r["messages"], r["seconds"], r["throughput"], 1e6 * r["cpu_seconds"] / max(r["messages"], 1)),
+        "latency  p50 %.3f ms  p99 %.3f ms  p999 %.3f ms  max %.3f ms  (%d arrivals)" % (
+            r["latency_ms"]["p50"], r["latency_ms"]["p99"], r["latency_ms"]["p999"], r["latency_ms"]["max"],
+            r["latency_ms"]["arrivals"]),
+        "%-30s %10s %14s %14s" % ("hop", "messages", "CPU us/msg", "wall us/msg"),
+    ]
+    for name, h in r["hops"].items():
+        lines.append("%-30s %10d %14.1f %14.1f" % (
+            name, h["messages"], h["cpu_us_per_msg"], h.get("wall_us_per_msg", h["cpu_us_per_msg"])))
+    return "\n".join(lines)
+
+
+def load_workflow(file: str) -> dict:
+    with open(file) as f:
+        wf = yaml.safe_load(f)
+    wf.setdefault("name", Path(file).stem)
+    return wf
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'end-to-end throughput and latency benchmark of a workflow')
+    parser.add_argument('-f', '--file', help = "The workflow file.", default = str(BENCH_DIR / "workflows/dns.yml"))
+    parser.add_argument('-c', '--config', help = "The config.yml for the processors.", default = str(BENCH_CONFIG))
+    parser.add_argument('-n', '--count', type = int, default = 10000, help = "number of messages")
+    parser.add_argument('-w', '--warmup', type = int, default = 1000, help = "messages to send before measuring")
+    parser.add_argument('-b', '--batch', type = int, default = 1, help = "messages per burst (closed loop)")
+    parser.add_argument('-r', '--rate', type = float, default = None, help = "messages per second (open loop)")
+    parser.add_argument('--fuse', action = 'store_true', default = None, help = "fuse linear chains")
+    parser.add_argument('--no-fuse', dest = 'fuse', action = 'store_false', help = "do not fuse linear chains")
+    parser.add_argument('--trace-rate', type = float, default = None,
+                        help = "fraction of the messages to trace (default: tracing: sample_rate of the config)")
+    parser.add_argument('--json', help = "also write the report as JSON to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    try:
+        with Bench(load_workflow(args.file), Path(args.config), args.fuse, args.trace_rate) as bench:
+            if args.warmup:
+                bench.run(args.warmup, args.batch, args.rate)
+            report = bench.run(args.count, args.batch, args.rate)
+    except (OSError, ValueError, ImportError) as ex:
+        print("could not run the benchmark. Reason: %s" % str(ex), file = sys.stderr)
+        sys.exit(1)
+    print(format_report(report))
+    if args.json:
+        if args.json == '-':
+            print(json.dumps(report, indent = 2))
+        else:
+            os.makedirs(os.path.dirname(args.json) or ".", exist_ok = True)
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent = 2)
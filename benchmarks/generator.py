@@ -0,0 +1,111 @@
+"""Synthetic messages in the common data format (see lib/dataformat_schema.json) for the benchmarks.
+
+A template is a message in which every string of the form ``{kind}`` is replaced by a generated value:
+
+    uuid     a new UUID per message
+    domain   a domain name, out of a pool of ``cardinality`` names (some of them NXDOMAINs, see ``nxdomain_ratio``)
+    url      http(s) URL on a pooled domain
+    ipv4     an IPv4 address out of a pool of ``cardinality`` addresses
+    md5, sha1, sha256
+             a hash out of a pool of ``cardinality`` hashes
+    word     a random lower case word
+    int      a random integer
+    now      the current time as a STIX timestamp
+
+The pools make the cache hit ratios of the enrichers configurable. The same seed gives the same message stream.
+"""
+
+import random
+import re
+import time
+import uuid
+from typing import Iterator
+
+DEFAULT_TEMPLATE = {
+    "format": "s2-common-data-format",
+    "version": 1,
+    "type": "event",
+    "meta": {"uuid": "{uuid}", "tags": ["benchmark"]},
+    "fqdn": "{domain}",
+    "search_value": "{ipv4}",
+    "hash": "{sha256}",
+    "payload": {
+        "source.fqdn": "{domain}",
+        "source.ip": "{ipv4}",
+        "destination.url": "{url}",
+        "file.sha256": "{sha256}",
+        "time.observation": "{now}",
+    }
+}
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+class MessageGenerator:
+    """Generates messages from a template. See the module docstring."""
+
+    def __init__(self, template: dict = None, cardinality: int = 1000, nxdomain_ratio: float = 0.1, seed: int = 42):
+        """
+        :param template: the message template, DEFAULT_TEMPLATE if None
+        :param cardinality: size of the pools of domains, IPs and hashes
+        :param nxdomain_ratio: fraction of the domains which do not resolve (they end in .invalid)
+        :param seed: seed of the random generator
+        """
+        self.template = template or DEFAULT_TEMPLATE
+        self.rnd = random.Random(seed)
+        cardinality = max(int(cardinality), 1)
+        words = ["".join(self.rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(self.rnd.randint(3, 10)))
+                 for _ in range(max(cardinality, 100))]
+        self.words = words
+        self.pools = {
+            "domain": ["%s.%s" % (w, "invalid" if self.rnd.random() < nxdomain_ratio else
+                                  self.rnd.choice(("com", "net", "org", "example"))) for w in words[:cardinality]],
+            "ipv4": ["%d.%d.%d.%d" % (self.rnd.randint(1, 223), self.rnd.randint(0, 255), self.rnd.randint(0, 255),
+                                      self.rnd.randint(1, 254)) for _ in range(cardinality)],
+            "md5": ["%032x" % self.rnd.getrandbits(128) for _ in range(cardinality)],
+            "sha1": ["%040x" % self.rnd.getrandbits(160) for _ in range(cardinality)],
+            "sha256": ["%064x" % self.rnd.getrandbits(256) for _ in range(cardinality)],
+        }
+
+    def value(self, kind: str, current: dict) -> str:
+        """One value of a kind. current holds the values already picked for this message, so that the same kind
+        gets the same value within one message (the fqdn and the source.fqdn of the default template, say)."""
+        if kind in current:
+            return current[kind]
+        if kind == "uuid":
+            v = str(uuid.UUID(int = self.rnd.getrandbits(128), version = 4))
+        elif kind in self.pools:
+            v = self.rnd.choice(self.pools[kind])
+        elif kind == "url":
+            v = "%s://%s/%s" % (self.rnd.choice(("http", "https")), self.value("domain", current),
+                                self.rnd.choice(self.words))
+        elif kind == "word":
+            v = self.rnd.choice(self.words)
+        elif kind == "int":
+            v = self.rnd.randint(0, 2 ** 31)
+        elif kind == "now":
+            v = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        else:
+            raise ValueError("unknown placeholder {%s} in the message template" % kind)
+        current[kind] = v
+        return v
+
+    def _fill(self, obj, current: dict):
+        if isinstance(obj, dict):
+            return {k: self._fill(v, current) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [self._fill(v, current) for v in obj]
+        if isinstance(obj, str):
+            m = _PLACEHOLDER.fullmatch(obj)
+            if m:
+                return self.value(m.group(1), current)    # keeps the type of int placeholders
+            return _PLACEHOLDER.sub(lambda m: str(self.value(m.group(1), current)), obj)
+        return obj
+
+    def message(self) -> dict:
+        """One new message."""
+        return self._fill(self.template, {})
+
+    def __iter__(self) -> Iterator[dict]:
+        while True:
+            yield self.message()
@@ -0,0 +1,245 @@
+"""Micro-benchmarks of the code every message goes through.
+
+Every case measures one operation: ops/s (best of ``repeat`` timeit runs of at least ``min_time`` seconds each) and
+the memory one call allocates (tracemalloc peak, averaged over a few calls). Redis and the RabbitMQ channel are the
+stand-ins of benchmarks/standins.py, so the numbers are those of yellowsub's own code and the suite runs offline.
+
+The results can be stored as a baseline (--save) and later runs compared against it (--compare): a case whose ops/s
+dropped, or whose allocations grew, by more than --tolerance is flagged and the exit code is 1. Baselines are only
+comparable on the same machine and Python version.
+
+USAGE example:
+    python -m benchmarks.micro --compare benchmarks/baseline.json
+    python -m benchmarks.micro -k dataformat --save benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import timeit
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from benchmarks.e2e import BENCH_CONFIG, BENCH_DIR
+from benchmarks.standins import FakeRedis, InMemoryBroker
+from lib.config import ROOTDIR, use_config_file
+from lib.message import Message
+from lib.mq import MQ, Producer
+
+BASELINE = BENCH_DIR / "baseline.json"
+
+with open(Path(ROOTDIR) / "lib/data_sample.json") as _f:
+    SAMPLE_TEXT = _f.read()
+SAMPLE = json.loads(SAMPLE_TEXT)
+SAMPLE_BYTES = json.dumps(SAMPLE).encode()
+
+# name -> setup function. The setup function returns the operation (a callable without arguments) to measure
+CASES: Dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def case(name: str):
+    """Register a micro-benchmark case."""
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+@contextmanager
+def environment():
+    """The stand-ins for the whole suite: in-memory broker, benchmark config and an initialised yellowsub logger."""
+    with ExitStack() as stack:
+        import lib.config
+        old_factory, old_config = MQ.connection_factory, lib.config.CONFIG_FILE_PATH_STR
+        MQ.connection_factory = InMemoryBroker().connect
+        use_config_file(BENCH_CONFIG)
+        stack.callback(setattr, MQ, "connection_factory", old_factory)
+        stack.callback(use_config_file, old_config)
+        root_logger = logging.getLogger("yellowsub")
+        handler = logging.NullHandler()
+        root_logger.addHandler(handler)
+        stack.callback(root_logger.removeHandler, handler)
+        yield
+
+
+@case("json.dumps")
+def _json_dumps():
+    return lambda: json.dumps(SAMPLE)
+
+
+@case("json.loads")
+def _json_loads():
+    return lambda: json.loads(SAMPLE_BYTES)
+
+
+def _producer() -> Producer:
+    return Producer("micro", "micro.ex", "fanout")     # no queue bound: measures the encoding and the publish call
+
+
+@case("mq.publish.dict")
+def _publish_dict():
+    p = _producer()
+    return lambda: p.produce(SAMPLE)
+
+
+@case("mq.publish.message")
+def _publish_message():
+    p = _producer()
+    msg = Message.from_bytes(SAMPLE_BYTES)          # payload untouched: re-uses the raw payload
+    return lambda: p.produce(msg)
+
+
+@case("processor.convert.json")
+def _convert_json():
+    from lib.processor.processor import Processor
+    p = SimpleNamespace(lazy_decode = False, logger = logging.getLogger("yellowsub"))
+    return lambda: Processor._convert_to_internal_df(p, SAMPLE_BYTES)
+
+
+@case("processor.convert.lazy")
+def _convert_lazy():
+    from lib.processor.processor import Processor
+    p = SimpleNamespace(lazy_decode = True, logger = logging.getLogger("yellowsub"))
+    return lambda: Processor._convert_to_internal_df(p, SAMPLE_BYTES)
+
+
+def _dataformat():
+    from lib.dataformat import DataFormat
+    from lib.utils.cache import Cache
+    d = DataFormat(cache = Cache(client = FakeRedis()))
+    d.load_schema(Path(ROOTDIR) / "lib/dataformat_schema.json")
+    return d
+
+
+@case("dataformat.validate")
+def _validate():
+    d = _dataformat()
+    return lambda: d.validate(SAMPLE_TEXT)
+
+
+@case("dataformat.validate_semantic")
+def _validate_semantic():
+    d = _dataformat()
+    return lambda: d.validate_semantic(SAMPLE)
+
+
+@case("dataformat.dedup")
+def _dedup():
+    d = _dataformat()
+    d.add_to_cache(SAMPLE)
+    return lambda: d.dedup(SAMPLE)
+
+
+@case("cache.set")
+def _cache_set():
+    from lib.utils.cache import Cache
+    c = Cache(client = FakeRedis())
+    return lambda: c.__setitem__("25c9487c-1ae9-11ec-99a3-b3a261e8732d", "1")
+
+
+@case("cache.get")
+def _cache_get():
+    from lib.utils.cache import Cache
+    c = Cache(client = FakeRedis())
+    c["25c9487c-1ae9-11ec-99a3-b3a261e8732d"] = "1"
+    return lambda: c["25c9487c-1ae9-11ec-99a3-b3a261e8732d"]
+
+
+@case("projectutils.get_logger")
+def _get_logger():
+    from lib.utils.projectutils import ProjectUtils
+    return lambda: ProjectUtils.get_logger("GetHostByName.micro")
+
+
+def measure(fn: Callable[[], object], min_time: float = 0.2, repeat: int = 5, alloc_calls: int = 20) -> dict:
+    """ops/s and allocated bytes per call of fn."""
+    timer = timeit.Timer(fn)
+    number, t = timer.autorange()
+    number = max(int(number * min_time / max(t, 1e-9)), 1)
+    best = min(timer.repeat(repeat = repeat, number = number)) / number
+
+    fn()        # warm caches, so they don't count as allocations
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(alloc_calls):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            fn()
+            total += tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_sec": 1.0 / best, "us_per_op": 1e6 * best, "alloc_bytes": total / alloc_calls}
+
+
+def run(names: List[str] = None, min_time: float = 0.2, repeat: int = 5) -> dict:
+    """Run the cases (all of them by default) and return the results."""
+    results = {}
+    with environment():
+        for name in names or CASES:
+            results[name] = measure(CASES[name](), min_time, repeat)
+    return {"python": platform.python_version(), "platform": platform.platform(), "results": results}
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """Return one line per regression of current against baseline: ops/s lower or allocations higher than tolerance
+    (a fraction) allows."""
+    regressions = []
+    for name, now in current["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        if now["ops_per_sec"] < before["ops_per_sec"] * (1 - tolerance):
+            regressions.append("%s: %.0f ops/s, baseline %.0f ops/s (%+.1f%%)" % (
+                name, now["ops_per_sec"], before["ops_per_sec"],
+                100.0 * (now["ops_per_sec"] / before["ops_per_sec"] - 1)))
+        # a few bytes of slack: tiny allocations jitter
+        if now["alloc_bytes"] > before["alloc_bytes"] * (1 + tolerance) + 64:
+            regressions.append("%s: %.0f bytes allocated per call, baseline %.0f"
+                               % (name, now["alloc_bytes"], before["alloc_bytes"]))
+    return regressions
+
+
+def format_results(current: dict, baseline: dict = None) -> str:
+    lines = ["%-30s %14s %12s %14s %10s" % ("case", "ops/s", "us/op", "alloc B/call", "vs base")]
+    for name, r in current["results"].items():
+        before = (baseline or {}).get("results", {}).get(name)
+        change = "%+.1f%%" % (100.0 * (r["ops_per_sec"] / before["ops_per_sec"] - 1)) if before else ""
+        lines.append("%-30s %14.0f %12.2f %14.0f %10s" % (name, r["ops_per_sec"], r["us_per_op"], r["alloc_bytes"],
+                                                          change))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'micro-benchmarks of the per-message hot paths')
+    parser.add_argument('-k', '--keyword', help = "only run the cases whose name contains this")
+    parser.add_argument('--min-time', type = float, default = 0.2, help = "seconds per timing run")
+    parser.add_argument('--repeat', type = int, default = 5, help = "timing runs per case (the best one counts)")
+    parser.add_argument('--compare', help = "baseline JSON to compare against", nargs = '?', const = str(BASELINE))
+    parser.add_argument('--tolerance', type = float, default = 0.1, help = "allowed regression (fraction)")
+    parser.add_argument('--save', help = "store the results as baseline JSON", nargs = '?', const = str(BASELINE))
+    args = parser.parse_args()
+
+    names = [n for n in CASES if not args.keyword or args.keyword in n]
+    current = run(names, args.min_time, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if (baseline.get("python"), baseline.get("platform")) != (current["python"], current["platform"]):
+            print("note: the baseline was measured on %s / Python %s"
+                  % (baseline.get("platform"), baseline.get("python")), file = sys.stderr)
+    print(format_results(current, baseline))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent = 2, sort_keys = True)
+    if baseline:
+        regressions = compare(current, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line, file = sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,668 @@
+"""Local stand-ins for the services the processors talk to, so benchmarks run on one machine without any of them.
+
+  * InMemoryBroker: RabbitMQ. Plugs into lib.mq via MQ.connection_factory. Its connections and channels implement
+    the part of pika's BlockingConnection / BlockingChannel API which lib.mq, lib.workflow and lib.flowcontrol use.
+    Consumption is driven by the benchmark (deliver_one()), start_consuming() returns immediately.
+  * FakeRedis: redis, for lib.utils.cache.Cache(client = FakeRedis()).
+  * FakeResolver: DNS. Deterministic answers (and NXDOMAINs) for any name, with an optional simulated round trip.
+    Implements the interface of processors/enrichers/gethostbyname/resolver.py:Resolver.
+  * StubDNSServer: the same answers from a real DNS server on a local UDP and TCP port, for the resolver itself.
+  * FakeMISP: the part of the PyMISP API which the MISP enrichers use.
+  * FakeMISPServer: the same attribute searches over HTTP (POST /attributes/restSearch), for MISP REST clients.
+  * StubElasticsearch: the _search and _msearch APIs of Elasticsearch over a list of documents.
+  * FakeCensysServer: the account, host search and host names APIs of Censys Search v2, with a query quota.
+
+They model the interfaces, not the performance of the real services: a benchmark run with them measures the cost of
+yellowsub's own code (plus the simulated latencies).
+"""
+
+import base64
+import hashlib
+import heapq
+import http.server
+import ipaddress
+import json
+import re
+import select
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import pika.exceptions
+
+
+def _topic_matches(pattern: str, key: str) -> bool:
+    """AMQP topic matching: '*' is exactly one word, '#' is zero or more words."""
+    p, k = pattern.split("."), key.split(".")
+
+    def match(i: int, j: int) -> bool:
+        if i == len(p):
+            return j == len(k)
+        if p[i] == "#":
+            return any(match(i + 1, jj) for jj in range(j, len(k) + 1))
+        return j < len(k) and (p[i] == "*" or p[i] == k[j]) and match(i + 1, j + 1)
+
+    return match(0, 0)
+
+
+def _headers_match(arguments: dict, headers: Optional[dict]) -> bool:
+    headers = headers or {}
+    wanted = {k: v for k, v in (arguments or {}).items() if not k.startswith("x-")}
+    hits = [k in headers and headers[k] == v for k, v in wanted.items()]
+    return any(hits) if (arguments or {}).get("x-match") == "any" else all(hits)
+
+
+class _Queue:
+    def __init__(self, name: str, arguments: dict = None):
+        self.name = name
+        self.arguments = arguments or {}
+        self.messages = deque()
+        self.consumers: List[Callable] = []
+        self.next_consumer = 0
+
+
+class InMemoryBroker:
+    """A single-threaded in-memory AMQP broker with fanout, direct, topic and headers exchanges."""
+
+    def __init__(self):
+        self.exchanges: Dict[str, str] = {}
+        self.bindings: Dict[str, list] = {}        # exchange -> [(queue, routing_key, arguments)]
+        self.queues: Dict[str, _Queue] = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self._delivery_tag = 0
+        self._rr = deque()                          # queues with consumers, round robin
+        self._timers: List[list] = []               # [due, callback], see InMemoryConnection.call_later()
+
+    def connect(self, parameters = None) -> "InMemoryConnection":
+        """For lib.mq.MQ.connection_factory."""
+        return InMemoryConnection(self)
+
+    def route(self, exchange: str, routing_key: str, headers: Optional[dict]) -> List[str]:
+        if exchange == "":
+            return [routing_key] if routing_key in self.queues else []
+        ex_type = self.exchanges.get(exchange)
+        if ex_type is None:
+            raise pika.exceptions.ChannelClosedByBroker(404, "NOT_FOUND - no exchange '%s'" % exchange)
+        queues = []
+        for queue, key, arguments in self.bindings.get(exchange, []):
+            if ex_type == "fanout":
+                matches = True
+            elif ex_type == "direct":
+                matches = key == routing_key
+            elif ex_type == "topic":
+                matches = _topic_matches(key or "", routing_key)
+            else:
+                matches = ex_type == "headers" and _headers_match(arguments, headers)
+            if matches:
+                if queue not in queues:
+                    queues.append(queue)
+        return queues
+
+    def publish(self, exchange: str, routing_key: str, body: bytes, properties = None, confirm: bool = False):
+        self.published += 1
+        headers = getattr(properties, "headers", None)
+        for name in self.route(exchange, routing_key, headers):
+            q = self.queues[name]
+            limit = q.arguments.get("x-max-length")
+            if limit is not None and len(q.messages) >= limit:
+                if q.arguments.get("x-overflow", "drop-head") == "drop-head":
+                    q.messages.popleft()
+                else:
+                    self.dropped += 1
+                    if confirm:
+                        raise pika.exceptions.NackError([])
+                    continue
+            q.messages.append((exchange, routing_key, body, properties))
+
+    def pending(self) -> int:
+        """Number of messages waiting in queues which have consumers, and of timers not fired yet."""
+        return sum(len(q.messages) for q in self.queues.values() if q.consumers) + len(self._timers)
+
+    def deliver_one(self) -> bool:
+        """Deliver one message to one consumer (queues and consumers round robin). If no message is waiting, fire
+        the next timer right away. False if there was nothing to do."""
+        if not self._deliver() and not self._fire_timer():
+            return False
+        return True
+
+    def _fire_timer(self) -> bool:
+        if not self._timers:
+            return False
+        timer = min(self._timers, key = lambda t: t[0])
+        self._timers = [t for t in self._timers if t is not timer]
+        timer[1]()
+        return True
+
+    def _deliver(self) -> bool:
+        for _ in range(len(self._rr)):
+            q = self._rr[0]
+            self._rr.rotate(-1)
+            if q.messages:
+                exchange, routing_key, body, properties = q.messages.popleft()
+                callback = q.consumers[q.next_consumer % len(q.consumers)]
+                q.next_consumer += 1
+                self._delivery_tag += 1
+                self.delivered += 1
+                method = SimpleNamespace(delivery_tag = self._delivery_tag, exchange = exchange,
+                                         routing_key = routing_key, redelivered = False)
+                callback(None, method, properties or SimpleNamespace(headers = None), body)
+                return True
+        return False
+
+    def drain(self) -> int:
+        """Deliver until all queues with consumers are empty. Returns the number of deliveries."""
+        n = 0
+        while self.deliver_one():
+            n += 1
+        return n
+
+
+class InMemoryChannel:
+    """The pika BlockingChannel API subset on an InMemoryBroker."""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+        self.confirm = False
+        self.is_closed = False
+        self.is_open = True
+
+    def exchange_declare(self, exchange: str, exchange_type: str = "direct", **kwargs):
+        if self.broker.exchanges.setdefault(exchange, exchange_type) != exchange_type:
+            raise pika.exceptions.ChannelClosedByBroker(406, "PRECONDITION_FAILED - exchange type of '%s'" % exchange)
+
+    def queue_declare(self, queue: str = "", passive: bool = False, arguments: dict = None, **kwargs):
+        if passive and queue not in self.broker.queues:
+            raise pika.exceptions.ChannelClosedByBroker(404, "NOT_FOUND - no queue '%s'" % queue)
+        q = self.broker.queues.setdefault(queue, _Queue(queue, arguments))
+        return SimpleNamespace(method = SimpleNamespace(queue = queue, message_count = len(q.messages),
+                                                        consumer_count = len(q.consumers)))
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str = None, arguments: dict = None, **kwargs):
+        self.broker.bindings.setdefault(exchange, []).append((queue, routing_key, arguments))
+
+    def basic_qos(self, **kwargs):
+        pass
+
+    def confirm_delivery(self):
+        self.confirm = True
+
+    def basic_publish(self, exchange: str, routing_key: str, body: bytes, properties = None, mandatory: bool = False):
+        self.broker.publish(exchange, routing_key, body, properties, self.confirm)
+
+    def basic_consume(self, queue: str, on_message_callback: Callable, auto_ack: bool = False, **kwargs):
+        q = self.broker.queues[queue]
+        q.consumers.append(on_message_callback)
+        if q not in self.broker._rr:
+            self.broker._rr.append(q)
+
+    def start_consuming(self):
+        """Returns right away: InMemoryBroker.deliver_one() drives the consumers."""
+
+    def stop_consuming(self):
+        pass
+
+    def close(self):
+        self.is_closed, self.is_open = True, False
+
+
+class InMemoryConnection:
+    """The pika BlockingConnection API subset on an InMemoryBroker."""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+        self.is_open = True
+
+    def channel(self) -> InMemoryChannel:
+        return InMemoryChannel(self.broker)
+
+    def add_on_connection_blocked_callback(self, callback):
+        pass
+
+    def add_on_connection_unblocked_callback(self, callback):
+        pass
+
+    def add_callback_threadsafe(self, callback):
+        callback()
+
+    def call_later(self, delay: float, callback):
+        timer = [time.monotonic() + delay, callback]
+        self.broker._timers.append(timer)
+        return timer
+
+    def remove_timeout(self, timer):
+        self.broker._timers = [t for t in self.broker._timers if t is not timer]
+
+    def process_data_events(self, time_limit: float = 0):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeRedis:
+    """The subset of redis.StrictRedis (with decode_responses = True) which lib.utils.cache.Cache uses."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.data: Dict[str, object] = {}
+        self.expires: Dict[str, float] = {}
+        self.clock = clock
+
+    def _alive(self, key: str) -> bool:
+        if key in self.expires and self.expires[key] <= self.clock():
+            del self.data[key], self.expires[key]
+        return key in self.data
+
+    def get(self, key: str):
+        return self.data[key] if self._alive(key) else None
+
+    def set(self, key: str, value) -> bool:
+        self.data[key] = str(value)
+        self.expires.pop(key, None)
+        return True
+
+    def expire(self, key: str, seconds: int) -> bool:
+        if not self._alive(key):
+            return False
+        self.expires[key] = self.clock() + seconds
+        return True
+
+    def exists(self, key: str) -> int:
+        return int(self._alive(key))
+
+    def hset(self, name, key, value) -> int:
+        self.data.setdefault(name if isinstance(name, str) else name.decode(), {})[key] = value
+        return 1
+
+    def info(self, section: str = None) -> dict:
+        return {"db2": {"keys": len(self.data)}}
+
+    def flushdb(self) -> bool:
+        self.data.clear()
+        self.expires.clear()
+        return True
+
+
+def _fake_address(fqdn: str, qtype: int = 1) -> str:
+    n = int.from_bytes(hashlib.blake2b(fqdn.encode(), digest_size = 4).digest(), "big")
+    if qtype == 28:
+        return str(ipaddress.IPv6Address((0x20010db8 << 96) | n))                   # 2001:db8::/32 (RFC 3849)
+    return str(ipaddress.IPv4Address((198 << 24) | (18 << 16) | (n & 0x1ffff)))    # 198.18.0.0/15 (RFC 2544)
+
+
+class FakeResolver:
+    """Deterministic DNS: every name under one of the nxdomain_suffixes does not exist, every other name has one A
+    record derived from a hash of the name."""
+
+    def __init__(self, latency: float = 0.0, nxdomain_suffixes = (".invalid",)):
+        """
+        :param latency: simulated round trip time per lookup (seconds)
+        :param nxdomain_suffixes: names ending in one of these get no answer
+        """
+        self.latency = latency
+        self.nxdomain_suffixes = tuple(nxdomain_suffixes)
+        self.queries = 0
+
+    def resolve(self, fqdn: str, port = None) -> List[str]:
+        """Same signature and result as processors.enrichers.gethostbyname.gethostbyname.get_ips_by_dns_lookup()."""
+        self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self._answer(fqdn)
+
+    def _answer(self, fqdn: str) -> List[str]:
+        if not fqdn or fqdn.endswith(self.nxdomain_suffixes):
+            return []
+        return [_fake_address(fqdn)]
+
+    def resolve_many(self, fqdns) -> Dict[str, List[str]]:
+        """All names concurrently: one simulated round trip for the whole batch."""
+        fqdns = set(fqdns)
+        self.queries += len(fqdns)
+        if self.latency and fqdns:
+            time.sleep(self.latency)
+        return {fqdn: self._answer(fqdn) for fqdn in fqdns}
+
+    def close(self):
+        pass
+
+
+class StubDNSServer:
+    """A DNS server on 127.0.0.1 (UDP and TCP, same port) with the answers of FakeResolver: one A and one AAAA
+    record per name, NXDOMAIN (with a SOA record) for names under the nxdomain_suffixes. Answers are sent after
+    ``latency`` seconds without blocking other queries. UDP answers for names in ``truncate`` have the TC bit set
+    and no records, so clients must ask again over TCP. Use as a context manager."""
+
+    def __init__(self, ttl: int = 300, negative_ttl: int = 60, latency: float = 0.0,
+                 nxdomain_suffixes = (".invalid",), truncate = ()):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.latency = latency
+        self.nxdomain_suffixes = tuple(nxdomain_suffixes)
+        self.truncate = set(truncate)
+        self.queries = {"udp": 0, "tcp": 0}
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(("127.0.0.1", 0))
+        self.port = self.udp.getsockname()[1]
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind(("127.0.0.1", self.port))
+        self.tcp.listen(16)
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target = self._serve_udp, daemon = True),
+                         threading.Thread(target = self._serve_tcp, daemon = True)]
+
+    @property
+    def address(self) -> str:
+        return "127.0.0.1:%d" % self.port
+
+    def __enter__(self) -> "StubDNSServer":
+        for t in self._threads:
+            t.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        for t in self._threads:
+            t.join(5)
+        self.udp.close()
+        self.tcp.close()
+
+    def answer(self, query: bytes, tcp: bool = False) -> bytes:
+        qid, flags = struct.unpack_from("!HH", query, 0)
+        end = 12
+        while query[end]:
+            end += query[end] + 1
+        question = query[12:end + 5]
+        labels, i = [], 12
+        while query[i]:
+            labels.append(query[i + 1:i + 1 + query[i]].decode("ascii").lower())
+            i += query[i] + 1
+        name = ".".join(labels)
+        qtype = struct.unpack_from("!H", query, end + 1)[0]
+        answers, authority, rcode, tc = [], [], 0, 0
+        if name in self.truncate and not tcp:
+            tc = 0x0200
+        elif name.endswith(self.nxdomain_suffixes):
+            rcode = 3
+        elif qtype in (1, 28):
+            rdata = ipaddress.ip_address(_fake_address(name, qtype)).packed
+            answers.append(struct.pack("!HHHIH", 0xc00c, qtype, 1, self.ttl, len(rdata)) + rdata)
+        if rcode or (not answers and not tc):
+            soa = b"\x02ns\x07invalid\x00\x0ahostmaster\x07invalid\x00" + \
+                struct.pack("!IIIII", 1, 3600, 600, 86400, self.negative_ttl)
+            authority.append(struct.pack("!HHHIH", 0xc00c, 6, 1, self.ttl, len(soa)) + soa)
+        header = struct.pack("!HHHHHH", qid, 0x8180 | tc | rcode | (flags & 0x0100), 1, len(answers),
+                             len(authority), 0)
+        return header + question + b"".join(answers + authority)
+
+    def _serve_udp(self):
+        due = []        # (time, sequence, answer, address)
+        seq = 0
+        while not self._stop.is_set():
+            timeout = 0.05 if not due else max(min(due[0][0] - time.monotonic(), 0.05), 0)
+            if select.select([self.udp], [], [], timeout)[0]:
+                query, addr = self.udp.recvfrom(4096)
+                self.queries["udp"] += 1
+                seq += 1
+                heapq.heappush(due, (time.monotonic() + self.latency, seq, self.answer(query), addr))
+            while due and due[0][0] <= time.monotonic():
+                _, _, data, addr = heapq.heappop(due)
+                self.udp.sendto(data, addr)
+
+    def _serve_tcp(self):
+        while not self._stop.is_set():
+            if not select.select([self.tcp], [], [], 0.05)[0]:
+                continue
+            conn, _ = self.tcp.accept()
+            with conn:
+                conn.settimeout(2)
+                try:
+                    length = struct.unpack("!H", conn.recv(2))[0]
+                    query = b""
+                    while len(query) < length:
+                        query += conn.recv(length - len(query))
+                    self.queries["tcp"] += 1
+                    data = self.answer(query, tcp = True)
+                    conn.sendall(struct.pack("!H", len(data)) + data)
+                except (OSError, struct.error):
+                    pass
+
+
+class FakeMISP:
+    """The part of pymisp.PyMISP which the MISP enrichers use: attribute searches against a fixed set of IOCs, one
+    attribute per IOC. Supports the value, timestamp, limit / page and deleted filters (``last`` is ignored)."""
+
+    def __init__(self, iocs = (), latency: float = 0.0, clock: Callable[[], float] = time.time):
+        self.attributes: Dict[str, dict] = {}        # by value
+        self.latency = latency
+        self.clock = clock
+        self.searches = 0
+        for value in iocs:
+            self.add(value)
+
+    def __call__(self, url = None, key = None, ssl = None, out_type = None, *args, **kwargs) -> "FakeMISP":
+        """Stands in for the PyMISP class itself: PyMISP(url, key, ...) returns this instance."""
+        return self
+
+    def add(self, value: str, deleted: bool = False) -> dict:
+        """Add or change (or delete) the attribute of value. Its timestamp is the current time."""
+        old = self.attributes.pop(value, None)
+        att = {"id": old["id"] if old else str(len(self.attributes) + 1), "event_id": "1", "type": "other",
+               "category": "Other", "value": value, "timestamp": str(int(self.clock())), "deleted": deleted}
+        self.attributes[value] = att            # changed attributes move to the end, as with an ordered timestamp
+        return att
+
+    def search(self, controller: str = "attributes", return_format: str = "json", value = None, timestamp = None,
+               limit: int = None, page: int = 1, deleted = 0, **kwargs) -> dict:
+        self.searches += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if value is not None:
+            found = [self.attributes[v] for v in (value if isinstance(value, (list, tuple)) else [value])
+                     if v in self.attributes]
+        else:
+            found = list(self.attributes.values())
+        if timestamp is not None:
+            found = [a for a in found if int(a["timestamp"]) >= int(timestamp)]
+        if deleted not in (1, [0, 1]):
+            found = [a for a in found if not a["deleted"]]
+        if limit:
+            found = found[(page - 1) * limit:page * limit]
+        return {"Attribute": found}
+
+
+class LocalJSONServer:
+    """An HTTP/1.1 server with keep-alive on 127.0.0.1 for the JSON APIs below. Subclasses implement
+    answer(method, path, headers, body) -> (status, payload, extra headers); payload is JSON-encoded unless it is
+    bytes. Use as a context manager."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                server.connections += 1
+
+            def _handle(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                status, payload, headers = server.answer(self.command, self.path, self.headers, body)
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target = self.httpd.serve_forever, args = (0.05,), daemon = True)
+
+    def answer(self, method: str, path: str, headers, body: bytes):
+        raise NotImplementedError
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:%d/" % self.httpd.server_address[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join(5)
+
+
+class FakeMISPServer(LocalJSONServer):
+    """A MISP REST API which answers POST /attributes/restSearch with the matches of a FakeMISP. A request with a
+    wrong API key gets a 403, one with more than ``max_values`` values a 413."""
+
+    def __init__(self, iocs = (), key: str = "fake-misp-key", latency: float = 0.0, max_values: int = 1000,
+                 clock: Callable[[], float] = time.time):
+        super().__init__(latency)
+        self.misp = FakeMISP(iocs, clock = clock)
+        self.key = key
+        self.max_values = max_values
+        self.values: List[int] = []         # number of values of every search
+
+    def answer(self, method: str, path: str, headers, body: bytes):
+        if path != "/attributes/restSearch":
+            return 404, {"message": "not found"}, None
+        if headers.get("Authorization") != self.key:
+            return 403, {"message": "Authentication failed."}, None
+        params = json.loads(body)
+        params.pop("returnFormat", None)
+        value = params.get("value")
+        if value is not None:
+            values = value if isinstance(value, list) else [value]
+            if len(values) > self.max_values:
+                return 413, {"message": "too many values"}, None
+            self.values.append(len(values))
+        return 200, {"response": self.misp.search(**params)}, None
+
+
+class StubElasticsearch(LocalJSONServer):
+    """The _search and _msearch APIs of Elasticsearch over a list of documents, for queries of ``term`` / ``terms``
+    clauses (alone or as the should of a bool query) on keyword fields (dotted paths). The index names are ignored."""
+
+    def __init__(self, docs = (), latency: float = 0.0):
+        super().__init__(latency)
+        self.docs = list(docs)
+        self.searches = {"search": 0, "msearch": 0}
+
+    @staticmethod
+    def _values(doc: dict, field: str) -> list:
+        for part in field.split("."):
+            doc = doc.get(part) if isinstance(doc, dict) else None
+        return doc if isinstance(doc, list) else [doc]
+
+    def _matches(self, doc: dict, query: dict) -> bool:
+        if "bool" in query:
+            return any(self._matches(doc, q) for q in query["bool"].get("should", []))
+        if "term" in query:
+            (field, value), = query["term"].items()
+            return value in self._values(doc, field)
+        if "terms" in query:
+            (field, values), = query["terms"].items()
+            return bool(set(values) & set(v for v in self._values(doc, field) if v is not None))
+        if "match_all" in query:
+            return True
+        raise ValueError("unsupported query %r" % query)
+
+    def search(self, body: dict) -> dict:
+        hits = [doc for doc in self.docs if self._matches(doc, body.get("query", {"match_all": {}}))]
+        total = min(len(hits), body["terminate_after"]) if "terminate_after" in body else len(hits)
+        fields = body.get("_source")
+        return {"took": 1, "timed_out": False, "hits": {
+            "total": {"value": total, "relation": "eq"},
+            "hits": [{"_index": "stub", "_id": str(self.docs.index(doc)),
+                      "_source": doc if fields is None else {f.split(".")[0]: doc.get(f.split(".")[0]) for f in fields
+                                                             if f.split(".")[0] in doc}}
+                     for doc in hits[:body.get("size", 10)]]}}
+
+    def answer(self, method: str, path: str, headers, body: bytes):
+        path = path.split("?")[0]
+        try:
+            if path.endswith("/_msearch"):
+                self.searches["msearch"] += 1
+                lines = [json.loads(line) for line in body.decode().splitlines() if line.strip()]
+                return 200, {"responses": [self.search(b) for b in lines[1::2]]}, None
+            if path.endswith("/_search"):
+                self.searches["search"] += 1
+                return 200, self.search(json.loads(body or b"{}")), None
+        except ValueError as ex:
+            return 400, {"error": {"type": "parsing_exception", "reason": str(ex)}, "status": 400}, None
+        return 404, {"error": "no handler for %s" % path, "status": 404}, None
+
+
+class FakeCensysServer(LocalJSONServer):
+    """The Censys Search API: GET /v1/account (the quota), POST /v2/hosts/search for queries of the form
+    ``ip: "a" or ip: "b" ...`` and GET /v2/hosts/<ip>/names. Every search and names request uses one query of the
+    ``allowance``; after that they are answered with a 403 quota_exceeded. A request with wrong credentials gets a
+    401. ``hosts`` maps IPs to the host data of the search hits, ``names`` IPs to their host names."""
+
+    def __init__(self, hosts: Dict[str, dict] = None, names: Dict[str, List[str]] = None, allowance: int = 250,
+                 used: int = 0, resets_at: str = "2100-01-01 00:00:00", api_id: str = "fake-id",
+                 secret: str = "fake-secret", latency: float = 0.0):
+        super().__init__(latency)
+        self.hosts = dict(hosts or {})
+        self.names = dict(names or {})
+        self.allowance = allowance
+        self.used = used
+        self.resets_at = resets_at
+        self.auth = "Basic %s" % base64.b64encode(("%s:%s" % (api_id, secret)).encode()).decode()
+        self.queries = {"search": 0, "names": 0}
+
+    def _quota_exceeded(self):
+        return 403, {"code": 403, "status": "Forbidden", "error_type": "quota_exceeded",
+                     "error": "You have used your full quota for this billing period."}, None
+
+    def answer(self, method: str, path: str, headers, body: bytes):
+        if headers.get("Authorization") != self.auth:
+            return 401, {"code": 401, "status": "Unauthorized", "error": "Unauthorized"}, None
+        path = path.split("?")[0].rstrip("/")
+        if path.endswith("/v1/account"):
+            return 200, {"login": "fake", "quota": {"used": self.used, "allowance": self.allowance,
+                                                    "resets_at": self.resets_at}}, None
+        m = re.search(r"/v2/hosts/([^/]+)/names$", path)
+        if m:
+            if self.used >= self.allowance:
+                return self._quota_exceeded()
+            self.used += 1
+            self.queries["names"] += 1
+            return 200, {"code": 200, "status": "OK",
+                         "result": {"names": self.names.get(m.group(1), []), "links": {"next": ""}}}, None
+        if path.endswith("/v2/hosts/search") and method == "POST":
+            if self.used >= self.allowance:
+                return self._quota_exceeded()
+            self.used += 1
+            self.queries["search"] += 1
+            params = json.loads(body)
+            ips = re.findall(r'ip:\s*"([^"]+)"', params.get("q", ""))
+            hits = [dict(self.hosts[ip], ip = ip) for ip in ips if ip in self.hosts][:int(params.get("per_page", 50))]
+            result = {"query": params.get("q"), "total": len(hits), "hits": hits, "links": {"next": ""}}
+            return 200, {"code": 200, "status": "OK", "result": result}, None
+        return 404, {"code": 404, "status": "Not Found", "error": "no such endpoint %s" % path}, None
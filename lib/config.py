@@ -3,17 +3,155 @@ A simple config loader.
 
 USAGE EXAMPLE:
 
-from config import config
+from lib.config import get_config
 
+config = get_config()                                   # parsed once per process, read-only
 TTL = config['redis'].get('cache_ttl', 24*3600)         # 1 day default
 
+get_config() returns the current snapshot of the config file: nested read-only mappings (and tuples instead of
+lists), so one parsed copy can be shared by everything in the process. ConfigService.check() re-parses the file
+when its mtime or size changed and swaps in a new snapshot; the subscribers (see Processor.reload()) are then called
+with it. Code which wants to modify its copy of the config can still use Config().load(), which returns a dict.
+
 """
 
+import logging
+import os
+import threading
+import time
+import weakref
+from types import MappingProxyType
+from typing import Callable, Dict, List, Mapping, Optional
+
 import yaml
 from lib.utils.projectutils import ProjectUtils
 from pathlib import Path
 
-__all__ = ["ROOTDIR", "CONFIG_FILE_PATH_STR", "Config"]
+__all__ = ["ROOTDIR", "CONFIG_FILE_PATH_STR", "Config", "ConfigService", "config_service", "get_config",
+           "use_config_file", "freeze", "thaw"]
+
+
+def freeze(obj):
+    """Return a read-only copy of a parsed YAML tree: dicts become MappingProxyTypes, lists become tuples."""
+    if isinstance(obj, Mapping):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj):
+    """Return a mutable (dict and list) copy of a frozen tree."""
+    if isinstance(obj, Mapping):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+class ConfigService:
+    """One config file, parsed once and shared by the whole process as an immutable snapshot."""
+
+    snapshot: Mapping = MappingProxyType({})
+    version: int = 0
+
+    def __init__(self, file: Path, poll_interval: float = 2.0):
+        """
+        :param file: the config file
+        :param poll_interval: maybe_check() looks at the file at most every poll_interval seconds
+        """
+        self.file = Path(file)
+        self.poll_interval = poll_interval
+        self.subscribers: List[Callable] = []     # functions, or weakref.WeakMethod of bound methods
+        self._stat = None
+        self._last_poll = time.monotonic()
+        self._lock = threading.Lock()
+        self.check()
+
+    def _parse(self) -> Optional[Mapping]:
+        try:
+            st = os.stat(self.file)
+            if self._stat == (st.st_mtime_ns, st.st_size):
+                return None
+            with open(self.file, 'r') as _f:
+                params = yaml.safe_load(_f)
+        except (OSError, yaml.YAMLError) as ex:
+            # keep running with the last good snapshot
+            logging.error("could not load config file %s. Reason: %s" % (self.file, str(ex)))
+            return None
+        self._stat = (st.st_mtime_ns, st.st_size)
+        return freeze(params or {})
+
+    def check(self) -> bool:
+        """Re-parse the file if it changed. Swaps in the new snapshot, notifies the subscribers and returns True then."""
+        with self._lock:
+            snapshot = self._parse()
+            if snapshot is None:
+                return False
+            self.snapshot = snapshot      # one reference assignment: readers see either the old or the new snapshot
+            self.version += 1
+            subscribers = self._callbacks() if self.version > 1 else []
+        for callback in subscribers:
+            try:
+                callback(snapshot)
+            except Exception as ex:
+                logging.error("config reload of %r failed. Reason: %s" % (callback, str(ex)))
+        return True
+
+    def maybe_check(self) -> bool:
+        """check(), but at most every poll_interval seconds. Cheap enough to call before every message."""
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return False
+        self._last_poll = now
+        return self.check()
+
+    def _callbacks(self) -> List[Callable[[Mapping], None]]:
+        """The live subscribers. Drops the weak ones whose object is gone."""
+        callbacks = []
+        for ref in list(self.subscribers):
+            callback = ref() if isinstance(ref, weakref.WeakMethod) else ref
+            if callback is None:
+                self.subscribers.remove(ref)
+            else:
+                callbacks.append(callback)
+        return callbacks
+
+    def subscribe(self, callback: Callable[[Mapping], None]):
+        """Call callback(snapshot) whenever a changed config file was loaded. A bound method (Processor's, say) is
+        held weakly, so the subscription does not keep its object alive."""
+        if hasattr(callback, "__self__") and hasattr(callback, "__func__"):
+            callback = weakref.WeakMethod(callback)
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Mapping], None]):
+        for ref in list(self.subscribers):
+            if (ref() if isinstance(ref, weakref.WeakMethod) else ref) == callback:
+                self.subscribers.remove(ref)
+
+
+_services: Dict[str, ConfigService] = {}
+_services_lock = threading.Lock()
+
+
+def config_service(file: Path = None) -> ConfigService:
+    """The (process-wide) ConfigService of file, by default the main config file."""
+    key = os.path.abspath(file or CONFIG_FILE_PATH_STR)
+    with _services_lock:
+        if key not in _services:
+            _services[key] = ConfigService(Path(key))
+        return _services[key]
+
+
+def use_config_file(file: Path):
+    """Make file the default config file of this process (see get_config()), for example for tests or benchmarks."""
+    global CONFIG_FILE_PATH_STR
+    CONFIG_FILE_PATH_STR = str(file)
+
+
+def get_config(file: Path = None) -> Mapping:
+    """The current (read-only) snapshot of the config file, by default the main config file."""
+    return config_service(file).snapshot
 
 
 class Config:
@@ -29,12 +167,13 @@ class Config:
         # if no path is supplied get the config from the default location inside the project folder
         if file is None:
             file = Path(ProjectUtils.get_config_path_as_str())
-        try:
-            with open(file, 'r') as _f:
-                self.params = yaml.safe_load(_f)
-        except (OSError, FileNotFoundError) as ex:
-            print("could not load config file %s. Reason: %s" % (file, str(ex)))
-            # FIXME: here, we might also have other exceptions maybe? Catch them!
+        if not Path(file).exists():
+            print("could not load config file %s. Reason: file not found" % (file,))
+            return self.params
+        # parsed once per process (and again only if the file changed), this is just a mutable copy
+        service = config_service(file)
+        service.check()
+        self.params = thaw(service.snapshot)
         return self.params
 
     def store(self, file: Path):
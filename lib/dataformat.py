@@ -4,19 +4,30 @@
 import json
 import logging
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional
 
 import jsonschema
 
-from lib.utils.cache import cache
+from lib.datamodel.validators import get_validator
+from lib.utils.cache import Cache, get_cache
 
 
 class DataFormat:
     """The main DataFormat utility class."""
     schema = None
 
-    def __init__(self):
-        pass
+    def __init__(self, cache: Cache = None):
+        """
+        :param cache: the de-duplication cache. Defaults to the process-wide one (lib.utils.cache.get_cache()), which
+                      is only connected when it is first used
+        """
+        self._cache = cache
+
+    @property
+    def cache(self) -> Cache:
+        if self._cache is None:
+            self._cache = get_cache()
+        return self._cache
 
     def load_schema(self, file: Path):
         """Load the JSON Schema describing the internal data format."""
@@ -45,17 +56,22 @@ class DataFormat:
             return None
 
     def validate_semantic(self, message: dict) -> bool:
-        """Validate semantically: is the contents of the fields OK?"""
-        return True
+        """Validate semantically: is the contents of the fields OK? (IPs, domains, URLs, hashes, timestamps...)
+        See lib/datamodel/validators.py for the checks."""
+        return get_validator().validate(message)
+
+    def validate_semantic_batch(self, messages: Iterable[dict]) -> List[bool]:
+        """Validate many messages semantically. Returns one bool per message."""
+        return get_validator().validate_batch(messages)
 
     def has_been_seen(self, imessage: dict) -> bool:
         """Check if a message has been cached before."""
-        if 'meta' in imessage and imessage['meta']['uuid'] in cache:
+        if 'meta' in imessage and imessage['meta']['uuid'] in self.cache:
             return True
 
     def add_to_cache(self, imessage: dict):
         """Add a message to the cache."""
-        cache[imessage['meta']['uuid']] = 1
+        self.cache[imessage['meta']['uuid']] = 1
 
     def dedup(self, imessage: dict) -> Optional[Dict]:
         """De-duplicate . Returns None if the message has already been seen."""
@@ -0,0 +1,216 @@
+"""Semantic validators for the common observable fields.
+
+The checks are built once from the STIX 2.1 definitions in lib/datamodel/common and lib/datamodel/observables
+(hashes-type.json, timestamp.json, ipv4-addr.json) and compiled into regular expressions. Where a definition only
+names a format (url-regex.json: "uri", domain-name.json: "idn-hostname") or its pattern is not usable (the IPv6
+pattern in ipv6-addr.json), a precompiled equivalent is used instead. Rejecting a malformed indicator costs a few
+microseconds instead of a full JSON schema validation round.
+
+USAGE example:
+    from lib.datamodel.validators import get_validator
+
+    v = get_validator()
+    v.is_url("https://example.com/x")        # True
+    v.validate_payload({"source.ip": "300.1.1.1"})              # False
+    v.validate_batch([msg1, msg2, msg3])      # [True, False, True]
+
+"""
+
+import calendar
+import ipaddress
+import json
+import re
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+__all__ = ["SemanticValidator", "get_validator", "DATAMODEL_DIR"]
+
+DATAMODEL_DIR = Path(__file__).parent
+
+# RFC 3986: scheme ":" [ "//" authority ] path [ "?" query ] [ "#" fragment ]. An authority, if present, is not empty.
+_URL_PATTERN = (r"^[A-Za-z][A-Za-z0-9+.\-]*:"
+                r"(?://(?:[A-Za-z0-9\-._~!$&'()*+,;=:@\[\]]|%[0-9A-Fa-f]{2})+|(?!//))"
+                r"(?:[A-Za-z0-9\-._~!$&'()*+,;=:@/?#\[\]]|%[0-9A-Fa-f]{2})*$")
+# RFC 1123 host names. Underscores are tolerated in all but the top level label (think of _dmarc.example.com).
+_DOMAIN_PATTERN = (r"^(?=.{1,253}\.?$)(?:(?!-)[A-Za-z0-9_\-]{1,63}(?<!-)\.)+"
+                   r"(?!-)(?=[A-Za-z0-9\-]*[A-Za-z])[A-Za-z0-9\-]{1,63}(?<!-)\.?$")
+_EMAIL_PATTERN = r"^[A-Za-z0-9.!#$%&'*+/=?^_`{|}~\-]+@[^@\s]+$"
+
+# some feeds use other spellings for the hash algorithm names of hashes-type.json
+_HASH_ALIASES = {"MD5": "MD5", "SHA1": "SHA-1", "SHA-1": "SHA-1", "SHA256": "SHA-256", "SHA-256": "SHA-256",
+                 "SHA512": "SHA-512", "SHA-512": "SHA-512", "SHA3-256": "SHA3-256", "SHA3-512": "SHA3-512",
+                 "SSDEEP": "SSDEEP", "TLSH": "TLSH"}
+
+
+def _load(path: Path) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _observable_value_pattern(path: Path) -> str:
+    for part in _load(path)["allOf"]:
+        if "properties" in part and "pattern" in part["properties"].get("value", {}):
+            return part["properties"]["value"]["pattern"]
+    raise RuntimeError("no value pattern found in %s" % path)
+
+
+class SemanticValidator:
+    """Precompiled semantic checks for observable fields (URLs, IPs, domains, hashes, timestamps, email addresses)."""
+
+    def __init__(self, datamodel_dir: Path = DATAMODEL_DIR):
+        """
+        @param datamodel_dir: the directory holding the common/ and observables/ STIX definitions
+        @type datamodel_dir: Path
+        """
+        common = datamodel_dir / "common"
+        observables = datamodel_dir / "observables"
+
+        self._url = re.compile(_URL_PATTERN).fullmatch
+        self._domain = re.compile(_DOMAIN_PATTERN).fullmatch
+        self._email = re.compile(_EMAIL_PATTERN).fullmatch
+        self._timestamp = re.compile(_load(common / "timestamp.json")["pattern"]).fullmatch
+        self._ipv4 = re.compile(_observable_value_pattern(observables / "ipv4-addr.json")).fullmatch
+
+        # hashes-type.json: exact algorithm names with a value pattern, plus a catch-all pattern for custom hash keys
+        self._hashes: Dict[str, Callable] = {}
+        self._custom_hash_key = None
+        for key_pattern, spec in _load(common / "hashes-type.json")["patternProperties"].items():
+            name = key_pattern.strip("^$")
+            if re.fullmatch(r"[A-Za-z0-9\-]+", name) and "pattern" in spec:
+                self._hashes[name] = re.compile(spec["pattern"]).fullmatch
+            else:
+                self._custom_hash_key = re.compile(key_pattern).fullmatch
+
+        # payload field name (last dotted component, lower case) -> check. "source.ip" -> is_ip, etc.
+        self.field_checks: Dict[str, Callable] = {
+            "ip": self.is_ip, "ipv4": self.is_ipv4, "ipv6": self.is_ipv6,
+            "fqdn": self.is_domain, "domain": self.is_domain, "domain_name": self.is_domain,
+            "url": self.is_url, "uri": self.is_url,
+            "email": self.is_email,
+            "hashes": self.is_hashes,
+            "md5": self._hash_check("MD5"), "sha1": self._hash_check("SHA-1"), "sha256": self._hash_check("SHA-256"),
+            "sha512": self._hash_check("SHA-512"),
+            "timestamp": self.is_timestamp, "created": self.is_timestamp, "modified": self.is_timestamp,
+            "first_seen": self.is_timestamp, "last_seen": self.is_timestamp,
+        }
+        # STIX cyber observable type -> check of its "value" (or "hashes") property
+        self.observable_checks: Dict[str, Callable] = {
+            "ipv4-addr": lambda o: self.is_ipv4(o.get("value")),
+            "ipv6-addr": lambda o: self.is_ipv6(o.get("value")),
+            "domain-name": lambda o: self.is_domain(o.get("value")),
+            "url": lambda o: self.is_url(o.get("value")),
+            "email-addr": lambda o: self.is_email(o.get("value")),
+            "file": lambda o: "hashes" not in o or self.is_hashes(o["hashes"]),
+        }
+
+    # --- single field checks ---
+
+    def is_url(self, s: str) -> bool:
+        """RFC 3986 URI with a scheme."""
+        return isinstance(s, str) and self._url(s) is not None
+
+    def is_ipv4(self, s: str) -> bool:
+        """IPv4 address, optionally in CIDR notation (ipv4-addr.json)."""
+        return isinstance(s, str) and self._ipv4(s) is not None
+
+    def is_ipv6(self, s: str) -> bool:
+        """IPv6 address, optionally in CIDR notation."""
+        if not isinstance(s, str) or ":" not in s:
+            return False
+        try:
+            ipaddress.IPv6Network(s, strict = False)
+        except ValueError:
+            return False
+        return True
+
+    def is_ip(self, s: str) -> bool:
+        """IPv4 or IPv6 address."""
+        return self.is_ipv4(s) or self.is_ipv6(s)
+
+    def is_domain(self, s: str) -> bool:
+        """Domain name (idn-hostname). Internationalized names are checked in their IDNA form."""
+        if not isinstance(s, str):
+            return False
+        if not s.isascii():
+            try:
+                s = s.encode("idna").decode("ascii")
+            except UnicodeError:
+                return False
+        return self._domain(s) is not None
+
+    def is_email(self, s: str) -> bool:
+        """Email address (local part @ domain)."""
+        if not isinstance(s, str) or self._email(s) is None:
+            return False
+        return self.is_domain(s.rsplit("@", 1)[1])
+
+    def is_timestamp(self, s: str) -> bool:
+        """RFC 3339 timestamp in UTC (timestamp.json), which also must be a valid calendar date."""
+        if not isinstance(s, str) or self._timestamp(s) is None:
+            return False
+        day = int(s[8:10])
+        return day <= 28 or day <= calendar.monthrange(int(s[0:4]), int(s[5:7]))[1]
+
+    def is_hash(self, algorithm: str, value: str) -> bool:
+        """Check a single hash value for the given algorithm (MD5, SHA-1, sha256, ...)."""
+        check = self._hashes.get(_HASH_ALIASES.get(algorithm.upper(), algorithm))
+        if check is None:
+            return self._custom_hash_key(algorithm) is not None and isinstance(value, str)
+        return isinstance(value, str) and check(value) is not None
+
+    def _hash_check(self, algorithm: str) -> Callable:
+        check = self._hashes[algorithm]
+        return lambda s: isinstance(s, str) and check(s) is not None
+
+    def is_hashes(self, d: dict) -> bool:
+        """Hashes dictionary (hashes-type.json): {"MD5": "...", "SHA-256": "..."}."""
+        if not isinstance(d, dict) or not d:
+            return False
+        return all(self.is_hash(k, v) for k, v in d.items())
+
+    # --- messages ---
+
+    def validate_observable(self, obj: dict) -> bool:
+        """Validate a STIX cyber observable object such as {"type": "ipv4-addr", "value": "127.0.0.1"}.
+        Unknown observable types are not checked."""
+        check = self.observable_checks.get(obj.get("type"))
+        return check is None or check(obj)
+
+    def validate_payload(self, payload: dict) -> bool:
+        """Validate the fields of a payload. Fields are matched by the last component of their (dotted) name,
+        so "source.ip" and "destination.ip" are both checked as IP addresses. Unknown fields are not checked."""
+        if not isinstance(payload, dict):
+            return False
+        if "type" in payload and not self.validate_observable(payload):
+            return False
+        checks = self.field_checks
+        for key, value in payload.items():
+            check = checks.get(key.rsplit(".", 1)[-1].lower())
+            if check is not None and value is not None:
+                if isinstance(value, list):
+                    if not all(check(v) for v in value):
+                        return False
+                elif not check(value):
+                    return False
+        return True
+
+    def validate(self, message: Union[dict, "Message"]) -> bool:  # noqa: F821
+        """Validate the payload of a message of the internal data format (a dict or a lib.message.Message)."""
+        payload = message.get("payload")
+        return payload is None or self.validate_payload(payload)
+
+    def validate_batch(self, messages: Iterable[Union[dict, "Message"]]) -> List[bool]:  # noqa: F821
+        """Validate many messages in one go. Returns one bool per message."""
+        validate = self.validate
+        return [validate(m) for m in messages]
+
+
+_validator: Optional[SemanticValidator] = None
+
+
+def get_validator() -> SemanticValidator:
+    """Return the process wide SemanticValidator. The definitions are loaded and compiled on the first call only."""
+    global _validator
+    if _validator is None:
+        _validator = SemanticValidator()
+    return _validator
@@ -0,0 +1,144 @@
+"""Producer side flow control.
+
+A fast producer (a collector, typically) slows down before the queues it feeds grow without bounds:
+
+  * while RabbitMQ blocks the connection (memory or disk alarm), nothing is published. The producer waits for the
+    Connection.Unblocked notification instead of piling up messages in the socket buffer.
+  * the fill level of the downstream queues is polled every ``check_interval`` seconds. Below ``low_watermark`` (a
+    fraction of the queue's x-max-length, or of ``max_depth`` for unlimited queues) there is no delay. Above that, the
+    delay before every publish grows linearly up to ``max_delay`` at ``high_watermark``.
+  * with publisher confirms, a message which the broker refuses (a full queue with x-overflow = reject-publish) is
+    sent again after a back-off which doubles with every refusal and halves with every accepted message. The retry
+    goes to the whole exchange: other queues of a fanout exchange which accepted the message get it a second time,
+    which is why lib/workflow.py refuses such workflows.
+
+Throughput thus degrades gradually to the speed of the slowest consumer instead of running into the broker's alarms.
+See ``flow_control`` in lib/workflow.py.
+"""
+
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+import pika.exceptions
+
+from lib.metrics import REGISTRY
+
+
+class FlowControl:
+    """Throttles the publishing of one (connected) lib.mq.Producer."""
+
+    def __init__(self, producer, queues: Dict[str, Optional[int]] = None, max_depth: int = 100000,
+                 low_watermark: float = 0.5, high_watermark: float = 0.9, max_delay: float = 1.0,
+                 check_interval: float = 1.0, confirm: bool = True, max_retries: int = 100,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        """
+        :param producer: the producer to throttle
+        :param queues: the downstream queues and their x-max-length (None if unlimited)
+        :param max_depth: the depth which counts as full for queues without x-max-length
+        :param low_watermark: fill level (0..1) where throttling starts
+        :param high_watermark: fill level (0..1) where the delay reaches max_delay
+        :param max_delay: longest delay (seconds) before a publish
+        :param check_interval: seconds between two polls of the queue depths
+        :param confirm: enable publisher confirms, so refused messages are retried
+        :param max_retries: give up (and raise) after this many refusals of the same message
+        """
+        if not 0 <= low_watermark < high_watermark <= 1:
+            raise ValueError("flow_control: need 0 <= low_watermark < high_watermark <= 1")
+        self.producer = producer
+        self.queues = {q: limit or max_depth for q, limit in (queues or {}).items()}
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.max_delay = max_delay
+        self.check_interval = check_interval
+        self.max_retries = max_retries
+        self.clock = clock
+        self.sleep = sleep
+        self.blocked = False
+        self.fill = 0.0             # fill level of the fullest downstream queue
+        self.backoff = 0.0          # extra delay after refused messages
+        self._last_check = float('-inf')
+        self._stats_channel = None
+        connection = producer.connection
+        connection.add_on_connection_blocked_callback(self._on_blocked)
+        connection.add_on_connection_unblocked_callback(self._on_unblocked)
+        self.confirm = confirm
+        if confirm:
+            producer.channel.confirm_delivery()
+        self._fill_gauge = REGISTRY.gauge("yellowsub_downstream_fill_ratio",
+                                          "Fill level (0..1) of the fullest downstream queue.", client = producer.id)
+        self._confirm_latency = REGISTRY.histogram("yellowsub_publish_confirm_seconds",
+                                                   "Time until the broker confirmed a publish.", client = producer.id)
+
+    def _on_blocked(self, connection, method_frame):
+        logging.warning("%s: connection blocked by the broker (%s), pausing publishing" %
+                        (self.producer.id, getattr(method_frame.method, 'reason', '')))
+        self.blocked = True
+
+    def _on_unblocked(self, connection, method_frame):
+        logging.info("%s: connection unblocked, resuming publishing" % self.producer.id)
+        self.blocked = False
+
+    def _depth(self, queue: str) -> Optional[int]:
+        # a separate channel: a passive declare of a missing queue closes the channel it is sent on
+        try:
+            if not self._stats_channel or self._stats_channel.is_closed:
+                self._stats_channel = self.producer.connection.channel()
+            return self._stats_channel.queue_declare(queue = queue, passive = True).method.message_count
+        except pika.exceptions.ChannelClosed as ex:
+            logging.warning("%s: can't get the depth of queue %s. Reason: %s" % (self.producer.id, queue, str(ex)))
+            return None
+
+    def check(self):
+        """Poll the depths of the downstream queues (at most every check_interval seconds)."""
+        now = self.clock()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        fill = 0.0
+        for queue, limit in self.queues.items():
+            depth = self._depth(queue)
+            if depth is not None:
+                fill = max(fill, depth / limit)
+        self.fill = fill
+        self._fill_gauge.set(fill)
+
+    def delay(self) -> float:
+        """The delay (in seconds) before the next publish."""
+        if self.fill <= self.low_watermark:
+            d = 0.0
+        elif self.fill >= self.high_watermark:
+            d = self.max_delay
+        else:
+            d = self.max_delay * (self.fill - self.low_watermark) / (self.high_watermark - self.low_watermark)
+        return min(d + self.backoff, self.max_delay)
+
+    def wait(self):
+        """Block while the connection is blocked, then wait for the current delay."""
+        while self.blocked:
+            # dispatches the Connection.Unblocked callback
+            self.producer.connection.process_data_events(time_limit = 0.5)
+        self.check()
+        d = self.delay()
+        if d > 0:
+            self.sleep(d)
+
+    def publish(self, send: Callable[[], None]):
+        """Call send() (one basic_publish) when the flow control allows it. Refused messages are sent again (to all
+        queues of the exchange, not only to the one which refused it)."""
+        for _ in range(self.max_retries):
+            self.wait()
+            t0 = time.perf_counter()
+            try:
+                send()      # with confirms, returns once the broker confirmed (or refused) the message
+            except pika.exceptions.NackError:
+                self.backoff = min(max(self.backoff * 2, 0.01), self.max_delay)
+                self._last_check = float('-inf')        # re-check the depths right away
+                logging.debug("%s: message refused by the broker, retrying in %.3fs" % (self.producer.id,
+                                                                                        self.delay()))
+                continue
+            if self.confirm:
+                self._confirm_latency.observe(time.perf_counter() - t0)
+            self.backoff = self.backoff / 2 if self.backoff > 0.01 else 0.0
+            return
+        raise RuntimeError("message refused %d times by the broker, giving up" % self.max_retries)
@@ -0,0 +1,274 @@
+"""Message: a compact envelope for the internal data format with lazy payload decoding.
+
+The internal data format (see lib/dataformat_schema.json) is a JSON object with the envelope fields
+``format``, ``version``, ``type`` and ``meta`` plus the actual ``payload``. Most processors only look at the
+envelope (``meta.uuid`` for de-duplication, ``type`` for routing) or at a single payload field. A Message therefore
+decodes the envelope eagerly and keeps the payload as raw JSON text until it is accessed for the first time.
+Re-serializing a message whose payload was never touched splices the original payload text back in.
+
+USAGE example:
+    from lib.message import Message
+
+    m = Message.from_bytes(body)
+    if m.meta['uuid'] in seen:                   # payload is still undecoded here
+        return
+    m.payload['source.fqdn']                     # first access decodes the payload
+    producer.produce(m)                          # MQ._publish() calls m.to_bytes()
+
+The reader only checks that the payload text is one balanced JSON value: in the canonical layout (the payload is the
+last member, as Message.to_bytes() writes it) by looking at its brackets alone, once the strings are stripped. Other
+top level members are decoded eagerly, wherever they are.
+"""
+
+import json
+import re
+from typing import Optional, Union
+
+__all__ = ["Message", "ENVELOPE_FIELDS", "routing_headers", "routing_key"]
+
+ENVELOPE_FIELDS = ("format", "version", "type", "meta")
+
+_decoder = json.JSONDecoder()
+_scan_once = _decoder.scan_once                 # the C accelerated scanner, if available
+_WS = re.compile(r'[ \t\n\r]*')
+# everything up to the next bracket or unterminated string; complete strings are skipped as a whole
+_SKIP = re.compile(r'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*')
+_CLOSING = {'{': '}', '[': ']'}
+_NOT_STRUCTURE = bytes(c for c in range(256) if c not in b'"\\{}[]')
+_CLOSING_BYTES = {ord('{'): ord('}'), ord('['): ord(']')}
+_UNDECODED = object()
+
+
+def _is_one_value(raw: str) -> bool:
+    """True if raw (an object or array) is exactly one balanced JSON value. Fast: strips everything but the
+    brackets. False if that is not enough to tell (escapes or brackets in strings): use _value_end() then."""
+    if raw[-1] != _CLOSING[raw[0]]:
+        return False
+    structure = raw.encode('utf-8').translate(None, _NOT_STRUCTURE).replace(b'""', b'')
+    if b'"' in structure or b'\\' in structure:
+        return False
+    expected = []
+    last = len(structure) - 1
+    for i, c in enumerate(structure):
+        if c in _CLOSING_BYTES:
+            expected.append(_CLOSING_BYTES[c])
+        elif not expected or c != expected.pop() or (not expected and i != last):
+            return False
+    return not expected
+
+
+def _value_end(s: str, idx: int) -> int:
+    """The end of the JSON value starting at s[idx]. Objects and arrays are only checked for balanced brackets,
+    other values are decoded."""
+    if s[idx] not in _CLOSING:
+        return _scan_once(s, idx)[1]
+    expected = []
+    pos = idx
+    while True:
+        c = s[pos]
+        if c in _CLOSING:
+            expected.append(_CLOSING[c])
+        elif not expected or c != expected.pop():
+            raise ValueError("unbalanced JSON at position %d" % pos)
+        elif not expected:
+            return pos + 1
+        pos = _SKIP.match(s, pos + 1).end()
+
+
+class Message:
+    """The envelope of one message of the internal data format. The payload is decoded on first access."""
+
+    __slots__ = ("format", "version", "type", "meta", "extra", "_payload", "_payload_raw")
+
+    def __init__(self, format: str = None, version: int = None, type: str = None, meta: dict = None,
+                 payload: dict = None, extra: dict = None):
+        self.format = format
+        self.version = version
+        self.type = type
+        self.meta = meta
+        self.extra = extra if extra is not None else {}
+        self._payload = payload
+        self._payload_raw = None
+
+    @classmethod
+    def from_bytes(cls, data: Union[bytes, str]) -> "Message":
+        """Decode the envelope of a JSON encoded message. The payload is kept as raw JSON text.
+
+        @param data: the message as received from the MQ (utf-8 encoded JSON) or as str
+        @return: the Message
+        @raise ValueError: if the data is not a JSON object, or the payload is not one balanced JSON value
+        """
+        s = data.decode('utf-8') if isinstance(data, (bytes, bytearray)) else data
+        m = cls()
+        envelope = {}
+        try:
+            idx = _WS.match(s, 0).end()
+            if s[idx] != '{':
+                raise ValueError("message is not a JSON object")
+            idx = _WS.match(s, idx + 1).end()
+            while s[idx] != '}':
+                key, idx = _scan_once(s, idx)
+                idx = _WS.match(s, idx).end()
+                if s[idx] != ':':
+                    raise ValueError("expected ':' at position %d" % idx)
+                idx = _WS.match(s, idx + 1).end()
+                if key == "payload":
+                    # keep its raw text, do not decode it
+                    end = s.rindex('}')
+                    raw = s[idx:end].rstrip()
+                    if raw[:1] not in _CLOSING or not _is_one_value(raw):
+                        end = _value_end(s, idx)         # not the last member, or not that simple
+                        raw = s[idx:end]
+                    m._payload_raw = raw
+                    m._payload = _UNDECODED
+                    idx = end
+                else:
+                    envelope[key], idx = _scan_once(s, idx)
+                idx = _WS.match(s, idx).end()
+                if s[idx] == ',':
+                    idx = _WS.match(s, idx + 1).end()
+                elif s[idx] != '}':
+                    raise ValueError("expected ',' or '}' at position %d" % idx)
+            if _WS.match(s, idx + 1).end() != len(s):
+                raise ValueError("extra data after the message at position %d" % (idx + 1))
+        except (StopIteration, IndexError) as ex:
+            raise ValueError("could not decode message envelope. Reason: %r" % ex)
+        m._set_fields(envelope)
+        return m
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Message":
+        """Create a Message from an (already decoded) dict of the internal data format."""
+        m = cls()
+        m._set_fields(dict(d))
+        return m
+
+    def _set_fields(self, d: dict):
+        self.format = d.pop("format", None)
+        self.version = d.pop("version", None)
+        self.type = d.pop("type", None)
+        self.meta = d.pop("meta", None)
+        if "payload" in d:
+            self._payload = d.pop("payload")
+        self.extra = d
+
+    @property
+    def payload(self) -> Optional[dict]:
+        """The payload. Decoded from the raw JSON text on first access."""
+        if self._payload is _UNDECODED:
+            self._payload = json.loads(self._payload_raw)
+            self._payload_raw = None
+        return self._payload
+
+    @payload.setter
+    def payload(self, value: dict):
+        self._payload = value
+        self._payload_raw = None
+
+    @property
+    def is_decoded(self) -> bool:
+        """True if the payload has been decoded (or was never encoded)."""
+        return self._payload is not _UNDECODED
+
+    @property
+    def uuid(self) -> Optional[str]:
+        """Shortcut for meta['uuid']."""
+        return self.meta.get("uuid") if self.meta else None
+
+    def _envelope(self) -> dict:
+        d = {f: getattr(self, f) for f in ENVELOPE_FIELDS if getattr(self, f) is not None}
+        d.update(self.extra)
+        return d
+
+    def to_bytes(self) -> bytes:
+        """Encode the message as utf-8 JSON. An untouched payload is copied over as is, without re-encoding it."""
+        head = json.dumps(self._envelope())
+        if self._payload is _UNDECODED:
+            body = self._payload_raw
+        elif self._payload is None:
+            return head.encode('utf-8')
+        else:
+            body = json.dumps(self._payload)
+        if len(head) > 2:
+            return (head[:-1] + ', "payload": ' + body + '}').encode('utf-8')
+        return ('{"payload": ' + body + '}').encode('utf-8')
+
+    def to_dict(self) -> dict:
+        """Return the message as a plain dict. This decodes the payload."""
+        d = self._envelope()
+        if self.payload is not None:
+            d["payload"] = self.payload
+        return d
+
+    def __getitem__(self, key: str):
+        """Dict like read access, so that a Message can be used wherever a dict message was used."""
+        if key in ENVELOPE_FIELDS:
+            value = getattr(self, key)
+        elif key == "payload":
+            value = self.payload
+        else:
+            return self.extra[key]
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value):
+        """Dict like write access. Unknown keys are stored next to the envelope fields."""
+        if key in ENVELOPE_FIELDS:
+            setattr(self, key, value)
+        elif key == "payload":
+            self.payload = value
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        """Check for existence of a top level key. Does not decode the payload."""
+        if key in ENVELOPE_FIELDS:
+            return getattr(self, key) is not None
+        if key == "payload":
+            return self._payload is not None
+        return key in self.extra
+
+    def get(self, key: str, default=None):
+        """Like dict.get()."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self) -> str:
+        payload = "<undecoded %d chars>" % len(self._payload_raw) if self._payload is _UNDECODED else self._payload
+        return "Message(format=%r, version=%r, type=%r, meta=%r, payload=%r)" % (self.format, self.version, self.type,
+                                                                                 self.meta, payload)
+
+
+def _observable_type(msg: Union[dict, Message]) -> Optional[str]:
+    # only the envelope: the route of a message must not depend on whether a processor decoded its payload
+    meta = msg.get("meta") or {}
+    return meta.get("observable_type")
+
+
+def routing_headers(msg: Union[dict, Message]) -> dict:
+    """Copy the envelope fields which are useful for routing into a dict of AMQP headers.
+
+    The headers are: 'type' (the envelope type), 'observable' (meta['observable_type']) and one 'tag.<name>': True entry per entry in meta['tags']. A headers exchange can then filter on
+    them, for example with the binding arguments {'x-match': 'any', 'tag.phishing': True}.
+    """
+    headers = {}
+    if msg.get("type"):
+        headers["type"] = msg.get("type")
+    observable = _observable_type(msg)
+    if observable:
+        headers["observable"] = observable
+    meta = msg.get("meta") or {}
+    for tag in meta.get("tags") or []:
+        headers["tag.%s" % tag] = True
+    return headers
+
+
+def routing_key(msg: Union[dict, Message]) -> str:
+    """Build a topic exchange routing key '<type>.<observable>' from the envelope. Missing parts become 'none'.
+
+    Example: 'event.ipv4-addr'. Consumers bind with patterns such as 'event.*' or '*.domain-name'.
+    """
+    return "%s.%s" % (msg.get("type") or "none", _observable_type(msg) or "none")
@@ -0,0 +1,262 @@
+"""Metrics of a worker process in the Prometheus text format.
+
+Every worker process keeps its metrics in the process-wide REGISTRY and exposes them either
+  * on an HTTP endpoint (``metrics: port:`` in etc/config.yml): GET /metrics. Several workers on one host take the
+    first free port of ``port`` .. ``port + ports - 1``, the chosen port is logged, or
+  * as a file for the node_exporter textfile collector (``metrics: textfile_dir:``): ``<id>.<pid>.prom``, rewritten
+    every ``interval`` seconds and removed when the worker stops.
+
+Per processor (labels ``processor_class`` and ``processor_id``, as in ``config['processors']``):
+
+    yellowsub_messages_in_total         messages taken from the input queue
+    yellowsub_messages_out_total        messages sent to the output exchanges
+    yellowsub_messages_failed_total     messages which could not be decoded or whose handling raised
+    yellowsub_messages_in_flight        messages being handled right now
+    yellowsub_busy_seconds_total        time spent handling messages. Its rate is the utilisation of the worker
+    yellowsub_phase_seconds             histogram of the decode / validate / process / publish phases (label ``phase``,
+                                        see lib/profiling.py)
+
+Per MQ client (label ``client``, the processor ID for the consumers and producers of processors):
+
+    yellowsub_mq_connections_total      connections opened. More than one means the client reconnected
+    yellowsub_publish_confirm_seconds   histogram of the time until the broker confirmed a publish (flow control
+                                        with confirm, see lib/flowcontrol.py)
+
+Per process: yellowsub_cache_hits_total and yellowsub_cache_misses_total of lib.utils.cache.Cache.
+
+Counting is a plain attribute increment. Rendering happens in the exporter's thread only when the metrics are read.
+"""
+
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from lib.config import ROOTDIR
+from lib.profiling import Histogram, PhaseTimings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    """A value which only goes up."""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Gauge(Counter):
+    """A value which goes up and down."""
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+def _labels(labels: LabelValues, extra: str = "") -> str:
+    parts = ['%s="%s"' % (k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+             for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{%s}" % ",".join(parts) if parts else ""
+
+
+def _number(v: float) -> str:
+    return "%d" % v if v == int(v) else repr(float(v))
+
+
+def _render_histogram(lines: List[str], name: str, labels: LabelValues, h: Histogram, extra: str = ""):
+    cumulative = 0
+    for bound, n in zip(h.bounds, h.counts):
+        cumulative += n
+        le = 'le="%s"' % _number(bound)
+        lines.append("%s_bucket%s %d" % (name, _labels(labels, ",".join(filter(None, (extra, le)))), cumulative))
+    lines.append("%s_bucket%s %d" % (name, _labels(labels, ",".join(filter(None, (extra, 'le="+Inf"')))), h.count))
+    lines.append("%s_sum%s %s" % (name, _labels(labels, extra), repr(h.sum)))
+    lines.append("%s_count%s %d" % (name, _labels(labels, extra), h.count))
+
+
+class Registry:
+    """Metric families by name. A family has a type, a help text and one metric per set of label values."""
+
+    def __init__(self):
+        self.families: Dict[str, Tuple[str, str, Dict[LabelValues, object]]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, name: str, help: str, labels: Dict[str, str], factory):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self.families.setdefault(name, (kind, help, {}))
+            if family[0] != kind:
+                raise ValueError("metric %s is a %s, not a %s" % (name, family[0], kind))
+            metrics = family[2]
+            if key not in metrics:
+                metrics[key] = factory()
+            return metrics[key]
+
+    def counter(self, name: str, help: str, **labels) -> Counter:
+        """The counter of name with these labels. Created on first use."""
+        return self._get("counter", name, help, labels, Counter)
+
+    def gauge(self, name: str, help: str, **labels) -> Gauge:
+        return self._get("gauge", name, help, labels, Gauge)
+
+    def histogram(self, name: str, help: str, **labels) -> Histogram:
+        return self._get("histogram", name, help, labels, Histogram)
+
+    def timings(self, name: str, help: str, timings: PhaseTimings, **labels):
+        """Export a PhaseTimings as a histogram with one ``phase`` label value per phase."""
+        with self._lock:
+            self.families.setdefault(name, ("phases", help, {}))[2][tuple(sorted(labels.items()))] = timings
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            families = [(name, kind, help, list(metrics.items())) for name, (kind, help, metrics) in
+                        sorted(self.families.items())]
+        for name, kind, help, metrics in families:
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, "histogram" if kind == "phases" else kind))
+            for labels, m in metrics:
+                if kind == "histogram":
+                    _render_histogram(lines, name, labels, m)
+                elif kind == "phases":
+                    for phase, h in list(m.phases.items()):
+                        _render_histogram(lines, name, labels, h, 'phase="%s"' % phase)
+                else:
+                    lines.append("%s%s %s" % (name, _labels(labels), _number(m.value)))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class ProcessorMetrics:
+    """The per-processor metrics (see the module docstring), bound to the labels of one processor."""
+
+    def __init__(self, processor_class: str, processor_id: str, timings: PhaseTimings = None,
+                 registry: Registry = None):
+        registry = registry or REGISTRY
+        labels = {"processor_class": processor_class, "processor_id": processor_id}
+        self.messages_in = registry.counter("yellowsub_messages_in_total", "Messages taken from the input queue.",
+                                            **labels)
+        self.messages_out = registry.counter("yellowsub_messages_out_total", "Messages sent to the output exchanges.",
+                                             **labels)
+        self.messages_failed = registry.counter("yellowsub_messages_failed_total",
+                                                "Messages which could not be decoded or whose handling raised.",
+                                                **labels)
+        self.in_flight = registry.gauge("yellowsub_messages_in_flight", "Messages being handled right now.",
+                                        **labels)
+        self.busy = registry.counter("yellowsub_busy_seconds_total", "Time spent handling messages.", **labels)
+        if timings is not None:
+            registry.timings("yellowsub_phase_seconds", "Duration of the phases of the message handling.",
+                             timings, **labels)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass        # scrapes are not worth a log line
+
+
+class Exporter:
+    """Serves the registry on HTTP and/or writes it to a textfile, from a daemon thread. See the module docstring."""
+
+    def __init__(self, name: str, config: dict, registry: Registry = None):
+        """
+        :param name: the worker's name (processor ID), used in the textfile name
+        :param config: the ``metrics:`` section of the config
+        :param registry: the registry to export, REGISTRY by default
+        """
+        self.registry = registry or REGISTRY
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.textfile: Optional[Path] = None
+        self.interval = float(config.get('interval', 15))
+        self._stop = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        if config.get('port'):
+            self._serve(config.get('host', '127.0.0.1'), int(config['port']), int(config.get('ports', 1)))
+        if config.get('textfile_dir'):
+            directory = Path(ROOTDIR) / config['textfile_dir']
+            directory.mkdir(parents = True, exist_ok = True)
+            self.textfile = directory / ("%s.%d.prom" % (name.replace("/", "_"), os.getpid()))
+            self._writer = threading.Thread(target = self._write_loop, name = "metrics-textfile", daemon = True)
+            self._writer.start()
+
+    @property
+    def port(self) -> Optional[int]:
+        return self.server.server_address[1] if self.server else None
+
+    def _serve(self, host: str, port: int, ports: int):
+        handler = type("Handler", (_Handler,), {"registry": self.registry})
+        for p in range(port, port + max(ports, 1)):
+            try:
+                self.server = ThreadingHTTPServer((host, p), handler)
+                break
+            except OSError:
+                continue
+        else:
+            logging.error("metrics: no free port in %d..%d, not serving metrics" % (port, port + ports - 1))
+            return
+        self.server.daemon_threads = True
+        threading.Thread(target = self.server.serve_forever, name = "metrics-http", daemon = True).start()
+        logging.info("metrics: serving on http://%s:%d/metrics" % (host, self.port))
+
+    def write(self):
+        """Write the textfile now (atomically: write a temporary file, then rename it)."""
+        tmp = self.textfile.with_suffix(".prom.tmp")
+        tmp.write_text(self.registry.render())
+        os.replace(tmp, self.textfile)
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.write()
+            except OSError as ex:
+                logging.error("metrics: could not write %s. Reason: %s" % (self.textfile, str(ex)))
+            self._stop.wait(self.interval)
+
+    def close(self):
+        """Stop serving and remove the textfile."""
+        self._stop.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self._writer:
+            self._writer.join(5)
+        if self.textfile:
+            try:
+                self.textfile.unlink()
+            except OSError:
+                pass
+
+
+def start_exporter(name: str, config: Optional[dict]) -> Optional[Exporter]:
+    """Start exporting the metrics as configured in the ``metrics:`` section of the config. None if it is empty."""
+    if not config or not (config.get('port') or config.get('textfile_dir')):
+        return None
+    return Exporter(name, config)
+
@@ -7,14 +7,19 @@ import logging
 import sys
 import time
 import uuid
+from typing import Union
 
 import pika
 
-from pathlib import Path
-
-from lib.config import Config, CONFIG_FILE_PATH_STR
+from lib.config import get_config
+from lib.flowcontrol import FlowControl
+from lib.metrics import REGISTRY
+from lib.message import Message, routing_headers, routing_key as envelope_routing_key
 from lib.utils import sanitize_password_str
 
+EXCHANGE_TYPES = ("fanout", "direct", "topic", "headers")
+OVERFLOW_POLICIES = ("drop-head", "reject-publish", "reject-publish-dlx")
+
 
 class MQ:
     """ The message queue class """
@@ -23,15 +28,19 @@ class MQ:
     queue = None
     queue_name = ""
     exchange = None
+    exchange_type: str = "fanout"
     id: str = ""
+    # called with the pika.ConnectionParameters, returns a connected pika.BlockingConnection (or something which
+    # behaves like one, see benchmarks/standins.py). None means pika.BlockingConnection
+    connection_factory = None
 
     def __init__(self, id: str = str(uuid.uuid4())):
-        _c = Config()
-        self.config = _c.load(Path(CONFIG_FILE_PATH_STR))
+        self.config = get_config()
         self.id = id
 
-    def connect(self, exchange: str = ""):
-        """Connect to the MQ system."""
+    def connect(self, exchange: str = "", exchange_type: str = "fanout", declare: bool = True):
+        """Connect to the MQ system and declare the exchange (of type fanout, direct, topic or headers).
+        With declare=False, the exchange must already exist (for example, provisioned by lib.workflow)."""
 
         try:
             logging.info("connecting to RabbitMQ...")
@@ -43,8 +52,10 @@ class MQ:
             credentials = pika.PlainCredentials(user, password)
             logging.info("Attempting to connect with (%s:%d as %s/%s)" % (host, port, user,
                                                                           sanitize_password_str(password)))
-            self.connection = pika.BlockingConnection(pika.ConnectionParameters(host = host, port = port,
-                                                                                credentials = credentials))
+            factory = MQ.connection_factory or pika.BlockingConnection
+            self.connection = factory(pika.ConnectionParameters(host = host, port = port, credentials = credentials))
+            REGISTRY.counter("yellowsub_mq_connections_total", "Connections opened to the MQ system.",
+                             client = self.id).inc()
         except Exception as ex:
             logging.error("can't connect to the MQ system. Bailing out. Reason: %s" % (str(ex)))
             sys.exit(-1)
@@ -55,7 +66,7 @@ class MQ:
             logging.info("Setting up the exchange and channels...")
             self.channel = self.connection.channel()
             logging.info("channel = %r" % self.channel)
-            self._create_exchange(exchange)
+            self._create_exchange(exchange, exchange_type, declare)
             logging.info("exchange = %r" % self.exchange)
         except Exception as ex:
             logging.error("can't set up channel and exchange. Reason: %s. Bailing out." % (str(ex)))
@@ -63,22 +74,30 @@ class MQ:
         logging.info("Done")
         return True
 
-    def _create_exchange(self, exchange: str = ""):
+    def _create_exchange(self, exchange: str = "", exchange_type: str = "fanout", declare: bool = True):
+        if exchange_type not in EXCHANGE_TYPES:
+            raise ValueError("unknown exchange type '%s'. Must be one of %s" % (exchange_type, EXCHANGE_TYPES))
         self.exchange = exchange
-        if exchange:
-            logging.info("Creating exchange %s" % exchange)
+        self.exchange_type = exchange_type
+        if exchange and declare:
+            logging.info("Creating %s exchange %s" % (exchange_type, exchange))
             try:
-                self.channel.exchange_declare(exchange = self.exchange, exchange_type = 'fanout')
+                self.channel.exchange_declare(exchange = self.exchange, exchange_type = exchange_type)
             except Exception as ex:
                 logging.error("can't Create exchange '%s'. Reason: %s" % (exchange, str(ex)))
                 raise ex
         else:
             logging.info("not creating exchange, using the default '' exchange.")
 
-    def _publish(self, message: dict, routing_key=""):
-        data = bytes(json.dumps(message), 'utf-8')  # JSON is always utf-8
-        self.channel.basic_publish(exchange = self.exchange, routing_key = routing_key, body = data,
-                                   properties = pika.BasicProperties(delivery_mode = 2, )  # make the message persistent
+    def _publish(self, message: Union[dict, Message], routing_key="", headers: dict = None, exchange: str = None):
+        if isinstance(message, Message):
+            data = message.to_bytes()  # re-uses the raw payload if it was not touched
+        else:
+            data = bytes(json.dumps(message), 'utf-8')  # JSON is always utf-8
+        exchange = self.exchange if exchange is None else exchange
+        self.channel.basic_publish(exchange = exchange, routing_key = routing_key, body = data,
+                                   properties = pika.BasicProperties(delivery_mode = 2,  # make the message persistent
+                                                                     headers = headers)
                                    )
 
     def _consume(self, queue: str, callback=None, auto_ack=False):
@@ -89,8 +108,9 @@ class MQ:
         self.channel.basic_qos(prefetch_count = 1)
         self.queue_name = self.queue.method.queue
 
-    def _bind_queue(self):
-        self.channel.queue_bind(exchange = self.exchange, queue = self.queue_name)
+    def _bind_queue(self, routing_key: str = None, arguments: dict = None):
+        self.channel.queue_bind(exchange = self.exchange, queue = self.queue_name, routing_key = routing_key,
+                                arguments = arguments)
 
     def close(self):
         """Close the connection to rabbitmq."""
@@ -100,41 +120,81 @@ class MQ:
 
 
 class Producer(MQ):
-    """A producer, based on the base functionality of MQ."""
+    """A producer, based on the base functionality of MQ.
+
+    On a topic exchange, the routing key defaults to '<type>.<observable>' (see lib.message.routing_key()).
+    On a headers exchange, the envelope's type, observable kind and meta tags are sent as AMQP headers (see
+    lib.message.routing_headers()). Either way, the broker filters the messages before any consumer has to decode them.
+
+    With flow_control (a dict of lib.flowcontrol.FlowControl parameters), publishing slows down as the downstream
+    queues fill up and pauses while the broker blocks the connection.
+    """
 
-    def __init__(self, id: str, exchange: str):
+    flow: FlowControl = None
+
+    def __init__(self, id: str, exchange: str, exchange_type: str = "fanout", declare: bool = True,
+                 flow_control: dict = None):
         super().__init__(id)
-        self.connect(exchange)
+        self.connect(exchange, exchange_type, declare)
+        if flow_control is not None:
+            self.flow = FlowControl(self, **flow_control)
 
-    def connect(self, exchange: str = ""):
+    def connect(self, exchange: str = "", exchange_type: str = "fanout", declare: bool = True):
         """Connect to an exchange."""
         logging.info("Connecting to exchange %s" % (exchange,))
-        super().connect(exchange)
+        super().connect(exchange, exchange_type, declare)
         # super()._connect_queue()       # producers don't need to connect to queues, they send to the exchange.
 
-    def produce(self, msg: dict, routing_key: str = ""):
-        """Send a msg to the exchange with the given routing_key."""
+    def produce(self, msg: Union[dict, Message], routing_key: str = None, exchange: str = None, trace = None):
+        """Send a msg to the exchange with the given routing_key. If no routing_key is given and the exchange is a
+        topic exchange, it is derived from the message envelope. exchange overrides the producer's exchange (it must
+        be of the same type). A trace (lib.tracing.Trace) is sent on in the AMQP headers, with a publish stamp."""
         if msg:
-            super()._publish(message = msg, routing_key = routing_key)
-            logging.info("[x] Sent %r" % msg)
+            headers = None
+            if routing_key is None:
+                routing_key = envelope_routing_key(msg) if self.exchange_type == "topic" else ""
+            if self.exchange_type == "headers":
+                headers = routing_headers(msg)
+            if trace is not None:
+                headers = dict(headers or {})
+                headers.update(trace.headers())
+            if self.flow:
+                self.flow.publish(lambda: super(Producer, self)._publish(message = msg, routing_key = routing_key,
+                                                                         headers = headers, exchange = exchange))
+            else:
+                super()._publish(message = msg, routing_key = routing_key, headers = headers, exchange = exchange)
+            logging.debug("[x] Sent %r", msg)       # formatted only if DEBUG is enabled
 
 
 class Consumer(MQ):
-    """A consumer, based on the base functionality of MQ."""
+    """A consumer, based on the base functionality of MQ.
+
+    On a topic exchange, bind with a routing_key pattern such as 'event.ipv4-addr' or '*.domain-name'.
+    On a headers exchange, bind with arguments such as {'x-match': 'all', 'observable': 'url'}.
+    The AMQP headers are also available to the callback as properties.headers, without decoding the body.
+    If queue_name is given, the queue (and its bindings) must already exist, for example provisioned by lib.workflow.
+    Nothing is declared then.
+    """
 
     cb_function = None
 
-    def __init__(self, id: str, exchange: str, callback=None):
+    def __init__(self, id: str, exchange: str, callback=None, exchange_type: str = "fanout", routing_key: str = None,
+                 bind_arguments: dict = None, queue_name: str = None):
         super().__init__(id)
-        super().connect(exchange)
-        queue_name = "q.%s.%s" % (self.exchange, self.id)
         if callback:
             self.cb_function = callback
         else:
             self.cb_function = self.process
 
-        super()._connect_queue(queue_name)
-        super()._bind_queue()
+        if queue_name:
+            # pre-provisioned queue
+            super().connect(exchange, exchange_type, declare = False)
+            self.queue_name = queue_name
+            self.channel.basic_qos(prefetch_count = 1)
+        else:
+            super().connect(exchange, exchange_type)
+            super()._connect_queue("q.%s.%s" % (self.exchange, self.id))
+            super()._bind_queue(routing_key, bind_arguments)
 
     def consume(self) -> None:
         """Register the callback function for consuming from the exchange / queue given the routing_key."""
@@ -142,6 +202,11 @@ class Consumer(MQ):
         self.channel.basic_consume(queue = self.queue_name, on_message_callback = self.cb_function, auto_ack = True)
         self.channel.start_consuming()
 
+    def stop(self) -> None:
+        """Stop consuming after the message at hand has been handled. Safe to call from a signal handler or from
+        another thread: consume() then returns."""
+        self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+
     def process(self, ch, method, properties, msg):
         """Handle the arriving message."""
         logging.info("received '%r'" % msg)
@@ -157,17 +222,21 @@ if __name__ == "__main__":
     parser.add_argument('-p', '--producer', action = 'store_true', help = "run as a producer")
     parser.add_argument('-c', '--consumer', action = 'store_true', help = "run as a consumer")
     parser.add_argument('-e', '--exchange', help = "Exchange to connect to.", required = True)
+    parser.add_argument('-t', '--exchange-type', help = "Type of the exchange.", choices = EXCHANGE_TYPES,
+                        default = "fanout")
+    parser.add_argument('-k', '--routing-key', help = "Routing key (pattern) to bind the consumer's queue with.",
+                        default = None)
     parser.add_argument('-i', '--id', help = "Unique ID of the producer or consumer (used to set the queue name!)",
                         required = True)
     args = parser.parse_args()
 
     if args.producer:
-        p = Producer(args.id, args.exchange)
+        p = Producer(args.id, args.exchange, args.exchange_type)
         for i in range(10):
-            p.produce({"msg": i})
+            p.produce({"msg": i, "type": "event"}, routing_key = args.routing_key)
             time.sleep(3)
     elif args.consumer:
-        c = Consumer(args.id, args.exchange)
+        c = Consumer(args.id, args.exchange, exchange_type = args.exchange_type, routing_key = args.routing_key)
         c.consume()
     else:
         print("Need to specify one of -c or -p. See --help.", file = sys.stderr)
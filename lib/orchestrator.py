@@ -0,0 +1,387 @@
+"""Orchestrator: start the processors of a workflow and scale them with the depth of their input queues.
+
+Every LaunchSpec of the workflow (see lib/workflow.py) gets a pool of worker processes. All workers of a processor
+ID consume from the same src_queue, so RabbitMQ hands the messages out round robin. The autoscaling loop polls the
+depth and the delivery rate of every src_queue and grows or shrinks the pool between ``min_workers`` and
+``max_workers``. Several processor IDs may consume from the same queue; they are scaled together (the sum of their
+bounds) and the workers are split between them:
+
+  * arrival rate  = delivery rate + change of the queue depth per second
+  * needed rate   = arrival rate + depth / target_drain_seconds   (drain the backlog within target_drain_seconds)
+  * workers       = ceil(needed rate / capacity of one worker)
+
+The capacity of one worker is learned while the queue has a backlog (the workers are saturated then). As long as it
+is not known yet, one worker is added per step while there is a backlog. Scaling up waits ``scale_up_cooldown``
+seconds after the last change, scaling down waits ``scale_down_cooldown`` seconds and removes one worker at a time.
+A worker which is scaled down gets a SIGTERM and finishes the message at hand before it exits.
+
+Processors without a src_queue (collectors) always get exactly one worker. A collector which exits with code 0 has
+read all its input and is not restarted.
+
+A worker which dies on its own is restarted after a back-off of ``restart_backoff`` seconds, doubling with every
+further crash up to ``max_backoff``. A worker which ran for ``healthy_after`` seconds resets the count. After
+``max_crashes`` crashes in a row the processor ID is given up (logged as an error) instead of being restarted forever.
+
+Workers are forked from a zygote (see lib/zygote.py) which has imported and warmed up everything the processors need,
+so scaling up and restarting crashed workers takes milliseconds.
+
+The defaults are in the ``orchestrator: autoscale:`` section of etc/config.yml. A Workflow entry in workflow.yml can
+override them with its own ``autoscale:`` dict.
+
+USAGE example:
+    python -m lib.orchestrator -f etc/workflow.yml
+"""
+
+import argparse
+import base64
+import json
+import logging
+import math
+import multiprocessing
+import sys
+import time
+import urllib.parse
+import urllib.request
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from lib.config import get_config
+from lib.mq import MQ
+from lib.workflow import DEFAULT_WORKFLOW_FILE, LaunchSpec, Workflow, launch
+from lib.zygote import Zygote
+
+
+class ScalingPolicy(NamedTuple):
+    """Bounds and timing of the autoscaler for one processor ID."""
+    min_workers: int = 1
+    max_workers: int = 4
+    target_drain_seconds: float = 60
+    scale_up_cooldown: float = 30
+    scale_down_cooldown: float = 120
+
+    @classmethod
+    def from_dict(cls, d: Optional[dict], defaults: "ScalingPolicy" = None) -> "ScalingPolicy":
+        """Build a policy from a config dict. Missing keys are taken from defaults. Unknown keys are ignored."""
+        defaults = defaults or cls()
+        policy = defaults._replace(**{k: v for k, v in (d or {}).items() if k in cls._fields})
+        if not 0 <= policy.min_workers <= policy.max_workers:
+            raise ValueError("autoscale: need 0 <= min_workers <= max_workers, got %r" % (policy,))
+        if policy.target_drain_seconds <= 0:
+            raise ValueError("autoscale: target_drain_seconds must be > 0")
+        return policy
+
+
+def desired_workers(policy: ScalingPolicy, current: int, depth: int, arrival_rate: float,
+                    capacity: Optional[float]) -> int:
+    """Number of workers needed to keep up with arrival_rate (msgs/s) and drain depth messages within the target.
+
+    :param policy: the scaling policy
+    :param current: the current number of workers
+    :param depth: messages ready in the queue
+    :param arrival_rate: messages arriving per second
+    :param capacity: messages per second one worker can handle, None if not known (yet)
+    """
+    if capacity:
+        needed = max(arrival_rate, 0.0) + depth / policy.target_drain_seconds
+        n = math.ceil(needed / capacity)
+    elif depth > 0:
+        n = current + 1       # backlog, but no idea how fast a worker is: grow step by step
+    elif arrival_rate > 0:
+        n = current
+    else:
+        n = 0                 # idle
+    return min(max(n, policy.min_workers), policy.max_workers)
+
+
+class QueueStats:
+    """Depth and delivery rate of a queue.
+
+    Uses the RabbitMQ management API if ``rabbitmq: management_url:`` is configured. Otherwise the depth is taken
+    from a passive queue_declare and the delivery rate is not known (None). The broker closes the channel of a
+    passive queue_declare for a missing queue, so it runs on a channel of its own which is reopened when needed.
+    """
+
+    def __init__(self, config: dict, mq: MQ = None):
+        rmq = config.get('rabbitmq', {})
+        self.api_url = rmq.get('management_url')
+        self.vhost = rmq.get('vhost', '/')
+        self.auth = base64.b64encode(("%s:%s" % (rmq.get('user', 'guest'), rmq.get('password', 'guest'))).encode())
+        self.mq = mq
+        self._channel = None
+
+    def get(self, queue: str) -> Tuple[int, Optional[float]]:
+        """Return (messages ready, delivered messages per second) of queue."""
+        if self.api_url:
+            url = "%s/api/queues/%s/%s" % (self.api_url.rstrip('/'), urllib.parse.quote(self.vhost, safe = ''),
+                                           urllib.parse.quote(queue, safe = ''))
+            req = urllib.request.Request(url, headers = {"Authorization": "Basic %s" % self.auth.decode()})
+            with urllib.request.urlopen(req, timeout = 5) as r:
+                q = json.load(r)
+            stats = q.get('message_stats', {})
+            # consumers use auto_ack, so deliver_get (which includes deliver_no_ack) is the consumption rate
+            details = stats.get('deliver_get_details') or stats.get('ack_details') or {}
+            return int(q.get('messages_ready', 0)), float(details.get('rate', 0.0))
+        if not self._channel or self._channel.is_closed:
+            self._channel = self.mq.connection.channel()
+        ok = self._channel.queue_declare(queue = queue, passive = True)
+        return ok.method.message_count, None
+
+
+class WorkerPool:
+    """The worker processes of each processor ID. With a zygote (see lib/zygote.py), workers are forked from the
+    warmed-up zygote, otherwise they are started with multiprocessing."""
+
+    def __init__(self, stop_timeout: float = 30, zygote = None, restart_backoff: float = 1.0,
+                 max_backoff: float = 300.0, max_crashes: int = 10, healthy_after: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param stop_timeout: seconds a stopped worker gets before it is killed
+        :param zygote: fork the workers from this zygote (see lib/zygote.py)
+        :param restart_backoff: seconds before a crashed worker is replaced, doubled with every further crash
+        :param max_backoff: longest back-off (seconds)
+        :param max_crashes: give a processor ID up after this many crashes in a row
+        :param healthy_after: a worker which ran this many seconds resets the crash count
+        """
+        self.workers: Dict[str, List[multiprocessing.Process]] = {}
+        self.stop_timeout = stop_timeout
+        self.zygote = zygote
+        self.restart_backoff = restart_backoff
+        self.max_backoff = max_backoff
+        self.max_crashes = max_crashes
+        self.healthy_after = healthy_after
+        self.clock = clock
+        self.crashes: Dict[str, int] = {}
+        self.blocked_until: Dict[str, float] = {}
+        self.given_up: Set[str] = set()
+        self.finished: Set[str] = set()    # collectors which read all their input
+        self._specs: Dict[str, LaunchSpec] = {}
+        self._started: Dict[multiprocessing.Process, float] = {}
+        self._stopping: List[multiprocessing.Process] = []
+
+    def _spawn(self, spec: LaunchSpec) -> multiprocessing.Process:
+        """Start one worker process for spec."""
+        if self.zygote:
+            return self.zygote.spawn(spec)
+        p = multiprocessing.Process(target = launch, args = (spec,), name = spec.processor_id, daemon = False)
+        p.start()
+        return p
+
+    def count(self, processor_id: str) -> int:
+        """Number of running workers of processor_id."""
+        return len(self.workers.get(processor_id, []))
+
+    def can_spawn(self, processor_id: str) -> bool:
+        """False while processor_id is in its crash back-off, or was given up or finished."""
+        if processor_id in self.given_up or processor_id in self.finished:
+            return False
+        return self.clock() >= self.blocked_until.get(processor_id, float('-inf'))
+
+    def scale(self, spec: LaunchSpec, n: int):
+        """Start or stop workers of spec until n are running. Stopped workers get a SIGTERM (graceful stop).
+        No workers are started while spec is in its crash back-off."""
+        workers = self.workers.setdefault(spec.processor_id, [])
+        self._specs[spec.processor_id] = spec
+        while len(workers) < n and self.can_spawn(spec.processor_id):
+            p = self._spawn(spec)
+            workers.append(p)
+            self._started[p] = self.clock()
+            logging.info("started worker %d of %s" % (len(workers), spec.processor_id))
+        while len(workers) > n:
+            p = workers.pop()
+            self._started.pop(p, None)
+            p.terminate()
+            self._stopping.append(p)
+            logging.info("stopping worker %d of %s" % (len(workers) + 1, spec.processor_id))
+
+    def reap(self):
+        """Forget workers which died on their own (the autoscaler replaces them after the back-off) and reap stopped
+        ones."""
+        now = self.clock()
+        for pid, workers in self.workers.items():
+            for p in [p for p in workers if not p.is_alive()]:
+                workers.remove(p)
+                lived = now - self._started.pop(p, now)
+                spec = self._specs.get(pid)
+                if p.exitcode == 0 and spec is not None and not spec.src_queue:
+                    logging.info("collector %s is done" % pid)
+                    self.finished.add(pid)
+                    continue
+                self._crashed(pid, p.exitcode, lived, now)
+        self._stopping = [p for p in self._stopping if p.is_alive()]
+
+    def _crashed(self, pid: str, exitcode: Optional[int], lived: float, now: float):
+        if lived >= self.healthy_after:
+            self.crashes[pid] = 0
+        n = self.crashes[pid] = self.crashes.get(pid, 0) + 1
+        if n >= self.max_crashes:
+            if pid not in self.given_up:
+                logging.error("worker of %s exited with code %s, %d crashes in a row: giving up" % (pid, exitcode, n))
+                self.given_up.add(pid)
+            return
+        delay = min(self.restart_backoff * 2 ** (n - 1), self.max_backoff)
+        self.blocked_until[pid] = now + delay
+        logging.warning("worker of %s exited with code %s after %.1fs, restarting in %.1fs" % (pid, exitcode, lived, delay))
+
+    def stop_all(self):
+        """Gracefully stop all workers, kill the ones which do not stop within stop_timeout seconds."""
+        for workers in self.workers.values():
+            for p in workers:
+                p.terminate()
+            self._stopping.extend(workers)
+        self.workers = {}
+        self._started = {}
+        deadline = time.monotonic() + self.stop_timeout
+        for p in self._stopping:
+            p.join(max(deadline - time.monotonic(), 0))
+            if p.is_alive():
+                p.kill()
+        self._stopping = []
+
+
+class _QueueState:
+    """What the autoscaler remembers about one src_queue between two steps."""
+
+    def __init__(self):
+        self.depth: Optional[int] = None
+        self.t: Optional[float] = None
+        self.capacity: Optional[float] = None
+
+
+class Autoscaler:
+    """Polls the src_queue of every spec and resizes its worker pool. See the module docstring."""
+
+    # weight of a new per-worker capacity sample (exponential moving average)
+    capacity_alpha: float = 0.3
+
+    def __init__(self, pool: WorkerPool, stats: QueueStats, specs: List[LaunchSpec], policy: ScalingPolicy = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.pool = pool
+        self.stats = stats
+        self.specs = specs
+        self.clock = clock
+        default = policy or ScalingPolicy()
+        self.policies = {s.processor_id: ScalingPolicy.from_dict(s.options.get('autoscale'), default) for s in specs}
+        self.groups: Dict[str, List[LaunchSpec]] = {}
+        for s in specs:
+            if s.src_queue:
+                self.groups.setdefault(s.src_queue, []).append(s)
+        self.state = {queue: _QueueState() for queue in self.groups}
+        self.last_change = {s.processor_id: float('-inf') for s in specs}
+
+    def start(self):
+        """Start the minimum number of workers (one for collectors)."""
+        for spec in self.specs:
+            n = max(self.policies[spec.processor_id].min_workers, 1) if spec.src_queue else 1
+            self.pool.scale(spec, n)
+            self.last_change[spec.processor_id] = self.clock()
+
+    def step(self):
+        """Poll all queues once and scale where needed."""
+        self.pool.reap()
+        for spec in self.specs:
+            if not spec.src_queue and not self.pool.count(spec.processor_id) and \
+                    spec.processor_id not in self.pool.finished:
+                self.pool.scale(spec, 1)
+        for queue, group in self.groups.items():
+            try:
+                depth, rate = self.stats.get(queue)
+            except Exception as ex:
+                logging.warning("could not get the stats of queue %s. Reason: %s" % (queue, str(ex)))
+                continue
+            self._scale(queue, group, depth, rate)
+
+    def _split(self, group: List[LaunchSpec], total: int) -> Dict[str, int]:
+        """Split total workers between the processor IDs of group: min_workers each, the rest round robin up to
+        max_workers."""
+        n = {s.processor_id: self.policies[s.processor_id].min_workers for s in group}
+        left = total - sum(n.values())
+        while left > 0:
+            grown = False
+            for s in group:
+                if left > 0 and n[s.processor_id] < self.policies[s.processor_id].max_workers:
+                    n[s.processor_id] += 1
+                    left -= 1
+                    grown = True
+            if not grown:
+                break
+        return n
+
+    def _scale(self, queue: str, group: List[LaunchSpec], depth: int, rate: Optional[float]):
+        st, now = self.state[queue], self.clock()
+        counts = {s.processor_id: self.pool.count(s.processor_id) for s in group}
+        current = sum(counts.values())
+        rate = rate or 0.0
+        arrival = rate
+        if st.t is not None and now > st.t:
+            arrival = max(rate + (depth - st.depth) / (now - st.t), 0.0)
+        if depth > 0 and current and rate > 0:
+            # with a backlog, the workers are saturated: rate / current is what one worker can do
+            sample = rate / current
+            st.capacity = sample if st.capacity is None else \
+                (1 - self.capacity_alpha) * st.capacity + self.capacity_alpha * sample
+        st.depth, st.t = depth, now
+
+        policies = [self.policies[s.processor_id] for s in group]
+        combined = policies[0]._replace(min_workers = sum(p.min_workers for p in policies),
+                                        max_workers = sum(p.max_workers for p in policies),
+                                        target_drain_seconds = min(p.target_drain_seconds for p in policies))
+        total = desired_workers(combined, current, depth, arrival, st.capacity)
+        targets = self._split(group, total)
+        for spec in group:
+            pid = spec.processor_id
+            policy, cur, n = self.policies[pid], counts[pid], targets[pid]
+            since = now - self.last_change[pid]
+            if n > cur and since >= policy.scale_up_cooldown:
+                logging.info("%s: %s depth=%d arrival=%.1f/s capacity=%s/s, scaling up %d -> %d" %
+                             (pid, queue, depth, arrival, st.capacity, cur, n))
+            elif n < cur and since >= policy.scale_down_cooldown:
+                n = cur - 1
+                logging.info("%s: %s depth=%d arrival=%.1f/s, scaling down %d -> %d" % (pid, queue, depth, arrival,
+                                                                                        cur, n))
+            elif cur < policy.min_workers and self.pool.can_spawn(pid):
+                n = policy.min_workers    # replace crashed workers once their back-off is over
+            else:
+                continue
+            self.pool.scale(spec, n)
+            self.last_change[pid] = now
+
+    def run(self, interval: float = 5):
+        """Run the autoscaling loop until interrupted, then stop all workers."""
+        self.start()
+        try:
+            while True:
+                time.sleep(interval)
+                self.step()
+        except KeyboardInterrupt:
+            logging.info("stopping all workers")
+        finally:
+            self.pool.stop_all()
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description = 'start the processors of a workflow and autoscale them')
+    parser.add_argument('-f', '--file', help = "The workflow file.", default = DEFAULT_WORKFLOW_FILE)
+    parser.add_argument('-n', '--no-provision', action = 'store_true', help = "the workflow is already provisioned")
+    parser.add_argument('-z', '--no-zygote', action = 'store_true',
+                        help = "start every worker as a fresh process instead of forking it from a preloaded zygote")
+    args = parser.parse_args()
+
+    try:
+        wf = Workflow(args.file)
+    except (OSError, ValueError) as ex:
+        print("could not load workflow %s. Reason: %s" % (args.file, str(ex)), file = sys.stderr)
+        sys.exit(1)
+    specs = wf.launch_specs()
+    # preload once, up front. The workers inherit the orchestrator's MQ connection but never use it, each connects itself
+    zygote = None if args.no_zygote else Zygote(Zygote.processor_types(specs))
+    config = get_config()
+    autoscale = dict(config.get('orchestrator', {}).get('autoscale', {}))
+    interval = autoscale.pop('interval', 5)
+    mq = MQ("orchestrator")
+    mq.connect()
+    if not args.no_provision:
+        wf.provision(mq)
+    scaler = Autoscaler(WorkerPool(zygote = zygote), QueueStats(config, mq), specs, ScalingPolicy.from_dict(autoscale))
+    scaler.run(interval)
@@ -2,8 +2,7 @@
 
 import json
 from lib.mq import Consumer, Producer
-from lib.config import Config, CONFIG_FILE_PATH_STR
-from pathlib import Path
+from lib.config import get_config
 from lib.utils.projectutils import ProjectUtils
 
 
@@ -47,8 +46,7 @@ class AbstractProcessor:
         # create self.consumer and self.producer
         # create n instances of yourself as parallel processes
         # load the global config
-        _c = Config()
-        self.config = _c.load(Path(CONFIG_FILE_PATH_STR))
+        self.config = get_config()
 
         # setup logger using the global config the processor class name and the id of the processor
         # TODO: DG_Comment :this can and should be moved to a higher level (orchestrator) as it does not pertain
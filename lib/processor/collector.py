@@ -1,9 +1,116 @@
-"""Collector abstract class. Inherts from Processor."""
+"""Collector abstract class. Inherts from Processor.
 
+A collector reads an external source and emits what it finds. Subclasses implement read(): a generator of
+(message, position) pairs, where position is None or (source key, its offset after the message). collect() sends the
+messages on in batches of batch_size (through process_batch() and emit(), like a consuming processor does) and, once a
+batch is out, stores the positions of its messages in the collector's Checkpoint. After a restart, read() resumes at
+the stored positions (self.checkpoint.get(key)), so nothing is read or sent twice. A (None, position) pair only moves
+the position on, past a line which could not be parsed for example. A (None, None) pair sends the batch at hand now,
+before read() waits for the source to have more.
+
+The settings of a collector are its class' section of the processors config, overridden by the section of its ID.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple, Union
+
+from lib.config import ROOTDIR
+from lib.message import Message
 from lib.processor.processor import Processor
+from lib.tracing import Trace
+
+DEFAULT_CHECKPOINT_DIR = "var/checkpoints"
+
+Position = Optional[Tuple[str, Any]]
+
+
+class Checkpoint:
+    """The positions of a collector in its sources, by source key, in a JSON file. Saved atomically."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        try:
+            with open(self.path, 'r') as f:
+                self.positions: Dict[str, Any] = json.load(f)
+        except FileNotFoundError:
+            self.positions = {}
+
+    def get(self, key: str, default = None):
+        return self.positions.get(key, default)
+
+    def update(self, positions: Mapping[str, Any]):
+        """Store positions (and the ones stored before)."""
+        if not positions:
+            return
+        self.positions.update(positions)
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.positions, f)
+        os.replace(tmp, self.path)
 
 
 class Collector(Processor):
+    """A processor without input queue: it reads from an external source and emit()s what it finds."""
+
+    batch_size = 1000
+    stopping: bool = False
+    checkpoint: Optional[Checkpoint] = None
 
     def __init__(self, id: str, n: int = 1):
         super().__init__(id, n)
+
+    def settings(self) -> dict:
+        """The collector's config: the section of its class, overridden by the one of its ID."""
+        processors = self.config['processors']
+        return dict(processors.get(self.__class__.__name__) or {}, **(processors.get(self.id) or {}))
+
+    def startup(self):
+        config = self.settings()
+        self.batch_size = int(config.get('batch_size', self.__class__.batch_size))
+        checkpoint_dir = Path(ROOTDIR) / config.get('checkpoint_dir', DEFAULT_CHECKPOINT_DIR)
+        self.checkpoint = Checkpoint(checkpoint_dir / ("%s.json" % self.id))
+
+    def start(self):
+        """Collect until the source is exhausted or stop() is called."""
+        self.collect()
+
+    def stop(self):
+        """Stop collecting after the message at hand. Safe to call from a signal handler."""
+        self.stopping = True
+
+    def read(self) -> Iterator[Tuple[Optional[dict], Position]]:
+        """The messages of the source and their positions, see the module docstring. Must return soon after
+        self.stopping became True."""
+        raise RuntimeError("not implemented in the abstract base class. This should not have been called.")
+
+    def process(self, channel=None, method=None, properties=None, msg: dict = {}) -> Optional[dict]:
+        """The message to send on for a message read. Override to map it or to drop it (None)."""
+        return msg
+
+    def collect(self):
+        """Read from the source and emit() every message, in batches, storing the positions after every batch."""
+        positions: Dict[str, Any] = {}
+        metrics = self.metrics
+        for msg, position in self.read():
+            if msg is not None:
+                metrics.messages_in.inc()
+                metrics.in_flight.inc()
+                self._batch.append((msg, None))
+            if position is not None:
+                positions[position[0]] = position[1]
+            if len(self._batch) >= self.batch_size or (msg is None and position is None):
+                self.flush()
+                self.checkpoint.update(positions)
+                positions = {}
+            if self.stopping:
+                break
+        # if sending failed (an exception), the positions of the batch are not stored: it is read again next time
+        self.flush()
+        self.checkpoint.update(positions)
+
+    def emit(self, msg: Union[dict, Message], trace: Trace = None):
+        """Messages enter the workflow here: sample them for tracing (see lib/tracing.py)."""
+        super().emit(msg, trace or self.tracer.sample())
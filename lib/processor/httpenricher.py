@@ -0,0 +1,173 @@
+"""HTTPEnricher: base class of enrichers which call HTTP APIs (Elasticsearch, Censys, ...).
+
+Every back end (API) of an enricher is configured in the ``http:`` section of the processor's config:
+
+    CensysEnricher:
+      http:
+        censys:
+          url: "https://search.censys.io/api"
+          user: "<API ID>"
+          password: "<secret>"
+          rate: 0.4                 # requests per second, all workers together (shared: true)
+          burst: 1
+          shared: true              # the token bucket lives in redis and is shared by all workers
+          max_concurrency: 2        # requests in flight at once, per worker
+          pool_size: 2              # idle keep-alive connections, per worker
+          timeout: 10.0
+          max_retries: 3            # after 429 Too Many Requests / 503 Service Unavailable
+
+A Backend keeps its connections open (lib/utils/httppool.py), waits for a token before every request
+(lib/utils/ratelimit.py) and caps the requests in flight. A 429 (or 503) answer pauses the token bucket, for all
+workers sharing it, for the Retry-After time of the answer (or a back-off doubling from ``retry_backoff`` seconds) and
+the request is sent again, up to ``max_retries`` times. map() runs requests concurrently within the concurrency cap.
+"""
+
+import email.utils
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Mapping, Optional
+
+from lib.processor.enricher import Enricher
+from lib.utils.httppool import HTTPPool, HTTPResponse
+from lib.utils.ratelimit import RedisTokenBucket, TokenBucket, redis_client
+
+RETRY_STATUS = (429, 503)
+
+
+def retry_after(response: HTTPResponse, now: float = None) -> Optional[float]:
+    """Seconds to wait according to the Retry-After header of response (seconds or an HTTP date), None if there is
+    none."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(when - (time.time() if now is None else now), 0.0)
+
+
+class Backend:
+    """One HTTP API: pooled keep-alive connections, a token bucket and a cap on the requests in flight."""
+
+    def __init__(self, name: str, url: str, rate: float = None, burst: float = 1, bucket = None,
+                 max_concurrency: int = 4, pool_size: int = None, timeout: float = 10.0, verify: bool = True,
+                 headers: Dict[str, str] = None, user: str = None, password: str = None, max_retries: int = 3,
+                 retry_backoff: float = 1.0, sleep: Callable[[float], None] = time.sleep):
+        """
+        :param name: for the logs
+        :param url: base URL of the API
+        :param rate: requests per second, None for no limit
+        :param burst: requests at once
+        :param bucket: the token bucket to use instead of a TokenBucket(rate, burst) of this process
+        :param max_concurrency: requests in flight at once
+        :param pool_size: idle connections kept open. Default: max_concurrency
+        :param max_retries: send a request again at most this many times after 429 / 503 answers
+        :param retry_backoff: first wait after a 429 / 503 without Retry-After, doubled for every further one
+        """
+        self.name = name
+        self.pool = HTTPPool(url, size = pool_size or max_concurrency, timeout = timeout, verify = verify,
+                             headers = headers, user = user, password = password)
+        self.bucket = bucket if bucket is not None else (TokenBucket(rate, burst) if rate else None)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.sleep = sleep
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.throttled = 0          # 429 / 503 answers so far
+
+    def request(self, method: str, path: str, **kwargs) -> HTTPResponse:
+        """Send a request (see HTTPPool.request()) within the rate and concurrency limits. Returns the last answer,
+        which is a 429 / 503 only if max_retries retries did not help."""
+        backoff = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            if self.bucket is not None:
+                wait = self.bucket.take()
+                if wait > 0:
+                    self.sleep(wait)
+            with self._slots:
+                r = self.pool.request(method, path, **kwargs)
+            if r.status not in RETRY_STATUS or attempt == self.max_retries:
+                return r
+            self.throttled += 1
+            delay = retry_after(r)
+            if delay is None:
+                delay, backoff = backoff, backoff * 2
+            logging.warning("%s: HTTP %d, retrying in %.1fs" % (self.name, r.status, delay))
+            if self.bucket is not None:
+                self.bucket.pause(delay)        # every worker sharing the bucket waits
+            else:
+                self.sleep(delay)
+        return r
+
+    def map(self, fn: Callable, items: Iterable) -> List:
+        """[fn(item) for item in items], up to max_concurrency at once. fn calls request()."""
+        items = list(items)
+        if len(items) <= 1 or self.max_concurrency <= 1:
+            return [fn(item) for item in items]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix = self.name)
+        return list(self._executor.map(fn, items))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.pool.close()
+
+
+def backend_from_config(name: str, config: Mapping, key_prefix: str = "yellowsub:ratelimit:") -> Backend:
+    """A Backend for one entry of an ``http:`` section (see the module docstring)."""
+    config = dict(config)
+    if not config.get('url'):
+        raise RuntimeError("http backend %s: no url configured" % name)
+    rate, burst = config.pop('rate', None), config.pop('burst', 1)
+    bucket = None
+    if rate and config.pop('shared', False):
+        bucket = RedisTokenBucket(redis_client(), key_prefix + name, rate, burst)
+    config.pop('shared', None)
+    return Backend(name, rate = rate, burst = burst, bucket = bucket, **config)
+
+
+class HTTPEnricher(Enricher):
+    """An Enricher with one Backend per API of its ``http:`` config section, in self.backends. They are (re)built
+    by startup() and reload() and closed by shutdown(). http_defaults holds the settings of a subclass' back ends
+    which the config may leave out, by back end name."""
+
+    http_defaults: Dict[str, dict] = {}
+    backends: Dict[str, Backend] = {}
+
+    def startup(self):
+        super().startup()
+        config = self.config['processors'].get(self.__class__.__name__) or {}
+        http = {name: dict(c) for name, c in self.http_defaults.items()}
+        for name, c in (config.get('http') or {}).items():
+            http.setdefault(name, {}).update(c or {})
+        self.close_backends()
+        self.backends = {name: backend_from_config(name, c) for name, c in http.items()}
+
+    def reload(self):
+        super().reload()
+        self.startup()
+
+    def backend(self, name: str) -> Backend:
+        try:
+            return self.backends[name]
+        except KeyError:
+            raise RuntimeError("%s: no http backend %s configured" % (self.__class__.__name__, name))
+
+    def close_backends(self):
+        for b in self.backends.values():
+            b.close()
+        self.backends = {}
+
+    def shutdown(self):
+        self.close_backends()
+        super().shutdown()
@@ -0,0 +1,84 @@
+"""Pipeline: a linear chain of processors fused into one (unix) process.
+
+Instead of going through RabbitMQ between every step (serialization, a persistent write and a network hop each
+time), the message is decoded once at the head of the chain, handed from one process() method to the next as an
+in-memory object and only sent to the broker again at the tail of the chain. See the ``fuse`` option in
+lib/workflow.py for which chains get fused.
+"""
+
+import json
+from typing import Iterable, List, Optional, Union
+
+from lib.message import Message
+from lib.metrics import ProcessorMetrics
+from lib.mq import Consumer, Producer
+from lib.processor.processor import MessageCallback, Processor
+from lib.profiling import PhaseTimings, Profiler
+from lib.tracing import Trace, Tracer
+
+
+class Pipeline(MessageCallback):
+    """A linear chain of Processors which exchange messages in memory. The consumer callback (see
+    MessageCallback.mq_msg_callback()) decodes once, runs the chain and sends the result on."""
+
+    consumer: Consumer = None
+
+    def __init__(self, processors: List[Processor]):
+        """
+        :param processors: the processors of the chain, in order. They must not be connected themselves.
+        """
+        assert processors, "a Pipeline needs at least one processor."
+        self.processors = processors
+        self.head = processors[0]
+        self.tail = processors[-1]
+        self.id = "+".join(p.id for p in processors)
+        # only hand out lazily decoded messages if every processor of the chain can deal with them
+        self.lazy_decode = all(getattr(p, "lazy_decode", False) for p in processors)
+        # decode and publish are timed here, validate and process by every processor (see lib/profiling.py)
+        self.timings = PhaseTimings()
+        self.profiler = Profiler(self.id)
+        # messages in/failed and busy time of the whole chain. Messages out are counted by the tail
+        self.metrics = ProcessorMetrics(self.__class__.__name__, self.id, self.timings)
+        self.tracer = Tracer(self.id)           # the chain is one hop
+
+    @property
+    def config_service(self):
+        return self.head.config_service         # all processors of the chain share the config service
+
+    def run(self, msg: Union[dict, Message], channel=None, method=None, properties=None) -> Optional[Union[dict, Message]]:
+        """Pass a decoded message through all processors. Returns the result of the last one, or None if a processor
+        dropped the message."""
+        for p in self.processors:
+            msg = p.handle(channel, method, properties, msg)
+            if not msg:
+                return None
+        return msg
+
+    def _convert_to_internal_df(self, msg: bytes) -> Optional[Union[dict, Message]]:
+        try:
+            return Message.from_bytes(msg) if self.lazy_decode else json.loads(msg)
+        except ValueError as ex:
+            self.head.logger.error("Could not convert msg (bytes) to msg (JSON) internal format. Reason: %s" % str(ex))
+            return None
+
+    def handle(self, channel=None, method=None, properties=None, msg: Union[dict, Message] = None):
+        return self.run(msg, channel, method, properties)
+
+    def emit(self, msg: Union[dict, Message], trace: Trace = None):
+        self.tail.emit(msg, trace)
+
+    def connect(self, src_queue: Optional[str] = None, dst_exchanges: Iterable[str] = (), exchange_type: str = "fanout",
+                flow_control: dict = None):
+        """Attach the head of the chain to the input queue and the tail to the output exchanges (see
+        Processor.connect())."""
+        self.tail.dst_exchanges = tuple(dst_exchanges)
+        if src_queue:
+            self.consumer = Consumer(id = self.id, exchange = "", callback = self.mq_msg_callback, queue_name = src_queue)
+        if self.tail.dst_exchanges:
+            self.tail.producer = Producer(id = self.id, exchange = self.tail.dst_exchanges[0],
+                                          exchange_type = exchange_type, declare = False,
+                                          flow_control = flow_control)
+
+    def start(self):
+        """Start consuming from the input queue."""
+        self.consumer.consume()
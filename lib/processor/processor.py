@@ -1,20 +1,104 @@
 """Processor - a subclass of Abstract Processor."""
 import json
+from time import perf_counter
+from typing import Iterable, List, Mapping, Optional, Union
 # from lib.dataformat import DataFormat
+from lib.config import config_service
+from lib.message import Message
+from lib.metrics import ProcessorMetrics
+from lib.mq import Consumer, Producer
 from lib.processor.abstractProcessor import AbstractProcessor
+from lib.profiling import PhaseTimings, Profiler
+from lib.tracing import Trace, Tracer
 
 
-class Processor(AbstractProcessor):
+class MessageCallback:
+    """The consumer callback of Processor and Pipeline: control messages, config reloads, tracing, metrics and
+    timings around _convert_to_internal_df(), handle() and emit() of the class."""
+
+    batch_size: int = 1             # see Processor
+
+    def mq_msg_callback(self, channel=None, method=None, properties=None, msg: bytes = None):
+        """Callback function which will be registered with the MQ's callback system.
+        Initially converts the (bytes) msg to an internal data format.
+        Then calls handle() and sends the result on with emit()."""
+
+        if not msg:
+            return
+        headers = getattr(properties, "headers", None)
+        if headers and self.profiler.control(headers):
+            return
+        if self.profiler.pending:
+            self.profiler.tick()
+        self.config_service.maybe_check()
+        trace = self.tracer.begin(headers)
+        if self.batch_size > 1:
+            self._collect(msg, trace)
+            return
+        metrics = self.metrics
+        metrics.messages_in.inc()
+        metrics.in_flight.inc()
+        start = t0 = perf_counter()
+        try:
+            msg = self._convert_to_internal_df(msg)
+            self.timings.observe("decode", perf_counter() - t0)
+            if msg is None:
+                metrics.messages_failed.inc()
+                return
+            msg = self.handle(channel, method, properties, msg)
+            if trace:
+                trace.done = trace.clock()
+            # here we submit to the other exchanges
+            t0 = perf_counter()
+            self.emit(msg, trace)
+            self.timings.observe("publish", perf_counter() - t0)
+        except Exception:
+            metrics.messages_failed.inc()
+            raise
+        finally:
+            metrics.in_flight.dec()
+            metrics.busy.inc(perf_counter() - start)
+
+
+class Processor(MessageCallback, AbstractProcessor):
     """The main Processor class, all others derive from it."""
 
     # logger = ...
 
+    # if True, process() gets a lib.message.Message whose payload is only decoded when accessed. Pass-through and
+    # routing processors which only look at the envelope should set this.
+    lazy_decode: bool = False
+    dst_exchanges: tuple = ()
+    # if > 1, messages are collected and handed to process_batch() together: when batch_size messages are there,
+    # or batch_wait seconds after the first one came in. For processors which wait on the network per message
+    # (DNS, HTTP APIs) and can do many lookups at once. Not used in a fused Pipeline.
+    batch_size: int = 1
+    batch_wait: float = 0.05
+
     def __init__(self, id: str, n: int = 1):
         super().__init__(id, n)
+        # config changes are picked up between two messages, see reload()
+        self.config_service = config_service()
+        self.config_service.subscribe(self._on_config_change)
+        # per-phase timings and on-demand profiling, see lib/profiling.py
+        self.timings = PhaseTimings()
+        self.profiler = Profiler(self.id)
+        # Prometheus metrics, see lib/metrics.py
+        self.metrics = ProcessorMetrics(self.__class__.__name__, self.id, self.timings)
+        # per-hop latency stamps of sampled messages, see lib/tracing.py
+        self.tracer = Tracer(self.id)
+        self._batch = []                # [(msg, trace)], see batch_size
+        self._batch_timer = None
         self.startup()
 
-    def _convert_to_internal_df(self, msg: bytes) -> dict:
+    def _on_config_change(self, config: Mapping):
+        self.config = config
+        self.reload()
+
+    def _convert_to_internal_df(self, msg: bytes) -> Union[dict, Message]:
         try:
+            if self.lazy_decode:
+                return Message.from_bytes(msg)
             data = json.loads(msg)
         except Exception as ex:
             self.logger.error("Could not convert msg (bytes) to msg (JSON) internal format. Reason: %s" % str(ex))
@@ -25,20 +109,105 @@ class Processor(AbstractProcessor):
         # TODO: implement me
         return super().validate(msg)
 
-    def mq_msg_callback(self, channel=None, method=None, properties=None, msg: bytes = None):
-        """Callback function which will be registered with the MQ's callback system.
-        Initially converts the (bytes) msg to an internal data format.
-        Then calls the self.process() function."""
+    def _collect(self, msg: bytes, trace: Optional[Trace]):
+        self.metrics.messages_in.inc()
+        t0 = perf_counter()
+        msg = self._convert_to_internal_df(msg)
+        self.timings.observe("decode", perf_counter() - t0)
+        self.metrics.busy.inc(perf_counter() - t0)
+        if msg is None:
+            self.metrics.messages_failed.inc()
+            return
+        self._batch.append((msg, trace))
+        self.metrics.in_flight.inc()
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+        elif self._batch_timer is None and self.consumer:
+            self._batch_timer = self.consumer.connection.call_later(self.batch_wait, self._on_batch_timer)
 
-        if not msg:
+    def _on_batch_timer(self):
+        self._batch_timer = None
+        self.flush()
+
+    def flush(self):
+        """Process and emit the collected messages now (see batch_size)."""
+        if self._batch_timer is not None:
+            self.consumer.connection.remove_timeout(self._batch_timer)
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
             return
-        msg = self._convert_to_internal_df(msg)
+        metrics = self.metrics
+        start = t0 = perf_counter()
+        try:
+            results = self.process_batch([msg for msg, _ in batch])
+            self.timings.observe("process_batch", perf_counter() - t0)
+            t0 = perf_counter()
+            for msg, (_, trace) in zip(results, batch):
+                if trace:
+                    trace.done = trace.clock()
+                self.emit(msg, trace)
+            self.timings.observe("publish", perf_counter() - t0)
+        except Exception:
+            metrics.messages_failed.inc(len(batch))
+            raise
+        finally:
+            metrics.in_flight.dec(len(batch))
+            metrics.busy.inc(perf_counter() - start)
+
+    def process_batch(self, msgs: List[Union[dict, Message]]) -> List[Optional[dict]]:
+        """Process several messages at once (see batch_size). Returns one result per message, in order, as
+        process() would. The default handles them one by one; override it to do the slow part for all of them at
+        once."""
+        return [self.handle(msg = msg) for msg in msgs]
+
+    def handle(self, channel=None, method=None, properties=None, msg: Union[dict, Message] = None):
+        """Validate (if configured) and process one already converted message. Returns the result of process()."""
         if self.id in self.config['processors'] and 'validate_msg' in self.config['processors'][self.id] and self.config['processors'][self.id]['validate_msg']:
+            t0 = perf_counter()
             self.validate(msg)
-        self.process(channel, method, properties, msg)
-        # here we submit to the other exchanges
+            self.timings.observe("validate", perf_counter() - t0)
+        t0 = perf_counter()
+        msg = self.process(channel, method, properties, msg)
+        self.timings.observe("process", perf_counter() - t0)
+        return msg
+
+    def connect(self, src_queue: Optional[str] = None, dst_exchanges: Iterable[str] = (), exchange_type: str = "fanout",
+                flow_control: dict = None):
+        """Attach to the input queue and the output exchanges. They must already exist (see lib/workflow.py), nothing
+        is declared here.
+
+        :param src_queue: the queue to consume from. None for processors without input (collectors)
+        :param dst_exchanges: the exchanges to send the results of process() to
+        :param exchange_type: the type of the output exchanges
+        :param flow_control: throttle the producer, see lib.flowcontrol.FlowControl
+        """
+        self.dst_exchanges = tuple(dst_exchanges)
+        if src_queue:
+            self.consumer = Consumer(id = self.id, exchange = "", callback = self.mq_msg_callback, queue_name = src_queue)
+        if self.dst_exchanges:
+            self.producer = Producer(id = self.id, exchange = self.dst_exchanges[0], exchange_type = exchange_type,
+                                     declare = False, flow_control = flow_control)
 
-    def process(self, channel=None, method=None, properties=None, msg: dict = {}):
+    def emit(self, msg: Union[dict, Message], trace: Trace = None):
+        """Send a (processed) message to all output exchanges. Nothing is sent for an empty message. If the message
+        is traced and does not go on, its path ends here."""
+        if msg and self.producer:
+            for exchange in self.dst_exchanges:
+                self.producer.produce(msg, exchange = exchange, trace = trace)
+                self.metrics.messages_out.inc()
+        elif trace:
+            self.tracer.finish(trace)
+
+    def start(self):
+        """Start consuming from the input queue."""
+        if self.consumer is None:
+            raise RuntimeError("%s has no src_queue to consume from." % self.id)
+        self.consumer.consume()
+        self.flush()            # the rest of the last batch
+
+    def process(self, channel=None, method=None, properties=None, msg: dict = {}) -> Optional[dict]:
+        """Process one message. Returns the message to be sent on to the output exchanges, or None to drop it."""
         # TODO: do we need channel, method, properties here?
         raise RuntimeError("not implemented in the abstract base class. This should not have been called.")
 
@@ -49,9 +218,10 @@ class Processor(AbstractProcessor):
         pass
 
     def reload(self):
-        # reload the config
-        pass
+        """Called between two messages after the config file changed. self.config already is the new (read-only)
+        snapshot. Override to re-read settings from it or to re-connect to enrichment DBs."""
+        self.logger.info("config reloaded (version %d)" % self.config_service.version)
 
     def shutdown(self):
-        # close DB connections etc.
-        pass
+        # close DB connections etc. Overrides call super().shutdown()
+        self.config_service.unsubscribe(self._on_config_change)
@@ -0,0 +1,226 @@
+"""Per-phase timings of the message handling and on-demand profiling of a live worker.
+
+Timings: every Processor (and Pipeline) has a PhaseTimings in ``self.timings``. mq_msg_callback() measures the phases
+of every message with time.perf_counter() and adds them to one Histogram per phase:
+
+    decode    bytes -> dict (or lib.message.Message)
+    validate  only if ``validate_msg`` is configured for the processor
+    process   the process() method
+    process_batch  the process_batch() method, for a whole batch (processors with batch_size > 1)
+    publish   sending the result to the output exchanges
+
+In a Pipeline, decode and publish are measured by the pipeline, validate and process by every processor of the
+chain. This costs well below a microsecond per message. A worker writes its timings to the log on SIGUSR2 and when it
+stops.
+
+Profiling: a Profiler runs cProfile in the worker's consumer thread for a limited time and then writes the stats to
+``<profiling: directory>/<id>.<pid>.<timestamp>.prof`` (read them with ``python -m pstats`` or snakeviz). It is
+switched on by
+  * SIGUSR1: profile for ``profiling: seconds`` seconds (see etc/config.yml)
+  * a control message: a message on the worker's input queue with the AMQP header ``yellowsub-control: profile`` (and
+    optionally ``seconds``) is not processed, but switches on the profiler of the worker which got it. Send one with
+    ``python -m lib.profiling <queue>``.
+The profiler is only started and stopped between two messages, or by a timer of the worker's connection (see
+Profiler.attach()), so that an idle worker starts and ends its profile on time too. While it is off, the cost is one
+attribute check per message.
+
+USAGE example:
+    kill -USR1 <pid of the worker>
+    python -m lib.profiling is_url_on_safebrowsing -s 60 -n 4       # profile 4 workers of the queue for a minute
+"""
+
+import argparse
+import bisect
+import cProfile
+import logging
+import os
+import signal
+import time
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+from lib.config import ROOTDIR, get_config
+
+CONTROL_HEADER = "yellowsub-control"
+DEFAULT_PROFILE_SECONDS = 30
+DEFAULT_PROFILE_DIR = "var/profiles"
+
+# upper bounds (seconds) of the histogram buckets: 10us .. 10s, plus +Inf
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Bucket counts (not cumulative) of observed durations in seconds, plus their count and sum."""
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)     # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q-quantile (0 <= q <= 1): linear interpolation within the bucket it falls into."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                if i == len(self.bounds):
+                    return lower                        # in +Inf: the best we know is the largest bound
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+class PhaseTimings:
+    """One Histogram per phase of the message handling."""
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.phases: Dict[str, Histogram] = {}
+
+    def observe(self, phase: str, seconds: float):
+        h = self.phases.get(phase)
+        if h is None:
+            h = self.phases[phase] = Histogram(self.bounds)
+        h.observe(seconds)
+
+    def reset(self):
+        self.phases = {}
+
+    def report(self, prefix: str = "") -> str:
+        """One line per phase: count, mean, p50 and p99 (in milliseconds) and the total time spent."""
+        return "\n".join("%s%-10s n=%d mean=%.3fms p50=%.3fms p99=%.3fms total=%.1fs" % (
+            prefix, phase, h.count, 1e3 * h.mean(), 1e3 * h.quantile(0.5), 1e3 * h.quantile(0.99), h.sum)
+            for phase, h in self.phases.items())
+
+
+class Profiler:
+    """cProfile for a limited time, started and stopped between two messages. See the module docstring."""
+
+    def __init__(self, name: str, directory: str = None, seconds: float = None, clock = time.monotonic):
+        """
+        :param name: used in the file name of the profiles, the processor ID for example
+        :param directory: where to write the profiles, relative to ROOTDIR. Default: ``profiling: directory`` of the
+            config, else var/profiles
+        :param seconds: default duration of a profile. Default: ``profiling: seconds`` of the config, else 30
+        :param clock: time source
+        """
+        config = get_config().get('profiling') or {}
+        self.name = name.replace("/", "_")
+        self.directory = Path(ROOTDIR) / (directory or config.get('directory', DEFAULT_PROFILE_DIR))
+        self.seconds = float(seconds or config.get('seconds', DEFAULT_PROFILE_SECONDS))
+        self.clock = clock
+        # True while there is something to do between two messages: a requested start or a running profile
+        self.pending = False
+        self._requested: Optional[float] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._deadline = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def request(self, seconds: float = None):
+        """Ask for a profile of seconds seconds. Takes effect before the next message. Safe to call from a signal
+        handler."""
+        self._requested = float(seconds or self.seconds)
+        self.pending = True
+
+    def tick(self) -> Optional[Path]:
+        """Called before every message while pending: start a requested profile, stop and write an expired one.
+        Returns the file written, if any."""
+        written = None
+        if self._profile is not None and (self._requested is not None or self.clock() >= self._deadline):
+            written = self.stop()
+        if self._requested is not None:
+            self._deadline = self.clock() + self._requested
+            self._requested = None
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            logging.info("%s: profiling for %.0f seconds" % (self.name, self._deadline - self.clock()))
+        self.pending = self._profile is not None
+        return written
+
+    def attach(self, connection, interval: float = 1.0):
+        """Call tick() every interval seconds on a timer of connection (a pika connection, the timer runs in the
+        consumer thread), so that requested profiles start and expired ones stop without waiting for a message."""
+        def on_timer():
+            if self.pending:
+                self.tick()
+            connection.call_later(interval, on_timer)
+        connection.call_later(interval, on_timer)
+
+    def stop(self) -> Optional[Path]:
+        """Stop a running profile and write it to disk. Returns the file, None if no profile was running."""
+        profile, self._profile = self._profile, None
+        self.pending = self._requested is not None
+        if profile is None:
+            return None
+        profile.disable()
+        try:
+            self.directory.mkdir(parents = True, exist_ok = True)
+            path = self.directory / ("%s.%d.%s.prof" % (self.name, os.getpid(), time.strftime("%Y%m%dT%H%M%S")))
+            profile.dump_stats(str(path))
+        except OSError as ex:
+            logging.error("%s: could not write the profile. Reason: %s" % (self.name, str(ex)))
+            return None
+        logging.info("%s: profile written to %s" % (self.name, path))
+        return path
+
+    def control(self, headers: dict) -> bool:
+        """Act on a control message (see CONTROL_HEADER). Returns True if the message was one and must not be
+        processed."""
+        command = headers.get(CONTROL_HEADER)
+        if command is None:
+            return False
+        if command == "profile":
+            self.request(headers.get("seconds"))
+        else:
+            logging.warning("%s: unknown control command %r" % (self.name, command))
+        return True
+
+
+def install_signal_handlers(p):
+    """SIGUSR1 profiles the processor (or Pipeline) p, SIGUSR2 writes its timings to the log."""
+    signal.signal(signal.SIGUSR1, lambda signum, frame: p.profiler.request())
+    signal.signal(signal.SIGUSR2, lambda signum, frame: log_timings(p))
+
+
+def log_timings(p):
+    """Write the timings of a processor, or of all processors of a Pipeline, to the log."""
+    for q in [p] + list(getattr(p, "processors", [])):
+        if q.timings.phases:
+            logging.info("timings of %s:\n%s" % (q.id, q.timings.report("  ")))
+
+
+if __name__ == "__main__":
+    from lib.mq import MQ
+
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description = 'switch on the profiler of the workers consuming from a queue')
+    parser.add_argument('queue', help = "the input queue of the processor")
+    parser.add_argument('-s', '--seconds', type = float, default = DEFAULT_PROFILE_SECONDS, help = "profile duration")
+    parser.add_argument('-n', '--count', type = int, default = 1,
+                        help = "number of control messages. Each one reaches one worker (round robin)")
+    args = parser.parse_args()
+
+    mq = MQ("profiling")
+    mq.connect()
+    for _ in range(args.count):
+        mq._publish({}, routing_key = args.queue, exchange = "",
+                    headers = {CONTROL_HEADER: "profile", "seconds": args.seconds})
+    mq.close()
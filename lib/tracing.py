@@ -0,0 +1,224 @@
+"""Per-hop latency stamps of sampled messages, and a tool to turn them into waterfalls and queue-wait histograms.
+
+A message is sampled where it enters the workflow: a Collector emits it with probability ``tracing: sample_rate``
+(see etc/config.yml). A sampled message carries two AMQP headers, so the body is never touched:
+
+    yellowsub-trace-id   the trace ID
+    yellowsub-trace      one stamp per hop it went through: "<processor id> <received> <done> <published>"
+                         (unix times). received: the consumer callback got the message, done: process() returned,
+                         published: the producer sent it on.
+
+Every processor appends its own stamp when it sends a traced message on (Producer.produce(trace = ...)). Where a
+path ends -- a processor without output exchanges, or process() dropped the message -- the Tracer appends the
+complete path to ``<tracing: directory>/<processor id>.<pid>.jsonl``. A message which fans out to several queues
+has one path per branch, with a common prefix.
+
+Untraced messages cost one dict lookup per hop. A fused Pipeline (see lib/processor/pipeline.py) is one hop.
+
+The stamps are wall clock times of different hosts: the queue waits are only as good as the clock synchronisation.
+
+USAGE example:
+    python -m lib.tracing var/traces/*.jsonl                    # queue waits per edge, service times per processor
+    python -m lib.tracing var/traces/*.jsonl -w 5               # ... and the waterfalls of the 5 slowest messages
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from lib.config import ROOTDIR, get_config
+from lib.profiling import Histogram
+
+TRACE_HEADER = "yellowsub-trace"
+TRACE_ID_HEADER = "yellowsub-trace-id"
+DEFAULT_TRACE_DIR = "var/traces"
+
+
+def format_stamp(processor_id: str, received: float, done: float, published: Optional[float]) -> str:
+    return "%s %.6f %.6f %s" % (processor_id, received, done, "-" if published is None else "%.6f" % published)
+
+
+def parse_stamp(stamp: str) -> dict:
+    """The inverse of format_stamp(): a dict with id, received, done and published (None at the end of a path)."""
+    pid, received, done, published = stamp.rsplit(" ", 3)
+    return {"id": pid, "received": float(received), "done": float(done),
+            "published": None if published == "-" else float(published)}
+
+
+class Trace:
+    """The trace of one message while one processor handles it."""
+
+    __slots__ = ("trace_id", "stamps", "processor_id", "received", "done", "clock")
+
+    def __init__(self, trace_id: str, stamps: List[str], processor_id: str, received: float, clock = time.time):
+        self.trace_id = trace_id
+        self.stamps = stamps                # of the previous hops
+        self.processor_id = processor_id
+        self.received = received
+        self.done = received
+        self.clock = clock
+
+    def headers(self) -> dict:
+        """The AMQP headers for sending the message on now, with the stamp of this hop."""
+        return {TRACE_ID_HEADER: self.trace_id,
+                TRACE_HEADER: self.stamps + [format_stamp(self.processor_id, self.received, self.done, self.clock())]}
+
+    def path(self) -> dict:
+        """The complete path, ending at this hop."""
+        hops = [parse_stamp(s) for s in self.stamps]
+        hops.append(parse_stamp(format_stamp(self.processor_id, self.received, self.done, None)))
+        return {"trace_id": self.trace_id, "hops": hops}
+
+
+class Tracer:
+    """Starts, continues and ends the traces of one processor (or Pipeline). See the module docstring."""
+
+    def __init__(self, processor_id: str, sample_rate: float = None, directory: str = None, clock = time.time,
+                 rand = random.random):
+        """
+        :param processor_id: the hop's name in the stamps
+        :param sample_rate: fraction of the messages to trace, where they enter the workflow. Default: ``tracing:
+            sample_rate`` of the config, else 0 (off)
+        :param directory: where to write the paths, relative to ROOTDIR. Default: ``tracing: directory`` of the
+            config, else var/traces
+        """
+        config = get_config().get('tracing') or {}
+        self.processor_id = processor_id
+        self.sample_rate = float(config.get('sample_rate', 0.0) if sample_rate is None else sample_rate)
+        self.directory = Path(ROOTDIR) / (directory or config.get('directory', DEFAULT_TRACE_DIR))
+        self.clock = clock
+        self.rand = rand
+        self._file = None
+
+    def begin(self, headers: Optional[dict]) -> Optional[Trace]:
+        """The trace of a received message, None if it is not traced."""
+        stamps = headers.get(TRACE_HEADER) if headers else None
+        if not stamps:
+            return None
+        return Trace(headers.get(TRACE_ID_HEADER), list(stamps), self.processor_id, self.clock(), self.clock)
+
+    def sample(self) -> Optional[Trace]:
+        """Start tracing a new message with probability sample_rate. None if it is not sampled."""
+        if self.sample_rate and self.rand() < self.sample_rate:
+            return Trace(uuid.uuid4().hex, [], self.processor_id, self.clock(), self.clock)
+        return None
+
+    def finish(self, trace: Trace):
+        """The path of trace ends here: append it to the trace file."""
+        try:
+            if self._file is None:
+                self.directory.mkdir(parents = True, exist_ok = True)
+                name = "%s.%d.jsonl" % (self.processor_id.replace("/", "_"), os.getpid())
+                self._file = open(self.directory / name, "a", buffering = 1)
+            self._file.write(json.dumps(trace.path()) + "\n")
+        except OSError as ex:
+            logging.error("%s: could not write trace %s. Reason: %s" % (self.processor_id, trace.trace_id, str(ex)))
+
+
+def load_paths(files: Iterable[str]) -> Dict[str, List[dict]]:
+    """Read trace files. Returns trace ID -> paths."""
+    traces: Dict[str, List[dict]] = {}
+    for name in files:
+        with open(name) as f:
+            for line in f:
+                if line.strip():
+                    path = json.loads(line)
+                    traces.setdefault(path["trace_id"], []).append(path)
+    return traces
+
+
+def waterfall_rows(paths: List[dict]) -> List[dict]:
+    """The hops of one trace (all paths merged, shared prefixes once), in order of arrival. Every row has the hop,
+    its queue wait (since the previous hop published it; None for the first hop) and its depth in the tree."""
+    rows, seen = [], set()
+    for path in paths:
+        prev = None
+        for depth, hop in enumerate(path["hops"]):
+            key = (depth, hop["id"], hop["received"])
+            if key not in seen:
+                seen.add(key)
+                rows.append(dict(hop, depth = depth, edge = (prev["id"], hop["id"]) if prev else None,
+                                 wait = hop["received"] - prev["published"] if prev else None))
+            prev = hop
+    rows.sort(key = lambda r: (r["received"], r["depth"]))
+    return rows
+
+
+def duration(paths: List[dict]) -> float:
+    """From the first stamp to the end of the longest path."""
+    start = min(p["hops"][0]["received"] for p in paths)
+    return max(p["hops"][-1]["done"] for p in paths) - start
+
+
+def edge_stats(traces: Dict[str, List[dict]]):
+    """Queue wait histograms per edge ("A -> B") and service time histograms per processor, over all traces."""
+    waits: Dict[str, Histogram] = {}
+    service: Dict[str, Histogram] = {}
+    for paths in traces.values():
+        for row in waterfall_rows(paths):
+            service.setdefault(row["id"], Histogram()).observe(max(row["done"] - row["received"], 0.0))
+            if row["edge"]:
+                waits.setdefault("%s -> %s" % row["edge"], Histogram()).observe(max(row["wait"], 0.0))
+    return waits, service
+
+
+def format_stats(title: str, histograms: Dict[str, Histogram]) -> str:
+    lines = ["%-50s %8s %10s %10s %10s %10s" % (title, "n", "mean ms", "p50 ms", "p99 ms", "total s")]
+    for name, h in sorted(histograms.items(), key = lambda kv: -kv[1].sum):
+        lines.append("%-50s %8d %10.3f %10.3f %10.3f %10.2f"
+                     % (name, h.count, 1e3 * h.mean(), 1e3 * h.quantile(0.5), 1e3 * h.quantile(0.99), h.sum))
+    return "\n".join(lines)
+
+
+def format_waterfall(trace_id: str, paths: List[dict], width: int = 60) -> str:
+    """A text waterfall: per hop, '.' is the queue wait, '#' the processing and '>' the publishing."""
+    rows = waterfall_rows(paths)
+    start = rows[0]["received"]
+    total = max(duration(paths), max(r["published"] or r["done"] for r in rows) - start, 1e-9)
+
+    def col(t: float) -> int:
+        return int(round(width * (t - start) / total))
+
+    lines = ["trace %s: %.3f ms" % (trace_id, 1e3 * duration(paths))]
+    for r in rows:
+        arrived = r["received"] - (r["wait"] or 0.0)
+        bar = " " * col(arrived) + "." * (col(r["received"]) - col(arrived)) + \
+            "#" * max(col(r["done"]) - col(r["received"]), 1)
+        if r["published"] is not None:
+            bar += ">" * (col(r["published"]) - col(r["done"]))
+        lines.append("  %-30s |%-*s| wait %8.3f ms  busy %8.3f ms"
+                     % ("  " * r["depth"] + r["id"], width + 1, bar, 1e3 * (r["wait"] or 0.0),
+                        1e3 * (r["done"] - r["received"])))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'queue waits, service times and waterfalls from trace files')
+    parser.add_argument('files', nargs = '*', help = "trace files (default: var/traces/*.jsonl)")
+    parser.add_argument('-w', '--waterfalls', type = int, default = 0, help = "show the N slowest messages")
+    parser.add_argument('-t', '--trace', help = "show the waterfall of this trace ID")
+    args = parser.parse_args()
+
+    files = args.files or glob.glob(str(Path(ROOTDIR) / DEFAULT_TRACE_DIR / "*.jsonl"))
+    traces = load_paths(files)
+    if not traces:
+        print("no traces found", file = sys.stderr)
+        sys.exit(1)
+    waits, service = edge_stats(traces)
+    print("%d traced messages\n" % len(traces))
+    print(format_stats("queue wait (edge)", waits))
+    print()
+    print(format_stats("service time (processor)", service))
+    selected = [args.trace] if args.trace else \
+        sorted(traces, key = lambda t: -duration(traces[t]))[:args.waterfalls]
+    for trace_id in selected:
+        print()
+        print(format_waterfall(trace_id, traces[trace_id]))
@@ -15,46 +15,63 @@ Also see the unit test in tests/test_cache.py please.
 """
 
 import time
+from typing import Optional
+
 import redis
-from pathlib import Path
-from lib.config import Config, CONFIG_FILE_PATH_STR
+from lib.config import get_config
+from lib.metrics import REGISTRY
 
-c = Config()
-config = c.load(Path(CONFIG_FILE_PATH_STR))
-TTL = config['redis'].get('cache_ttl', 24 * 3600)  # 1 day default
+DEFAULT_TTL = 24 * 3600  # 1 day
 
 
 class Cache:
     """A simple cache of key/value pairs (both strings) via redis."""
 
-    def __init__(self):
-        """Construct it."""
+    def __init__(self, client: redis.StrictRedis = None):
+        """Construct it.
+
+        :param client: a redis client to use instead of connecting to the one from the config (needs
+                       decode_responses = True)
+        """
 
-        _c = Config()
-        self.config = _c.load(Path(CONFIG_FILE_PATH_STR))
+        self.config = get_config()
 
         self.host = self.config['redis'].get('host', "localhost")
         self.port = int(self.config['redis'].get('port', 6379))
         self.password = self.config['redis'].get('password', None)
         self.db = int(self.config['redis'].get('db', 2))
-        self.r = redis.StrictRedis(host = self.host, port = self.port, db = self.db, password = self.password,
-                                   decode_responses = True)
+        self.ttl = self.config['redis'].get('cache_ttl', DEFAULT_TTL)
+        self.r = client or redis.StrictRedis(host = self.host, port = self.port, db = self.db,
+                                             password = self.password, decode_responses = True)
+        self.hits = REGISTRY.counter("yellowsub_cache_hits_total", "Cache lookups which found the key.")
+        self.misses = REGISTRY.counter("yellowsub_cache_misses_total", "Cache lookups which did not find the key.")
         if not self.r.exists("cache_metadata"):
             self.r.hset(b"cache_metadata", b"created_at", time.time())
 
     def __contains__(self, key: str) -> bool:
         """Check for existence of the key in the redis cache."""
 
-        return self.r.exists(key)
+        found = self.r.exists(key)
+        if found:
+            self.hits.inc()
+        else:
+            self.misses.inc()
+        return found
 
     def __getitem__(self, key: str) -> str:
         """Get key from redis."""
 
-        return self.r.get(key)
+        value = self.r.get(key)
+        if value is None:
+            self.misses.inc()
+        else:
+            self.hits.inc()
+        return value
 
-    def __setitem__(self, key: str, value: str, ttl: int = TTL) -> int:
-        """Store the key in redis."""
+    def __setitem__(self, key: str, value: str, ttl: Optional[int] = None) -> int:
+        """Store the key in redis. ttl defaults to redis: cache_ttl from the config, 0 means no expiry."""
 
+        ttl = self.ttl if ttl is None else ttl
         rv = self.r.set(key, value)
         if ttl:
             self.r.expire(key, ttl)
@@ -75,5 +92,18 @@ class Cache:
         return self.r.flushdb()
 
 
-# XXX FIXME: this global cache var needs to die XXX
-cache = Cache()
+_cache: Optional[Cache] = None
+
+
+def set_cache(cache: Optional[Cache]):
+    """Replace the process-wide Cache, for example by one on a stand-in redis client. None resets it."""
+    global _cache
+    _cache = cache
+
+
+def get_cache() -> Cache:
+    """The process-wide Cache. Connects on first use, not on import."""
+    global _cache
+    if _cache is None:
+        _cache = Cache()
+    return _cache
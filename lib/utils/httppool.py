@@ -0,0 +1,137 @@
+"""HTTPPool: keep-alive HTTP(S) connections to one server, reused between requests.
+
+Opening a connection (and a TLS session) per request costs a round trip or more. The pool keeps up to ``size`` idle
+connections; a request takes one (or opens a new one) and puts it back once the answer is read. A request on a reused
+connection which the server has closed in the meantime is sent once more on a fresh connection.
+
+USAGE example:
+    pool = HTTPPool("https://es.example.com:9200", headers = {"Authorization": "ApiKey ..."})
+    r = pool.request("POST", "/hunter/_search", json_body = {"query": {"match_all": {}}})
+    print(r.status, r.json())
+"""
+
+import base64
+import http.client
+import json
+import socket
+import ssl
+import threading
+import urllib.parse
+from typing import Dict, List, NamedTuple, Tuple
+
+
+class HTTPError(RuntimeError):
+    """The request failed, or the server answered with an error status (see HTTPResponse.raise_for_status)."""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class HTTPResponse(NamedTuple):
+    status: int
+    reason: str
+    headers: Dict[str, str]     # lower-case names
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body)
+
+    def raise_for_status(self) -> "HTTPResponse":
+        if self.status >= 400:
+            raise HTTPError("HTTP %d %s: %s" % (self.status, self.reason, self.body[:200]), self.status)
+        return self
+
+
+class HTTPPool:
+    """Keep-alive connections to one server. Thread safe. See the module docstring."""
+
+    def __init__(self, base_url: str, size: int = 4, timeout: float = 10.0, verify: bool = True,
+                 headers: Dict[str, str] = None, user: str = None, password: str = None):
+        """
+        :param base_url: scheme, host, port and an optional path prefix of all requests
+        :param size: idle connections kept open
+        :param timeout: seconds for connecting and for every answer
+        :param verify: verify the server certificate (https)
+        :param headers: sent with every request
+        :param user: basic auth user, if any
+        :param password: basic auth password
+        """
+        u = urllib.parse.urlsplit(base_url)
+        if u.scheme not in ("http", "https") or not u.hostname:
+            raise ValueError("invalid URL %r" % base_url)
+        self.scheme, self.host, self.port = u.scheme, u.hostname, u.port
+        self.prefix = u.path.rstrip('/')
+        self.size = size
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        if user is not None:
+            token = base64.b64encode(("%s:%s" % (user, password or "")).encode()).decode()
+            self.headers["Authorization"] = "Basic %s" % token
+        self._context = None
+        if self.scheme == "https":
+            self._context = ssl.create_default_context()
+            if not verify:
+                self._context.check_hostname = False
+                self._context.verify_mode = ssl.CERT_NONE
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self.opened = 0             # connections opened so far
+        self.requests = 0
+
+    def _acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+            self.opened += 1
+        if self.scheme == "http":
+            return http.client.HTTPConnection(self.host, self.port, timeout = self.timeout), False
+        return http.client.HTTPSConnection(self.host, self.port, timeout = self.timeout, context = self._context), False
+
+    def _release(self, connection: http.client.HTTPConnection):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method: str, path: str, body: bytes = None, json_body = None,
+                headers: Dict[str, str] = None) -> HTTPResponse:
+        """Send one request and read the whole answer. Raises HTTPError if no answer could be read.
+
+        :param method: GET, POST, ...
+        :param path: appended to the path of base_url
+        :param body: the request body
+        :param json_body: alternatively, an object to send as JSON
+        :param headers: in addition to the pool's headers
+        """
+        h = dict(self.headers)
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            h["Content-Type"] = "application/json"
+        h.update(headers or {})
+        while True:
+            connection, reused = self._acquire()
+            try:
+                connection.request(method, self.prefix + path, body = body, headers = h)
+                r = connection.getresponse()
+                data = r.read()
+            except (http.client.HTTPException, OSError) as ex:
+                connection.close()
+                if reused and not isinstance(ex, socket.timeout):
+                    continue        # the server closed the idle connection: try again on another one
+                raise HTTPError("%s %s failed. Reason: %s" % (method, path, str(ex)))
+            self.requests += 1
+            response = HTTPResponse(r.status, r.reason, {k.lower(): v for k, v in r.getheaders()}, data)
+            if r.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return response
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
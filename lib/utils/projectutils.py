@@ -1,6 +1,123 @@
+import copy
 import os
 import logging
 import logging.handlers
+import queue
+import threading
+import time
+from collections.abc import Mapping
+
+LOG_FORMAT = '%(asctime)s|%(created)s|%(name)s|%(levelname)s: %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per logger and message template: at most ``burst`` records at once and ``rate`` records per
+    second on average. Meant for per-message logs. The number of dropped records is added to the next record which
+    passes (by the handler of the filter, see take()); the record itself is shared with the other handlers and is not
+    changed. Records of level WARNING and above always pass unless ``all_levels`` is set."""
+
+    def __init__(self, rate: float = 10.0, burst: int = 100, all_levels: bool = False, clock = time.monotonic):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.all_levels = all_levels
+        self.clock = clock
+        self._buckets = {}      # (logger name, template) -> [tokens, last refill, dropped]
+        self._lock = threading.Lock()
+        self._passed = threading.local()     # (record, dropped) of the last record which passed in this thread
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING and not self.all_levels:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg))
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) > 10000:      # templates built with % instead of args: don't grow forever
+                    self._buckets.clear()
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        if dropped:
+            self._passed.last = (record, dropped)
+        return True
+
+    def take(self, record: logging.LogRecord) -> int:
+        """Number of records dropped before record passed this filter (0 if none). Called by the handler of the filter
+        on the same thread, right after filter()."""
+        last = getattr(self._passed, "last", None)
+        if last is None or last[0] is not record:
+            return 0
+        self._passed.last = None
+        return last[1]
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+    """Hands the records to a QueueListener which writes them to the actual (file) handlers on a background thread.
+
+    Only the message itself is merged with its arguments on the logging thread (the arguments may be mutable and
+    change later). Timestamps, formatting and the writes happen on the listener's thread. A record whose logger level
+    is disabled is never created, so it costs nothing.
+    """
+
+    def __init__(self, handlers: list):
+        super().__init__(queue.SimpleQueue())
+        self.listener = None
+        self._start_listener(handlers)
+        _queued_handlers.add(self)
+
+    def _start_listener(self, handlers: list):
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level = True)
+        self.listener.start()
+        self._listening = True
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        suppressed = sum(f.take(record) for f in self.filters if isinstance(f, RateLimitFilter))
+        record = copy.copy(record)      # other handlers (of parent loggers) get the original
+        msg = record.getMessage()
+        if suppressed:
+            msg = "%s (%d similar messages suppressed)" % (msg, suppressed)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = msg, None, None
+        return record
+
+    def restart(self):
+        """Give the handler a fresh queue and listener thread. In a forked child, the parent's thread is gone."""
+        self.queue = queue.SimpleQueue()
+        self._start_listener(self.listener.handlers)
+
+    def stop(self):
+        """Write the queued records and stop the listener thread."""
+        if self._listening:
+            self._listening = False
+            self.listener.stop()
+
+    def close(self):
+        """Write the queued records, stop the listener and close the file handlers."""
+        self.stop()
+        for h in self.listener.handlers:
+            h.close()
+        _queued_handlers.discard(self)
+        super().close()
+
+
+_queued_handlers = set()
+
+
+def _restart_queued_handlers():
+    for h in list(_queued_handlers):
+        h.restart()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child = _restart_queued_handlers)
 
 
 class ProjectUtils:
@@ -65,28 +182,53 @@ class ProjectUtils:
             if "logging" not in config.keys():
                 raise RuntimeError("the global logger is not defined in the config")
             else:
-                formatter = logging.Formatter('%(asctime)s|%(created)s|%(name)s|%(levelname)s: %(message)s')
-                logger_config = config["logging"]
-                log_level = logger_config["loglevel"]
-                handlers = []
-
-                for h in logger_config["handlers"]:
-                    handler_config = h["handler"]
-                    if handler_config["type"] != "TimedRotatingFileHandler":
-                        raise NotImplementedError("the only supported logging handler is TimedRotatingFileHandler")
-                    h_type = handler_config["type"]
-                    h_output = handler_config["output"]
-                    h_log_level = handler_config["loglevel"]
-                    handler = getattr(logging.handlers, h_type)(h_output, when="midnight", interval=1,
-                                                                backupCount=30)
-                    handler.setLevel(h_log_level)
-                    handler.setFormatter(formatter)
-                    handlers.append(handler)
-
-                root_logger.setLevel(log_level)
+                ProjectUtils.__attach_handlers(root_logger, config["logging"])
                 root_logger.propagate = False
-                for h in handlers:
-                    root_logger.addHandler(h)
+
+    @staticmethod
+    def __attach_handlers(logger: logging.Logger, logger_config: dict, defaults: dict = None):
+        """
+        Create the handlers of a logging config section and attach them to logger. Unless ``queue: false`` is
+        configured, the file handlers run behind a QueuedHandler (background thread). ``rate_limit: {rate, burst}``
+        adds a RateLimitFilter. The logger level is raised to the lowest handler level, so that records no handler
+        would write are not even created.
+
+        @param logger: the logger to configure
+        @param logger_config: the ``logging:`` section (global or of a processor)
+        @param defaults: the global ``logging:`` section, for the queue and rate_limit settings of processor loggers
+        @return: None
+        @rtype: None
+        """
+        defaults = defaults or {}
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = []
+        for h in logger_config["handlers"]:
+            handler_config = h["handler"]
+            if handler_config["type"] != "TimedRotatingFileHandler":
+                raise NotImplementedError("the only supported logging handler is TimedRotatingFileHandler")
+            h_type = handler_config["type"]
+            h_output = handler_config["output"]
+            h_log_level = handler_config["loglevel"]
+            handler = getattr(logging.handlers, h_type)(h_output, when="midnight", interval=1, backupCount=30)
+            handler.setLevel(h_log_level)
+            handler.setFormatter(formatter)
+            handlers.append(handler)
+
+        log_level = logger_config.get("loglevel", "DEBUG")
+        log_level = logging.getLevelName(log_level) if isinstance(log_level, str) else log_level
+        # records propagate to the handlers of the global logger as well
+        levels = [h.level for h in handlers] + [logging.getLevelName(h["handler"]["loglevel"])
+                                                for h in defaults.get("handlers", [])]
+        if levels:
+            log_level = max(log_level, min(levels))
+        logger.setLevel(log_level)
+        if logger_config.get("queue", defaults.get("queue", True)):
+            handlers = [QueuedHandler(handlers)]
+        rate_limit = logger_config.get("rate_limit", defaults.get("rate_limit"))
+        for h in handlers:
+            if rate_limit:
+                h.addFilter(RateLimitFilter(**rate_limit))
+            logger.addHandler(h)
 
     # TODO: DG_Comment: break the parsing of the config in a different function this should be actually implemented
     #       entirely in the "orchestrator" in order to parse config in one place only. The only method implemented in
@@ -107,8 +249,8 @@ class ProjectUtils:
         @return: None
         @rtype: None
         """
-        if type(config) != dict:
-            raise TypeError("config parameter should be of type dict")
+        if not isinstance(config, Mapping):
+            raise TypeError("config parameter should be a mapping (dict)")
         elif len(config.keys()) == 0:
             raise RuntimeError("The config dictionary supplied for configuring loggers is empty")
 
@@ -129,27 +271,7 @@ class ProjectUtils:
             else:
                 processor_logger = logging.getLogger("yellowsub." + processor_class + "." + processor_id)
                 if len(processor_logger.handlers) == 0:
-                    formatter = logging.Formatter('%(asctime)s|%(created)s|%(name)s|%(levelname)s: %(message)s')
-                    logger_config = processor_config["logging"]
-                    log_level = logger_config["loglevel"]
-                    handlers = []
-                    for h in logger_config["handlers"]:
-                        handler_config = h["handler"]
-                        if handler_config["type"] != "TimedRotatingFileHandler":
-                            raise NotImplementedError(
-                                "the only supported logging handler is TimedRotatingFileHandler")
-                        h_type = handler_config["type"]
-                        h_output = handler_config["output"]
-                        h_log_level = handler_config["loglevel"]
-                        handler = getattr(logging.handlers, h_type)(h_output, when="midnight", interval=1,
-                                                                    backupCount=30)
-                        handler.setLevel(h_log_level)
-                        handler.setFormatter(formatter)
-                        handlers.append(handler)
-
-                    processor_logger.setLevel(log_level)
-                    for h in handlers:
-                        processor_logger.addHandler(h)
+                    ProjectUtils.__attach_handlers(processor_logger, processor_config["logging"], config["logging"])
 
     @staticmethod
     def get_logger(logger_name: str = None):
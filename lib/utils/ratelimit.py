@@ -0,0 +1,111 @@
+"""Token buckets: at most ``burst`` requests at once and ``rate`` requests per second on average.
+
+take() reserves tokens and returns how long the caller must wait before it may go ahead (0 if right away). The
+reservation is made even if the tokens are not there yet (the bucket goes negative), so waiting callers are served in
+order instead of racing for every new token. pause() stops the bucket for a while, after a 429 Too Many Requests for
+example.
+
+TokenBucket counts in the process. RedisTokenBucket keeps the bucket in redis (one hash per key, updated by a Lua
+script with the redis server's clock), so all workers of all hosts which share the key share the rate.
+
+USAGE example:
+    bucket = RedisTokenBucket(redis.StrictRedis(), "yellowsub:ratelimit:censys", rate = 0.4, burst = 1)
+    time.sleep(bucket.take())
+    ... send the request ...
+"""
+
+import threading
+import time
+from typing import Callable
+
+import redis
+from lib.config import get_config
+
+
+class TokenBucket:
+    """A token bucket in the process. Thread safe."""
+
+    def __init__(self, rate: float, burst: float = 1, clock: Callable[[], float] = time.monotonic):
+        """
+        :param rate: tokens added per second
+        :param burst: size of the bucket
+        :param clock: time source
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("token bucket: need rate > 0 and burst >= 1")
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.clock = clock
+        self.tokens = self.burst
+        self._last = clock()
+        self._paused_until = float('-inf')
+        self._lock = threading.Lock()
+
+    def take(self, n: float = 1) -> float:
+        """Reserve n tokens. Returns the seconds to wait before using them."""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+            self._last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for seconds seconds (from now)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+
+
+# KEYS[1]: the bucket. ARGV: rate, burst, n, pause seconds (0: take n tokens). Returns the wait in microseconds.
+_SCRIPT = """
+redis.replicate_commands()      -- TIME before a write: replicate the effects (the default since redis 5)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate, burst, n, pause = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'paused_until')
+local tokens, ts, paused_until = tonumber(b[1]) or burst, tonumber(b[2]) or now, tonumber(b[3]) or 0
+if pause > 0 then
+    paused_until = math.max(paused_until, now + pause)
+else
+    tokens = math.min(burst, tokens + (now - ts) * rate) - n
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now, 'paused_until', paused_until)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate + math.max(paused_until - now, 0)) + 60)
+local wait = 0
+if tokens < 0 then wait = -tokens / rate end
+return math.floor(math.max(wait, paused_until - now) * 1000000)
+"""
+
+
+class RedisTokenBucket:
+    """A token bucket in redis, shared by every process which uses the same key."""
+
+    def __init__(self, client: redis.StrictRedis, key: str, rate: float, burst: float = 1):
+        """
+        :param client: the redis connection
+        :param key: the redis key of the bucket
+        :param rate: tokens added per second
+        :param burst: size of the bucket
+        """
+        if rate <= 0 or burst < 1:
+            raise ValueError("token bucket: need rate > 0 and burst >= 1")
+        self.key = key
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._script = client.register_script(_SCRIPT)
+
+    def take(self, n: float = 1) -> float:
+        """Reserve n tokens. Returns the seconds to wait before using them."""
+        return self._script(keys = [self.key], args = [self.rate, self.burst, n, 0]) / 1e6
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for seconds seconds (from now), in all processes."""
+        self._script(keys = [self.key], args = [self.rate, self.burst, 0, seconds])
+
+
+def redis_client() -> redis.StrictRedis:
+    """A connection to the redis of the config (see ``redis:`` in etc/config.yml)."""
+    c = get_config()['redis']
+    return redis.StrictRedis(host = c.get('host', "localhost"), port = int(c.get('port', 6379)),
+                             db = int(c.get('db', 2)), password = c.get('password', None))
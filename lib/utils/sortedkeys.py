@@ -0,0 +1,46 @@
+"""SortedKeys: a sorted array of fixed-width byte string keys in a buffer (a memory-mapped file), searched with bisect.
+
+Big-endian integers and raw digests of equal width sort the same as bytes, so the keys are compared as they are,
+without decoding. find_many() searches sorted keys in one pass: every search starts where the previous one ended.
+
+USAGE example:
+    keys = SortedKeys(mm, offset = 16, width = 32, count = n)
+    i = keys.find(digest)            # its position, or -1
+"""
+
+import bisect
+from typing import Iterable, Iterator, Tuple
+
+
+class SortedKeys:
+    """count keys of width bytes at offset of buf, sorted. A sequence of bytes, for bisect."""
+
+    def __init__(self, buf, offset: int, width: int, count: int):
+        self.buf, self.offset, self.width, self.count = buf, offset, width, count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> bytes:
+        start = self.offset + i * self.width
+        return self.buf[start:start + self.width]
+
+    def floor(self, key: bytes, lo: int = 0) -> int:
+        """The position of the last key <= key, -1 if there is none. Searches from lo on."""
+        return bisect.bisect_right(self, key, lo) - 1
+
+    def find(self, key: bytes, lo: int = 0) -> int:
+        """The position of key, -1 if it is not there."""
+        i = bisect.bisect_left(self, key, lo)
+        return i if i < self.count and self[i] == key else -1
+
+    def find_many(self, keys: Iterable[bytes]) -> Iterator[Tuple[bytes, int]]:
+        """(key, find(key)) of keys, which must be sorted."""
+        lo = 0
+        for key in keys:
+            i = bisect.bisect_left(self, key, lo)
+            if i < self.count and self[i] == key:
+                yield key, i
+            else:
+                yield key, -1
+            lo = i
@@ -1,22 +1,411 @@
 """Workflow generator. This python module reads in a workflow.yml config file and will instantiate all required
-processors and connect them to the right queues and exchanges."""
+processors and connect them to the right queues and exchanges.
+
+The ``Nodes``, ``Edges`` and ``Workflow`` sections are compiled into a validated DAG. All exchanges, queues and
+bindings of the workflow are then declared in one provisioning pass over a single channel. Processors started from
+the emitted launch specs only attach to the existing queue and exchanges, they do not declare anything themselves.
+
+Binding rule: for an edge ``src -> dst``, the ``src_queue`` of ``dst`` is bound to the ``dst_exchg`` exchanges of
+``src``. If the queue name starts with ``<exchange>.`` for one of those exchanges (``ex1.q1.sb``), it is only bound
+to that exchange.
+
+Fusing: with ``Options: { fuse: true }`` in workflow.yml, linear chains of processors run in one process as a
+lib.processor.pipeline.Pipeline. ``a -> b`` is fused if b is a's only successor, a is b's only predecessor, b is the
+only consumer of its src_queue and a's exchanges only feed b's src_queue. The edge must not filter or limit
+anything: a needs a src_queue itself (a chain is started by its consumer), a's exchanges are fanout and b's queue has
+no routing_key, bind_arguments or queue limits. The exchanges and queues inside a fused chain are not provisioned at
+all. A single processor can opt out with ``fuse: false`` in its Workflow entry.
+
+Flow control: a Workflow entry can limit its src_queue with ``max_length`` (messages), ``max_length_bytes`` and
+``overflow`` (``drop-head``, ``reject-publish`` or ``reject-publish-dlx``), which become the x-max-length,
+x-max-length-bytes and x-overflow queue arguments. With ``flow_control: true`` (or a dict of lib.flowcontrol.FlowControl
+parameters), the producer of an entry slows down as the queues it feeds fill up, and waits while the broker blocks
+the connection. With ``reject-publish``, the messages the broker refuses are retried instead of being lost. A retry
+goes to all queues of the exchange again, so a producer with flow control must not publish to an exchange which feeds
+a reject-publish queue and other queues (these would get the message twice).
+
+USAGE example:
+    python -m lib.workflow -f etc/workflow.yml --provision --specs var/run/launch-specs.jsonl
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import signal
+import sys
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 import yaml
 
-# from config import config
+from lib.config import get_config
+from lib.metrics import start_exporter
+from lib.mq import EXCHANGE_TYPES, MQ, OVERFLOW_POLICIES
+from lib.processor.pipeline import Pipeline
+from lib.profiling import install_signal_handlers, log_timings
+
+DEFAULT_WORKFLOW_FILE = "etc/workflow.yml"
+
+# processor type (as used in workflow.yml) -> "module:Class". A type may also be given as "module:Class" directly.
+PROCESSOR_TYPES: Dict[str, str] = {
+    "gethostbyname": "processors.enrichers.gethostbyname.gethostbyname:GetHostByName",
+    "mispattributesearcher": "processors.enrichers.mispattributesearcher.mispattributesearcher:MispAttributeSearcher",
+    "es_hunter": "processors.enrichers.es_hunter.es_hunter:ElasticHunter_Hash_Lookup",
+    "censys": "processors.enrichers.censys.censys:CensysEnricher",
+    "iprange": "processors.enrichers.iprange.iprange:IPRangeEnricher",
+    "hashset": "processors.enrichers.hashset.hashset:HashSetEnricher",
+    "blocklist": "processors.enrichers.blocklist.blocklist:BlocklistEnricher",
+    "enricher_is_on_safebrowsing": "processors.enrichers.blocklist.blocklist:BlocklistEnricher",
+    "stdin_collector": "processors.collectors.stdin_collector:StdinCollector",
+    "file_collector": "processors.collectors.file_collector:FileCollector",
+    "directory_collector": "processors.collectors.file_collector:DirectoryCollector",
+    "stdout_output": "processors.output.stdout.stdout_output:StdoutOutput",
+}
 
 
-DEFAULT_WORKFLOW_FILE="etc/workflow.yml"
+class LaunchSpec(NamedTuple):
+    """Everything a processor instance needs to know to start and to attach to its queue and exchanges."""
+    processor_id: str
+    type: str
+    category: str
+    src_queue: Optional[str]
+    dst_exchanges: Tuple[str, ...]
+    config: Optional[str]
+    options: dict
+    chain: tuple = ()           # the LaunchSpecs of the processors of a fused chain, see lib.processor.pipeline
+
+
+class Binding(NamedTuple):
+    """A queue to exchange binding."""
+    queue: str
+    exchange: str
+    routing_key: Optional[str]
+    arguments: Optional[dict]
 
 
 class Workflow():
+    """A compiled workflow: the DAG of processors plus the exchanges, queues and bindings connecting them."""
     workflow_config = ""
 
-    def __init__(self, workflow_config: str = DEFAULT_WORKFLOW_FILE):
-        with open(workflow_config, 'r') as f:
-            wf = yaml.safe_load(f)
-            print(wf)
+    def __init__(self, workflow_config: str = DEFAULT_WORKFLOW_FILE, known_types: Iterable[str] = ()):
+        """
+        :param workflow_config: the workflow.yml file to compile. None for an empty workflow, see from_dict()
+        :param known_types: processor types which are valid besides the ones of PROCESSOR_TYPES (and "module:Class"),
+            for types which are not started by launch() (the generator of the benchmarks, for example)
+        """
+        self.workflow_config = workflow_config
+        self.known_types = set(known_types)
+        if workflow_config:
+            with open(workflow_config, 'r') as f:
+                wf = yaml.safe_load(f)
+            self.compile(wf)
+
+    @classmethod
+    def from_dict(cls, wf: dict, known_types: Iterable[str] = ()) -> "Workflow":
+        """Compile an already parsed workflow definition."""
+        w = cls(None, known_types)
+        w.compile(wf)
+        return w
+
+    def compile(self, wf: dict):
+        """Compile and validate the parsed workflow.yml. Raises ValueError if the workflow is invalid."""
+        if not isinstance(wf, dict):
+            raise ValueError("invalid workflow: expected a mapping with Nodes, Edges and Workflow sections")
+        self.nodes = self._parse_nodes(wf.get("Nodes") or [])
+        self.entries = self._parse_entries(wf.get("Workflow") or [])
+        self.edges = self._parse_edges(wf.get("Edges") or [])
+        self.order = self._toposort()
+        self.exchanges: Dict[str, str] = {}
+        self.queues: Dict[str, dict] = {}
+        self.bindings: List[Binding] = []
+        self._wire()
+        self._check_flow_control()
+        self.fuse = bool((wf.get("Options") or {}).get("fuse", False))
+        self.chains = self._fuse() if self.fuse else [[pid] for pid in self.order]
+
+    def _parse_nodes(self, sections: list) -> Dict[str, dict]:
+        nodes = {}
+        for section in sections:
+            for category, items in (section or {}).items():
+                for item in items or []:
+                    for node_type, attrs in item.items():
+                        attrs = attrs or {}
+                        node_id = attrs.get("id")
+                        if not node_id:
+                            raise ValueError("invalid workflow: node of type '%s' has no id" % node_type)
+                        if node_id in nodes:
+                            raise ValueError("invalid workflow: duplicate node id '%s'" % node_id)
+                        known = node_type in PROCESSOR_TYPES or node_type in self.known_types
+                        if not known and ":" not in node_type:      # "module:Class" is checked by launch()
+                            raise ValueError("invalid workflow: unknown processor type '%s' of '%s'" %
+                                             (node_type, node_id))
+                        nodes[node_id] = {"id": node_id, "type": node_type, "category": category,
+                                          "config": attrs.get("config")}
+        return nodes
+
+    def _parse_entries(self, entries: list) -> Dict[str, dict]:
+        parsed = {}
+        for entry in entries:
+            if not entry:
+                continue
+            pid = entry.get("processor_id")
+            if pid not in self.nodes:
+                raise ValueError("invalid workflow: processor_id '%s' is not defined in Nodes" % pid)
+            if pid in parsed:
+                raise ValueError("invalid workflow: processor_id '%s' is listed twice in Workflow" % pid)
+            if entry.get("type", self.nodes[pid]["type"]) != self.nodes[pid]["type"]:
+                raise ValueError("invalid workflow: type of '%s' differs between Nodes and Workflow" % pid)
+            dst = entry.get("dst_exchg") or []
+            entry["dst_exchg"] = [dst] if isinstance(dst, str) else list(dst)
+            if entry.get("exchange_type", "fanout") not in EXCHANGE_TYPES:
+                raise ValueError("invalid workflow: unknown exchange_type '%s' for '%s'" % (entry["exchange_type"], pid))
+            parsed[pid] = entry
+        missing = set(self.nodes) - set(parsed)
+        if missing:
+            raise ValueError("invalid workflow: no Workflow entry for node(s) %s" % sorted(missing))
+        return parsed
+
+    def _parse_edges(self, edges: list) -> List[Tuple[str, str]]:
+        parsed = []
+        for edge in edges:
+            src, dst = edge.get("src"), edge.get("dst")
+            for n in (src, dst):
+                if n not in self.nodes:
+                    raise ValueError("invalid workflow: edge %s -> %s references unknown node '%s'" % (src, dst, n))
+            if not self.entries[src]["dst_exchg"]:
+                raise ValueError("invalid workflow: '%s' has outgoing edges but no dst_exchg" % src)
+            if not self.entries[dst].get("src_queue"):
+                raise ValueError("invalid workflow: '%s' has incoming edges but no src_queue" % dst)
+            parsed.append((src, dst))
+        return parsed
+
+    def _toposort(self) -> List[str]:
+        """Kahn's algorithm. Returns the processor ids in topological order, raises ValueError on cycles."""
+        indegree = {n: 0 for n in self.nodes}
+        successors = {n: [] for n in self.nodes}
+        for src, dst in self.edges:
+            indegree[dst] += 1
+            successors[src].append(dst)
+        todo = deque(n for n, d in indegree.items() if d == 0)
+        order = []
+        while todo:
+            n = todo.popleft()
+            order.append(n)
+            for dst in successors[n]:
+                indegree[dst] -= 1
+                if indegree[dst] == 0:
+                    todo.append(dst)
+        if len(order) != len(self.nodes):
+            raise ValueError("invalid workflow: cycle between %s" % sorted(set(self.nodes) - set(order)))
+        return order
+
+    def _wire(self):
+        for pid in self.order:
+            entry = self.entries[pid]
+            for ex in entry["dst_exchg"]:
+                ex_type = entry.get("exchange_type", "fanout")
+                if self.exchanges.setdefault(ex, ex_type) != ex_type:
+                    raise ValueError("invalid workflow: exchange '%s' is declared with different types" % ex)
+            if entry.get("src_queue"):
+                # the limits of a shared queue only need to be given in one of the entries which consume from it
+                queue, arguments = entry["src_queue"], self._queue_arguments(pid, entry)
+                if self.queues.get(queue) and arguments and self.queues[queue] != arguments:
+                    raise ValueError("invalid workflow: queue '%s' is configured with different limits" % queue)
+                self.queues[queue] = self.queues.get(queue) or arguments
+        seen = set()
+        for src, dst in self.edges:
+            entry = self.entries[dst]
+            queue = entry["src_queue"]
+            candidates = self.entries[src]["dst_exchg"]
+            prefixed = [ex for ex in candidates if queue.startswith(ex + ".")]
+            for ex in prefixed or candidates:
+                b = Binding(queue, ex, entry.get("routing_key"), entry.get("bind_arguments"))
+                if (b.queue, b.exchange, b.routing_key) not in seen:
+                    seen.add((b.queue, b.exchange, b.routing_key))
+                    self.bindings.append(b)
+
+    @staticmethod
+    def _queue_arguments(pid: str, entry: dict) -> dict:
+        """The x-max-length, x-max-length-bytes and x-overflow queue arguments of a Workflow entry."""
+        arguments = {}
+        for key, arg in (("max_length", "x-max-length"), ("max_length_bytes", "x-max-length-bytes")):
+            if entry.get(key) is not None:
+                if isinstance(entry[key], bool) or not isinstance(entry[key], int) or entry[key] <= 0:
+                    raise ValueError("invalid workflow: %s of '%s' must be a positive integer" % (key, pid))
+                arguments[arg] = entry[key]
+        if entry.get("overflow") is not None:
+            if entry["overflow"] not in OVERFLOW_POLICIES:
+                raise ValueError("invalid workflow: overflow of '%s' must be one of %s" % (pid, OVERFLOW_POLICIES))
+            arguments["x-overflow"] = entry["overflow"]
+        return arguments
+
+    def _check_flow_control(self):
+        feeds = {}
+        for b in self.bindings:
+            feeds.setdefault(b.exchange, set()).add(b.queue)
+        for pid, entry in self.entries.items():
+            fc = entry.get("flow_control")
+            if not fc or (isinstance(fc, dict) and not fc.get("confirm", True)):
+                continue        # refused messages are not retried without confirms
+            for ex in entry["dst_exchg"]:
+                queues = feeds.get(ex, set())
+                rejecting = sorted(q for q in queues if self.queues[q].get("x-overflow", "").startswith("reject-publish"))
+                if rejecting and len(queues) > 1:
+                    raise ValueError("invalid workflow: '%s' retries messages refused by queue '%s', but exchange '%s' "
+                                     "feeds other queues too, which would get them twice" % (pid, rejecting[0], ex))
+
+    def _fusable(self, a: str, b: str, successors: dict, predecessors: dict, consumers: dict, publishers: dict,
+                 feeds: dict) -> bool:
+        ea, eb = self.entries[a], self.entries[b]
+        queue = eb["src_queue"]
+        if not (ea.get("fuse", True) and eb.get("fuse", True)):
+            return False
+        if not ea.get("src_queue") or ea.get("exchange_type", "fanout") != "fanout":
+            return False        # nothing to start the chain / the exchange filters
+        if eb.get("routing_key") or eb.get("bind_arguments") or self.queues.get(queue):
+            return False        # the binding filters or the queue is limited
+        if successors[a] != {b} or predecessors[b] != {a} or consumers[queue] != {b}:
+            return False
+        return all(publishers[ex] == {a} and feeds.get(ex) == {queue} for ex in ea["dst_exchg"])
+
+    def _fuse(self) -> List[List[str]]:
+        """Split the workflow into maximal fusable linear chains and drop the exchanges, queues and bindings which
+        are only used inside a chain."""
+        successors = {n: set() for n in self.nodes}
+        predecessors = {n: set() for n in self.nodes}
+        for src, dst in self.edges:
+            successors[src].add(dst)
+            predecessors[dst].add(src)
+        consumers, publishers, feeds = {}, {}, {}
+        for pid, entry in self.entries.items():
+            if entry.get("src_queue"):
+                consumers.setdefault(entry["src_queue"], set()).add(pid)
+            for ex in entry["dst_exchg"]:
+                publishers.setdefault(ex, set()).add(pid)
+        for b in self.bindings:
+            feeds.setdefault(b.exchange, set()).add(b.queue)
+
+        def fusable(a, b):
+            return self._fusable(a, b, successors, predecessors, consumers, publishers, feeds)
+
+        chains = []
+        for pid in self.order:
+            if len(predecessors[pid]) == 1 and fusable(next(iter(predecessors[pid])), pid):
+                continue            # part of a chain started further up
+            chain = [pid]
+            while len(successors[chain[-1]]) == 1 and fusable(chain[-1], next(iter(successors[chain[-1]]))):
+                chain.append(next(iter(successors[chain[-1]])))
+            chains.append(chain)
+            for a, b in zip(chain, chain[1:]):
+                queue = self.entries[b]["src_queue"]
+                for ex in self.entries[a]["dst_exchg"]:
+                    self.exchanges.pop(ex, None)
+                self.queues.pop(queue, None)
+                self.bindings = [x for x in self.bindings if x.queue != queue]
+        return chains
+
+    def provision(self, mq: MQ):
+        """Declare all exchanges, queues and bindings of the workflow on the (connected) channel of mq."""
+        ch = mq.channel
+        for ex, ex_type in self.exchanges.items():
+            ch.exchange_declare(exchange = ex, exchange_type = ex_type)
+        for queue, arguments in self.queues.items():
+            ch.queue_declare(queue = queue, durable = True, exclusive = False, arguments = arguments or None)
+        for b in self.bindings:
+            ch.queue_bind(queue = b.queue, exchange = b.exchange, routing_key = b.routing_key, arguments = b.arguments)
+        logging.info("provisioned %d exchanges, %d queues and %d bindings" % (len(self.exchanges), len(self.queues),
+                                                                              len(self.bindings)))
+
+    def _spec(self, pid: str) -> LaunchSpec:
+        node, entry = self.nodes[pid], self.entries[pid]
+        options = {k: v for k, v in entry.items() if k not in ("processor_id", "type", "src_queue", "dst_exchg")}
+        if options.get("flow_control"):
+            # the producer throttles on the fill level of the queues its exchanges feed
+            fc = {} if options["flow_control"] is True else dict(options["flow_control"])
+            fc.setdefault("queues", {b.queue: self.queues[b.queue].get("x-max-length") for b in self.bindings
+                                     if b.exchange in entry["dst_exchg"]})
+            options["flow_control"] = fc
+        return LaunchSpec(pid, node["type"], node["category"], entry.get("src_queue"), tuple(entry["dst_exchg"]),
+                          node["config"], options)
+
+    def launch_specs(self) -> List[LaunchSpec]:
+        """Return one LaunchSpec per processor (or per fused chain of processors), in topological order."""
+        specs = []
+        for chain in self.chains:
+            if len(chain) == 1:
+                specs.append(self._spec(chain[0]))
+                continue
+            members = tuple(self._spec(pid) for pid in chain)
+            head, tail = members[0], members[-1]
+            specs.append(LaunchSpec("+".join(chain), "pipeline", "pipeline", head.src_queue, tail.dst_exchanges,
+                                    None, dict(tail.options), members))
+        return specs
+
+
+def load_processor_class(processor_type: str):
+    """Resolve a processor type (see PROCESSOR_TYPES) or a "module:Class" string to the processor class."""
+    path = PROCESSOR_TYPES.get(processor_type, processor_type)
+    if ":" not in path:
+        raise ValueError("unknown processor type '%s'" % processor_type)
+    module, cls = path.split(":", 1)
+    return getattr(importlib.import_module(module), cls)
+
+
+def launch(spec: LaunchSpec):
+    """Instantiate the processor of a LaunchSpec, attach it to its queue and exchanges and start consuming."""
+    if spec.chain:
+        p = Pipeline([load_processor_class(m.type)(m.processor_id) for m in spec.chain])
+    else:
+        p = load_processor_class(spec.type)(spec.processor_id)
+    p.connect(spec.src_queue, spec.dst_exchanges, spec.options.get("exchange_type", "fanout"),
+              spec.options.get("flow_control"))
+    if p.consumer:
+        # SIGTERM (from the orchestrator scaling down, for example) finishes the message at hand, then stops
+        signal.signal(signal.SIGTERM, lambda signum, frame: p.consumer.stop())
+        install_signal_handlers(p)
+        p.profiler.attach(p.consumer.connection)
+    elif hasattr(p, "stop"):
+        signal.signal(signal.SIGTERM, lambda signum, frame: p.stop())     # a collector
+    exporter = start_exporter(p.id, get_config().get('metrics'))
+    try:
+        p.start()
+    finally:
+        if exporter:
+            exporter.close()
+    if p.consumer:
+        p.consumer.close()
+    elif getattr(p, "producer", None):
+        p.producer.close()
+    p.profiler.stop()
+    log_timings(p)
 
 
 if __name__ == "__main__":
-    wf = Workflow()
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description = 'compile, validate and provision a workflow')
+    parser.add_argument('-f', '--file', help = "The workflow file.", default = DEFAULT_WORKFLOW_FILE)
+    parser.add_argument('-p', '--provision', action = 'store_true', help = "declare all exchanges, queues and bindings")
+    parser.add_argument('-s', '--specs', help = "write the launch specs (JSON lines) to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    try:
+        wf = Workflow(args.file)
+    except (OSError, ValueError) as ex:
+        print("could not load workflow %s. Reason: %s" % (args.file, str(ex)), file = sys.stderr)
+        sys.exit(1)
+    if args.provision:
+        mq = MQ("workflow")
+        mq.connect()
+        wf.provision(mq)
+        mq.close()
+    if args.specs:
+        out = sys.stdout if args.specs == '-' else open(args.specs, 'w')
+        for spec in wf.launch_specs():
+            d = spec._asdict()
+            d["chain"] = [m._asdict() for m in spec.chain]
+            print(json.dumps(d), file = out)
+        if out is not sys.stdout:
+            out.close()
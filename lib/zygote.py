@@ -0,0 +1,147 @@
+"""Zygote: start processor instances by forking a warmed-up process.
+
+Starting a processor from scratch means a new interpreter which imports pika, redis, jsonschema, yaml, pymisp, ... and
+compiles the validators before it connects. The zygote does all of that once, in the orchestrator, and then forks a
+child per processor instance. The child only has to read its config, connect and start consuming, which takes
+milliseconds instead of seconds. Since the preloaded modules are frozen out of the garbage collector (gc.freeze())
+before forking, the children do not write to those pages and share them with the zygote (copy-on-write).
+
+The zygote must not hold any connections (RabbitMQ, redis, ...) it wants the children to use: every child connects
+itself, after the fork.
+
+USAGE example:
+    zygote = Zygote(["gethostbyname", "mispattributesearcher"])
+    worker = zygote.spawn(spec)       # spec: a lib.workflow.LaunchSpec
+    ...
+    worker.terminate()
+"""
+
+import gc
+import importlib
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Iterable, Optional
+
+from lib.workflow import LaunchSpec, launch, load_processor_class
+
+# modules every processor needs. The modules of the processor types are added by Zygote.preload()
+PRELOAD_MODULES = ("pika", "redis", "jsonschema", "yaml", "lib.message", "lib.mq", "lib.processor.processor",
+                   "lib.processor.pipeline", "lib.datamodel.validators")
+
+
+class ForkedWorker:
+    """A child process forked by the zygote. Offers the parts of the multiprocessing.Process API which
+    lib.orchestrator.WorkerPool uses."""
+
+    def __init__(self, pid: int, name: str):
+        self.pid = pid
+        self.name = name
+        self.exitcode: Optional[int] = None
+
+    def is_alive(self) -> bool:
+        if self.exitcode is not None:
+            return False
+        try:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+        except ChildProcessError:       # reaped elsewhere
+            self.exitcode = -1
+            return False
+        if pid == 0:
+            return True
+        self.exitcode = os.waitstatus_to_exitcode(status)
+        return False
+
+    def _signal(self, signum: int):
+        try:
+            os.kill(self.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        """Ask the worker to stop after the message at hand (SIGTERM)."""
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        self._signal(signal.SIGKILL)
+
+    def join(self, timeout: float = None):
+        """Wait until the worker exited, at most timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.is_alive() and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.01)
+
+
+class Zygote:
+    """Imports and warms up everything the processors need once, then forks processor instances on demand."""
+
+    preload_seconds: float = 0.0
+
+    def __init__(self, processor_types: Iterable[str] = ()):
+        """
+        :param processor_types: processor types (see lib.workflow.PROCESSOR_TYPES) whose modules get preloaded
+        """
+        self.preload(processor_types)
+
+    def preload(self, processor_types: Iterable[str] = ()):
+        """Import the common modules and the processor classes, compile the validators and freeze the result."""
+        t0 = time.monotonic()
+        gc.disable()
+        try:
+            for module in PRELOAD_MODULES:
+                try:
+                    importlib.import_module(module)
+                except ImportError as ex:
+                    logging.warning("zygote: can't preload %s. Reason: %s" % (module, str(ex)))
+            for processor_type in set(processor_types):
+                try:
+                    load_processor_class(processor_type)
+                except (ImportError, AttributeError, ValueError) as ex:
+                    # the child will fail the same way and report it
+                    logging.warning("zygote: can't preload processor type %s. Reason: %s" % (processor_type, str(ex)))
+            from lib.config import get_config
+            from lib.datamodel.validators import get_validator
+            get_config()        # the children share the parsed config, they only re-parse it if the file changed
+            get_validator()
+            gc.collect()
+            # everything allocated so far stays out of the GC's way, so the children don't dirty these pages
+            gc.freeze()
+        finally:
+            gc.enable()
+        self.preload_seconds = time.monotonic() - t0
+        logging.info("zygote: preloaded in %.3fs" % self.preload_seconds)
+
+    @staticmethod
+    def processor_types(specs: Iterable[LaunchSpec]) -> set:
+        """All processor types used by specs, including the members of fused chains."""
+        types = set()
+        for spec in specs:
+            if spec.chain:
+                types.update(m.type for m in spec.chain)
+            else:
+                types.add(spec.type)
+        return types
+
+    def spawn(self, spec: LaunchSpec) -> ForkedWorker:
+        """Fork a child which runs lib.workflow.launch(spec)."""
+        pid = os.fork()
+        if pid:
+            return ForkedWorker(pid, spec.processor_id)
+        # child
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            launch(spec)
+        except SystemExit as ex:
+            code = ex.code if isinstance(ex.code, int) else int(ex.code is not None)
+        except BaseException:
+            logging.exception("%s: worker died" % spec.processor_id)
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            logging.shutdown()
+            # skip the zygote's atexit handlers and the cleanup of objects the child does not own
+            os._exit(code)
@@ -0,0 +1,99 @@
+import glob
+import os
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from lib.config import ROOTDIR
+from lib.processor.collector import Collector, Position
+from processors.collectors.readers import decoder, format_of, lines, open_source, read_header
+
+
+class FileCollector(Collector):
+    """Reads the files matching the glob patterns of ``paths`` (JSONL, CSV or text, also gzip-compressed; the format
+    by the file name, else ``format``), in name order, and stops when all are read.
+
+    Per file, the checkpoint holds its inode, the offset read up to and, once it was read to the end, its size then.
+    A restart resumes every file at its offset; a file which was replaced (another inode) or truncated is read from the
+    start, one whose size did not change since it was read to the end is skipped without opening it."""
+    paths: List[str] = []
+    format = "auto"
+    observable_type: Optional[str] = None
+    csv_delimiter = ","
+    follow = False                  # see DirectoryCollector
+    poll_interval = 1.0
+
+    def startup(self):
+        super().startup()
+        config = self.settings()
+        paths = config.get('paths', self.__class__.paths)
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        if not self.paths:
+            self.logger.warning("no paths configured, nothing to collect")
+        self.format = config.get('format', self.__class__.format)
+        self.observable_type = config.get('observable_type', self.__class__.observable_type)
+        self.csv_delimiter = config.get('csv_delimiter', self.__class__.csv_delimiter)
+        self.follow = bool(config.get('follow', self.__class__.follow))
+        self.poll_interval = float(config.get('poll_interval', self.__class__.poll_interval))
+
+    def files(self) -> List[str]:
+        """The files to read, in name order."""
+        found = set()
+        for pattern in self.paths:
+            found.update(p for p in glob.glob(str(Path(ROOTDIR) / pattern)) if os.path.isfile(p))
+        return sorted(found)
+
+    def read_file(self, path: str) -> Iterator[Tuple[Optional[dict], Position]]:
+        """The records of path from its checkpointed offset on. Ends with a position at the end of what was read."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        state = self.checkpoint.get(path) or {}
+        offset = state.get('offset', 0)
+        compressed = path.endswith(".gz")
+        if state.get('ino') != st.st_ino or (not compressed and st.st_size < offset):
+            state, offset = {}, 0                       # a new file under this name
+        if state.get('size') == st.st_size:
+            return                                      # read to the end before and unchanged since
+        fmt = format_of(path, self.format)
+        fieldnames = None
+        if fmt == "csv" and offset:
+            fieldnames, _ = read_header(path, self.csv_delimiter)
+        decode = decoder(fmt, self.observable_type, fieldnames, self.csv_delimiter)
+        # a plain file which is still being written is read up to its last complete line; a growing gzip file can
+        # not be read to its end yet (EOFError) and is read again later
+        complete_only = self.follow and not compressed
+        try:
+            with open_source(path) as f:
+                for record, offset in decode(lines(f, offset, complete_only)):
+                    yield record, (path, {'ino': st.st_ino, 'offset': offset})
+                    if self.stopping:
+                        return
+        except (EOFError, zlib.error, OSError) as ex:
+            self.logger.warning("Could not read %s to its end. Reason: %s" % (path, str(ex)))
+            return
+        size = st.st_size if compressed or os.stat(path).st_size == offset else None
+        yield None, (path, {'ino': st.st_ino, 'offset': offset, 'size': size})
+
+    def read(self) -> Iterator[Tuple[Optional[dict], Position]]:
+        while True:
+            for path in self.files():
+                yield from self.read_file(path)
+                if self.stopping:
+                    return
+            if not self.follow:
+                return
+            yield None, None                # everything read: send what is collected, then wait for more
+            deadline = time.monotonic() + self.poll_interval
+            while time.monotonic() < deadline and not self.stopping:
+                time.sleep(min(0.1, self.poll_interval))
+            if self.stopping:
+                return
+
+
+class DirectoryCollector(FileCollector):
+    """A FileCollector which does not stop: it tails the files matching ``paths`` as they grow and picks up new ones
+    (log rotation included), checking every ``poll_interval`` seconds once everything is read."""
+    follow = True
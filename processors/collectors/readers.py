@@ -0,0 +1,164 @@
+"""Streaming readers for the collectors: generators which parse lazily, one record at a time, with its offset.
+
+Every reader yields (record, offset): the offset is the byte position right after the record in the (uncompressed)
+stream, the position to resume at. A record which can not be parsed is yielded as None (and logged), so the offset
+still moves past it.
+
+    lines()     the lines of a binary stream (without the line break), from an offset on
+    jsonl()     a JSON object per line
+    csv_rows()  a dict per CSV row, by the column names of the header line
+    text()      a {"value": line} per line, with an optional STIX "type"
+    auto()      JSON objects and text lines mixed
+    decoder()   one of the above by name
+
+Files are read with a large buffer, gzip files (by the .gz suffix) are decompressed on the fly: a backfill of a large
+dump is bound by the disk, the decompression and json.loads(). Resuming a gzip file at an offset decompresses (but
+does not parse) what comes before it.
+
+USAGE example:
+    with open_source("feed.jsonl.gz") as f:
+        for record, offset in jsonl(lines(f, offset = 0)):
+            ...
+"""
+
+import codecs
+import csv
+import gzip
+import json
+import logging
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+BUFFER_SIZE = 1 << 20
+
+Lines = Iterable[Tuple[bytes, int]]
+Records = Iterator[Tuple[Optional[dict], int]]
+
+
+def open_source(path: Union[str, Path]) -> BinaryIO:
+    """A binary stream of a file, decompressed if its name ends with .gz."""
+    if str(path).endswith(".gz"):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb', buffering = BUFFER_SIZE)
+
+
+def lines(f: BinaryIO, offset: int = 0, complete_only: bool = False) -> Iterator[Tuple[bytes, int]]:
+    """The lines of f from offset on, without the line break, with the offset after each. With complete_only, a last
+    line without a line break (still being written) is not yielded: it is read again from its start next time."""
+    if offset:
+        f.seek(offset)
+    for line in f:
+        if line.endswith(b"\n"):
+            offset += len(line)
+            line = line[:-2] if line.endswith(b"\r\n") else line[:-1]
+        elif complete_only:
+            return
+        else:
+            offset += len(line)
+        if line:
+            yield line, offset
+
+
+def jsonl(source: Lines) -> Records:
+    loads = json.loads
+    for line, offset in source:
+        try:
+            record = loads(line)
+        except ValueError as ex:
+            logging.warning("skipping a line which is not JSON at offset %d: %s" % (offset, str(ex)))
+            record = None
+        if record is not None and not isinstance(record, dict):
+            record = {"value": record}
+        yield record, offset
+
+
+def text(source: Lines, observable_type: str = None) -> Records:
+    decode = codecs.getdecoder("utf-8")
+    for line, offset in source:
+        value = decode(line, "replace")[0].strip()
+        if not value or value.startswith("#"):
+            yield None, offset
+        elif observable_type:
+            yield {"type": observable_type, "value": value}, offset
+        else:
+            yield {"value": value}, offset
+
+
+def auto(source: Lines, observable_type: str = None) -> Records:
+    """jsonl() for lines which start with "{", text() for the others."""
+    loads = json.loads
+    decode = codecs.getdecoder("utf-8")
+    for line, offset in source:
+        if line.lstrip().startswith(b"{"):
+            try:
+                yield loads(line), offset
+                continue
+            except ValueError:
+                pass
+        value = decode(line, "replace")[0].strip()
+        if not value or value.startswith("#"):
+            yield None, offset
+        else:
+            yield (dict(type = observable_type, value = value) if observable_type else {"value": value}), offset
+
+
+def csv_rows(source: Lines, fieldnames: List[str] = None, delimiter: str = ",") -> Records:
+    """The rows of a CSV stream as dicts. The first line is the header, unless fieldnames are given (when resuming
+    after the header, see read_header()). Quoted values may span lines; the offset is the one after the row's last
+    line."""
+    last = [0]
+
+    def decoded() -> Iterator[str]:
+        for line, offset in source:
+            last[0] = offset
+            yield line.decode("utf-8", "replace") + "\n"        # for values which span lines
+
+    reader = csv.reader(decoded(), delimiter = delimiter)
+    if fieldnames is None:
+        fieldnames = next(reader, None)
+        if fieldnames is None:
+            return
+    for row in reader:
+        if len(row) > len(fieldnames):
+            logging.warning("skipping a CSV row with %d instead of %d columns before offset %d" %
+                            (len(row), len(fieldnames), last[0]))
+            yield None, last[0]
+            continue
+        yield {k: v for k, v in zip(fieldnames, row) if v != ""}, last[0]
+
+
+def read_header(path: Union[str, Path], delimiter: str = ",") -> Tuple[Optional[List[str]], int]:
+    """The column names of a CSV file and the offset after the header."""
+    with open_source(path) as f:
+        for line, offset in lines(f):
+            return next(csv.reader([line.decode("utf-8", "replace")], delimiter = delimiter)), offset
+    return None, 0
+
+
+FORMATS = ("auto", "jsonl", "csv", "text")
+
+
+def format_of(path: Union[str, Path], default: str = "auto") -> str:
+    """The format of a file by its suffix (.jsonl, .ndjson, .json, .csv, .txt, also with .gz)."""
+    name = str(path).lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for suffix, fmt in ((".jsonl", "jsonl"), (".ndjson", "jsonl"), (".json", "jsonl"), (".csv", "csv"),
+                        (".txt", "text")):
+        if name.endswith(suffix):
+            return fmt
+    return default
+
+
+def decoder(fmt: str, observable_type: str = None, fieldnames: List[str] = None,
+            delimiter: str = ",") -> Callable[[Lines], Records]:
+    """The reader of a format (see FORMATS) as a function of the lines."""
+    if fmt == "jsonl":
+        return jsonl
+    if fmt == "csv":
+        return lambda source: csv_rows(source, fieldnames, delimiter)
+    if fmt == "text":
+        return lambda source: text(source, observable_type)
+    if fmt == "auto":
+        return lambda source: auto(source, observable_type)
+    raise ValueError("unknown format %s, expected one of %s" % (fmt, ", ".join(FORMATS)))
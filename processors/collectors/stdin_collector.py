@@ -0,0 +1,26 @@
+import sys
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from lib.processor.collector import Collector, Position
+from processors.collectors.readers import decoder, lines
+
+
+class StdinCollector(Collector):
+    """Reads messages from standard input, one per line, until it is closed: JSON objects, text lines (as
+    {"type": <observable_type>, "value": <line>}) or both mixed (``format: auto``), or CSV rows. Standard input can not
+    be resumed at an offset, so nothing is checkpointed."""
+    format = "auto"
+    observable_type: Optional[str] = None
+    stream: Optional[BinaryIO] = None       # sys.stdin.buffer by default
+
+    def startup(self):
+        super().startup()
+        config = self.settings()
+        self.format = config.get('format', self.__class__.format)
+        self.observable_type = config.get('observable_type', self.__class__.observable_type)
+        self.decode = decoder(self.format, self.observable_type, delimiter = config.get('csv_delimiter', ","))
+
+    def read(self) -> Iterator[Tuple[Optional[dict], Position]]:
+        stream = self.stream or sys.stdin.buffer
+        for record, _ in self.decode(lines(stream)):
+            yield record, None
@@ -0,0 +1,112 @@
+import os
+import time
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+from lib.config import ROOTDIR
+from lib.processor.enricher import Enricher
+from processors.enrichers.blocklist.engine import Blocklist
+
+# field name -> kind of value
+URL_FIELDS = {"url": "url"}
+DOMAIN_FIELDS = {"fqdn": "domain", "domain": "domain", "hostname": "domain"}
+OBSERVABLES = {"url": "url", "domain-name": "domain"}
+
+
+class BlocklistEnricher(Enricher):
+    """Checks URLs and domains against the compiled blocklist of blocklist_file (see engine.py) and adds the names of
+    the lists they are on:
+
+      * to a url / domain-name observable (the message or its "payload", {"type": "url", "value": ...}) as
+        x_blocklist_match,
+      * to a message or payload with "url", "fqdn", "domain" or "hostname" fields (also dotted, "source.fqdn") as
+        blocklist_match.
+
+    blocklist_file is loaded again when it was replaced, at most every blocklist_check_interval seconds. The new
+    Blocklist is built aside and swapped in between two batches."""
+    batch_size = 100
+    blocklist_file = "var/blocklist/blocklist.json.gz"
+    blocklist_check_interval = 30.0
+    blocklist: Optional[Blocklist] = None
+    _checked = 0.0
+    _stat: Optional[Tuple[int, int, int]] = None
+
+    def startup(self):
+        config = self.config['processors'].get(self.__class__.__name__) or {}
+        self.batch_size = int(config.get('batch_size', self.__class__.batch_size))
+        self.batch_wait = float(config.get('batch_wait', self.__class__.batch_wait))
+        self.blocklist_check_interval = float(config.get('blocklist_check_interval',
+                                                         self.__class__.blocklist_check_interval))
+        self.path = Path(ROOTDIR) / config.get('blocklist_file', self.__class__.blocklist_file)
+        self._stat = None
+        self.refresh(force = True)
+
+    def reload(self):
+        super().reload()
+        self.startup()
+
+    def refresh(self, force: bool = False):
+        """Load blocklist_file if it changed."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.blocklist_check_interval:
+            return
+        self._checked = now
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self.blocklist is None:
+                self.logger.warning("no blocklist file %s, nothing is matched" % self.path)
+                self.blocklist = Blocklist([], {}, [{}], [0], [[]])
+            return
+        stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stat == self._stat:
+            return
+        try:
+            blocklist = Blocklist.load(self.path)
+        except (OSError, ValueError, KeyError, RuntimeError) as ex:
+            self.logger.error("Could not load the blocklist %s, keeping the old one. Reason: %s" % (self.path, str(ex)))
+            if self.blocklist is None:
+                raise
+            return
+        self.blocklist, self._stat = blocklist, stat
+        self.logger.info("blocklist %s loaded: lists %s" % (self.path, ", ".join(blocklist.lists)))
+
+    def _values(self, msg) -> List[Tuple[dict, str, List[Tuple[str, str]]]]:
+        """(the dict to mark, the key to mark it with, its (kind, value) pairs) of the objects of msg with URLs or
+        domains."""
+        result = []
+        payload = msg.get('payload') if hasattr(msg, 'get') else None
+        for obj in (msg, payload):
+            if not isinstance(obj, dict):
+                continue
+            kind = OBSERVABLES.get(obj.get('type'))
+            if kind and isinstance(obj.get('value'), str):
+                result.append((obj, "x_blocklist_match", [(kind, obj['value'])]))
+            pairs = []
+            for key, value in obj.items():
+                if isinstance(value, str):
+                    field = key.rsplit('.', 1)[-1].lower()
+                    kind = URL_FIELDS.get(field) or DOMAIN_FIELDS.get(field)
+                    if kind:
+                        pairs.append((kind, value))
+            if pairs:
+                result.append((obj, "blocklist_match", pairs))
+        return result
+
+    def match(self, kind: str, value: str) -> Set[str]:
+        if kind == "url":
+            return self.blocklist.match_url(value)
+        return self.blocklist.match_domain(value)
+
+    def process(self, channel=None, method=None, properties=None, msg: dict = {}):
+        for obj, key, pairs in self._values(msg):
+            found = set()
+            for kind, value in pairs:
+                found |= self.match(kind, value)
+            obj[key] = sorted(found)
+        return msg
+
+    def process_batch(self, msgs: list) -> list:
+        """Swap in a new blocklist, if any, then process the messages one by one."""
+        self.refresh()
+        return super().process_batch(msgs)
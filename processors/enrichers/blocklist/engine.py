@@ -0,0 +1,224 @@
+"""Blocklist matching: is a domain (or one of its parent domains) or a URL on a list?
+
+A Blocklist is compiled from named lists of
+
+  * domains: "example.com" lists example.com and all its subdomains. They go into a trie of the reversed labels
+    (com -> example), so a lookup walks at most one node per label of the name, whatever the size of the lists.
+  * URL patterns: substrings of URLs ("example.net/phish/", "/wp-admin/evil.php"), matched case-insensitively all at
+    once by an Aho-Corasick automaton: one pass over the URL, whatever the number of patterns.
+
+A URL is matched by the domain trie (its host) and by the automaton. Lists are compiled offline (compile_lists() or
+the command line below) into a gzip-compressed JSON file, which loads without re-building anything. A Blocklist is
+never changed once built: a reload builds a new one and swaps the reference.
+
+USAGE example:
+    python -m processors.enrichers.blocklist.engine var/blocklist/blocklist.json.gz \\
+        --domains safebrowsing=sb-domains.txt --patterns phishing=phishing-urls.txt
+
+    bl = Blocklist.load("var/blocklist/blocklist.json.gz")
+    bl.match_domain("login.evil.example.com")          # {"safebrowsing"}
+    bl.match_url("https://example.net/phish/x.html")   # {"phishing"}
+"""
+
+import argparse
+import gzip
+import json
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Set, Tuple, Union
+
+FORMAT = "yellowsub-blocklist"
+VERSION = 1
+_END = ""           # trie key of the list ids of the node's domain (labels are never empty)
+
+
+def normalize_domain(name: str) -> str:
+    """Lower case, without a trailing dot, internationalized names in their IDNA (xn--) form."""
+    name = name.strip().rstrip(".").lower()
+    if not name.isascii():
+        try:
+            name = name.encode("idna").decode("ascii")
+        except UnicodeError:
+            pass
+    return name
+
+
+def url_host(url: str) -> str:
+    """The host of a URL (without user info and port), normalized. Faster than urllib.parse for this one job."""
+    start = url.find("://")
+    if start < 0 or any(c in url[:start] for c in "/?#"):
+        start = 0                               # no scheme: "example.com/path?u=http://..."
+    else:
+        start += 3
+    end = len(url)
+    for c in "/?#":
+        i = url.find(c, start, end)
+        if i >= 0:
+            end = i
+    host = url[start:end]
+    host = host[host.rfind("@") + 1:]
+    if host.startswith("["):                  # IPv6 literal
+        return host[1:host.find("]")].lower() if "]" in host else host.lower()
+    return normalize_domain(host.split(":", 1)[0])
+
+
+class Blocklist:
+    """A compiled set of domain and URL pattern lists. See the module docstring."""
+
+    def __init__(self, lists: List[str], trie: dict, goto: List[Dict[str, int]], fail: List[int],
+                 out: List[List[int]]):
+        """Use compile_lists() or load()."""
+        self.lists = lists
+        self.trie = trie
+        self.goto = goto
+        self.fail = fail
+        self.out = out
+
+    def match_domain(self, name: str) -> Set[str]:
+        """The lists on which name or one of its parent domains is."""
+        found = set()
+        node = self.trie
+        for label in reversed(normalize_domain(name).split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            ids = node.get(_END)
+            if ids:
+                found.update(ids)
+        return {self.lists[i] for i in found}
+
+    def match_patterns(self, text: str) -> Set[str]:
+        """The lists with a URL pattern in text (case-insensitive)."""
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        state = 0
+        for c in text.lower():
+            while True:
+                nxt = goto[state].get(c)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            if out[state]:
+                found.update(out[state])
+        return {self.lists[i] for i in found}
+
+    def match_url(self, url: str) -> Set[str]:
+        """The lists on which the host of url (or a parent domain) is, or with a pattern in url."""
+        found = self.match_domain(url_host(url)) if self.trie else set()
+        if len(self.goto) > 1:
+            found |= self.match_patterns(url)
+        return found
+
+    def to_json(self) -> dict:
+        return {"format": FORMAT, "version": VERSION, "lists": self.lists, "trie": self.trie,
+                "goto": self.goto, "fail": self.fail, "out": self.out}
+
+    def save(self, path: Union[str, Path]):
+        """Write the compiled form, atomically."""
+        path = Path(path)
+        path.parent.mkdir(parents = True, exist_ok = True)
+        tmp = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp, 'wt', encoding = 'utf-8', compresslevel = 6) as f:
+            json.dump(self.to_json(), f, separators = (',', ':'))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "Blocklist":
+        with gzip.open(path, 'rt', encoding = 'utf-8') as f:
+            d = json.load(f)
+        if d.get("format") != FORMAT or d.get("version") != VERSION:
+            raise RuntimeError("%s is not a compiled blocklist (version %d)" % (path, VERSION))
+        return cls(d["lists"], d["trie"], d["goto"], d["fail"], d["out"])
+
+
+def _trie(domains: Iterable[Tuple[str, int]]) -> dict:
+    root: dict = {}
+    for name, list_id in domains:
+        name = normalize_domain(name)
+        if not name:
+            continue
+        node = root
+        for label in reversed(name.split(".")):
+            node = node.setdefault(label, {})
+        ids = node.setdefault(_END, [])
+        if list_id not in ids:
+            ids.append(list_id)
+    return root
+
+
+def _automaton(patterns: Iterable[Tuple[str, int]]) -> Tuple[List[Dict[str, int]], List[int], List[List[int]]]:
+    """The goto, failure and output functions of an Aho-Corasick automaton of the patterns (lower-cased)."""
+    goto: List[Dict[str, int]] = [{}]
+    out: List[List[int]] = [[]]
+    for pattern, list_id in patterns:
+        pattern = pattern.strip().lower()
+        if not pattern:
+            continue
+        state = 0
+        for c in pattern:
+            nxt = goto[state].get(c)
+            if nxt is None:
+                nxt = len(goto)
+                goto.append({})
+                out.append([])
+                goto[state][c] = nxt
+            state = nxt
+        if list_id not in out[state]:
+            out[state].append(list_id)
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for c, nxt in goto[state].items():
+            queue.append(nxt)
+            f = fail[state]
+            while f and c not in goto[f]:
+                f = fail[f]
+            fail[nxt] = goto[f][c] if c in goto[f] and goto[f][c] != nxt else 0
+            out[nxt] = sorted(set(out[nxt]) | set(out[fail[nxt]]))     # outputs of the proper suffixes
+    return goto, fail, out
+
+
+def compile_lists(domains: Mapping[str, Iterable[str]] = None, patterns: Mapping[str, Iterable[str]] = None) -> Blocklist:
+    """A Blocklist of domain lists and URL pattern lists, both by list name."""
+    domains, patterns = domains or {}, patterns or {}
+    lists = sorted(set(domains) | set(patterns))
+    ids = {name: i for i, name in enumerate(lists)}
+    trie = _trie((d, ids[name]) for name, ds in domains.items() for d in ds)
+    goto, fail, out = _automaton((p, ids[name]) for name, ps in patterns.items() for p in ps)
+    return Blocklist(lists, trie, goto, fail, out)
+
+
+def read_lines(path: Union[str, Path]) -> Iterable[str]:
+    """The entries of a list file: one per line, empty lines and # comments left out."""
+    with open(path, 'r', encoding = 'utf-8', errors = 'replace') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'compile domain and URL pattern lists into a blocklist file')
+    parser.add_argument('output', help = "the compiled file to write (.json.gz)")
+    parser.add_argument('--domains', action = 'append', default = [], metavar = "NAME=FILE",
+                        help = "a list of domains, one per line (repeatable)")
+    parser.add_argument('--patterns', action = 'append', default = [], metavar = "NAME=FILE",
+                        help = "a list of URL substrings, one per line (repeatable)")
+    args = parser.parse_args()
+
+    def named(specs: List[str]) -> Dict[str, List[str]]:
+        result: Dict[str, List[str]] = {}
+        for spec in specs:
+            name, _, path = spec.partition("=")
+            if not path:
+                parser.error("expected NAME=FILE, got %s" % spec)
+            result.setdefault(name, []).extend(read_lines(path))
+        return result
+
+    bl = compile_lists(named(args.domains), named(args.patterns))
+    bl.save(args.output)
+    print("%s: lists %s, %d automaton states" % (args.output, ", ".join(bl.lists), len(bl.goto)))
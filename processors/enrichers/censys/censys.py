@@ -0,0 +1,231 @@
+"""CensysEnricher: host data and host names of IP addresses from the Censys Search API v2.
+
+The IPs of a batch of messages are looked up with one host search (``ip: "a" or ip: "b" ...``, up to
+``censys_per_page`` IPs per query) plus one host names request per IP which Censys knows. The answers are cached in
+redis (lib/utils/cache.py) for ``censys_cache_ttl`` seconds.
+
+Every search and names request uses one query of the account's quota. The quota is read from /v1/account every
+``censys_quota_refresh`` seconds and the queries left (minus ``censys_quota_reserve``) are spread evenly over the time
+until it resets, in bursts of at most ``censys_quota_burst``. An IP which can not be looked up within that budget (or
+because Censys failed) is not waited for: its message goes on with "censys" added to its "pending_enrichments".
+
+USAGE example:
+    python -m processors.enrichers.censys.censys 8.8.8.8       # with CENSYS_API_ID and CENSYS_API_SECRET set
+"""
+
+import datetime
+import ipaddress
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from lib.processor.httpenricher import HTTPEnricher
+from lib.utils.cache import Cache, get_cache
+from lib.utils.httppool import HTTPError
+
+
+class QueryBudget:
+    """The queries of the account left until the quota resets, spread evenly over that time."""
+
+    def __init__(self, reserve: int = 0, burst: int = 100, clock: Callable[[], float] = time.time):
+        """
+        :param reserve: queries which are never used
+        :param burst: queries which may be used at once
+        :param clock: wall clock time (the quota resets at a date)
+        """
+        self.reserve = reserve
+        self.burst = burst
+        self.clock = clock
+        self.remaining: Optional[int] = None    # unknown: not limited
+        self.resets_at = 0.0
+        self.rate = 0.0
+        self.credits = float(burst)
+        self._last = clock()
+
+    def update(self, used: int, allowance: int, resets_at: float):
+        """The quota as reported by Censys."""
+        now = self.clock()
+        self.remaining = max(allowance - used - self.reserve, 0)
+        self.resets_at = resets_at
+        self.rate = self.remaining / max(resets_at - now, 1.0)
+
+    def exhausted(self):
+        """Censys said the quota is used up."""
+        self.remaining = 0
+
+    def spend(self, n: int = 1) -> bool:
+        """Use n queries if the budget allows it now."""
+        now = self.clock()
+        if self.remaining is None:
+            return True
+        if now >= self.resets_at:       # a new period: allowed until the quota is read again
+            self.remaining, self.credits = None, float(self.burst)
+            return True
+        self.credits = min(float(self.burst), self.credits + (now - self._last) * self.rate)
+        self._last = now
+        if n > self.remaining or n > self.credits:
+            return False
+        self.remaining -= n
+        self.credits -= n
+        return True
+
+
+def parse_resets_at(value: str) -> float:
+    """The epoch time of a resets_at of /v1/account ("2024-02-01 00:00:00", UTC)."""
+    d = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if d.tzinfo is None:
+        d = d.replace(tzinfo = datetime.timezone.utc)
+    return d.timestamp()
+
+
+class CensysEnricher(HTTPEnricher):
+    """Adds "censys": {"host": <host data or None>, "names": [...]} to messages with an "ip". See the module docstring.
+    The API credentials are the user and password of the ``censys`` back end in the config, or the environment
+    variables CENSYS_API_ID and CENSYS_API_SECRET."""
+    batch_size = 100
+    censys_names = True             # also fetch the host names (one query per IP)
+    censys_per_page = 100           # IPs per search query
+    censys_cache_ttl = 86400
+    censys_quota_reserve = 0
+    censys_quota_burst = 100
+    censys_quota_refresh = 300.0    # seconds
+    cache: Optional[Cache] = None
+    budget: Optional[QueryBudget] = None
+    clock: Callable[[], float] = time.time
+    _quota_read = float('-inf')
+    _found: Optional[dict] = None   # of the batch at hand
+
+    def startup(self):
+        self.http_defaults = {"censys": {"url": "https://search.censys.io/api", "rate": 0.4, "burst": 1,
+                                         "max_concurrency": 2, "max_retries": 1,
+                                         "user": os.environ.get("CENSYS_API_ID"),
+                                         "password": os.environ.get("CENSYS_API_SECRET")}}
+        super().startup()
+        config = self.config['processors'].get(self.__class__.__name__) or {}
+        self.batch_size = int(config.get('batch_size', self.__class__.batch_size))
+        self.batch_wait = float(config.get('batch_wait', self.__class__.batch_wait))
+        self.censys_names = bool(config.get('censys_names', self.__class__.censys_names))
+        self.censys_per_page = int(config.get('censys_per_page', self.__class__.censys_per_page))
+        self.censys_cache_ttl = int(config.get('censys_cache_ttl', self.__class__.censys_cache_ttl))
+        self.censys_quota_refresh = float(config.get('censys_quota_refresh', self.__class__.censys_quota_refresh))
+        self.budget = QueryBudget(int(config.get('censys_quota_reserve', self.__class__.censys_quota_reserve)),
+                                  int(config.get('censys_quota_burst', self.__class__.censys_quota_burst)),
+                                  clock = self.clock)
+        self._quota_read = float('-inf')
+
+    def _cache(self) -> Cache:
+        if self.cache is None:
+            self.cache = get_cache()
+        return self.cache
+
+    def refresh_quota(self, force: bool = False):
+        """Read the quota from /v1/account, at most every censys_quota_refresh seconds."""
+        now = self.clock()
+        if not force and now - self._quota_read < self.censys_quota_refresh:
+            return
+        self._quota_read = now
+        try:
+            quota = self.backend("censys").request("GET", "/v1/account").raise_for_status().json()["quota"]
+            self.budget.update(int(quota["used"]), int(quota["allowance"]), parse_resets_at(quota["resets_at"]))
+        except (HTTPError, KeyError, ValueError) as ex:
+            self.logger.warning("Could not read the Censys quota. Reason: %s" % str(ex))
+
+    def _get(self, method: str, path: str, **kwargs) -> Optional[dict]:
+        """The "result" of an API call, None if the quota is used up or the call failed."""
+        r = self.backend("censys").request(method, path, **kwargs)
+        if r.status == 403 and b"quota_exceeded" in r.body:
+            self.logger.warning("Censys quota used up, enrichments are pending until %s" %
+                                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self.budget.resets_at)))
+            self.budget.exhausted()
+            return None
+        try:
+            return r.raise_for_status().json()["result"]
+        except (HTTPError, KeyError, ValueError) as ex:
+            self.logger.error("Censys %s %s failed. Reason: %s" % (method, path, str(ex)))
+            return None
+
+    def _search(self, ips: List[str]) -> Dict[str, Optional[dict]]:
+        """The host data of ips (None: Censys does not know the IP). IPs which were not looked up are missing."""
+        result = {}
+        for i in range(0, len(ips), self.censys_per_page):
+            chunk = ips[i:i + self.censys_per_page]
+            if not self.budget.spend():
+                break
+            query = " or ".join('ip: "%s"' % ip for ip in chunk)
+            r = self._get("POST", "/v2/hosts/search", json_body = {"q": query, "per_page": len(chunk)})
+            if r is None:
+                break
+            hits = {hit.get("ip"): hit for hit in r.get("hits", [])}
+            result.update({ip: hits.get(ip) for ip in chunk})
+        return result
+
+    def _names(self, ip: str) -> Optional[List[str]]:
+        r = self._get("GET", "/v2/hosts/%s/names" % ip)
+        return None if r is None else r.get("names", [])
+
+    def lookup_many(self, ips: Iterable[str]) -> Dict[str, dict]:
+        """{"host": ..., "names": [...]} by IP, from the cache or Censys. IPs which could not be looked up (yet)
+        are missing from the result."""
+        distinct = []
+        for ip in ips:
+            try:
+                distinct.append(str(ipaddress.ip_address(str(ip).strip())))
+            except ValueError:
+                continue
+        distinct = list(dict.fromkeys(distinct))
+        cache = self._cache()
+        result = {}
+        for ip in distinct:
+            cached = cache["censys:host:%s" % ip]
+            if cached is not None:
+                result[ip] = json.loads(cached)
+        todo = [ip for ip in distinct if ip not in result]
+        if not todo:
+            return result
+        self.refresh_quota()
+        hosts = self._search(todo)
+        names: Dict[str, Optional[List[str]]] = {ip: [] for ip, host in hosts.items() if host is None}
+        if self.censys_names:
+            known = [ip for ip, host in hosts.items() if host is not None]
+            allowed = [ip for ip in known if self.budget.spend()]
+            names.update(zip(allowed, self.backend("censys").map(self._names, allowed)))
+        else:
+            names.update((ip, []) for ip in hosts)
+        for ip, host in hosts.items():
+            if names.get(ip) is None:
+                continue                # names pending
+            result[ip] = {"host": host, "names": names[ip]}
+            cache.__setitem__("censys:host:%s" % ip, json.dumps(result[ip]), self.censys_cache_ttl)
+        return result
+
+    def process(self, channel=None, method=None, properties=None, msg: dict = {}):
+        ip = msg.get('ip', None)
+        if ip:
+            try:
+                key = str(ipaddress.ip_address(str(ip).strip()))
+            except ValueError:
+                return msg
+            found = self._found if self._found is not None else self.lookup_many([key])
+            if key in found:
+                msg['censys'] = found[key]
+            else:
+                msg.setdefault('pending_enrichments', []).append("censys")
+        return msg
+
+    def process_batch(self, msgs: list) -> list:
+        """Look up the IPs of all messages at once, then process them one by one with the results."""
+        self._found = self.lookup_many(msg.get('ip') for msg in msgs if isinstance(msg, dict) and msg.get('ip'))
+        try:
+            return super().process_batch(msgs)
+        finally:
+            self._found = None
+
+
+if __name__ == "__main__":
+    e = CensysEnricher(id = "censys-cli")
+    try:
+        print(json.dumps(e.lookup_many(sys.argv[1:]), indent = 2))
+    finally:
+        e.shutdown()
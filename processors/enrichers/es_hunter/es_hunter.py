@@ -1,45 +1,147 @@
-import logging
-# import socket
-# import uuid
-from lib.processor.enricher import Enricher
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from lib.processor.httpenricher import HTTPEnricher
+from lib.utils.httppool import HTTPError
 
 
-# see https://stackoverflow.com/questions/2805231/how-can-i-do-dns-lookups-in-python-including-referring-to-etc-hosts
-# thanks stackoverflow
+class NegativeCache:
+    """Keys which were not found, for ttl seconds. At most size keys, the oldest are dropped first."""
 
+    def __init__(self, ttl: float = 3600, size: int = 100000, clock = time.monotonic):
+        self.ttl = ttl
+        self.size = size
+        self.clock = clock
+        self._expires: "OrderedDict[str, float]" = OrderedDict()
 
-def elastic_hunter_lookup_hash(hash: str) -> bool:
-    """
-        This function looks up sometihing in ES ES hunter and returns True if it finds something
-    """
+    def __contains__(self, key: str) -> bool:
+        expires = self._expires.get(key)
+        if expires is None:
+            return False
+        if expires <= self.clock():
+            del self._expires[key]
+            return False
+        return True
 
-    try:
-        data = "Foobar"     # es_conn.lookup(hash)
-    except Exception as ex:
-        logging.info("Could not look up data in ES Hunter (key: %s). Reason: %s" % (hash, str(ex)))
-        return False
-    if not data:
-        return False
-    return True
+    def add(self, key: str):
+        self._expires.pop(key, None)
+        self._expires[key] = self.clock() + self.ttl
+        while len(self._expires) > self.size:
+            self._expires.popitem(last = False)
 
+    def __len__(self) -> int:
+        return len(self._expires)
 
-class ElasticHunter_Hash_Lookup(Enricher):
-    """A very simple / KISS gethostbyname enricher. """
-    es_conn = None
 
-    def __init__(self):
-        # Conenct to ES
-        # es_conn =
-        pass
+class ElasticHunter_Hash_Lookup(HTTPEnricher):
+    """Looks up the message's "hash" in the hunting indices of Elasticsearch and sets "found_in_es_hunter".
+    The hashes of a batch of messages are looked up with one request: a ``terms`` query over all of them (the default)
+    or an ``_msearch`` with one search per hash (``es_lookup: msearch``). Hashes which were not found are cached for
+    ``es_negative_ttl`` seconds. Elasticsearch is the ``es`` back end of the ``http:`` config section."""
+    batch_size = 100
+    http_defaults = {"es": {"url": "http://localhost:9200"}}
+    es_index = "hunter-*"
+    es_fields = ("hash",)
+    es_lookup = "terms"
+    es_terms_size = 10000           # hits of one terms query. With more, the rest is looked up with _msearch
+    negative: Optional[NegativeCache] = None
+    _found: Optional[dict] = None   # of the batch at hand
+
+    def startup(self):
+        super().startup()
+        config = self.config['processors'].get(self.__class__.__name__) or {}
+        self.batch_size = int(config.get('batch_size', self.__class__.batch_size))
+        self.batch_wait = float(config.get('batch_wait', self.__class__.batch_wait))
+        self.es_index = config.get('es_index', self.__class__.es_index)
+        self.es_fields = tuple(config.get('es_fields', self.__class__.es_fields))
+        self.es_lookup = config.get('es_lookup', self.__class__.es_lookup)
+        if self.es_lookup not in ("terms", "msearch"):
+            raise RuntimeError("es_lookup of %s must be terms or msearch" % self.__class__.__name__)
+        self.es_terms_size = int(config.get('es_terms_size', self.__class__.es_terms_size))
+        self.negative = NegativeCache(float(config.get('es_negative_ttl', 3600)),
+                                      int(config.get('es_negative_cache_size', 100000)))
+
+    def _query(self, hashes: List[str], size: int) -> dict:
+        should = [{"terms": {field: hashes}} for field in self.es_fields]
+        return {"size": size, "_source": list(self.es_fields),
+                "query": {"bool": {"should": should, "minimum_should_match": 1}}}
+
+    def _seen(self, hit: dict, wanted: set) -> set:
+        """The wanted hashes in the es_fields of a hit."""
+        seen = set()
+        for field in self.es_fields:
+            value = hit.get("_source", {})
+            for part in field.split("."):
+                value = value.get(part) if isinstance(value, dict) else None
+            for v in value if isinstance(value, list) else [value]:
+                if isinstance(v, str) and v.lower() in wanted:
+                    seen.add(v.lower())
+        return seen
+
+    def _terms(self, hashes: List[str]) -> Dict[str, bool]:
+        wanted = set(hashes)
+        r = self.backend("es").request("POST", "/%s/_search" % self.es_index,
+                                       json_body = self._query(hashes, self.es_terms_size)).raise_for_status().json()
+        hits = r["hits"]["hits"]
+        found = set()
+        for hit in hits:
+            found |= self._seen(hit, wanted)
+        if len(hits) < self.es_terms_size:
+            return {h: h in found for h in hashes}
+        # truncated: the hashes not seen yet may be in the hits which were cut off
+        result = {h: True for h in found}
+        result.update(self._msearch([h for h in hashes if h not in found]))
+        return result
+
+    def _msearch(self, hashes: List[str]) -> Dict[str, bool]:
+        if not hashes:
+            return {}
+        lines = []
+        for h in hashes:
+            lines.append(json.dumps({"index": self.es_index}))
+            lines.append(json.dumps(dict(self._query([h], 0), terminate_after = 1)))
+        r = self.backend("es").request("POST", "/_msearch", body = ("\n".join(lines) + "\n").encode(),
+                                       headers = {"Content-Type": "application/x-ndjson"}).raise_for_status().json()
+        result = {}
+        for h, response in zip(hashes, r["responses"]):
+            if "error" in response:
+                raise HTTPError("search for %s failed: %s" % (h, response["error"]))
+            total = response["hits"]["total"]
+            result[h] = (total["value"] if isinstance(total, dict) else total) > 0
+        return result
+
+    def lookup_many(self, hashes: Iterable[str]) -> Dict[str, bool]:
+        """Whether each hash is in the hunting indices, by lower-cased hash. Hashes which could not be looked up
+        (Elasticsearch failed) are missing from the result."""
+        distinct = list(dict.fromkeys(str(h).strip().lower() for h in hashes if h))
+        result = {h: False for h in distinct if h in self.negative}
+        todo = [h for h in distinct if h not in result]
+        if todo:
+            try:
+                found = self._terms(todo) if self.es_lookup == "terms" else self._msearch(todo)
+            except (HTTPError, KeyError, ValueError) as ex:
+                self.logger.error("Could not look up %d hashes in ES Hunter. Reason: %s" % (len(todo), str(ex)))
+                return result
+            for h, hit in found.items():
+                if not hit:
+                    self.negative.add(h)
+            result.update(found)
+        return result
 
     def process(self, channel=None, method=None, properties=None, msg: dict = {}):
         hash = msg.get('hash', None)
         if hash:
-            rc = elastic_hunter_lookup_hash(hash)
-            msg['found_in_es_hunter'] = rc
+            key = str(hash).strip().lower()
+            found = self._found if self._found is not None else self.lookup_many([key])
+            if key in found:
+                msg['found_in_es_hunter'] = found[key]
         return msg
 
-
-if __name__ == "__main__":
-    # make a unit test...
-    pass
+    def process_batch(self, msgs: list) -> list:
+        """Look up the hashes of all messages at once, then process them one by one with the results."""
+        self._found = self.lookup_many(msg.get('hash') for msg in msgs)
+        try:
+            return super().process_batch(msgs)
+        finally:
+            self._found = None
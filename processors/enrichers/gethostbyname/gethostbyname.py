@@ -1,7 +1,9 @@
 import logging
 import socket
 import uuid
+from typing import Mapping, Optional
 from lib.processor.enricher import Enricher
+from processors.enrichers.gethostbyname.resolver import Resolver
 
 
 # see https://stackoverflow.com/questions/2805231/how-can-i-do-dns-lookups-in-python-including-referring-to-etc-hosts
@@ -29,19 +31,79 @@ def get_ips_by_dns_lookup(fqdn, port=None):
     return l
 
 
+def resolver_from_config(config: Mapping) -> Optional[Resolver]:
+    """The Resolver for the settings of a GetHostByName processor (see etc/config.yml). None for
+    ``dns_recursor: system``: use the system resolver (get_ips_by_dns_lookup()), one name at a time.
+
+    :param config: the processor's section of the config
+    """
+    recursors = config.get('dns_recursor', GetHostByName.dns_recursor)
+    if recursors == "system":
+        return None
+    if isinstance(recursors, str):
+        recursors = [recursors]
+    return Resolver(recursors, timeout = float(config.get('dns_timeout', 2.0)),
+                    retries = int(config.get('dns_retries', 2)),
+                    cache_size = int(config.get('dns_cache_size', 100000)),
+                    max_ttl = int(config.get('dns_max_ttl', 86400)),
+                    negative_ttl = int(config.get('dns_negative_ttl', 300)),
+                    max_inflight = int(config.get('dns_max_inflight', 512)))
+
+
 class GetHostByName(Enricher):
-    """A very simple / KISS gethostbyname enricher. It will fetch the "fqdn" key-value pair from the message and add a list of IPs to the message """
+    """A very simple / KISS gethostbyname enricher. It will fetch the "fqdn" key-value pair from the message and add a list of IPs to the message.
+    The names of a batch of messages are looked up concurrently and the answers are cached for their TTL, see
+    resolver.py."""
     dns_recursor = "8.8.8.8"
+    batch_size = 100
+    resolver: Optional[Resolver] = None
+    _answers: dict = {}             # of the batch at hand
+
+    def startup(self):
+        self._configure()
+
+    def reload(self):
+        super().reload()
+        self._configure()
+
+    def _configure(self):
+        config = self.config['processors'].get(self.__class__.__name__) or {}
+        self.batch_size = int(config.get('batch_size', self.__class__.batch_size))
+        self.batch_wait = float(config.get('batch_wait', self.__class__.batch_wait))
+        if self.resolver:
+            self.resolver.close()
+        self.resolver = resolver_from_config(config)
+
+    def lookup(self, fqdn: str) -> list:
+        if fqdn in self._answers:
+            return self._answers[fqdn]
+        if self.resolver is None:
+            return get_ips_by_dns_lookup(fqdn)
+        return self.resolver.resolve(fqdn)
 
     def process(self, channel=None, method=None, properties=None, msg: dict = {}):
         fqdn = msg.get('fqdn', None)
-        self.logger.warn("(warning) about to log %s" %fqdn)
-        self.logger.info("here is some info for %s" %fqdn)
+        self.logger.debug("resolving %s", fqdn)
         if fqdn:
-            ips = get_ips_by_dns_lookup(fqdn)
+            ips = self.lookup(fqdn)
             msg['ips'] = ips
         return msg
 
+    def process_batch(self, msgs: list) -> list:
+        """Look up the names of all messages at once, then process them one by one with the answers."""
+        if self.resolver is None:
+            return super().process_batch(msgs)
+        self._answers = self.resolver.resolve_many(msg.get('fqdn') for msg in msgs if isinstance(msg, dict))
+        try:
+            return super().process_batch(msgs)
+        finally:
+            self._answers = {}
+
+    def shutdown(self):
+        if self.resolver:
+            self.resolver.close()
+        super().shutdown()
+
 
 if __name__ == "__main__":
     ips = get_ips_by_dns_lookup(fqdn = 'example.com')
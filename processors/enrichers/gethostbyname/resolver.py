@@ -0,0 +1,346 @@
+"""A small asynchronous stub resolver: many A and AAAA queries at once to the configured recursor, with a TTL cache.
+
+The blocking socket.getaddrinfo() resolves one name at a time through the system resolver and forgets the answer
+right away. Resolver instead
+  * sends all queries of a batch at once over one non-blocking UDP socket (at most ``max_inflight`` outstanding)
+    and waits for the answers with select(): a batch takes about one round trip, not one round trip per name,
+  * asks for A and AAAA in parallel,
+  * retries timed out queries (on the next recursor, if several are configured) and re-asks truncated answers over
+    TCP,
+  * caches answers for the TTL of their records and NXDOMAIN / NODATA answers for the TTL of the zone's SOA record
+    (RFC 2308), bounded by ``max_ttl`` and ``cache_size``. Failures (timeouts, SERVFAIL) are not cached.
+
+Only the DNS wire format needed for this is implemented (RFC 1035): queries with one question, answers with name
+compression. No DNSSEC, no EDNS0.
+
+USAGE example:
+    r = Resolver(["127.0.0.1:5353"])
+    r.resolve_many(["example.com", "example.org"])      # {"example.com": ["93.184.216.34", "2606:..."], ...}
+"""
+
+import ipaddress
+import random
+import select
+import socket
+import struct
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+QTYPE_A = 1
+QTYPE_CNAME = 5
+QTYPE_SOA = 6
+QTYPE_AAAA = 28
+QCLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+
+_HEADER = struct.Struct("!HHHHHH")
+_RR = struct.Struct("!HHIH")
+
+Key = Tuple[str, int]               # (name, qtype)
+
+
+class Response(NamedTuple):
+    qid: int
+    rcode: int
+    truncated: bool
+    name: str
+    qtype: int
+    addresses: List[str]            # the A / AAAA records of the answer
+    ttl: Optional[int]              # lowest TTL of the answer records, None if there are none
+    negative_ttl: Optional[int]     # from the SOA record of the authority section, None if there is none
+
+
+def encode_name(name: str) -> bytes:
+    """A domain name in DNS wire format. Raises ValueError for names which can't be one."""
+    out = b""
+    for label in name.rstrip(".").split("."):
+        try:
+            raw = label.encode("idna") if label else b""
+        except UnicodeError as ex:
+            raise ValueError("invalid label %r: %s" % (label, ex))
+        if not 0 < len(raw) <= 63:
+            raise ValueError("invalid label %r in %r" % (label, name))
+        out += bytes((len(raw),)) + raw
+    if len(out) > 254:
+        raise ValueError("name too long: %r" % name)
+    return out + b"\0"
+
+
+def build_query(qid: int, name: str, qtype: int) -> bytes:
+    """A recursive query (RD set) for one name and type."""
+    return _HEADER.pack(qid, 0x0100, 1, 0, 0, 0) + encode_name(name) + struct.pack("!HH", qtype, QCLASS_IN)
+
+
+def read_name(data: bytes, offset: int) -> Tuple[str, int]:
+    """Decode a (possibly compressed) name at offset. Returns the name and the offset after it."""
+    labels, end, jumps = [], None, 0
+    while True:
+        n = data[offset]
+        if n & 0xc0 == 0xc0:
+            if end is None:
+                end = offset + 2
+            offset = ((n & 0x3f) << 8) | data[offset + 1]
+            jumps += 1
+            if jumps > 64:
+                raise ValueError("compression loop")
+            continue
+        offset += 1
+        if n == 0:
+            break
+        labels.append(data[offset:offset + n].decode("ascii", "replace"))
+        offset += n
+    return ".".join(labels).lower(), end if end is not None else offset
+
+
+def parse_response(data: bytes) -> Response:
+    """Decode a response. Raises ValueError (or IndexError / struct.error) for malformed data."""
+    qid, flags, qdcount, ancount, nscount, _ = _HEADER.unpack_from(data, 0)
+    if not flags & 0x8000:
+        raise ValueError("not a response")
+    offset = _HEADER.size
+    name, qtype = "", 0
+    for _ in range(qdcount):
+        name, offset = read_name(data, offset)
+        qtype = struct.unpack_from("!H", data, offset)[0]
+        offset += 4
+    addresses, ttl, negative_ttl = [], None, None
+    for i in range(ancount + nscount):
+        _, offset = read_name(data, offset)
+        rtype, rclass, rttl, rdlength = _RR.unpack_from(data, offset)
+        offset += _RR.size
+        rdata = data[offset:offset + rdlength]
+        if i < ancount:
+            ttl = rttl if ttl is None else min(ttl, rttl)
+            if rtype == QTYPE_A and rdlength == 4:
+                addresses.append(str(ipaddress.IPv4Address(rdata)))
+            elif rtype == QTYPE_AAAA and rdlength == 16:
+                addresses.append(str(ipaddress.IPv6Address(rdata)))
+        elif rtype == QTYPE_SOA:
+            _, o = read_name(data, offset)          # mname
+            _, o = read_name(data, o)               # rname
+            minimum = struct.unpack_from("!IIIII", data, o)[4]
+            negative_ttl = min(rttl, minimum)
+        offset += rdlength
+    return Response(qid, flags & 0xf, bool(flags & 0x0200), name, qtype, addresses, ttl, negative_ttl)
+
+
+def parse_nameserver(ns: str) -> Tuple[str, int]:
+    """'8.8.8.8', '127.0.0.1:5353', '[::1]:53' or '::1' -> (address, port)."""
+    if ns.startswith("["):
+        host, _, port = ns[1:].partition("]")
+        return host, int(port.lstrip(":") or 53)
+    if ns.count(":") == 1:
+        host, port = ns.split(":")
+        return host, int(port)
+    return ns, 53
+
+
+class _Query:
+    __slots__ = ("key", "attempts", "server", "deadline")
+
+    def __init__(self, key: Key):
+        self.key = key
+        self.attempts = 0
+        self.server = 0
+        self.deadline = 0.0
+
+
+class Resolver:
+    """Concurrent A/AAAA lookups with a TTL cache. See the module docstring."""
+
+    def __init__(self, nameservers: Sequence[str] = ("8.8.8.8",), timeout: float = 2.0, retries: int = 2,
+                 qtypes: Sequence[int] = (QTYPE_A, QTYPE_AAAA), cache_size: int = 100000, max_ttl: int = 86400,
+                 negative_ttl: int = 300, max_inflight: int = 512, clock = time.monotonic):
+        """
+        :param nameservers: the recursors, "host" or "host:port"
+        :param timeout: seconds to wait for an answer before asking again
+        :param retries: how often to ask again before giving up on a name
+        :param qtypes: the record types to ask for
+        :param cache_size: maximum number of cached answers (one per name and type)
+        :param max_ttl: cache nothing longer than this (seconds)
+        :param negative_ttl: cache NXDOMAIN / NODATA answers without a SOA record this long (seconds)
+        :param max_inflight: maximum number of outstanding UDP queries
+        :param clock: time source of the cache TTLs. Query timeouts always use time.monotonic()
+        """
+        if not nameservers:
+            raise ValueError("at least one nameserver is needed")
+        # normalised, to compare them with the source addresses of the answers
+        self.servers = [(str(ipaddress.ip_address(host)), port) for host, port in map(parse_nameserver, nameservers)]
+        self.timeout = timeout
+        self.retries = retries
+        self.qtypes = tuple(qtypes)
+        self.cache_size = cache_size
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_inflight = max_inflight
+        self.clock = clock
+        self.cache: Dict[Key, Tuple[float, List[str]]] = {}
+        self.queries = 0                # sent over the network, retries included
+        self.cache_hits = 0
+        self._socks: Dict[int, socket.socket] = {}
+        self._rand = random.Random()
+
+    def _sock(self, server: Tuple[str, int]) -> socket.socket:
+        family = socket.AF_INET6 if ":" in server[0] else socket.AF_INET
+        s = self._socks.get(family)
+        if s is None:
+            s = self._socks[family] = socket.socket(family, socket.SOCK_DGRAM)
+            s.setblocking(False)
+        return s
+
+    def close(self):
+        for s in self._socks.values():
+            s.close()
+        self._socks = {}
+
+    def _cached(self, key: Key, now: float) -> Optional[List[str]]:
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self.cache[key]
+            return None
+        return entry[1]
+
+    def _store(self, key: Key, addresses: List[str], ttl: Optional[int]):
+        ttl = min(self.negative_ttl if ttl is None else ttl, self.max_ttl)
+        if ttl <= 0:
+            return
+        self.cache.pop(key, None)
+        while len(self.cache) >= self.cache_size:
+            del self.cache[next(iter(self.cache))]          # the oldest entry
+        self.cache[key] = (self.clock() + ttl, addresses)
+
+    def resolve(self, fqdn: str) -> List[str]:
+        """The addresses of one name (A records first). [] if it does not exist or the lookup failed."""
+        return self.resolve_many([fqdn]).get(fqdn, [])
+
+    def resolve_many(self, fqdns: Iterable[str]) -> Dict[str, List[str]]:
+        """The addresses of many names, looked up concurrently. Returns fqdn -> addresses (A records first)."""
+        names = {}
+        for fqdn in fqdns:
+            if fqdn and fqdn not in names:
+                names[fqdn] = fqdn.rstrip(".").lower()
+        now = self.clock()
+        answers: Dict[Key, List[str]] = {}
+        missing = []
+        for name in set(names.values()):
+            for qtype in self.qtypes:
+                key = (name, qtype)
+                cached = self._cached(key, now)
+                if cached is None:
+                    missing.append(key)
+                else:
+                    self.cache_hits += 1
+                    answers[key] = cached
+        if missing:
+            answers.update(self._lookup(missing))
+        return {fqdn: [a for qtype in self.qtypes for a in answers.get((name, qtype), [])]
+                for fqdn, name in names.items()}
+
+    def _lookup(self, keys: List[Key]) -> Dict[Key, List[str]]:
+        results: Dict[Key, List[str]] = {}
+        todo = []
+        for key in keys:
+            try:
+                encode_name(key[0])
+            except ValueError:
+                results[key] = []           # can't exist
+                self._store(key, [], None)
+                continue
+            todo.append(_Query(key))
+        todo.reverse()                      # pop() from the end, in order
+        inflight: Dict[int, _Query] = {}
+        truncated: List[_Query] = []
+        while todo or inflight:
+            while todo and len(inflight) < self.max_inflight:
+                q = todo.pop()
+                qid = self._rand.getrandbits(16)
+                while qid in inflight:
+                    qid = self._rand.getrandbits(16)
+                self._send(q, qid)
+                inflight[qid] = q
+            now = time.monotonic()
+            wait = max(min(q.deadline for q in inflight.values()) - now, 0) if inflight else 0
+            readable, _, _ = select.select(list(self._socks.values()), [], [], wait)
+            for s in readable:
+                self._receive(s, inflight, results, truncated)
+            now = time.monotonic()
+            for qid, q in list(inflight.items()):
+                if q.deadline <= now:
+                    del inflight[qid]
+                    if q.attempts <= self.retries:
+                        q.server += 1           # ask the next recursor
+                        todo.append(q)
+                    else:
+                        results[q.key] = []     # give up, don't cache
+        for q in truncated:
+            results[q.key] = self._tcp(q)
+        return results
+
+    def _send(self, q: _Query, qid: int):
+        server = self.servers[q.server % len(self.servers)]
+        try:
+            self._sock(server).sendto(build_query(qid, q.key[0], q.key[1]), server)
+        except OSError:
+            pass                # counts as a timeout
+        q.attempts += 1
+        q.deadline = time.monotonic() + self.timeout
+        self.queries += 1
+
+    def _receive(self, s: socket.socket, inflight: Dict[int, _Query], results: Dict[Key, List[str]],
+                 truncated: List[_Query]):
+        while True:
+            try:
+                data, addr = s.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return          # ICMP errors (port unreachable) of earlier sends
+            try:
+                r = parse_response(data)
+            except (ValueError, IndexError, struct.error):
+                continue
+            q = inflight.get(r.qid)
+            if q is None or (r.name, r.qtype) != q.key or addr[:2] != self.servers[q.server % len(self.servers)]:
+                continue        # late answer of a retried query, or spoofed
+            del inflight[r.qid]
+            if r.truncated:
+                truncated.append(q)
+            else:
+                results[q.key] = self._answer(q.key, r)
+
+    def _answer(self, key: Key, r: Response) -> List[str]:
+        if r.rcode == RCODE_NOERROR and r.addresses:
+            self._store(key, r.addresses, r.ttl)
+            return r.addresses
+        if r.rcode in (RCODE_NOERROR, RCODE_NXDOMAIN):         # NODATA or NXDOMAIN
+            self._store(key, [], r.negative_ttl)
+        return []
+
+    def _tcp(self, q: _Query) -> List[str]:
+        """Ask again over TCP (the UDP answer was truncated)."""
+        server = self.servers[q.server % len(self.servers)]
+        query = build_query(self._rand.getrandbits(16), q.key[0], q.key[1])
+        self.queries += 1
+        try:
+            with socket.create_connection(server, timeout = self.timeout) as s:
+                s.sendall(struct.pack("!H", len(query)) + query)
+                length = struct.unpack("!H", _recv_exactly(s, 2))[0]
+                r = parse_response(_recv_exactly(s, length))
+        except (OSError, ValueError, IndexError, struct.error):
+            return []
+        return self._answer(q.key, r)
+
+
+def _recv_exactly(s: socket.socket, n: int) -> bytes:
+    data = b""
+    while len(data) < n:
+        chunk = s.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
@@ -0,0 +1,108 @@
+import time
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+from lib.config import ROOTDIR
+from lib.processor.enricher import Enricher
+from processors.enrichers.hashset.index import ALGORITHMS, HashIndex, algorithm_name, algorithm_of
+
+# field name (as in lib/datamodel/validators.py) -> algorithm. "hash": told by the length
+HASH_FIELDS = {"md5": "MD5", "sha1": "SHA-1", "sha256": "SHA-256", "hash": None}
+
+
+class HashSetEnricher(Enricher):
+    """Matches file hashes against the local IOC hash sets of hashset_dir (see index.py) and adds the algorithms
+    whose hash is listed:
+
+      * to a file observable (the message or its "payload", {"type": "file", "hashes": {"MD5": ..., ...}}) as
+        x_ioc_hash_match: ["MD5", ...],
+      * to a message or payload with "md5", "sha1", "sha256" or "hash" fields (also dotted, "file.sha256") as
+        ioc_hash_match.
+
+    Objects without a hash of a supported algorithm get neither. The hashes of a batch of messages are looked up
+    together. The .delta files are read (and new .bin files mapped) at most every hashset_refresh_interval seconds."""
+    batch_size = 1000
+    hashset_dir = "var/hashset"
+    hashset_algorithms = tuple(ALGORITHMS)
+    hashset_refresh_interval = 10.0
+    index: Optional[HashIndex] = None
+    _refreshed = 0.0
+    _found: Optional[Set[Tuple[str, str]]] = None     # of the batch at hand
+
+    def startup(self):
+        config = self.config['processors'].get(self.__class__.__name__) or {}
+        self.batch_size = int(config.get('batch_size', self.__class__.batch_size))
+        self.batch_wait = float(config.get('batch_wait', self.__class__.batch_wait))
+        self.hashset_refresh_interval = float(config.get('hashset_refresh_interval',
+                                                         self.__class__.hashset_refresh_interval))
+        algorithms = [algorithm_name(a) for a in config.get('hashset_algorithms', self.__class__.hashset_algorithms)]
+        if None in algorithms:
+            raise RuntimeError("hashset_algorithms of %s: only %s are supported" %
+                               (self.__class__.__name__, ", ".join(ALGORITHMS)))
+        if self.index:
+            self.index.close()
+        self.index = HashIndex(Path(ROOTDIR) / config.get('hashset_dir', self.__class__.hashset_dir), algorithms)
+        self._refreshed = time.monotonic()
+
+    def reload(self):
+        super().reload()
+        self.startup()
+
+    def refresh(self, force: bool = False):
+        now = time.monotonic()
+        if force or now - self._refreshed >= self.hashset_refresh_interval:
+            self._refreshed = now
+            if self.index.refresh():
+                self.logger.info("IOC hash sets updated")
+
+    def _hashes(self, msg) -> List[Tuple[dict, str, List[Tuple[str, str]]]]:
+        """(the dict to mark, the key to mark it with, its (algorithm, hash) pairs) of the objects of msg with
+        hashes."""
+        result = []
+        payload = msg.get('payload') if hasattr(msg, 'get') else None
+        for obj in (msg, payload):
+            if not isinstance(obj, dict):
+                continue
+            if obj.get('type') == "file" and isinstance(obj.get('hashes'), dict):
+                pairs = [(a, h) for a, h in obj['hashes'].items() if algorithm_name(a) and isinstance(h, str)]
+                if pairs:
+                    result.append((obj, "x_ioc_hash_match", pairs))
+            pairs = []
+            for key, value in obj.items():
+                if not isinstance(value, str):
+                    continue
+                field = key.rsplit('.', 1)[-1].lower()
+                if field in HASH_FIELDS:
+                    algorithm = HASH_FIELDS[field] or algorithm_of(value.strip())
+                    if algorithm:
+                        pairs.append((algorithm, value))
+            if pairs:
+                result.append((obj, "ioc_hash_match", pairs))
+        return result
+
+    def process(self, channel=None, method=None, properties=None, msg: dict = {}):
+        objects = self._hashes(msg)
+        if not objects:
+            return msg
+        found = self._found
+        if found is None:
+            self.refresh()
+            found = self.index.contains_many(pair for _, _, pairs in objects for pair in pairs)
+        for obj, key, pairs in objects:
+            obj[key] = sorted({algorithm_name(a) for a, h in pairs if (a, h) in found})
+        return msg
+
+    def process_batch(self, msgs: list) -> list:
+        """Look up the hashes of all messages at once, then process them one by one with the results."""
+        self.refresh()
+        self._found = self.index.contains_many(pair for msg in msgs for _, _, pairs in self._hashes(msg)
+                                               for pair in pairs)
+        try:
+            return super().process_batch(msgs)
+        finally:
+            self._found = None
+
+    def shutdown(self):
+        if self.index:
+            self.index.close()
+        super().shutdown()
@@ -0,0 +1,345 @@
+"""HashIndex: is a file hash (MD5, SHA-1, SHA-256) on the IOC lists? Answered from local files, without a network call.
+
+Per algorithm, a directory holds
+
+  * <algorithm>.bin: the listed digests, raw (16, 20 or 32 bytes each), sorted and without duplicates, after a small
+    header. Memory-mapped: all worker processes on a host share one copy in the page cache and the memory used stays
+    near the raw size of the hashes. Built offline by build() from text files with one hex hash per line (the first
+    CSV column), with an external merge sort, so the lists need not fit in memory.
+  * <algorithm>.delta: changes since the .bin was built, one "+<hex>" (listed) or "-<hex>" (not listed any more) per
+    line, appended by add() / remove() or by the feed jobs. refresh() reads only the lines appended since its last
+    call and keeps them in two sets, so a change is applied without a rebuild. compact() merges the delta into a new
+    .bin and empties it.
+
+A lookup is a binary search over the sorted digests (lib/utils/sortedkeys.py), about log2(n) comparisons of short
+byte strings: 28 for 300 million hashes. contains_many() sorts the digests of a batch and searches them in one pass.
+
+USAGE example:
+    python -m processors.enrichers.hashset.index build var/hashset feed-md5.txt feed-sha256.txt
+    python -m processors.enrichers.hashset.index add var/hashset 44d88612fea8a8f36de82e1278abb02f
+    python -m processors.enrichers.hashset.index compact var/hashset
+
+    index = HashIndex("var/hashset")
+    index.contains("SHA-256", "275a021bbfb6489e54d471899f7db9d1663fc695ec2fe2a2c4538aabf651fd0f")
+"""
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from lib.utils.sortedkeys import SortedKeys
+
+MAGIC = b"YSHASH01"
+_HEADER = struct.Struct(">QQ")      # width, count
+
+# algorithm (as in hashes-type.json) -> (file name, digest bytes)
+ALGORITHMS = {"MD5": ("md5", 16), "SHA-1": ("sha1", 20), "SHA-256": ("sha256", 32)}
+_BY_HEX_LENGTH = {2 * width: algorithm for algorithm, (_, width) in ALGORITHMS.items()}
+_ALIASES = {a.replace("-", ""): a for a in ALGORITHMS}
+
+
+def algorithm_name(name: str) -> Optional[str]:
+    """The hashes-type.json name of an algorithm (md5, SHA1, sha-256, ...), None if it is not supported."""
+    return _ALIASES.get(str(name).upper().replace("-", "").replace("_", ""))
+
+
+def algorithm_of(hex_digest: str) -> Optional[str]:
+    """The algorithm of a hex digest, by its length."""
+    return _BY_HEX_LENGTH.get(len(hex_digest))
+
+
+def digest(hex_digest: str, width: int) -> Optional[bytes]:
+    """The raw digest of a hex string, None if it is not one of width bytes."""
+    hex_digest = hex_digest.strip()
+    if len(hex_digest) != 2 * width:
+        return None
+    try:
+        return bytes.fromhex(hex_digest)
+    except ValueError:
+        return None
+
+
+class HashSet:
+    """The listed digests of one algorithm: a memory-mapped .bin plus the changes of its .delta."""
+
+    def __init__(self, directory: Union[str, Path], algorithm: str):
+        name, self.width = ALGORITHMS[algorithm]
+        self.algorithm = algorithm
+        self.base_path = Path(directory) / ("%s.bin" % name)
+        self.delta_path = Path(directory) / ("%s.delta" % name)
+        self._file = self._mm = None
+        self._base_stat = None
+        self.keys = SortedKeys(b"", 0, self.width, 0)
+        self.added: Set[bytes] = set()
+        self.removed: Set[bytes] = set()
+        self._delta_id = None
+        self._delta_offset = 0
+        self.refresh()
+
+    def _open_base(self):
+        try:
+            f = open(self.base_path, 'rb')
+        except FileNotFoundError:
+            self._close_base()
+            return
+        st = os.fstat(f.fileno())
+        if st.st_size < len(MAGIC) + _HEADER.size:
+            f.close()
+            raise RuntimeError("%s: truncated hash set file" % self.base_path)
+        mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        width, count = _HEADER.unpack_from(mm, len(MAGIC))
+        if mm[:len(MAGIC)] != MAGIC or width != self.width:
+            mm.close()
+            f.close()
+            raise RuntimeError("%s is not a hash set of %s" % (self.base_path, self.algorithm))
+        self._close_base()
+        self._file, self._mm, self._base_stat = f, mm, st
+        self.keys = SortedKeys(mm, len(MAGIC) + _HEADER.size, width, count)
+
+    def _close_base(self):
+        self.keys = SortedKeys(b"", 0, self.width, 0)
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+        self._file = self._mm = self._base_stat = None
+
+    def refresh(self) -> bool:
+        """Map a new .bin, read the lines appended to the .delta. Returns True if anything changed."""
+        changed = False
+        try:
+            st = os.stat(self.base_path)
+            stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stat = None
+        old = self._base_stat
+        if stat != (None if old is None else (old.st_ino, old.st_mtime_ns, old.st_size)):
+            self._open_base()
+            changed = True
+        try:
+            f = open(self.delta_path, 'rb')
+        except FileNotFoundError:
+            changed |= bool(self.added or self.removed)
+            self.added, self.removed, self._delta_id, self._delta_offset = set(), set(), None, 0
+            return changed
+        with f:
+            st = os.fstat(f.fileno())
+            if (st.st_dev, st.st_ino) != self._delta_id or st.st_size < self._delta_offset:
+                self.added, self.removed = set(), set()     # a new delta file (after compact())
+                self._delta_id, self._delta_offset = (st.st_dev, st.st_ino), 0
+                changed = True
+            if st.st_size == self._delta_offset:
+                return changed
+            f.seek(self._delta_offset)
+            data = f.read(st.st_size - self._delta_offset)
+        end = data.rfind(b"\n") + 1        # complete lines only
+        self._delta_offset += end
+        for line in data[:end].splitlines():
+            d = digest(line[1:].decode('ascii', 'replace'), self.width)
+            if d is None:
+                continue
+            if line[:1] == b"+":
+                self.added.add(d)
+                self.removed.discard(d)
+            elif line[:1] == b"-":
+                self.removed.add(d)
+                self.added.discard(d)
+        return changed or end > 0
+
+    def __contains__(self, d: bytes) -> bool:
+        if d in self.added:
+            return True
+        if d in self.removed:
+            return False
+        return self.keys.find(d) >= 0
+
+    def contains_many(self, digests: Iterable[bytes]) -> Set[bytes]:
+        """The listed ones of digests."""
+        found = set()
+        todo = []
+        for d in set(digests):
+            if d in self.added:
+                found.add(d)
+            elif d not in self.removed:
+                todo.append(d)
+        todo.sort()
+        found.update(d for d, i in self.keys.find_many(todo) if i >= 0)
+        return found
+
+    def __len__(self) -> int:
+        """About the number of listed digests (removed ones which are not in the .bin are counted too)."""
+        return len(self.keys) + len(self.added) - len(self.removed)
+
+    def close(self):
+        self._close_base()
+
+
+class HashIndex:
+    """The HashSets of a directory, by algorithm."""
+
+    def __init__(self, directory: Union[str, Path], algorithms: Iterable[str] = ALGORITHMS):
+        self.directory = Path(directory)
+        self.sets: Dict[str, HashSet] = {a: HashSet(self.directory, a) for a in algorithms}
+
+    def refresh(self) -> bool:
+        changed = False
+        for s in self.sets.values():
+            changed |= s.refresh()
+        return changed
+
+    def contains(self, algorithm: str, hex_digest: str) -> bool:
+        return bool(self.contains_many([(algorithm, hex_digest)]))
+
+    def contains_many(self, hashes: Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """The listed ones of (algorithm, hex digest) pairs. The pairs are returned as given. Pairs of an algorithm
+        which is not supported, or whose digest is not a hex string of its length, are not listed."""
+        wanted: Dict[str, Dict[bytes, List[Tuple[str, str]]]] = {}
+        for pair in hashes:
+            algorithm = algorithm_name(pair[0])
+            if algorithm not in self.sets or not isinstance(pair[1], str):
+                continue
+            d = digest(pair[1], self.sets[algorithm].width)
+            if d is not None:
+                wanted.setdefault(algorithm, {}).setdefault(d, []).append(pair)
+        found = set()
+        for algorithm, by_digest in wanted.items():
+            for d in self.sets[algorithm].contains_many(by_digest):
+                found.update(by_digest[d])
+        return found
+
+    def close(self):
+        for s in self.sets.values():
+            s.close()
+
+
+def _write_run(digests: List[bytes], directory: str) -> str:
+    digests.sort()
+    f = tempfile.NamedTemporaryFile(dir = directory, prefix = "run-", delete = False)
+    with f:
+        f.write(b"".join(digests))
+    return f.name
+
+
+def _read_run(path: str, width: int) -> Iterator[bytes]:
+    with open(path, 'rb', buffering = 1 << 20) as f:
+        while True:
+            d = f.read(width)
+            if len(d) < width:
+                return
+            yield d
+
+
+def write_set(path: Union[str, Path], width: int, sorted_digests: Iterable[bytes]) -> int:
+    """Write a .bin of sorted digests, without the duplicates, atomically. Returns the number written."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    count = 0
+    with open(tmp, 'wb', buffering = 1 << 20) as f:
+        f.write(MAGIC + _HEADER.pack(width, 0))
+        last = None
+        for d in sorted_digests:
+            if d != last:
+                f.write(d)
+                count += 1
+                last = d
+        f.seek(len(MAGIC))
+        f.write(_HEADER.pack(width, count))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return count
+
+
+def read_hex_lines(paths: Iterable[Union[str, Path]]) -> Iterator[str]:
+    """The hashes of text files: the first (CSV) column of every line which is not empty or a # comment."""
+    for path in paths:
+        with open(path, 'r', errors = 'replace') as f:
+            for line in f:
+                line = line.split(',', 1)[0].strip().strip('"')
+                if line and not line.startswith('#'):
+                    yield line
+
+
+def build(directory: Union[str, Path], hex_digests: Iterable[str], run_size: int = 10000000) -> Dict[str, int]:
+    """Write the .bin files of a directory from hex digests (the algorithm is told by the length) and empty the
+    .delta files. Sorts in runs of run_size digests in temporary files, then merges them. Returns the number of
+    digests per algorithm."""
+    directory = Path(directory)
+    directory.mkdir(parents = True, exist_ok = True)
+    runs: Dict[str, List[str]] = {a: [] for a in ALGORITHMS}
+    pending: Dict[str, List[bytes]] = {a: [] for a in ALGORITHMS}
+    counts = {}
+    with tempfile.TemporaryDirectory(dir = directory) as tmp:
+        for h in hex_digests:
+            algorithm = algorithm_of(h)
+            d = digest(h, ALGORITHMS[algorithm][1]) if algorithm else None
+            if d is None:
+                continue
+            pending[algorithm].append(d)
+            if len(pending[algorithm]) >= run_size:
+                runs[algorithm].append(_write_run(pending[algorithm], tmp))
+                pending[algorithm] = []
+        for algorithm, (name, width) in ALGORITHMS.items():
+            pending[algorithm].sort()
+            merged = heapq.merge(pending[algorithm], *(_read_run(r, width) for r in runs[algorithm]))
+            counts[algorithm] = write_set(directory / ("%s.bin" % name), width, merged)
+            (directory / ("%s.delta" % name)).unlink(missing_ok = True)
+    return counts
+
+
+def append_delta(directory: Union[str, Path], hex_digests: Iterable[str], listed: bool = True) -> int:
+    """Append hashes to the .delta files of their algorithm: listed (+) or not listed any more (-)."""
+    lines: Dict[str, List[str]] = {}
+    for h in hex_digests:
+        h = h.strip().lower()
+        algorithm = algorithm_of(h)
+        if algorithm and digest(h, ALGORITHMS[algorithm][1]) is not None:
+            lines.setdefault(algorithm, []).append("%s%s\n" % ("+" if listed else "-", h))
+    for algorithm, ls in lines.items():
+        with open(Path(directory) / ("%s.delta" % ALGORITHMS[algorithm][0]), 'a') as f:
+            f.write("".join(ls))
+    return sum(len(ls) for ls in lines.values())
+
+
+def compact(directory: Union[str, Path]) -> Dict[str, int]:
+    """Merge the .delta files into new .bin files and empty them. Returns the number of digests per algorithm."""
+    counts = {}
+    for algorithm, (name, width) in ALGORITHMS.items():
+        s = HashSet(directory, algorithm)
+        try:
+            removed = s.removed
+            merged = heapq.merge((s.keys[i] for i in range(len(s.keys))), sorted(s.added))
+            delta_size = s._delta_offset
+            counts[algorithm] = write_set(s.base_path, width, (d for d in merged if d not in removed))
+        finally:
+            s.close()
+        # keep the lines appended while merging
+        if s.delta_path.exists():
+            with open(s.delta_path, 'rb') as f:
+                f.seek(delta_size)
+                rest = f.read()
+            tmp = s.delta_path.with_name(s.delta_path.name + ".tmp")
+            tmp.write_bytes(rest)
+            os.replace(tmp, s.delta_path)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'maintain the IOC hash set files of a directory')
+    parser.add_argument('command', choices = ("build", "add", "remove", "compact"),
+                        help = "build: from hash list files. add / remove: hashes, to the delta files. compact: "
+                               "merge the delta files into the hash set files")
+    parser.add_argument('directory')
+    parser.add_argument('args', nargs = '*', help = "the files (build) or hashes (add / remove)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(build(args.directory, read_hex_lines(args.args)))
+    elif args.command in ("add", "remove"):
+        print(append_delta(args.directory, args.args, listed = args.command == "add"))
+    else:
+        print(compact(args.directory))
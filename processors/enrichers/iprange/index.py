@@ -0,0 +1,258 @@
+"""RangeIndex: IP address -> data of the most specific range (CIDR or start-end) containing it, from a file.
+
+The file is built offline (build(), or the command line below) from CSV files with a ``network`` column (CIDR) or
+``start`` and ``end`` columns and any other columns as the data of the range, or from MaxMind DB files (needs the
+maxminddb package). Overlapping ranges are flattened into disjoint intervals: each address gets the data of the
+narrowest range containing it. The file holds, per address family, the sorted interval starts and ends as fixed-width
+big-endian keys (4 bytes for IPv4, 16 for IPv6) and a data number per interval, followed by the distinct data as JSON:
+
+    magic | header | v4 starts | v4 ends | v4 data | v6 starts | v6 ends | v6 data | data offsets | data JSON
+
+A RangeIndex memory-maps the file, so all worker processes on a host share one copy in the page cache, and finds an
+address with a binary search over the keys (lib/utils/sortedkeys.py): about log2(intervals) comparisons of short byte
+strings. lookup_many() sorts the addresses first and narrows every search to the rest of the array.
+
+A new file is written next to the old one and renamed over it. reopen() maps the new file if it changed.
+
+USAGE example:
+    python -m processors.enrichers.iprange.index var/iprange/asn.idx --csv asn-ipv4.csv --csv asn-ipv6.csv
+    python -m processors.enrichers.iprange.index var/iprange/geo.idx --mmdb GeoLite2-City.mmdb
+
+    index = RangeIndex("var/iprange/asn.idx")
+    index.lookup("1.2.3.4")          # {"asn": 13335, "as_org": "Cloudflare"} or None
+"""
+
+import argparse
+import csv
+import heapq
+import ipaddress
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from lib.utils.sortedkeys import SortedKeys
+
+MAGIC = b"YSIPRNG1"
+_HEADER = struct.Struct(">QQQ")      # v4 intervals, v6 intervals, distinct data
+_WIDTH = {4: 4, 6: 16}
+
+Range = Tuple[int, int, int, dict]  # version, first address, last address, data
+
+
+class RangeIndex:
+    """A memory-mapped range index file, see the module docstring."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._file = None
+        self._mm = None
+        self._stat = None
+        self.open()
+
+    def open(self):
+        f = open(self.path, 'rb')
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            f.close()
+            raise RuntimeError("%s: empty index file" % self.path)
+        if mm[:len(MAGIC)] != MAGIC:
+            mm.close()
+            f.close()
+            raise RuntimeError("%s is not an IP range index" % self.path)
+        n4, n6, nd = _HEADER.unpack_from(mm, len(MAGIC))
+        offset = len(MAGIC) + _HEADER.size
+        sections = {}
+        for version, n in ((4, n4), (6, n6)):
+            w = _WIDTH[version]
+            starts = SortedKeys(mm, offset, w, n)
+            ends = SortedKeys(mm, offset + n * w, w, n)
+            sections[version] = (starts, ends, offset + 2 * n * w)
+            offset += 2 * n * w + 4 * n
+        self._close()
+        self._file, self._mm, self._stat = f, mm, os.fstat(f.fileno())
+        self._sections = sections
+        self._data_offsets = offset
+        self._data_base = offset + 8 * (nd + 1)
+        self._data: Dict[int, dict] = {}
+        self.counts = {4: n4, 6: n6}
+
+    def reopen(self) -> bool:
+        """Map the file again if it was replaced. Returns True if it was."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        if (st.st_ino, st.st_mtime_ns, st.st_size) == (self._stat.st_ino, self._stat.st_mtime_ns, self._stat.st_size):
+            return False
+        self.open()
+        return True
+
+    def _value(self, i: int) -> dict:
+        value = self._data.get(i)
+        if value is None:
+            a, b = struct.unpack_from(">QQ", self._mm, self._data_offsets + 8 * i)
+            value = self._data[i] = json.loads(self._mm[self._data_base + a:self._data_base + b])
+        return value
+
+    def _find(self, version: int, key: bytes, lo: int = 0) -> Tuple[Optional[dict], int]:
+        """The data of the interval containing key and the position to continue from with a larger key."""
+        starts, ends, data = self._sections[version]
+        i = starts.floor(key, lo)
+        if i < 0 or ends[i] < key:
+            return None, max(i, 0)
+        return self._value(struct.unpack_from(">I", self._mm, data + 4 * i)[0]), i
+
+    def lookup(self, ip: str) -> Optional[dict]:
+        """The data of the most specific range containing ip, None if there is none (or ip is not an address)."""
+        try:
+            address = ipaddress.ip_address(str(ip).strip())
+        except ValueError:
+            return None
+        return self._find(address.version, address.packed)[0]
+
+    def lookup_many(self, ips: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """lookup() of many addresses, by the given string. Strings which are not addresses are left out."""
+        addresses = []
+        for ip in ips:
+            try:
+                address = ipaddress.ip_address(str(ip).strip())
+            except ValueError:
+                continue
+            addresses.append((address.version, address.packed, ip))
+        addresses.sort()
+        result = {}
+        lo = {4: 0, 6: 0}
+        for version, key, ip in addresses:
+            result[ip], lo[version] = self._find(version, key, lo[version])
+        return result
+
+    def __len__(self) -> int:
+        return self.counts[4] + self.counts[6]
+
+    def _close(self):
+        if self._mm is not None:
+            self._sections = {}
+            self._mm.close()
+            self._file.close()
+            self._mm = self._file = None
+
+    def close(self):
+        self._close()
+
+
+def parse_range(network: str = None, start: str = None, end: str = None) -> Tuple[int, int, int]:
+    """(version, first, last address as ints) of a CIDR network or of a start and an end address."""
+    if network:
+        n = ipaddress.ip_network(network.strip(), strict = False)
+        return n.version, int(n.network_address), int(n.broadcast_address)
+    first, last = ipaddress.ip_address(start.strip()), ipaddress.ip_address(end.strip())
+    if first.version != last.version or first > last:
+        raise ValueError("invalid range %s - %s" % (start, end))
+    return first.version, int(first), int(last)
+
+
+def read_csv(path: Union[str, Path], network_column: str = "network", start_column: str = "start",
+             end_column: str = "end") -> Iterator[Range]:
+    """The ranges of a CSV file with a header line. The other columns are the data, empty ones are left out."""
+    with open(path, newline = '') as f:
+        for row in csv.DictReader(f):
+            version, first, last = parse_range(row.pop(network_column, None), row.pop(start_column, None),
+                                               row.pop(end_column, None))
+            yield version, first, last, {k: v for k, v in row.items() if k and v not in (None, "")}
+
+
+def read_mmdb(path: Union[str, Path]) -> Iterator[Range]:
+    """The networks of a MaxMind DB file and their records."""
+    try:
+        import maxminddb
+    except ImportError:
+        raise RuntimeError("reading %s needs the maxminddb package (pip install maxminddb)" % path)
+    with maxminddb.open_database(str(path)) as reader:
+        for network, record in reader:
+            yield network.version, int(network.network_address), int(network.broadcast_address), record
+
+
+def flatten(ranges: Iterable[Range]) -> Dict[int, List[Tuple[int, int, str]]]:
+    """Disjoint (first, last, data JSON) intervals per version, sorted, each with the data of the narrowest range
+    containing it. Adjacent intervals with the same data are merged."""
+    by_version: Dict[int, List[Tuple[int, int, str]]] = {4: [], 6: []}
+    for version, first, last, data in ranges:
+        by_version[version].append((first, last, json.dumps(data, sort_keys = True, separators = (',', ':'))))
+    result = {}
+    for version, rs in by_version.items():
+        rs.sort()
+        bounds = sorted({r[0] for r in rs} | {r[1] + 1 for r in rs})
+        active: List[Tuple[int, int, str]] = []     # heap of (size, last, data)
+        out: List[Tuple[int, int, str]] = []
+        i = 0
+        for p, q in zip(bounds, bounds[1:]):
+            while i < len(rs) and rs[i][0] <= p:
+                heapq.heappush(active, (rs[i][1] - rs[i][0], rs[i][1], rs[i][2]))
+                i += 1
+            while active and active[0][1] < p:
+                heapq.heappop(active)
+            if not active:
+                continue
+            data = active[0][2]
+            if out and out[-1][1] == p - 1 and out[-1][2] == data:
+                out[-1] = (out[-1][0], q - 1, data)
+            else:
+                out.append((p, q - 1, data))
+        result[version] = out
+    return result
+
+
+def build(path: Union[str, Path], ranges: Iterable[Range]) -> Dict[int, int]:
+    """Write an index file of ranges (atomically: a reader sees the old or the new file). Returns the number of
+    intervals per version."""
+    path = Path(path)
+    intervals = flatten(ranges)
+    data: Dict[str, int] = {}
+    for version in (4, 6):
+        for _, _, d in intervals[version]:
+            data.setdefault(d, len(data))
+    blobs = [d.encode() for d in data]
+    tmp = path.with_name(path.name + ".tmp")
+    path.parent.mkdir(parents = True, exist_ok = True)
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + _HEADER.pack(len(intervals[4]), len(intervals[6]), len(blobs)))
+        for version in (4, 6):
+            w = _WIDTH[version]
+            f.write(b"".join(first.to_bytes(w, "big") for first, _, _ in intervals[version]))
+            f.write(b"".join(last.to_bytes(w, "big") for _, last, _ in intervals[version]))
+            f.write(b"".join(struct.pack(">I", data[d]) for _, _, d in intervals[version]))
+        offset = 0
+        offsets = [0]
+        for b in blobs:
+            offset += len(b)
+            offsets.append(offset)
+        f.write(b"".join(struct.pack(">Q", o) for o in offsets))
+        f.write(b"".join(blobs))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {version: len(intervals[version]) for version in (4, 6)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'build an IP range index file')
+    parser.add_argument('output', help = "the index file to write")
+    parser.add_argument('--csv', action = 'append', default = [], help = "a CSV file of ranges (repeatable)")
+    parser.add_argument('--mmdb', action = 'append', default = [], help = "a MaxMind DB file (repeatable)")
+    parser.add_argument('--network-column', default = "network", help = "CIDR column of the CSV files")
+    parser.add_argument('--start-column', default = "start", help = "first address column of the CSV files")
+    parser.add_argument('--end-column', default = "end", help = "last address column of the CSV files")
+    args = parser.parse_args()
+
+    def ranges() -> Iterator[Range]:
+        for f in args.csv:
+            yield from read_csv(f, args.network_column, args.start_column, args.end_column)
+        for f in args.mmdb:
+            yield from read_mmdb(f)
+
+    counts = build(args.output, ranges())
+    print("%s: %d IPv4 and %d IPv6 intervals" % (args.output, counts[4], counts[6]))
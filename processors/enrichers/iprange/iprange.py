@@ -0,0 +1,108 @@
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from lib.config import ROOTDIR
+from lib.processor.enricher import Enricher
+from processors.enrichers.iprange.index import RangeIndex
+
+IP_OBSERVABLES = ("ipv4-addr", "ipv6-addr")
+
+
+class IPRangeEnricher(Enricher):
+    """Adds the data of the ranges an IP address is in from local range indices (ASN, geo, internal asset ranges,
+    reputation lists, ... see index.py), one key per index. The addresses are taken from
+
+      * an ipv4-addr / ipv6-addr observable (the message or its "payload", {"type": "ipv4-addr", "value": ...}):
+        the data goes into x_<index name>,
+      * the ip_fields of the message or its payload ("source.ip", ...): the data goes into the field with the same
+        prefix and the index name ("source.asn", ...).
+
+    The addresses of a batch of messages are looked up together. The index files are memory-mapped and mapped again
+    when they are replaced, at most every ip_index_check_interval seconds."""
+    batch_size = 100
+    ip_fields = ("ip", "source.ip", "destination.ip")
+    ip_index_check_interval = 60.0
+    indices: Dict[str, RangeIndex] = {}
+    _checked = 0.0
+    _found: Optional[dict] = None   # of the batch at hand
+
+    def startup(self):
+        config = self.config['processors'].get(self.__class__.__name__) or {}
+        self.batch_size = int(config.get('batch_size', self.__class__.batch_size))
+        self.batch_wait = float(config.get('batch_wait', self.__class__.batch_wait))
+        self.ip_fields = tuple(config.get('ip_fields', self.__class__.ip_fields))
+        self.ip_index_check_interval = float(config.get('ip_index_check_interval',
+                                                        self.__class__.ip_index_check_interval))
+        self.close_indices()
+        self.indices = {name: RangeIndex(Path(ROOTDIR) / path) for name, path in (config.get('ip_indices') or {}).items()}
+        if not self.indices:
+            self.logger.warning("no ip_indices configured")
+        self._checked = time.monotonic()
+
+    def reload(self):
+        super().reload()
+        self.startup()
+
+    def _check_files(self):
+        now = time.monotonic()
+        if now - self._checked < self.ip_index_check_interval:
+            return
+        self._checked = now
+        for name, index in self.indices.items():
+            if index.reopen():
+                self.logger.info("index %s reloaded from %s" % (name, index.path))
+
+    def _targets(self, msg: dict) -> List[Tuple[dict, str, str]]:
+        """(the dict to write to, its key for the index name with %s, the address) of every address of msg."""
+        targets = []
+        payload = msg.get('payload') if hasattr(msg, 'get') else None
+        for obj in (msg, payload):
+            if not isinstance(obj, dict):
+                continue
+            if obj.get('type') in IP_OBSERVABLES and isinstance(obj.get('value'), str):
+                targets.append((obj, "x_%s", obj['value'].split('/')[0]))
+            for field in self.ip_fields:
+                value = obj.get(field)
+                if isinstance(value, str):
+                    prefix = field.rsplit('.', 1)[0] + '.' if '.' in field else ''
+                    targets.append((obj, prefix.replace('%', '%%') + "%s", value))
+        return targets
+
+    def lookup_many(self, ips) -> Dict[str, Dict[str, dict]]:
+        """{index name: data} of the ranges each address is in, by address. Addresses in no range are left out."""
+        ips = list(ips)
+        result: Dict[str, Dict[str, dict]] = {}
+        for name, index in self.indices.items():
+            for ip, data in index.lookup_many(ips).items():
+                if data is not None:
+                    result.setdefault(ip, {})[name] = data
+        return result
+
+    def process(self, channel=None, method=None, properties=None, msg: dict = {}):
+        targets = self._targets(msg)
+        if not targets:
+            return msg
+        found = self._found if self._found is not None else self.lookup_many(t[2] for t in targets)
+        for obj, key, ip in targets:
+            for name, data in found.get(ip, {}).items():
+                obj[key % name] = data
+        return msg
+
+    def process_batch(self, msgs: list) -> list:
+        """Look up the addresses of all messages at once, then process them one by one with the results."""
+        self._check_files()
+        self._found = self.lookup_many(t[2] for msg in msgs for t in self._targets(msg))
+        try:
+            return super().process_batch(msgs)
+        finally:
+            self._found = None
+
+    def close_indices(self):
+        for index in self.indices.values():
+            index.close()
+        self.indices = {}
+
+    def shutdown(self):
+        self.close_indices()
+        super().shutdown()
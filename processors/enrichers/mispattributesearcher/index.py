@@ -0,0 +1,175 @@
+"""A local copy of the MISP attributes in SQLite, for lookups without asking MISP.
+
+The index holds one row per attribute and normalized value (lower case, the parts of a composite "a|b" value
+separately) and the time of the last successful sync. sync() pulls the attributes changed since the newest timestamp
+of the last complete sync (MISP's ``timestamp`` filter), page by page, including deleted ones, which are removed. The
+very first sync can be limited to the events of the last ``initial_last`` (``last`` filter, "30d" for example).
+
+MispAttributeSearcher answers from the index (see ``misp_index`` in etc/config.yml) as long as the last sync is at
+most ``misp_index_max_age`` seconds old, and asks MISP live otherwise.
+
+USAGE example:
+    python -m processors.enrichers.mispattributesearcher.index              # sync every misp_sync_interval seconds
+    python -m processors.enrichers.mispattributesearcher.index --once
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from lib.config import ROOTDIR, get_config
+
+DEFAULT_INDEX_FILE = "var/misp/attributes.sqlite"
+
+
+def normalize(value) -> str:
+    return str(value).strip().lower()
+
+
+def attribute_keys(attribute: dict) -> Set[str]:
+    """The normalized values an attribute is found by: its value and, for composite values, each part."""
+    value = normalize(attribute.get("value", ""))
+    return {value} | set(value.split("|"))
+
+
+class AttributeIndex:
+    """MISP attributes by normalized value in an SQLite file. See the module docstring."""
+
+    def __init__(self, path, clock: Callable[[], float] = time.time, refresh: float = 1.0):
+        """
+        :param path: the SQLite file, created if needed
+        :param clock: wall clock, for the age of the last sync
+        :param refresh: age() reads the time of the last sync (written by another process) at most every refresh
+            seconds
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents = True, exist_ok = True)
+        self.clock = clock
+        self.refresh = refresh
+        self.db = sqlite3.connect(str(self.path), isolation_level = None)   # autocommit, explicit transactions
+        self.db.execute("PRAGMA journal_mode=WAL")      # readers don't block the sync and vice versa
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS attributes (key TEXT NOT NULL, id TEXT NOT NULL, timestamp INTEGER NOT NULL,
+                                                   attribute TEXT NOT NULL, PRIMARY KEY (key, id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS attributes_id ON attributes (id);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value) WITHOUT ROWID;
+        """)
+        self._synced_at: Optional[float] = None
+        self._read_at = float('-inf')
+
+    def lookup(self, value) -> List[dict]:
+        """The attributes found by value."""
+        rows = self.db.execute("SELECT attribute FROM attributes WHERE key = ?", (normalize(value),)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def lookup_many(self, values: Iterable) -> Dict[str, List[dict]]:
+        """The attributes of every value, by normalized value."""
+        return {key: self.lookup(key) for key in dict.fromkeys(normalize(v) for v in values)}
+
+    def upsert(self, attributes: Iterable[dict]) -> int:
+        """Add or replace attributes (by id), remove the deleted ones. Returns the number of attributes."""
+        n = 0
+        self.db.execute("BEGIN")
+        try:
+            for att in attributes:
+                n += 1
+                self.db.execute("DELETE FROM attributes WHERE id = ?", (str(att["id"]),))
+                if att.get("deleted") in (True, 1, "1"):
+                    continue
+                data = json.dumps(att)
+                self.db.executemany("INSERT INTO attributes (key, id, timestamp, attribute) VALUES (?, ?, ?, ?)",
+                                    [(key, str(att["id"]), int(att.get("timestamp") or 0), data)
+                                     for key in attribute_keys(att)])
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return n
+
+    def _meta(self, name: str):
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def cursor(self) -> Optional[int]:
+        """Newest attribute timestamp of the last complete sync, None before the first one."""
+        return self._meta("cursor")
+
+    def mark_synced(self, at: float = None):
+        """Record a complete sync: the next one asks for the attributes changed since the newest one now in the
+        index. at: when the sync started."""
+        at = self.clock() if at is None else at
+        cursor = self.db.execute("SELECT MAX(timestamp) FROM attributes").fetchone()[0]
+        self.db.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                            [("synced_at", at), ("cursor", cursor)])
+        self._synced_at, self._read_at = at, float('-inf')
+
+    def age(self) -> float:
+        """Seconds since the last successful sync, infinite if there was none."""
+        now = self.clock()
+        if now - self._read_at >= self.refresh:
+            synced_at = self._meta("synced_at")
+            self._synced_at, self._read_at = (None if synced_at is None else float(synced_at)), now
+        return float('inf') if self._synced_at is None else max(now - self._synced_at, 0.0)
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(DISTINCT id) FROM attributes").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def sync(misp, index: AttributeIndex, page_size: int = 1000, initial_last: str = None) -> int:
+    """Pull the attributes changed since the last sync into index. Returns the number of attributes pulled.
+
+    :param misp: a PyMISP (or MISPRestClient) connection
+    :param index: the index to update
+    :param page_size: attributes per request
+    :param initial_last: limit the first sync to the events published within this period ("30d")
+    """
+    started = index.clock()
+    since = index.cursor
+    filters = {"timestamp": since} if since is not None else ({"last": initial_last} if initial_last else {})
+    n, page = 0, 1
+    while True:
+        ret = misp.search(controller = "attributes", return_format = "json", limit = page_size, page = page,
+                          deleted = [0, 1], **filters)
+        attributes = ret.get("Attribute", [])
+        n += index.upsert(attributes)
+        if len(attributes) < page_size:
+            break
+        page += 1
+    index.mark_synced(started)
+    logging.info("MISP sync: %d attributes changed since %s, %d in the index" % (n, since, len(index)))
+    return n
+
+
+def index_path(config: dict) -> Path:
+    return Path(ROOTDIR) / config.get('misp_index', DEFAULT_INDEX_FILE)
+
+
+if __name__ == "__main__":
+    from processors.enrichers.mispattributesearcher.mispattributesearcher import PyMISP
+
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description = 'sync the MISP attributes into the local index')
+    parser.add_argument('--once', action = 'store_true', help = "sync once and exit")
+    args = parser.parse_args()
+
+    c = get_config()['processors']['MispAttributeSearcher']
+    misp = PyMISP(c['misp_uri'], c['misp_api_key'], False, 'json')
+    index = AttributeIndex(index_path(c))
+    while True:
+        try:
+            sync(misp, index, int(c.get('misp_sync_page_size', 1000)), c.get('misp_sync_initial_last'))
+        except Exception as ex:
+            logging.error("MISP sync failed. Reason: %s" % str(ex))
+        if args.once:
+            break
+        time.sleep(float(c.get('misp_sync_interval', 300)))
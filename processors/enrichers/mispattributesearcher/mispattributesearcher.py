@@ -1,9 +1,26 @@
+from typing import Dict, Iterable, List, Optional
 from lib.processor.enricher import Enricher
-from pymisp import PyMISP
+from processors.enrichers.mispattributesearcher.index import AttributeIndex, attribute_keys, index_path, normalize
+from processors.enrichers.mispattributesearcher.restclient import MISPRestClient
+
+try:
+    from pymisp import PyMISP
+except ImportError:
+    PyMISP = MISPRestClient         # only the attribute search, which is all this enricher needs
 
 
 class MispAttributeSearcher(Enricher):
-    """TODO: here goes a class description"""
+    """Adds the MISP attributes whose value is the message's "search_value" as "misp_attributes".
+    The values of a batch of messages are deduplicated and looked up with one search for every ``misp_search_chunk``
+    of them, the matches are then split up between the messages.
+    With ``misp_index`` configured, the attributes are looked up in the local copy kept by index.py instead, as long as
+    it was synced within ``misp_index_max_age`` seconds."""
+    batch_size = 100
+    misp_search_chunk = 200         # values per search, keeps the request within MISP's limits
+    misp_index_max_age = 3600.0
+    misp_index: Optional[AttributeIndex] = None
+    _index_stale = False
+    _matches: dict = {}             # of the batch at hand: normalized value -> attributes
     # How is configuration passed in at object creation?
     # How will this object be called from the other code?
 
@@ -21,14 +38,67 @@ class MispAttributeSearcher(Enricher):
         except Exception as e:
             raise RuntimeError("could not open MISP connection in MispAttributeSearcher Reason: {}".format(str(e)))
 
+    def startup(self):
+        config = self.config['processors'].get(self.__class__.__name__) or {}
+        self.batch_size = int(config.get('batch_size', self.__class__.batch_size))
+        self.batch_wait = float(config.get('batch_wait', self.__class__.batch_wait))
+        self.misp_search_chunk = int(config.get('misp_search_chunk', self.__class__.misp_search_chunk))
+        self.misp_index_max_age = float(config.get('misp_index_max_age', self.__class__.misp_index_max_age))
+        if self.misp_index:
+            self.misp_index.close()
+        self.misp_index = AttributeIndex(index_path(config)) if config.get('misp_index') else None
+
+    def reload(self):
+        super().reload()
+        self.startup()
+
+    def _use_index(self) -> bool:
+        """True if there is an index and it is fresh enough, else the attributes must be searched live."""
+        if self.misp_index is None:
+            return False
+        age = self.misp_index.age()
+        if age > self.misp_index_max_age:
+            if not self._index_stale:
+                self.logger.warning("MISP index last synced %.0fs ago, searching MISP live" % age)
+                self._index_stale = True
+            return False
+        if self._index_stale:
+            self.logger.info("MISP index synced again, using it")
+            self._index_stale = False
+        return True
+
+    def search_many(self, values: Iterable[str]) -> Dict[str, List[dict]]:
+        """Search the distinct values in chunks of misp_search_chunk. Returns the matched attributes by lower-cased
+        value. A composite value ("1.2.3.4|80") counts for both of its parts. Uses the index if it is fresh."""
+        distinct = list(dict.fromkeys(str(v) for v in values if v is not None))
+        if self._use_index():
+            return self.misp_index.lookup_many(distinct)
+        matches: Dict[str, List[dict]] = {}
+        for i in range(0, len(distinct), self.misp_search_chunk):
+            chunk = distinct[i:i + self.misp_search_chunk]
+            ret = self.misp_connection.search(controller="attributes", return_format="json", value=chunk)
+            for att in ret.get("Attribute", []):
+                for key in attribute_keys(att):
+                    matches.setdefault(key, []).append(att)
+        return {normalize(v): matches.get(normalize(v), []) for v in distinct}
+
+    def lookup(self, value: str) -> List[dict]:
+        key = normalize(value)
+        if key in self._matches:
+            return self._matches[key]
+        if self._use_index():
+            return self.misp_index.lookup(key)
+        ret = self.misp_connection.search(controller="attributes", return_format="json", value=value)
+        return ret["Attribute"]
+
     def process(self, channel=None, method=None, properties=None, msg: dict = {}):
-        # TODO:  This has to contain the value we are searching for in attributes
         # TODO:  Implement partial string search
-        # TODO:  documentation for methods
-        value = msg["search_value"]
-        ret = self.misp_connection.search(controller="attributes", return_format="json", value=value)
-        if len(ret["Attribute"]) == 0:
-            return (False, msg)
+        value = msg.get("search_value")
+        if value is None:
+            return msg
+        attributes = self.lookup(value)
+        if len(attributes) == 0:
+            return msg
         else:
             # TODO:  message appending and validation should not happen in an enricher
             msg["misp_attributes"] = {}
@@ -39,10 +109,25 @@ class MispAttributeSearcher(Enricher):
             instance_retrieved_data = {}
             instance_retrieved_data["misp_instance"] = self.misp_url
             instance_retrieved_data["matched_attributes"] = []
-            for att in ret["Attribute"]:
+            for att in attributes:
                 instance_retrieved_data["matched_attributes"].append(att)
             msg["misp_attributes"].append(instance_retrieved_data)
-            return (True, msg)
+            return msg
+
+    def process_batch(self, msgs: list) -> list:
+        """Search the values of all messages at once, then process them one by one with the matches."""
+        self._matches = self.search_many(msg.get("search_value") for msg in msgs)
+        try:
+            return super().process_batch(msgs)
+        finally:
+            self._matches = {}
+
+    def shutdown(self):
+        if hasattr(self.misp_connection, "close"):
+            self.misp_connection.close()
+        if self.misp_index:
+            self.misp_index.close()
+        super().shutdown()
 
 
 if __name__ == "__main__":
@@ -52,8 +137,8 @@ if __name__ == "__main__":
     ms = MispAttributeSearcher("313")
     c = ms.config
     print(c)
-    found, message = ms.process(channel=None, method=None, properties=None, msg=msg)
-    print("MAMA")
+    message = ms.process(channel=None, method=None, properties=None, msg=msg)
+    print(message)
 
     '''end of debugging'''
 
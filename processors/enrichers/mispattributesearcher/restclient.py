@@ -0,0 +1,87 @@
+"""A minimal MISP REST client: the attribute search of pymisp.PyMISP over one keep-alive HTTP(S) connection.
+
+MispAttributeSearcher uses it when pymisp is not installed. search() takes the arguments of PyMISP.search() which the
+enricher uses and returns the same {"Attribute": [...]} dict. A list of values is one search for any of them.
+"""
+
+import http.client
+import json
+import ssl as _ssl
+import urllib.parse
+from typing import Optional
+
+
+class MISPError(RuntimeError):
+    pass
+
+
+class MISPRestClient:
+    """PyMISP(url, key, ssl, out_type) for attribute searches only."""
+
+    def __init__(self, url: str, key: str, ssl: bool = True, out_type: str = 'json', timeout: float = 30.0):
+        """
+        :param url: the MISP base URL
+        :param key: the API key
+        :param ssl: verify the server certificate
+        :param out_type: only 'json' is supported
+        :param timeout: seconds for connecting and for every response
+        """
+        u = urllib.parse.urlsplit(url)
+        if u.scheme not in ("http", "https") or not u.hostname:
+            raise ValueError("invalid MISP URL %r" % url)
+        self.scheme = u.scheme
+        self.host = u.hostname
+        self.port = u.port
+        self.base_path = u.path.rstrip('/')
+        self.key = key
+        self.verify = ssl
+        self.timeout = timeout
+        self.requests = 0
+        self._connection: Optional[http.client.HTTPConnection] = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.scheme == "http":
+            return http.client.HTTPConnection(self.host, self.port, timeout = self.timeout)
+        context = _ssl.create_default_context()
+        if not self.verify:
+            context.check_hostname = False
+            context.verify_mode = _ssl.CERT_NONE
+        return http.client.HTTPSConnection(self.host, self.port, timeout = self.timeout, context = context)
+
+    def _post(self, path: str, body: dict) -> dict:
+        data = json.dumps(body).encode()
+        headers = {"Authorization": self.key, "Accept": "application/json", "Content-Type": "application/json"}
+        for attempt in (1, 2):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.request("POST", self.base_path + path, body = data, headers = headers)
+                r = self._connection.getresponse()
+                payload = r.read()
+            except (http.client.HTTPException, ConnectionError) as ex:
+                # the server closed the idle keep-alive connection: ask once more on a new one
+                self.close()
+                if attempt == 2:
+                    raise MISPError("MISP request failed. Reason: %s" % str(ex))
+                continue
+            self.requests += 1
+            if r.getheader("Connection", "").lower() == "close":
+                self.close()
+            if r.status != 200:
+                raise MISPError("MISP answered %d %s: %s" % (r.status, r.reason, payload[:200]))
+            return json.loads(payload)
+
+    def search(self, controller: str = "attributes", return_format: str = "json", value = None, **kwargs) -> dict:
+        """Search attributes whose value is value (or one of the values of a list)."""
+        if controller != "attributes" or return_format != "json":
+            raise NotImplementedError("MISPRestClient only searches attributes in JSON")
+        body = dict(kwargs, returnFormat = return_format)
+        if value is not None:
+            body["value"] = list(value) if isinstance(value, (list, tuple, set)) else value
+        result = self._post("/attributes/restSearch", body)
+        return result.get("response", result)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
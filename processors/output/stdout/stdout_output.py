@@ -0,0 +1,27 @@
+import json
+import sys
+from typing import Optional, TextIO, Union
+
+from lib.message import Message
+from lib.processor.output import OutputProcessor
+
+
+class StdoutOutput(OutputProcessor):
+    """Writes every message to standard output, one JSON object per line. The end of the workflow: nothing is sent
+    on."""
+    sort_keys = False
+    stream: Optional[TextIO] = None         # sys.stdout by default
+
+    def startup(self):
+        config = self.config['processors'].get(self.__class__.__name__) or {}
+        self.sort_keys = bool(config.get('sort_keys', self.__class__.sort_keys))
+
+    def process(self, channel=None, method=None, properties=None, msg: Union[dict, Message] = None) -> None:
+        if isinstance(msg, Message):
+            msg = msg.to_dict()
+        (self.stream or sys.stdout).write(json.dumps(msg, sort_keys = self.sort_keys) + "\n")
+        return None
+
+    def flush(self):
+        super().flush()
+        (self.stream or sys.stdout).flush()
@@ -1 +1,12 @@
 """ Unit tests. """
+
+import logging
+
+
+def forget_loggers():
+    """Close and forget the yellowsub loggers which processors set up from the config, so that tests which set up
+    loggers themselves start from scratch."""
+    for name in [n for n in logging.root.manager.loggerDict if n.startswith("yellowsub")]:
+        logger = logging.root.manager.loggerDict.pop(name)
+        for h in getattr(logger, "handlers", []):
+            h.close()
@@ -0,0 +1,95 @@
+from unittest import TestCase
+import pika.exceptions
+from benchmarks.e2e import Bench, load_workflow, percentile, BENCH_DIR
+from benchmarks.generator import MessageGenerator
+from benchmarks.micro import CASES, compare, environment, measure
+from benchmarks.standins import FakeRedis, InMemoryBroker
+from lib.config import get_config
+from lib.mq import MQ
+
+
+class TestStandIns(TestCase):
+
+    def test_broker_routing(self):
+        b = InMemoryBroker()
+        ch = b.connect().channel()
+        ch.exchange_declare("t", "topic")
+        for q, key in (("ips", "event.ipv4-addr"), ("all", "#"), ("domains", "*.domain-name")):
+            ch.queue_declare(q)
+            ch.queue_bind(q, "t", key)
+        ch.basic_publish("t", "event.ipv4-addr", b"1")
+        ch.basic_publish("t", "event.domain-name", b"2")
+        self.assertEqual({q: len(b.queues[q].messages) for q in b.queues}, {"ips": 1, "all": 2, "domains": 1})
+
+        ch.queue_declare("small", arguments = {"x-max-length": 1, "x-overflow": "reject-publish"})
+        ch.confirm_delivery()
+        ch.basic_publish("", "small", b"1")
+        with self.assertRaises(pika.exceptions.NackError):
+            ch.basic_publish("", "small", b"2")
+
+        got = []
+        ch.basic_consume("small", lambda c, m, p, body: got.append(body))
+        self.assertEqual(b.drain(), 1)
+        self.assertEqual(got, [b"1"])
+
+    def test_fake_redis_expiry(self):
+        now = [0.0]
+        r = FakeRedis(clock = lambda: now[0])
+        r.set("k", 1)
+        r.expire("k", 10)
+        self.assertEqual(r.get("k"), "1")
+        now[0] = 11
+        self.assertFalse(r.exists("k"))
+
+    def test_generator_is_reproducible(self):
+        a, b = MessageGenerator(seed = 1), MessageGenerator(seed = 1)
+        m = a.message()
+        self.assertEqual(m, b.message())
+        self.assertEqual(m["fqdn"], m["payload"]["source.fqdn"])
+        self.assertTrue(m["payload"]["destination.url"].startswith("http"))
+
+
+class TestE2E(TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 1001))
+        self.assertEqual(percentile(values, 50), 500)
+        self.assertEqual(percentile(values, 99.9), 999)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_dns_workflow(self):
+        config = get_config()
+        with Bench(load_workflow(str(BENCH_DIR / "workflows/dns.yml"))) as bench:
+            report = bench.run(200, batch = 10)
+            self.assertGreater(bench.resolver.queries, 0)
+        self.assertEqual(report["latency_ms"]["arrivals"], 200)
+        self.assertEqual(report["hops"]["dns"]["messages"], 200)
+        self.assertEqual(report["broker"], {"published": 400, "delivered": 400, "dropped": 0})
+        # the stand-ins are gone again
+        self.assertIsNone(MQ.connection_factory)
+        self.assertIs(get_config(), config)
+
+
+class TestMicro(TestCase):
+
+    def test_cases_run(self):
+        with environment():
+            for name, setup in CASES.items():
+                with self.subTest(case = name):
+                    setup()()
+        self.assertIsNone(MQ.connection_factory)
+
+    def test_measure(self):
+        r = measure(lambda: [0] * 1000, min_time = 0.01, repeat = 1, alloc_calls = 3)
+        self.assertGreater(r["ops_per_sec"], 0)
+        self.assertGreaterEqual(r["alloc_bytes"], 8000)
+
+    def test_compare(self):
+        baseline = {"results": {"a": {"ops_per_sec": 1000.0, "alloc_bytes": 100.0},
+                                "b": {"ops_per_sec": 1000.0, "alloc_bytes": 100.0}}}
+        current = {"results": {"a": {"ops_per_sec": 950.0, "alloc_bytes": 150.0},
+                               "b": {"ops_per_sec": 500.0, "alloc_bytes": 1000.0},
+                               "new": {"ops_per_sec": 1.0, "alloc_bytes": 0.0}}}
+        regressions = compare(current, baseline, tolerance = 0.1)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all(line.startswith("b: ") for line in regressions))
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase
+from processors.enrichers.blocklist.blocklist import BlocklistEnricher
+from processors.enrichers.blocklist.engine import Blocklist, compile_lists, url_host
+from tests import forget_loggers
+
+DOMAINS = {"safebrowsing": ["evil.example.com", "Bad.TEST.", "bücher.example"], "internal": ["corp.example.org"]}
+PATTERNS = {"phishing": ["/wp-admin/evil", "paypal-login", "he", "she", "hers"]}
+
+
+class TestBlocklist(TestCase):
+
+    def setUp(self):
+        self.bl = compile_lists(DOMAINS, PATTERNS)
+
+    def test_domains(self):
+        self.assertEqual(self.bl.match_domain("evil.example.com"), {"safebrowsing"})
+        self.assertEqual(self.bl.match_domain("a.b.EVIL.example.com."), {"safebrowsing"})
+        self.assertEqual(self.bl.match_domain("example.com"), set())
+        self.assertEqual(self.bl.match_domain("notevil.example.com"), set())
+        self.assertEqual(self.bl.match_domain("x.bad.test"), {"safebrowsing"})
+        self.assertEqual(self.bl.match_domain("www.xn--bcher-kva.example"), {"safebrowsing"})
+        self.assertEqual(self.bl.match_domain("host.corp.example.org"), {"internal"})
+
+    def test_patterns(self):
+        # the classic Aho-Corasick example: "ushers" contains she, he and hers
+        self.assertEqual(self.bl.match_patterns("ushers"), {"phishing"})
+        self.assertEqual(self.bl.match_patterns("xyz"), set())
+        bl = compile_lists(patterns = {"a": ["he"], "b": ["hers"], "c": ["she"], "d": ["xx"]})
+        self.assertEqual(bl.match_patterns("USHERS"), {"a", "b", "c"})
+        self.assertEqual(bl.match_patterns("shx"), set())
+        self.assertEqual(self.bl.match_url("https://user@login.evil.example.com:8443/x"), {"safebrowsing"})
+        self.assertEqual(self.bl.match_url("http://site.example.net/WP-Admin/evil.php"), {"phishing"})
+        self.assertEqual(url_host("https://[2001:db8::1]:443/"), "2001:db8::1")
+        self.assertEqual(url_host("example.com/path?q=http://x"), "example.com")
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "bl.json.gz"
+            self.bl.save(path)
+            bl = Blocklist.load(path)
+        for url in ("https://evil.example.com/", "https://ok.example.com/paypal-login", "https://ok.example.com/"):
+            self.assertEqual(bl.match_url(url), self.bl.match_url(url))
+
+    def test_enricher_and_hot_swap(self):
+        self.addCleanup(forget_loggers)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "bl.json.gz"
+        self.bl.save(path)
+        e = BlocklistEnricher("test-blocklist")
+        e.path = path
+        e.refresh(force = True)
+        emitted = []
+        e.emit = lambda msg, trace = None: emitted.append(msg)
+        e.batch_size = 2
+        for msg in (b'{"type": "url", "value": "https://evil.example.com/a"}',
+                    b'{"payload": {"source.fqdn": "corp.example.org", "url": "https://example.net/paypal-login"}}'):
+            e.mq_msg_callback(msg = msg)
+        self.assertEqual(emitted[0]["x_blocklist_match"], ["safebrowsing"])
+        self.assertEqual(emitted[1]["payload"]["blocklist_match"], ["internal", "phishing"])
+        # a new file is swapped in
+        compile_lists({"new": ["example.net"]}).save(path)
+        os.utime(path, ns = (time.time_ns(), time.time_ns() + 10 ** 9))
+        self.assertEqual(e.process(msg = {"fqdn": "example.net"})["blocklist_match"], [])     # not checked yet
+        e.refresh(force = True)
+        self.assertEqual(e.process(msg = {"fqdn": "www.example.net"})["blocklist_match"], ["new"])
+        # a broken file is not
+        path.write_bytes(b"garbage")
+        e.refresh(force = True)
+        self.assertEqual(e.blocklist.lists, ["new"])
@@ -0,0 +1,84 @@
+from unittest import TestCase
+from benchmarks.standins import FakeCensysServer, FakeRedis
+from lib.processor.httpenricher import Backend
+from lib.utils.cache import Cache
+from processors.enrichers.censys.censys import CensysEnricher, QueryBudget, parse_resets_at
+from tests import forget_loggers
+
+HOSTS = {"1.2.3.4": {"services": [{"port": 443, "service_name": "HTTP"}]}, "5.6.7.8": {"services": []}}
+NAMES = {"1.2.3.4": ["www.example.com", "example.com"]}
+
+
+class Clock:
+    def __init__(self, t = 1000000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+class TestCensys(TestCase):
+
+    def enricher(self, server: FakeCensysServer, clock: Clock) -> CensysEnricher:
+        self.addCleanup(forget_loggers)
+        e = CensysEnricher("test-censys")
+        e.clock = clock
+        e.budget = QueryBudget(burst = 100, clock = clock)
+        e.cache = Cache(client = FakeRedis(clock = clock))
+        e.close_backends()
+        e.backends = {"censys": Backend("censys", server.url, user = "fake-id", password = "fake-secret")}
+        self.addCleanup(e.shutdown)
+        return e
+
+    def test_batch_and_cache(self):
+        clock = Clock()
+        with FakeCensysServer(HOSTS, NAMES) as server:
+            e = self.enricher(server, clock)
+            e.batch_size = 4
+            emitted = []
+            e.emit = lambda msg, trace = None: emitted.append(msg)
+            for msg in (b'{"ip": "1.2.3.4"}', b'{"ip": "9.9.9.9"}', b'{"ip": "not an ip"}', b'{"ip": "5.6.7.8"}'):
+                e.mq_msg_callback(msg = msg)
+            self.assertEqual(emitted[0]["censys"]["names"], ["www.example.com", "example.com"])
+            self.assertEqual(emitted[0]["censys"]["host"]["services"][0]["port"], 443)
+            self.assertEqual(emitted[1]["censys"], {"host": None, "names": []})
+            self.assertEqual(emitted[2], {"ip": "not an ip"})
+            self.assertEqual(emitted[3]["censys"]["names"], [])
+            self.assertEqual(server.queries, {"search": 1, "names": 2})    # names only of the IPs Censys knows
+            # cached
+            self.assertEqual(e.process(msg = {"ip": "1.2.3.4"})["censys"], emitted[0]["censys"])
+            self.assertEqual(server.queries, {"search": 1, "names": 2})
+            clock.t += e.censys_cache_ttl
+            e.process(msg = {"ip": "1.2.3.4"})
+            self.assertEqual(server.queries, {"search": 2, "names": 3})
+
+    def test_quota(self):
+        clock = Clock()
+        resets_at = "2100-01-01 00:00:00"
+        with FakeCensysServer(HOSTS, NAMES, allowance = 100, used = 97, resets_at = resets_at) as server:
+            e = self.enricher(server, clock)
+            self.assertEqual(set(e.lookup_many(["1.2.3.4", "5.6.7.8"])), {"1.2.3.4", "5.6.7.8"})
+            self.assertEqual(e.budget.remaining, 0)
+            self.assertEqual(e.budget.resets_at, parse_resets_at(resets_at))
+            # no queries left: pending, without asking Censys
+            msg = e.process(msg = {"ip": "9.9.9.9"})
+            self.assertEqual(msg, {"ip": "9.9.9.9", "pending_enrichments": ["censys"]})
+            self.assertEqual(server.used, 100)
+            # Censys says the quota is used up
+            e.budget.remaining = 10
+            server.used = 100
+            self.assertEqual(e.lookup_many(["9.9.9.9"]), {})
+            self.assertEqual(e.budget.remaining, 0)
+
+    def test_budget(self):
+        clock = Clock()
+        b = QueryBudget(reserve = 10, burst = 5, clock = clock)
+        self.assertTrue(b.spend(1000))                  # quota unknown
+        b.update(used = 0, allowance = 110, resets_at = clock.t + 100)
+        self.assertEqual((b.remaining, b.rate), (100, 1.0))
+        self.assertEqual([b.spend(2), b.spend(2), b.spend(2)], [True, True, False])
+        clock.t += 3
+        self.assertTrue(b.spend(2))
+        self.assertEqual(b.remaining, 94)
+        clock.t += 100
+        self.assertTrue(b.spend(50))                    # the quota was reset
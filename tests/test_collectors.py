@@ -0,0 +1,137 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import TestCase
+from lib.processor.collector import Checkpoint
+from processors.collectors.file_collector import DirectoryCollector, FileCollector
+from processors.collectors.readers import auto, csv_rows, jsonl, lines
+from processors.collectors.stdin_collector import StdinCollector
+from tests import forget_loggers
+
+
+def make(cls, tmp: str, paths = (), batch_size = 2):
+    c = cls("test-collector")
+    c.paths = [str(Path(tmp) / p) for p in paths]
+    c.batch_size = batch_size
+    c.checkpoint = Checkpoint(Path(tmp) / "checkpoints" / "test-collector.json")
+    c.emitted = []
+    c.emit = lambda msg, trace = None: c.emitted.append(msg)
+    return c
+
+
+class TestReaders(TestCase):
+
+    def test_lines_and_offsets(self):
+        data = b'{"a": 1}\r\n\nnot json\n{"a": 2}'
+        self.assertEqual(list(lines(io.BytesIO(data))), [(b'{"a": 1}', 10), (b'not json', 20), (b'{"a": 2}', 28)])
+        self.assertEqual(list(lines(io.BytesIO(data), complete_only = True))[-1], (b'not json', 20))
+        self.assertEqual(list(lines(io.BytesIO(data), offset = 20)), [(b'{"a": 2}', 28)])
+        self.assertEqual([r for r, _ in jsonl(lines(io.BytesIO(data)))], [{"a": 1}, None, {"a": 2}])
+        self.assertEqual([r for r, _ in auto(lines(io.BytesIO(data)), "url")],
+                         [{"a": 1}, {"type": "url", "value": "not json"}, {"a": 2}])
+
+    def test_csv(self):
+        data = b'type,value,note\nurl,http://a/,"two\nlines"\ndomain,b.example,\n'
+        rows = list(csv_rows(lines(io.BytesIO(data))))
+        self.assertEqual(rows, [({"type": "url", "value": "http://a/", "note": "two\nlines"}, 42),
+                                ({"type": "domain", "value": "b.example"}, 60)])
+        resumed = list(csv_rows(lines(io.BytesIO(data), offset = 42), fieldnames = ["type", "value", "note"]))
+        self.assertEqual(resumed, rows[1:])
+
+
+class TestFileCollector(TestCase):
+
+    def setUp(self):
+        self.addCleanup(forget_loggers)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def test_backfill_and_resume(self):
+        with open(Path(self.tmp) / "a.jsonl", 'w') as f:
+            f.writelines('{"n": %d}\n' % i for i in range(5))
+        with gzip.open(Path(self.tmp) / "b.csv.gz", 'wt') as f:
+            f.write("type,value\nurl,http://b/1\nurl,http://b/2\n")
+        c = make(FileCollector, self.tmp, ["*.jsonl", "*.gz"])
+        c.start()
+        urls = [{"type": "url", "value": "http://b/1"}, {"type": "url", "value": "http://b/2"}]
+        self.assertEqual(c.emitted, [{"n": i} for i in range(5)] + urls)
+
+        # a restart sends only what was added since
+        with open(Path(self.tmp) / "a.jsonl", 'a') as f:
+            f.write('{"n": 5}\n')
+        c = make(FileCollector, self.tmp, ["*.jsonl", "*.gz"])
+        c.start()
+        self.assertEqual(c.emitted, [{"n": 5}])
+
+        # a replaced file is read from the start
+        os.replace(Path(self.tmp) / "a.jsonl", Path(self.tmp) / "old")
+        with open(Path(self.tmp) / "a.jsonl", 'w') as f:
+            f.write('{"n": 6}\n')
+        c = make(FileCollector, self.tmp, ["*.jsonl", "*.gz"])
+        c.start()
+        self.assertEqual(c.emitted, [{"n": 6}])
+
+    def test_no_checkpoint_when_sending_fails(self):
+        with open(Path(self.tmp) / "a.jsonl", 'w') as f:
+            f.writelines('{"n": %d}\n' % i for i in range(5))
+        c = make(FileCollector, self.tmp, ["a.jsonl"])
+
+        def emit(msg, trace = None):
+            if msg["n"] == 3:
+                raise RuntimeError("broker down")
+            c.emitted.append(msg)
+        c.emit = emit
+        with self.assertRaises(RuntimeError):
+            c.start()
+        # the first batch is stored, the second was not sent completely and is sent again
+        c = make(FileCollector, self.tmp, ["a.jsonl"])
+        c.start()
+        self.assertEqual(c.emitted, [{"n": 2}, {"n": 3}, {"n": 4}])
+
+    def test_tail(self):
+        path = Path(self.tmp) / "feed.log"
+        with open(path, 'w') as f:
+            f.write('{"n": 0}\n{"n": ')
+        c = make(DirectoryCollector, self.tmp, ["*.log"], batch_size = 100)
+        c.poll_interval = 0.02
+        t = threading.Thread(target = c.start)
+        t.start()
+        try:
+            self.wait_for(c, 1)
+            with open(path, 'a') as f:
+                f.write('1}\n')
+            with open(Path(self.tmp) / "new.log", 'w') as f:
+                f.write('{"n": 2}\n')
+            self.wait_for(c, 3)
+        finally:
+            c.stop()
+            t.join(5)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(sorted(m["n"] for m in c.emitted), [0, 1, 2])
+        with open(Path(self.tmp) / "checkpoints" / "test-collector.json") as f:
+            self.assertEqual(json.load(f)[str(path)]["offset"], path.stat().st_size)
+
+    def wait_for(self, c, n):
+        deadline = time.monotonic() + 5
+        while len(c.emitted) < n and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(c.emitted), n)
+
+
+class TestStdinCollector(TestCase):
+
+    def test_stdin(self):
+        self.addCleanup(forget_loggers)
+        with tempfile.TemporaryDirectory() as tmp:
+            c = make(StdinCollector, tmp)
+            c.stream = io.BytesIO(b'https://a.example/\n# comment\n{"type": "domain", "value": "b.example"}\n')
+            c.start()
+            self.assertFalse(os.path.exists(Path(tmp) / "checkpoints"))
+        self.assertEqual(c.emitted, [{"type": "url", "value": "https://a.example/"},
+                                     {"type": "domain", "value": "b.example"}])
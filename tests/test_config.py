@@ -1,4 +1,8 @@
-from lib.config import Config, ROOTDIR
+import os
+import tempfile
+import weakref
+from collections.abc import Mapping
+from lib.config import Config, ConfigService, get_config, ROOTDIR
 from pathlib import Path
 from unittest import TestCase
 
@@ -29,3 +33,73 @@ class TestConfig(TestCase):
     def test___len__(self):
         config = self.load_testcases_config()
         assert len(config) == 4
+
+
+class TestConfigService(TestCase):
+
+    def setUp(self):
+        fd, self.file = tempfile.mkstemp(suffix = ".yml")
+        os.close(fd)
+        self.write("redis:\n  host: localhost\nlist: [1, 2]\n")
+
+    def tearDown(self):
+        os.unlink(self.file)
+
+    def write(self, text: str):
+        with open(self.file, "w") as f:
+            f.write(text)
+
+    def test_snapshot_is_read_only(self):
+        service = ConfigService(Path(self.file))
+        config = service.snapshot
+        self.assertIsInstance(config, Mapping)
+        self.assertEqual(config["redis"]["host"], "localhost")
+        self.assertEqual(config["list"], (1, 2))
+        with self.assertRaises(TypeError):
+            config["redis"]["host"] = "elsewhere"
+        # Config.load() still hands out a mutable copy
+        params = Config().load(Path(self.file))
+        params["redis"]["host"] = "elsewhere"
+        self.assertEqual(service.snapshot["redis"]["host"], "localhost")
+        self.assertIs(get_config(Path(self.file)), get_config(Path(self.file)))
+
+    def test_reload_on_change(self):
+        service = ConfigService(Path(self.file))
+        seen = []
+        service.subscribe(seen.append)
+        self.assertFalse(service.check())
+        old = service.snapshot
+        self.write("redis:\n  host: redis.example.com\n")
+        self.assertTrue(service.check())
+        self.assertEqual(service.version, 2)
+        self.assertEqual(seen, [service.snapshot])
+        self.assertEqual(old["redis"]["host"], "localhost")          # old snapshots stay intact
+        self.assertEqual(service.snapshot["redis"]["host"], "redis.example.com")
+
+        # a broken file keeps the last good snapshot
+        self.write("redis: [\n")
+        self.assertFalse(service.check())
+        self.assertEqual(service.snapshot["redis"]["host"], "redis.example.com")
+        self.assertEqual(len(seen), 1)
+
+    def test_subscriptions_do_not_keep_objects_alive(self):
+        class Listener:
+            def __init__(self):
+                self.seen = []
+
+            def on_change(self, snapshot):
+                self.seen.append(snapshot)
+
+        service = ConfigService(Path(self.file))
+        kept, dropped, unsubscribed = Listener(), Listener(), Listener()
+        for listener in (kept, dropped, unsubscribed):
+            service.subscribe(listener.on_change)
+        service.unsubscribe(unsubscribed.on_change)
+        ref = weakref.ref(dropped)
+        del dropped
+        self.assertIsNone(ref())
+        self.write("redis:\n  host: redis.example.com\n")
+        self.assertTrue(service.check())
+        self.assertEqual(kept.seen, [service.snapshot])
+        self.assertEqual(unsubscribed.seen, [])
+        self.assertEqual(len(service.subscribers), 1)
@@ -0,0 +1,63 @@
+from unittest import TestCase
+from benchmarks.standins import StubElasticsearch
+from lib.processor.httpenricher import Backend
+from processors.enrichers.es_hunter.es_hunter import ElasticHunter_Hash_Lookup, NegativeCache
+from tests import forget_loggers
+
+DOCS = [{"hash": "aaaa", "file": "a.exe"}, {"hash": "bbbb"}, {"hash": ["cccc", "dddd"]}]
+
+
+class TestElasticHunter(TestCase):
+
+    def hunter(self, stub: StubElasticsearch) -> ElasticHunter_Hash_Lookup:
+        self.addCleanup(forget_loggers)
+        h = ElasticHunter_Hash_Lookup("test-es-hunter")
+        h.close_backends()
+        h.backends = {"es": Backend("es", stub.url)}
+        self.addCleanup(h.shutdown)
+        return h
+
+    def test_batch_terms_and_negative_cache(self):
+        with StubElasticsearch(DOCS) as stub:
+            h = self.hunter(stub)
+            h.batch_size = 4
+            emitted = []
+            h.emit = lambda msg, trace = None: emitted.append(msg)
+            for msg in (b'{"hash": "AAAA"}', b'{"hash": "eeee"}', b'{"other": 1}', b'{"hash": "dddd"}'):
+                h.mq_msg_callback(msg = msg)
+            self.assertEqual(emitted, [{"hash": "AAAA", "found_in_es_hunter": True},
+                                       {"hash": "eeee", "found_in_es_hunter": False}, {"other": 1},
+                                       {"hash": "dddd", "found_in_es_hunter": True}])
+            self.assertEqual(stub.searches, {"search": 1, "msearch": 0})
+            # "eeee" is cached as not found, only "bbbb" is asked
+            self.assertEqual(h.lookup_many(["eeee", "bbbb"]), {"eeee": False, "bbbb": True})
+            self.assertEqual(stub.searches["search"], 2)
+            self.assertEqual(h.lookup_many(["eeee"]), {"eeee": False})
+            self.assertEqual(stub.searches["search"], 2)
+            self.assertEqual(stub.connections, 1)       # keep-alive
+
+    def test_msearch_and_truncated_terms(self):
+        with StubElasticsearch(DOCS + [{"hash": "aaaa"}] * 3) as stub:
+            h = self.hunter(stub)
+            h.es_lookup = "msearch"
+            self.assertEqual(h.lookup_many(["aaaa", "ffff"]), {"aaaa": True, "ffff": False})
+            self.assertEqual(stub.searches, {"search": 0, "msearch": 1})
+            # the 2 hits of a terms query are all "aaaa": the other hashes are asked with _msearch
+            h.es_lookup, h.es_terms_size = "terms", 2
+            self.assertEqual(h.lookup_many(["aaaa", "bbbb", "gggg"]), {"aaaa": True, "bbbb": True, "gggg": False})
+            self.assertEqual(stub.searches, {"search": 1, "msearch": 2})
+
+    def test_unreachable(self):
+        with StubElasticsearch(DOCS) as stub:
+            h = self.hunter(stub)
+        self.assertEqual(h.process(msg = {"hash": "aaaa"}), {"hash": "aaaa"})     # unknown, nothing cached
+        self.assertEqual(len(h.negative), 0)
+
+    def test_negative_cache(self):
+        now = [0.0]
+        c = NegativeCache(ttl = 10, size = 2, clock = lambda: now[0])
+        for key in ("a", "b", "c"):
+            c.add(key)
+        self.assertEqual(("a" in c, "b" in c, "c" in c), (False, True, True))
+        now[0] = 10
+        self.assertNotIn("b", c)
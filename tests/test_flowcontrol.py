@@ -0,0 +1,67 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+import pika.exceptions
+from lib.flowcontrol import FlowControl
+
+
+class FakeClock:
+    t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def flow(depths: dict, limits: dict, **kwargs):
+    """A FlowControl on a fake producer whose downstream queues have the given depths."""
+    producer = MagicMock()
+    producer.id = "collector"
+    stats = producer.connection.channel.return_value
+    stats.is_closed = False
+    stats.queue_declare.side_effect = lambda queue, passive: MagicMock(**{"method.message_count": depths[queue]})
+    sleeps = []
+    fc = FlowControl(producer, limits, clock = FakeClock(), sleep = sleeps.append, **kwargs)
+    return fc, producer, sleeps
+
+
+class TestFlowControl(TestCase):
+
+    def test_delay_follows_fill_level(self):
+        depths = {"q1": 10, "q2": 0}
+        fc, producer, sleeps = flow(depths, {"q1": 100, "q2": None}, max_depth = 1000, max_delay = 1.0,
+                                    check_interval = 0)
+        producer.channel.confirm_delivery.assert_called_once()
+        fc.publish(lambda: None)
+        self.assertEqual(sleeps, [])                        # below low_watermark: full speed
+        depths["q1"] = 70
+        fc.publish(lambda: None)
+        self.assertAlmostEqual(sleeps[-1], 0.5)             # half way between the watermarks
+        depths["q1"], depths["q2"] = 0, 950                 # unlimited queue: relative to max_depth
+        fc.publish(lambda: None)
+        self.assertAlmostEqual(sleeps[-1], 1.0)
+
+    def test_refused_messages_are_retried(self):
+        fc, producer, sleeps = flow({"q": 0}, {"q": 100})
+        sent = []
+
+        def send():
+            if len(sent) < 2:
+                sent.append(None)
+                raise pika.exceptions.NackError([])
+            sent.append("ok")
+
+        fc.publish(send)
+        self.assertEqual(sent, [None, None, "ok"])
+        self.assertEqual(sleeps, [0.01, 0.02])
+        self.assertAlmostEqual(fc.backoff, 0.01)
+
+        fc.max_retries = 3
+        with self.assertRaises(RuntimeError):
+            fc.publish(lambda: (_ for _ in ()).throw(pika.exceptions.NackError([])))
+
+    def test_blocked_connection(self):
+        fc, producer, sleeps = flow({}, {})
+        fc._on_blocked(producer.connection, MagicMock())
+        producer.connection.process_data_events.side_effect = lambda time_limit: fc._on_unblocked(None, None)
+        fc.publish(lambda: None)
+        producer.connection.process_data_events.assert_called_once()
+        self.assertFalse(fc.blocked)
@@ -0,0 +1,85 @@
+import hashlib
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from processors.enrichers.hashset.hashset import HashSetEnricher
+from processors.enrichers.hashset.index import HashIndex, append_delta, build, compact, read_hex_lines
+from tests import forget_loggers
+
+
+def hashes(algorithm: str, n: int, start: int = 0):
+    return [hashlib.new(algorithm, b"%d" % i).hexdigest() for i in range(start, start + n)]
+
+
+class TestHashSet(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+        self.md5, self.sha256 = hashes("md5", 100), hashes("sha256", 50)
+        lines = ["# a feed"] + [h.upper() + ",malware" for h in self.md5] + ["not a hash"] + self.sha256 + self.md5[:10]
+        (self.dir / "feed.txt").write_text("\n".join(lines) + "\n")
+
+    def test_build_and_lookup(self):
+        counts = build(self.dir, read_hex_lines([self.dir / "feed.txt"]), run_size = 7)    # 15 runs of MD5s
+        self.assertEqual(counts, {"MD5": 100, "SHA-1": 0, "SHA-256": 50})
+        index = HashIndex(self.dir)
+        self.addCleanup(index.close)
+        self.assertTrue(index.contains("MD5", self.md5[42]))
+        self.assertTrue(index.contains("md5", self.md5[0].upper()))
+        self.assertTrue(index.contains("SHA256", self.sha256[-1]))
+        self.assertFalse(index.contains("SHA-256", hashes("sha256", 1, 1000)[0]))
+        self.assertFalse(index.contains("SHA-1", hashes("sha1", 1)[0]))
+        self.assertFalse(index.contains("MD5", "xyz"))
+        pairs = [("MD5", h) for h in self.md5[::10] + hashes("md5", 5, 500)] + [("SSDEEP", "3:abc")]
+        self.assertEqual(index.contains_many(pairs), set(pairs[:10]))
+        self.assertEqual(index.sets["MD5"].keys.count, 100)
+
+    def test_delta_and_compact(self):
+        build(self.dir, self.md5)
+        index = HashIndex(self.dir)
+        self.addCleanup(index.close)
+        new = hashes("md5", 3, 100)
+        append_delta(self.dir, new)
+        append_delta(self.dir, self.md5[:2], listed = False)
+        self.assertFalse(index.contains("MD5", new[0]))
+        self.assertTrue(index.refresh())
+        self.assertFalse(index.refresh())
+        self.assertTrue(index.contains("MD5", new[0]))
+        self.assertFalse(index.contains("MD5", self.md5[0]))
+        # a line which is still being written is read later
+        with open(self.dir / "md5.delta", 'a') as f:
+            f.write("-" + new[1][:10])
+        index.refresh()
+        self.assertTrue(index.contains("MD5", new[1]))
+        with open(self.dir / "md5.delta", 'a') as f:
+            f.write(new[1][10:] + "\n")
+        index.refresh()
+        self.assertFalse(index.contains("MD5", new[1]))
+        self.assertEqual(compact(self.dir)["MD5"], 100 - 2 + 2)
+        self.assertEqual((self.dir / "md5.delta").read_bytes(), b"")
+        self.assertTrue(index.refresh())
+        self.assertEqual((len(index.sets["MD5"].keys), index.sets["MD5"].added), (100, set()))
+        self.assertEqual(index.contains_many(("MD5", h) for h in new + self.md5[:3]),
+                         {("MD5", new[0]), ("MD5", new[2]), ("MD5", self.md5[2])})
+
+    def test_enricher(self):
+        build(self.dir, self.md5 + self.sha256)
+        self.addCleanup(forget_loggers)
+        e = HashSetEnricher("test-hashset")
+        self.addCleanup(e.shutdown)
+        e.index.close()
+        e.index = HashIndex(self.dir)
+        e.batch_size = 3
+        emitted = []
+        e.emit = lambda msg, trace = None: emitted.append(msg)
+        unknown = hashes("sha256", 1, 1000)[0]
+        for msg in ('{"type": "file", "hashes": {"MD5": "%s", "SHA-256": "%s"}}' % (self.md5[1], unknown),
+                    '{"payload": {"file.sha256": "%s", "hash": "%s"}}' % (self.sha256[3], self.md5[5]),
+                    '{"name": "no hashes"}'):
+            e.mq_msg_callback(msg = msg.encode())
+        self.assertEqual(emitted[0]["x_ioc_hash_match"], ["MD5"])
+        self.assertEqual(emitted[1]["payload"]["ioc_hash_match"], ["MD5", "SHA-256"])
+        self.assertEqual(emitted[2], {"name": "no hashes"})
+        self.assertEqual(e.process(msg = {"md5": hashes("md5", 1, 1000)[0]})["ioc_hash_match"], [])
@@ -0,0 +1,118 @@
+import socket
+import threading
+import time
+import unittest
+from unittest import TestCase
+import redis
+from benchmarks.standins import LocalJSONServer
+from lib.processor.httpenricher import Backend, backend_from_config, retry_after
+from lib.utils.httppool import HTTPResponse
+from lib.utils.ratelimit import RedisTokenBucket, TokenBucket
+
+
+class Clock:
+    def __init__(self, t = 100.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+    def sleep(self, seconds: float):
+        self.t += seconds
+
+
+class ThrottlingServer(LocalJSONServer):
+    """Answers 429 to the first `throttle` requests, then 200. Counts the requests in flight."""
+
+    def __init__(self, throttle: int = 0, retry_after: str = "0", latency: float = 0.0):
+        super().__init__(latency)
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.in_flight = self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def answer(self, method, path, headers, body):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.02)
+        with self._lock:
+            self.in_flight -= 1
+            if self.throttle > 0:
+                self.throttle -= 1
+                return 429, {"error": "slow down"}, {"Retry-After": self.retry_after}
+        return 200, {"path": path}, None
+
+
+class TestHTTPEnricher(TestCase):
+
+    def test_token_bucket(self):
+        clock = Clock()
+        b = TokenBucket(rate = 2, burst = 2, clock = clock)
+        self.assertEqual([b.take(), b.take(), b.take(), b.take()], [0, 0, 0.5, 1.0])    # reserved in order
+        clock.t += 1.0
+        self.assertEqual(b.take(), 0.5)
+        clock.t += 10
+        b.pause(3)
+        self.assertEqual(b.take(), 3)
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after(HTTPResponse(429, "", {"retry-after": "7"}, b"")), 7)
+        self.assertEqual(retry_after(HTTPResponse(429, "", {"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, b""),
+                                     now = 1445412470), 10)
+        self.assertIsNone(retry_after(HTTPResponse(429, "", {}, b"")))
+
+    def test_429_is_retried(self):
+        clock = Clock()
+        with ThrottlingServer(throttle = 2, retry_after = "5") as server:
+            b = Backend("test", server.url, rate = 100, burst = 1, max_retries = 3, sleep = clock.sleep)
+            b.bucket = TokenBucket(100, 1, clock = clock)
+            try:
+                r = b.request("GET", "/x")
+                self.assertEqual((r.status, r.json()), (200, {"path": "/x"}))
+                self.assertEqual((server.requests, b.throttled), (3, 2))
+                self.assertGreaterEqual(clock.t, 110)          # paused twice for 5s
+                self.assertEqual(server.connections, 1)
+                server.throttle = 5
+                self.assertEqual(b.request("GET", "/x").status, 429)        # gave up after 3 retries
+            finally:
+                b.close()
+
+    def test_concurrency_cap(self):
+        with ThrottlingServer() as server:
+            b = Backend("test", server.url, max_concurrency = 2)
+            try:
+                paths = b.map(lambda i: b.request("GET", "/%d" % i).json()["path"], range(8))
+                self.assertEqual(paths, ["/%d" % i for i in range(8)])
+                self.assertEqual(server.max_in_flight, 2)
+                self.assertLessEqual(server.connections, 2)
+            finally:
+                b.close()
+
+    def test_config(self):
+        b = backend_from_config("test", {"url": "http://127.0.0.1:1/api", "rate": 2, "burst": 3, "timeout": 1})
+        self.assertEqual((b.bucket.rate, b.bucket.burst, b.pool.prefix, b.pool.timeout), (2, 3, "/api", 1))
+        b.close()
+        with self.assertRaises(RuntimeError):
+            backend_from_config("test", {"rate": 2})
+
+
+class TestRedisTokenBucket(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            socket.create_connection(("localhost", 6379), 0.5).close()
+        except OSError:
+            raise unittest.SkipTest("redis is not reachable")
+        cls.client = redis.StrictRedis(db = 2)
+
+    def test_shared(self):
+        key = "yellowsub:ratelimit:test"
+        self.client.delete(key)
+        self.addCleanup(self.client.delete, key)
+        a, b = RedisTokenBucket(self.client, key, 1, 2), RedisTokenBucket(self.client, key, 1, 2)
+        self.assertEqual((a.take(), b.take()), (0, 0))
+        self.assertAlmostEqual(a.take(), 1, delta = 0.1)
+        b.pause(30)
+        self.assertAlmostEqual(a.take(), 30, delta = 0.1)
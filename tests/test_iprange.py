@@ -0,0 +1,75 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from processors.enrichers.iprange.index import RangeIndex, build, flatten, read_csv
+from processors.enrichers.iprange.iprange import IPRangeEnricher
+from tests import forget_loggers
+
+CSV = """network,start,end,asn,org
+10.0.0.0/8,,,64512,internal
+10.1.0.0/16,,,64513,lab
+,10.1.2.0,10.1.2.127,64514,
+1.2.3.0/24,,,13335,cloud
+2001:db8::/32,,,64515,docs
+"""
+
+
+class TestIPRange(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+        (self.dir / "ranges.csv").write_text(CSV)
+        self.path = self.dir / "asn.idx"
+        build(self.path, read_csv(self.dir / "ranges.csv"))
+
+    def test_flatten(self):
+        intervals = flatten([(4, 0, 99, {"a": 1}), (4, 10, 19, {"b": 2}), (4, 20, 29, {"a": 1}), (4, 150, 160, {})])
+        self.assertEqual(intervals[4], [(0, 9, '{"a":1}'), (10, 19, '{"b":2}'), (20, 99, '{"a":1}'),
+                                        (150, 160, '{}')])
+        self.assertEqual(intervals[6], [])
+
+    def test_lookup(self):
+        index = RangeIndex(self.path)
+        self.addCleanup(index.close)
+        self.assertEqual(index.counts, {4: 6, 6: 1})
+        self.assertEqual(index.lookup("10.200.0.1"), {"asn": "64512", "org": "internal"})
+        self.assertEqual(index.lookup("10.1.2.3"), {"asn": "64514"})            # the most specific range
+        self.assertEqual(index.lookup("10.1.2.128"), {"asn": "64513", "org": "lab"})
+        self.assertEqual(index.lookup("10.255.255.255")["asn"], "64512")
+        self.assertIsNone(index.lookup("11.0.0.0"))
+        self.assertIsNone(index.lookup("0.0.0.0"))
+        self.assertIsNone(index.lookup("not an ip"))
+        self.assertEqual(index.lookup("2001:db8::1")["org"], "docs")
+        self.assertIsNone(index.lookup("::1"))
+        ips = ["2001:db8::1", "1.2.3.4", "10.1.2.3", "9.9.9.9", "bad", "10.0.0.1", "1.2.3.4"]
+        self.assertEqual(index.lookup_many(ips), {ip: index.lookup(ip) for ip in ips if ip != "bad"})
+
+    def test_reopen(self):
+        index = RangeIndex(self.path)
+        self.addCleanup(index.close)
+        self.assertFalse(index.reopen())
+        build(self.path, [(4, 0, 2 ** 32 - 1, {"asn": "1"})])
+        os.utime(self.path, ns = (1, 1))
+        self.assertTrue(index.reopen())
+        self.assertEqual(index.lookup("10.1.2.3"), {"asn": "1"})
+
+    def test_enricher(self):
+        self.addCleanup(forget_loggers)
+        e = IPRangeEnricher("test-iprange")
+        self.addCleanup(e.shutdown)
+        e.indices = {"asn": RangeIndex(self.path)}
+        e.batch_size = 3
+        emitted = []
+        e.emit = lambda msg, trace = None: emitted.append(msg)
+        for msg in (b'{"type": "ipv4-addr", "value": "10.1.2.3"}',
+                    b'{"payload": {"source.ip": "1.2.3.4", "destination.ip": "8.8.8.8"}}',
+                    b'{"ip": "2001:db8::5"}'):
+            e.mq_msg_callback(msg = msg)
+        self.assertEqual(emitted[0]["x_asn"], {"asn": "64514"})
+        self.assertEqual(emitted[1]["payload"], {"source.ip": "1.2.3.4", "destination.ip": "8.8.8.8",
+                                                 "source.asn": {"asn": "13335", "org": "cloud"}})
+        self.assertEqual(emitted[2]["asn"]["asn"], "64515")
+        self.assertEqual(e.process(msg = {"ip": "10.9.9.9"})["asn"]["org"], "internal")
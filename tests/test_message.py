@@ -0,0 +1,114 @@
+import json
+from unittest import TestCase
+from lib.message import Message, routing_headers, routing_key
+
+SAMPLE = {
+    "format": "s2-common-data-format",
+    "version": 1,
+    "type": "event",
+    "meta": {"uuid": "25c9487c-1ae9-11ec-99a3-b3a261e8732d"},
+    "payload": {"source.ip": "127.0.0.1", "source.fqdn": "example.com"}
+}
+
+
+class TestMessage(TestCase):
+
+    def test_from_bytes_lazy(self):
+        m = Message.from_bytes(json.dumps(SAMPLE).encode('utf-8'))
+        self.assertFalse(m.is_decoded)
+        self.assertEqual(m.type, "event")
+        self.assertEqual(m.uuid, "25c9487c-1ae9-11ec-99a3-b3a261e8732d")
+        self.assertFalse(m.is_decoded)
+        self.assertEqual(m.payload["source.fqdn"], "example.com")
+        self.assertTrue(m.is_decoded)
+
+    def test_slots(self):
+        m = Message.from_dict(SAMPLE)
+        with self.assertRaises(AttributeError):
+            m.foo = 1
+
+    def test_untouched_payload_is_reused(self):
+        raw = '{"format":"f","version":1,"type":"event","meta":{"uuid":"x"},"payload":{"a" :  [1,2,  3]}}'
+        m = Message.from_bytes(raw)
+        m.meta["tag"] = "y"
+        out = m.to_bytes()
+        self.assertIn(b'{"a" :  [1,2,  3]}', out)
+        self.assertEqual(json.loads(out)["meta"], {"uuid": "x", "tag": "y"})
+
+    def test_modified_payload_is_encoded(self):
+        m = Message.from_bytes(json.dumps(SAMPLE))
+        m.payload["ips"] = ["93.184.216.34"]
+        self.assertEqual(json.loads(m.to_bytes())["payload"]["ips"], ["93.184.216.34"])
+
+    def test_roundtrip(self):
+        m = Message.from_bytes(json.dumps(SAMPLE))
+        self.assertEqual(json.loads(m.to_bytes()), SAMPLE)
+        self.assertEqual(Message.from_dict(SAMPLE).to_dict(), SAMPLE)
+
+    def test_non_canonical_order(self):
+        d = {"payload": {"a": 1}, "format": "f", "version": 1, "type": "t", "meta": {"uuid": "u"}}
+        m = Message.from_bytes(json.dumps(d))
+        self.assertEqual(m.payload, {"a": 1})
+        self.assertEqual(m.meta, {"uuid": "u"})
+
+        d = {"format": "f", "version": 1, "type": "t", "meta": {"uuid": "u"}, "payload": {"a": 1}, "x": 2}
+        m = Message.from_bytes(json.dumps(d))
+        self.assertEqual(json.loads(m.to_bytes()), d)
+        self.assertEqual(m.payload, {"a": 1})
+        self.assertEqual(m["x"], 2)
+        self.assertEqual(json.loads(m.to_bytes()), d)
+
+    def test_members_after_the_payload(self):
+        raw = '{"type": "t", "payload": {"s": "}{][", "l": [{"b": null}]}, "x": 2}'
+        m = Message.from_bytes(raw)
+        self.assertIn("x", m)
+        self.assertEqual(m.get("x"), 2)
+        m["x"] = 3
+        self.assertFalse(m.is_decoded)
+        pairs = json.loads(m.to_bytes(), object_pairs_hook = list)
+        self.assertEqual([k for k, _ in pairs], ["type", "x", "payload"])      # no duplicate x
+        self.assertEqual(dict(pairs)["x"], 3)
+        self.assertEqual(m.payload, {"s": "}{][", "l": [{"b": None}]})
+        m = Message.from_bytes(r'{"type": "t", "payload": {"s": "a\"}"}}')
+        self.assertEqual(m.payload, {"s": 'a"}'})
+
+    def test_dict_access(self):
+        m = Message.from_bytes(json.dumps(SAMPLE))
+        assert 'meta' in m
+        assert 'payload' in m
+        self.assertFalse(m.is_decoded)
+        self.assertEqual(m['meta']['uuid'], SAMPLE['meta']['uuid'])
+        m['ips'] = []
+        self.assertEqual(m.get('ips'), [])
+        self.assertIsNone(m.get('nonexistent'))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Message.from_bytes(b'[1, 2]')
+        with self.assertRaises(ValueError):
+            Message.from_bytes(b'{"format": ')
+        for truncated in (b'{"type": "t", "payload": }', b'{"type": "t", "payload": {"a": [1}}',
+                          b'{"type": "t", "payload": {"a": "x}', b'{"type": "t", "payload": {"a": 1}',
+                          b'{"type": "t", "payload": {"a": 1}} trailing', b'{"type": "t" "payload": {}}'):
+            with self.assertRaises(ValueError, msg = truncated):
+                Message.from_bytes(truncated)
+
+    def test_routing_headers(self):
+        d = dict(SAMPLE, meta={"uuid": "u", "observable_type": "domain-name", "tags": ["phishing", "tlp:amber"]})
+        expected = {"type": "event", "observable": "domain-name", "tag.phishing": True, "tag.tlp:amber": True}
+        self.assertEqual(routing_headers(d), expected)
+        m = Message.from_bytes(json.dumps(d))
+        self.assertEqual(routing_headers(m), expected)
+        self.assertFalse(m.is_decoded)
+
+    def test_routing_key(self):
+        self.assertEqual(routing_key(SAMPLE), "event.none")
+        d = dict(SAMPLE, meta={"uuid": "u", "observable_type": "ipv4-addr"})
+        self.assertEqual(routing_key(d), "event.ipv4-addr")
+        # the payload never counts, decoded or not: the route is the same in every processor
+        d = dict(SAMPLE, payload={"type": "ipv4-addr", "value": "127.0.0.1"})
+        self.assertEqual(routing_key(d), "event.none")
+        m = Message.from_bytes(json.dumps(d))
+        self.assertEqual(routing_key(m), "event.none")
+        m.payload
+        self.assertEqual(routing_key(m), "event.none")
@@ -0,0 +1,93 @@
+import tempfile
+import urllib.request
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase
+from lib.metrics import CONTENT_TYPE, REGISTRY, Exporter, ProcessorMetrics, Registry
+from lib.processor.pipeline import Pipeline
+from lib.profiling import PhaseTimings
+from processors.enrichers.gethostbyname.gethostbyname import GetHostByName
+from tests import forget_loggers
+
+
+class Step:
+    """Stands in for a Processor in a Pipeline."""
+
+    def __init__(self, id, fail = False):
+        self.id, self.fail = id, fail
+        self.timings = PhaseTimings()
+        self.config_service = SimpleNamespace(maybe_check = lambda: None)
+        self.logger = SimpleNamespace(error = lambda msg: None)
+
+    def handle(self, channel, method, properties, msg):
+        if self.fail:
+            raise RuntimeError("boom")
+        return msg
+
+    def emit(self, msg, trace = None):
+        pass
+
+
+class TestMetrics(TestCase):
+
+    def test_render(self):
+        r = Registry()
+        timings = PhaseTimings((0.1, 1.0))
+        m = ProcessorMetrics("GetHostByName", "dns", timings, registry = r)
+        m.messages_in.inc(3)
+        m.busy.inc(0.25)
+        timings.observe("process", 0.5)
+        r.counter("yellowsub_cache_hits_total", "Cache hits.").inc()
+        text = r.render()
+        self.assertIn('yellowsub_messages_in_total{processor_class="GetHostByName",processor_id="dns"} 3\n', text)
+        self.assertIn('yellowsub_busy_seconds_total{processor_class="GetHostByName",processor_id="dns"} 0.25\n', text)
+        self.assertIn("# TYPE yellowsub_phase_seconds histogram\n", text)
+        self.assertIn('yellowsub_phase_seconds_bucket{processor_class="GetHostByName",processor_id="dns",phase="process",'
+                      'le="0.1"} 0\n', text)
+        self.assertIn('yellowsub_phase_seconds_bucket{processor_class="GetHostByName",processor_id="dns",phase="process",'
+                      'le="+Inf"} 1\n', text)
+        self.assertIn("yellowsub_cache_hits_total 1\n", text)
+        # same labels, same metric
+        self.assertIs(r.counter("yellowsub_messages_in_total", "", processor_id = "dns",
+                                processor_class = "GetHostByName"), m.messages_in)
+        with self.assertRaises(ValueError):
+            r.gauge("yellowsub_messages_in_total", "")
+
+    def test_pipeline_counts(self):
+        pipe = Pipeline([Step("m1"), Step("m2")])
+        pipe.mq_msg_callback(None, None, None, b'{"x": 1}')
+        pipe.mq_msg_callback(None, None, None, b'not json')
+        self.assertEqual((pipe.metrics.messages_in.value, pipe.metrics.messages_failed.value), (2, 1))
+        failing = Pipeline([Step("m3", fail = True)])
+        with self.assertRaises(RuntimeError):
+            failing.mq_msg_callback(None, None, None, b'{}')
+        self.assertEqual((failing.metrics.messages_failed.value, failing.metrics.in_flight.value), (1, 0))
+        self.assertIn('processor_id="m1+m2"', REGISTRY.render())
+
+    def test_processor_decode_failure(self):
+        self.addCleanup(forget_loggers)
+        g = GetHostByName("metrics-gethostbyname")
+        try:
+            g.mq_msg_callback(msg = b'not json')
+            self.assertEqual((g.metrics.messages_in.value, g.metrics.messages_failed.value), (1, 1))
+            self.assertEqual(g.metrics.in_flight.value, 0)
+        finally:
+            g.shutdown()
+
+    def test_exporter(self):
+        r = Registry()
+        r.counter("yellowsub_test_total", "A test.").inc()
+        with tempfile.TemporaryDirectory() as tmp:
+            blocker = Exporter("a", {"port": 19400, "ports": 50}, registry = r)
+            e = Exporter("a", {"port": blocker.port, "ports": 50, "textfile_dir": tmp}, registry = r)
+            try:
+                self.assertNotEqual(e.port, blocker.port)
+                with urllib.request.urlopen("http://127.0.0.1:%d/metrics" % e.port, timeout = 5) as resp:
+                    self.assertEqual(resp.headers["Content-Type"], CONTENT_TYPE)
+                    self.assertIn(b"yellowsub_test_total 1\n", resp.read())
+                e.write()
+                self.assertIn("yellowsub_test_total 1", e.textfile.read_text())
+            finally:
+                e.close()
+                blocker.close()
+            self.assertEqual(list(Path(tmp).iterdir()), [])
@@ -0,0 +1,105 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from benchmarks.standins import FakeMISPServer
+from processors.enrichers.mispattributesearcher.mispattributesearcher import MispAttributeSearcher
+from processors.enrichers.mispattributesearcher.index import AttributeIndex, sync
+from processors.enrichers.mispattributesearcher.restclient import MISPError, MISPRestClient
+from tests import forget_loggers
+
+
+class Clock:
+    def __init__(self, t = 1000000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+class TestMisp(TestCase):
+
+    def test_rest_client(self):
+        with FakeMISPServer(iocs = ["1.2.3.4", "evil.example.com"]) as server:
+            c = MISPRestClient(server.url, server.key)
+            try:
+                ret = c.search(controller = "attributes", return_format = "json", value = ["1.2.3.4", "5.6.7.8"])
+                self.assertEqual([a["value"] for a in ret["Attribute"]], ["1.2.3.4"])
+                self.assertEqual(c.search(value = "evil.example.com")["Attribute"][0]["value"], "evil.example.com")
+                self.assertEqual(server.connections, 1)         # keep-alive
+                with self.assertRaises(MISPError):
+                    MISPRestClient(server.url, "wrong").search(value = "1.2.3.4")
+            finally:
+                c.close()
+
+    def test_batched_search(self):
+        self.addCleanup(forget_loggers)
+        m = MispAttributeSearcher("test-misp")
+        with FakeMISPServer(iocs = ["1.2.3.4", "9.9.9.9"], max_values = 2) as server:
+            m.misp_connection = MISPRestClient(server.url, server.key)
+            try:
+                m.batch_size, m.misp_search_chunk = 5, 2
+                emitted = []
+                m.emit = lambda msg, trace = None: emitted.append(msg)
+                for value in ("1.2.3.4", "5.6.7.8", "1.2.3.4", None, "9.9.9.9"):
+                    m.mq_msg_callback(msg = b'{"search_value": %s}' % (b'"%s"' % value.encode() if value else b'null'))
+                self.assertEqual(server.values, [2, 1])            # 3 distinct values in chunks of 2
+                self.assertEqual(len(emitted), 5)
+                hits = [msg["misp_attributes"][0]["matched_attributes"][0]["value"] if "misp_attributes" in msg
+                        else None for msg in emitted]
+                self.assertEqual(hits, ["1.2.3.4", None, "1.2.3.4", None, "9.9.9.9"])
+                self.assertEqual(emitted[3], {"search_value": None})
+                # one message at a time
+                self.assertNotIn("misp_attributes", m.process(msg = {"search_value": "5.6.7.8"}))
+            finally:
+                m.shutdown()
+
+    def test_index_sync(self):
+        clock = Clock()
+        iocs = ["1.2.3.4", "Evil.example.com", "5.6.7.8|443"]
+        with tempfile.TemporaryDirectory() as tmp, FakeMISPServer(iocs, clock = clock) as server:
+            c = MISPRestClient(server.url, server.key)
+            index = AttributeIndex(Path(tmp) / "misp.sqlite", clock = clock, refresh = 0)
+            try:
+                self.assertEqual(index.age(), float('inf'))
+                self.assertEqual(sync(c, index, page_size = 2), 3)
+                self.assertEqual(c.requests, 2)
+                self.assertEqual(len(index), 3)
+                self.assertEqual(index.lookup(" evil.EXAMPLE.com")[0]["value"], "Evil.example.com")
+                self.assertEqual(index.lookup("5.6.7.8")[0]["value"], "5.6.7.8|443")
+                self.assertEqual(index.lookup_many(["1.2.3.4", "9.9.9.9"]),
+                                 {"1.2.3.4": index.lookup("1.2.3.4"), "9.9.9.9": []})
+                # incremental: only what changed since the last sync, deleted attributes are removed
+                clock.t += 600
+                self.assertEqual(index.age(), 600)
+                server.misp.add("9.9.9.9")
+                server.misp.add("1.2.3.4", deleted = True)
+                self.assertEqual(sync(c, index, page_size = 100), 4)  # the timestamp filter is >=: 2 unchanged
+                self.assertEqual(index.lookup("1.2.3.4"), [])
+                self.assertEqual(len(index.lookup("9.9.9.9")), 1)
+                self.assertEqual(index.age(), 0)
+                clock.t += 600
+                self.assertEqual(sync(c, index, page_size = 100), 2)
+                self.assertEqual(len(index), 3)
+            finally:
+                index.close()
+                c.close()
+
+    def test_index_mode_and_staleness(self):
+        self.addCleanup(forget_loggers)
+        clock = Clock()
+        m = MispAttributeSearcher("test-misp")
+        with tempfile.TemporaryDirectory() as tmp, FakeMISPServer(["1.2.3.4"], clock = clock) as server:
+            m.misp_connection = MISPRestClient(server.url, server.key)
+            m.misp_index = AttributeIndex(Path(tmp) / "misp.sqlite", clock = clock, refresh = 0)
+            m.misp_index_max_age = 60
+            try:
+                sync(m.misp_connection, m.misp_index)
+                searches = server.misp.searches
+                self.assertEqual(m.search_many(["1.2.3.4", "5.6.7.8"])["1.2.3.4"][0]["value"], "1.2.3.4")
+                self.assertIn("misp_attributes", m.process(msg = {"search_value": "1.2.3.4"}))
+                self.assertEqual(server.misp.searches, searches)        # answered from the index
+                clock.t += 61
+                self.assertIn("misp_attributes", m.process(msg = {"search_value": "1.2.3.4"}))
+                self.assertEqual(server.misp.searches, searches + 1)    # stale: asked live
+            finally:
+                m.shutdown()
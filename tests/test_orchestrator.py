@@ -0,0 +1,183 @@
+from unittest import TestCase
+from lib.orchestrator import Autoscaler, ScalingPolicy, WorkerPool, desired_workers
+from lib.workflow import LaunchSpec
+
+
+class FakePool(WorkerPool):
+    """Counts workers instead of starting processes."""
+
+    def __init__(self):
+        super().__init__()
+        self.n = {}
+
+    def count(self, processor_id):
+        return self.n.get(processor_id, 0)
+
+    def scale(self, spec, n):
+        self.n[spec.processor_id] = n
+
+    def reap(self):
+        pass
+
+
+class FakeStats:
+    def __init__(self):
+        self.depth, self.rate = 0, 0.0
+
+    def get(self, queue):
+        return self.depth, self.rate
+
+
+class FakeClock:
+    t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def spec(pid, src_queue = "q", **options):
+    return LaunchSpec(pid, "gethostbyname", "enrichers", src_queue, (), None, options)
+
+
+class TestOrchestrator(TestCase):
+    policy = ScalingPolicy(min_workers = 1, max_workers = 10, target_drain_seconds = 10, scale_up_cooldown = 5,
+                           scale_down_cooldown = 20)
+
+    def test_desired_workers(self):
+        p = self.policy
+        # 100 msgs/s arriving + 1000 backlog to drain in 10s = 200 msgs/s at 50 msgs/s per worker
+        self.assertEqual(desired_workers(p, 1, 1000, 100.0, 50.0), 4)
+        self.assertEqual(desired_workers(p, 1, 100000, 100.0, 50.0), 10)    # max_workers
+        self.assertEqual(desired_workers(p, 4, 0, 0.0, 50.0), 1)            # idle: min_workers
+        self.assertEqual(desired_workers(p, 3, 5, 0.0, None), 4)            # unknown capacity: one more
+        self.assertEqual(desired_workers(p, 3, 0, 0.0, None), 1)
+        self.assertEqual(desired_workers(p._replace(min_workers = 0), 1, 0, 0.0, None), 0)
+
+    def test_policy_from_dict(self):
+        p = ScalingPolicy.from_dict({"max_workers": 8, "foo": 1}, self.policy)
+        self.assertEqual(p.max_workers, 8)
+        self.assertEqual(p.min_workers, 1)
+        with self.assertRaises(ValueError):
+            ScalingPolicy.from_dict({"min_workers": 5, "max_workers": 2})
+
+    def test_scale_up_drain_and_down(self):
+        pool, stats, clock = FakePool(), FakeStats(), FakeClock()
+        s = spec("dns", autoscale = {"max_workers": 6})
+        a = Autoscaler(pool, stats, [s, spec("collector", None)], self.policy, clock)
+        a.start()
+        self.assertEqual(pool.n, {"dns": 1, "collector": 1})
+
+        # feed spike: 5000 msgs backlog, one worker does 50 msgs/s
+        clock.t, stats.depth, stats.rate = 10, 5000, 50.0
+        a.step()
+        self.assertEqual(pool.count("dns"), 6)          # capped by the per-entry max_workers
+        clock.t, stats.depth, stats.rate = 12, 500, 300.0
+        a.step()
+        self.assertEqual(pool.count("dns"), 6)          # no scale down within the cooldown
+
+        # drained: scale down one worker per scale_down_cooldown, down to min_workers
+        for t in range(40, 400, 21):
+            clock.t, stats.depth, stats.rate = t, 0, 0.0
+            a.step()
+        self.assertEqual(pool.count("dns"), 1)
+        self.assertEqual(pool.count("collector"), 1)
+
+    def test_scale_up_cooldown(self):
+        pool, stats, clock = FakePool(), FakeStats(), FakeClock()
+        a = Autoscaler(pool, stats, [spec("dns")], self.policy, clock)
+        a.start()
+        stats.depth, stats.rate = 100, 0.0              # backlog, capacity unknown: +1 per step past the cooldown
+        for t in (1, 2, 6, 7, 12):
+            clock.t = t
+            a.step()
+        self.assertEqual(pool.count("dns"), 3)
+
+    def test_replace_crashed_worker(self):
+        pool, stats, clock = FakePool(), FakeStats(), FakeClock()
+        a = Autoscaler(pool, stats, [spec("dns", autoscale = {"min_workers": 2})], self.policy, clock)
+        a.start()
+        pool.n["dns"] = 1
+        clock.t = 1
+        a.step()
+        self.assertEqual(pool.count("dns"), 2)
+
+    def test_shared_queue(self):
+        pool, stats, clock = FakePool(), FakeStats(), FakeClock()
+        a = Autoscaler(pool, stats, [spec("a", autoscale = {"max_workers": 3}), spec("b", autoscale = {"max_workers": 2})],
+                       self.policy, clock)
+        a.start()
+        self.assertEqual(pool.n, {"a": 1, "b": 1})
+        # 2 workers at 50 msgs/s each: 50 msgs/s per worker, 6 needed but capped by 3 + 2
+        clock.t, stats.depth, stats.rate = 10, 5000, 100.0
+        a.step()
+        self.assertEqual(pool.n, {"a": 3, "b": 2})
+        self.assertAlmostEqual(a.state["q"].capacity, 50.0)
+        clock.t, stats.depth, stats.rate = 40, 0, 0.0
+        a.step()
+        self.assertEqual(pool.n, {"a": 2, "b": 1})
+
+
+class FakeProcess:
+    def __init__(self):
+        self.alive, self.exitcode = True, None
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.alive, self.exitcode = False, -15
+
+    def die(self, exitcode = 1):
+        self.alive, self.exitcode = False, exitcode
+
+
+class SpawnPool(WorkerPool):
+    def _spawn(self, spec):
+        return FakeProcess()
+
+
+class TestWorkerPool(TestCase):
+
+    def test_crash_backoff_and_give_up(self):
+        clock = FakeClock()
+        pool = SpawnPool(restart_backoff = 1, max_backoff = 4, max_crashes = 5, healthy_after = 60, clock = clock)
+        s = spec("dns")
+        pool.scale(s, 1)
+        delays = []
+        for _ in range(4):
+            pool.workers["dns"][0].die()
+            pool.reap()
+            delays.append(pool.blocked_until["dns"] - clock.t)
+            pool.scale(s, 1)
+            self.assertEqual(pool.count("dns"), 0)       # still in the back-off
+            clock.t += delays[-1]
+            pool.scale(s, 1)
+            self.assertEqual(pool.count("dns"), 1)
+        self.assertEqual(delays, [1, 2, 4, 4])
+        pool.workers["dns"][0].die()
+        pool.reap()
+        self.assertIn("dns", pool.given_up)
+        clock.t += 1000
+        pool.scale(s, 1)
+        self.assertEqual(pool.count("dns"), 0)
+
+    def test_healthy_worker_resets_the_count(self):
+        clock = FakeClock()
+        pool = SpawnPool(restart_backoff = 1, healthy_after = 60, clock = clock)
+        s = spec("dns")
+        for started, lived in ((0, 1), (5, 1), (10, 90)):
+            clock.t = started
+            pool.scale(s, 1)
+            clock.t += lived
+            pool.workers["dns"][0].die()
+            pool.reap()
+        self.assertEqual(pool.crashes["dns"], 1)    # the last one ran for 90s
+
+    def test_finished_collector(self):
+        pool, stats = SpawnPool(clock = FakeClock()), FakeStats()
+        a = Autoscaler(pool, stats, [spec("collector", None)], clock = pool.clock)
+        a.start()
+        pool.workers["collector"][0].die(0)
+        a.step()
+        self.assertEqual(pool.count("collector"), 0)
+        self.assertEqual(pool.finished, {"collector"})
@@ -0,0 +1,89 @@
+import pstats
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import TestCase
+from lib.processor.pipeline import Pipeline
+from lib.profiling import CONTROL_HEADER, Histogram, PhaseTimings, Profiler
+
+
+class Step:
+    """Stands in for a Processor in a Pipeline."""
+
+    def __init__(self, id):
+        self.id = id
+        self.timings = PhaseTimings()
+        self.config_service = SimpleNamespace(maybe_check = lambda: None)
+        self.emitted = []
+
+    def handle(self, channel, method, properties, msg):
+        self.timings.observe("process", 0.001)
+        return msg
+
+    def emit(self, msg, trace = None):
+        self.emitted.append(msg)
+
+
+class TestProfiling(TestCase):
+
+    def test_histogram(self):
+        h = Histogram((0.001, 0.01, 0.1))
+        for v in [0.0005] * 50 + [0.005] * 49 + [1.0]:
+            h.observe(v)
+        self.assertEqual(h.counts, [50, 49, 0, 1])
+        self.assertAlmostEqual(h.quantile(0.5), 0.001)
+        self.assertAlmostEqual(h.quantile(0.25), 0.0005)
+        self.assertEqual(h.quantile(1.0), 0.1)
+        self.assertAlmostEqual(h.mean(), (0.025 + 0.245 + 1.0) / 100)
+        self.assertEqual(Histogram().quantile(0.5), 0.0)
+
+    def test_profiler(self):
+        now = [0.0]
+        with tempfile.TemporaryDirectory() as tmp:
+            p = Profiler("a/b", directory = tmp, seconds = 10, clock = lambda: now[0])
+            self.assertFalse(p.pending)
+            self.assertFalse(p.control({"other": "header"}))
+            self.assertTrue(p.control({CONTROL_HEADER: "profile", "seconds": 5}))
+            self.assertTrue(p.pending)
+            self.assertIsNone(p.tick())
+            self.assertTrue(p.active)
+            sorted(range(1000))
+            now[0] = 4.0
+            self.assertIsNone(p.tick())
+            now[0] = 5.0
+            path = p.tick()
+            self.assertFalse(p.active or p.pending)
+            self.assertTrue(path.name.startswith("a_b."))
+            self.assertGreater(pstats.Stats(str(path)).total_calls, 0)
+            self.assertIsNone(p.stop())
+
+    def test_profiler_timer(self):
+        now, timers = [0.0], []
+        connection = SimpleNamespace(call_later = lambda delay, cb: timers.append((delay, cb)))
+        with tempfile.TemporaryDirectory() as tmp:
+            p = Profiler("idle", directory = tmp, seconds = 10, clock = lambda: now[0])
+            p.attach(connection, interval = 0.5)
+            p.request(2)            # SIGUSR1 on an idle worker
+            self.assertFalse(p.active)
+            timers.pop(0)[1]()
+            self.assertTrue(p.active)
+            now[0] = 2.0
+            timers.pop(0)[1]()
+            self.assertFalse(p.active or p.pending)
+            self.assertEqual(len(list(Path(tmp).glob("idle.*.prof"))), 1)
+            self.assertEqual(len(timers), 1)
+            self.assertEqual(timers[0][0], 0.5)
+
+    def test_pipeline_timings_and_control(self):
+        a, b = Step("a"), Step("b")
+        pipe = Pipeline([a, b])
+        pipe.mq_msg_callback(None, None, SimpleNamespace(headers = None), b'{"x": 1}')
+        self.assertEqual(b.emitted, [{"x": 1}])
+        self.assertEqual(set(pipe.timings.phases), {"decode", "publish"})
+        self.assertEqual(a.timings.phases["process"].count, 1)
+        # a control message is not processed
+        pipe.mq_msg_callback(None, None, SimpleNamespace(headers = {CONTROL_HEADER: "profile"}), b'{}')
+        self.assertEqual(len(b.emitted), 1)
+        self.assertTrue(pipe.profiler.pending)
+        pipe.profiler._requested = None
+        pipe.profiler.pending = False
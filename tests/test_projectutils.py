@@ -1,7 +1,7 @@
 import inspect
 from builtins import RuntimeError
 from unittest import TestCase
-from lib.utils.projectutils import ProjectUtils
+from lib.utils.projectutils import ProjectUtils, QueuedHandler, RateLimitFilter
 import os
 import sys
 import logging
@@ -125,9 +125,12 @@ class TestProjectUtils(TestCase):
 
         root_logger = logging.getLogger("yellowsub")
         self.assertEqual(root_logger.hasHandlers(), True)
-        self.assertEqual(root_logger.getEffectiveLevel(), 10)
+        # the logger level is raised to the lowest handler level (INFO): DEBUG records are not even created
+        self.assertEqual(root_logger.getEffectiveLevel(), 20)
 
-        root_logger_handlers = root_logger.handlers
+        # the file handlers write from a background thread, behind one QueuedHandler
+        self.assertEqual(type(root_logger.handlers[0]).__name__, "QueuedHandler")
+        root_logger_handlers = root_logger.handlers[0].listener.handlers
         h = root_logger_handlers[0]
         self.assertEqual(h.level, 20)
         self.assertEqual(type(h).__name__, "TimedRotatingFileHandler")
@@ -189,9 +192,12 @@ class TestProjectUtils(TestCase):
         #                  both for this as well as testing the root logger setup private method.
         root_logger = logging.getLogger("yellowsub")
         self.assertEqual(root_logger.hasHandlers(), True)
-        self.assertEqual(root_logger.getEffectiveLevel(), 10)
+        # the logger level is raised to the lowest handler level (INFO): DEBUG records are not even created
+        self.assertEqual(root_logger.getEffectiveLevel(), 20)
 
-        root_logger_handlers = root_logger.handlers
+        # the file handlers write from a background thread, behind one QueuedHandler
+        self.assertEqual(type(root_logger.handlers[0]).__name__, "QueuedHandler")
+        root_logger_handlers = root_logger.handlers[0].listener.handlers
         h = root_logger_handlers[0]
         self.assertEqual(h.level, 20)
         self.assertEqual(type(h).__name__, "TimedRotatingFileHandler")
@@ -229,9 +235,12 @@ class TestProjectUtils(TestCase):
         #                  both for this as well as testing the root logger setup private method.
         root_logger = logging.getLogger("yellowsub")
         self.assertEqual(root_logger.hasHandlers(), True)
-        self.assertEqual(root_logger.getEffectiveLevel(), 10)
+        # the logger level is raised to the lowest handler level (INFO): DEBUG records are not even created
+        self.assertEqual(root_logger.getEffectiveLevel(), 20)
 
-        root_logger_handlers = root_logger.handlers
+        # the file handlers write from a background thread, behind one QueuedHandler
+        self.assertEqual(type(root_logger.handlers[0]).__name__, "QueuedHandler")
+        root_logger_handlers = root_logger.handlers[0].listener.handlers
         h = root_logger_handlers[0]
         self.assertEqual(h.level, 20)
         self.assertEqual(type(h).__name__, "TimedRotatingFileHandler")
@@ -279,9 +288,10 @@ class TestProjectUtils(TestCase):
 
         processor_logger = logging.getLogger("yellowsub.MispAttributeSearcher.testId")
         self.assertEqual(processor_logger.hasHandlers(), True)
-        self.assertEqual(processor_logger.getEffectiveLevel(), 10)
+        self.assertEqual(processor_logger.getEffectiveLevel(), 20)
 
-        processor_logger_handlers = processor_logger.handlers
+        self.assertEqual(type(processor_logger.handlers[0]).__name__, "QueuedHandler")
+        processor_logger_handlers = processor_logger.handlers[0].listener.handlers
         h = processor_logger_handlers[0]
         self.assertEqual(h.level, 20)
         self.assertEqual(type(h).__name__, "TimedRotatingFileHandler")
@@ -327,6 +337,59 @@ class TestProjectUtils(TestCase):
         with self.assertRaises(NotImplementedError):
             ProjectUtils.configure_logger(config, "MispAttributeSearcher", "testId")
 
+    def test_rate_limit_filter(self):
+        now = [0.0]
+        f = RateLimitFilter(rate = 1, burst = 2, clock = lambda: now[0])
+
+        def record(msg, level = logging.INFO, name = "yellowsub.a"):
+            return logging.LogRecord(name, level, __file__, 1, msg, ("x",), None)
+
+        self.assertEqual([f.filter(record("got %s")) for _ in range(4)], [True, True, False, False])
+        self.assertTrue(f.filter(record("other %s")))
+        self.assertTrue(f.filter(record("got %s", logging.WARNING)))
+        now[0] = 1.0
+        r = record("got %s")
+        self.assertTrue(f.filter(r))
+        self.assertFalse(hasattr(r, "suppressed"))     # the record is shared by all handlers
+        self.assertEqual(f.take(record("got %s")), 0)
+        self.assertEqual(f.take(r), 2)
+        self.assertEqual(f.take(r), 0)
+
+    def test_queued_handler(self):
+        class ListHandler(logging.Handler):
+            def __init__(self):
+                super().__init__(logging.INFO)
+                self.lines = []
+
+            def emit(self, record):
+                self.lines.append(self.format(record))
+
+        target = ListHandler()
+        h = QueuedHandler([target])
+        now = [0.0]
+        h.addFilter(RateLimitFilter(rate = 1, burst = 1, clock = lambda: now[0]))
+        logger = logging.getLogger("yellowsub.test_queued_handler")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(h)
+        try:
+            msg = {"n": 1}
+            logger.info("sent %r", msg)
+            msg["n"] = 2            # the message is merged on the logging thread: later changes don't show
+            logger.info("sent %r", msg)
+            logger.debug("below the handler level")
+            logger.info("sent %r", msg)
+            h.stop()
+            self.assertEqual(target.lines, ["sent {'n': 1}"])
+            h.restart()
+            logger.warning("after %s", "restart")
+            now[0] = 10.0
+            logger.info("sent %r", msg)
+        finally:
+            logger.removeHandler(h)
+            h.close()
+        self.assertEqual(target.lines[-2:], ["after restart", "sent {'n': 2} (2 similar messages suppressed)"])
+
 
 if __name__ == '__main__':
     class_names = [(name, cls) for name, cls in inspect.getmembers(sys.modules[__name__], inspect.isclass) if
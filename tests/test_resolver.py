@@ -0,0 +1,102 @@
+import socket
+from unittest import TestCase
+from benchmarks.standins import StubDNSServer, _fake_address
+from processors.enrichers.gethostbyname.gethostbyname import GetHostByName, resolver_from_config
+from processors.enrichers.gethostbyname.resolver import (QTYPE_A, RCODE_NXDOMAIN, Resolver, build_query,
+                                                         parse_response)
+from tests import forget_loggers
+
+
+class Clock:
+    def __init__(self, t = 1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+class TestResolver(TestCase):
+
+    def test_wire_format(self):
+        with StubDNSServer(ttl = 120) as stub:
+            r = parse_response(stub.answer(build_query(4711, "Example.COM", QTYPE_A)))
+            self.assertEqual((r.qid, r.rcode, r.name, r.qtype), (4711, 0, "example.com", QTYPE_A))
+            self.assertEqual((r.addresses, r.ttl), ([_fake_address("example.com")], 120))
+            r = parse_response(stub.answer(build_query(1, "no.invalid", QTYPE_A)))
+            self.assertEqual((r.rcode, r.addresses, r.negative_ttl), (RCODE_NXDOMAIN, [], 60))
+
+    def test_resolve_many_and_cache(self):
+        clock = Clock()
+        names = ["host%d.example.com" % i for i in range(300)] + ["gone.invalid"]
+        with StubDNSServer(ttl = 300, negative_ttl = 60, latency = 0.05) as stub:
+            r = Resolver([stub.address], timeout = 1.0, clock = clock)
+            try:
+                answers = r.resolve_many(names + ["HOST0.example.com."])
+                self.assertEqual(answers["host7.example.com"], [_fake_address("host7.example.com", 1),
+                                                                _fake_address("host7.example.com", 28)])
+                self.assertEqual(answers["HOST0.example.com."], answers["host0.example.com"])
+                self.assertEqual(answers["gone.invalid"], [])
+                self.assertGreaterEqual(r.queries, 2 * len(names))
+                # from the cache
+                sent = r.queries
+                self.assertEqual(r.resolve("host7.example.com"), answers["host7.example.com"])
+                self.assertEqual(r.resolve("gone.invalid"), [])
+                self.assertEqual(r.queries, sent)
+                # the NXDOMAIN expires first
+                clock.t += 61
+                r.resolve_many(["host7.example.com", "gone.invalid"])
+                self.assertEqual(r.queries, sent + 2)
+            finally:
+                r.close()
+
+    def test_truncated_answers_over_tcp(self):
+        with StubDNSServer(truncate = ["big.example.com"]) as stub:
+            r = Resolver([stub.address], timeout = 1.0)
+            try:
+                self.assertEqual(r.resolve("big.example.com")[0], _fake_address("big.example.com"))
+                self.assertEqual(stub.queries["tcp"], 2)
+            finally:
+                r.close()
+
+    def test_timeout(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(("127.0.0.1", 0))       # never answers
+        r = Resolver(["127.0.0.1:%d" % s.getsockname()[1]], timeout = 0.05, retries = 1)
+        try:
+            self.assertEqual(r.resolve_many(["a.example.com", "b.example.com"]),
+                             {"a.example.com": [], "b.example.com": []})
+            self.assertEqual(r.queries, 8)
+            self.assertEqual(r.cache, {})           # failures are not cached
+        finally:
+            r.close()
+            s.close()
+
+    def test_config(self):
+        self.assertIsNone(resolver_from_config({"dns_recursor": "system"}))
+        r = resolver_from_config({"dns_recursor": ["127.0.0.1:5353", "::1"], "dns_timeout": 0.5})
+        self.assertEqual((r.servers, r.timeout), ([("127.0.0.1", 5353), ("::1", 53)], 0.5))
+        with self.assertRaises(ValueError):
+            resolver_from_config({"dns_recursor": []})
+
+    def test_enricher_batch(self):
+        self.addCleanup(forget_loggers)
+        g = GetHostByName("test-gethostbyname")
+        with StubDNSServer() as stub:
+            g.resolver.close()
+            g.resolver = Resolver([stub.address], timeout = 1.0)
+            try:
+                g.batch_size = 3
+                g.mq_msg_callback(msg = b'{"fqdn": "a.example.com"}')
+                g.mq_msg_callback(msg = b'{"other": 1}')
+                self.assertEqual(stub.queries["udp"], 0)
+                emitted = []
+                g.emit = lambda msg, trace = None: emitted.append(msg)
+                g.mq_msg_callback(msg = b'{"fqdn": "b.example.com"}')
+                self.assertEqual(emitted, [{"fqdn": "a.example.com", "ips": g.resolver.resolve("a.example.com")},
+                                           {"other": 1},
+                                           {"fqdn": "b.example.com", "ips": g.resolver.resolve("b.example.com")}])
+                self.assertEqual(stub.queries["udp"], 4)
+                self.assertEqual(g.metrics.in_flight.value, 0)
+                self.assertEqual(g.timings.phases["process_batch"].count, 1)
+            finally:
+                g.shutdown()
@@ -0,0 +1,66 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from benchmarks.standins import InMemoryBroker
+from lib.mq import MQ, Producer
+from lib.tracing import (TRACE_HEADER, Tracer, edge_stats, format_waterfall, load_paths, parse_stamp,
+                         waterfall_rows)
+
+
+class Clock:
+    def __init__(self, t = 1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+class TestTracing(TestCase):
+
+    def test_stamps_across_hops(self):
+        clock = Clock()
+        broker = InMemoryBroker()
+        MQ.connection_factory = broker.connect
+        try:
+            ch = broker.connect().channel()
+            ch.exchange_declare("ex.collect", "fanout")
+            ch.queue_declare("q.enrich")
+            ch.queue_bind("q.enrich", "ex.collect")
+            producer = Producer("collect", "ex.collect", declare = False)
+            with tempfile.TemporaryDirectory() as tmp:
+                self.assertIsNone(Tracer("collect", sample_rate = 0.0, directory = tmp).sample())
+                collector = Tracer("collect", sample_rate = 0.5, directory = tmp, clock = clock, rand = lambda: 0.1)
+                trace = collector.sample()
+                clock.t += 0.001
+                producer.produce({"type": "event"}, trace = trace)
+
+                _, _, body, properties = broker.queues["q.enrich"].messages.popleft()
+                self.assertEqual(parse_stamp(properties.headers[TRACE_HEADER][0]),
+                                 {"id": "collect", "received": 1000.0, "done": 1000.0, "published": 1000.001})
+                clock.t += 0.25                                 # waits in q.enrich
+                enricher = Tracer("enrich", directory = tmp, clock = clock)
+                self.assertIsNone(enricher.begin({"other": "header"}))
+                trace = enricher.begin(properties.headers)
+                clock.t += 0.05                                 # process()
+                trace.done = clock()
+                enricher.finish(trace)                          # end of the path
+                enricher._file.close()
+
+                traces = load_paths(str(p) for p in Path(tmp).glob("*.jsonl"))
+        finally:
+            MQ.connection_factory = None
+        self.assertEqual(list(traces), [trace.trace_id])
+        rows = waterfall_rows(traces[trace.trace_id])
+        self.assertEqual([r["id"] for r in rows], ["collect", "enrich"])
+        waits, service = edge_stats(traces)
+        self.assertAlmostEqual(waits["collect -> enrich"].sum, 0.25, places = 5)
+        self.assertAlmostEqual(service["enrich"].sum, 0.05, places = 5)
+        self.assertIn("enrich", format_waterfall(trace.trace_id, traces[trace.trace_id]))
+
+    def test_fan_out_paths_share_the_prefix(self):
+        origin = "a 1.000000 1.100000 1.200000"
+        paths = [{"trace_id": "t", "hops": [parse_stamp(origin), parse_stamp("b 1.300000 1.400000 -")]},
+                 {"trace_id": "t", "hops": [parse_stamp(origin), parse_stamp("c 1.500000 1.600000 -")]}]
+        rows = waterfall_rows(paths)
+        self.assertEqual([(r["id"], r["depth"]) for r in rows], [("a", 0), ("b", 1), ("c", 1)])
+        self.assertAlmostEqual(rows[2]["wait"], 0.3)
@@ -0,0 +1,74 @@
+from unittest import TestCase
+from lib.datamodel.validators import get_validator
+from lib.message import Message
+
+
+class TestSemanticValidator(TestCase):
+    v = get_validator()
+
+    def test_url(self):
+        assert self.v.is_url("https://example.com/a?b=c#d")
+        assert self.v.is_url("mailto:foo@example.com")
+        assert self.v.is_url("http://[2001:db8::1]:8080/%20x")
+        assert not self.v.is_url("example.com/foo")
+        assert not self.v.is_url("http:///foo")
+        assert not self.v.is_url("http://exa mple.com/")
+        assert not self.v.is_url("http://example.com/%zz")
+        assert not self.v.is_url(None)
+
+    def test_ip(self):
+        assert self.v.is_ipv4("127.0.0.1")
+        assert self.v.is_ipv4("10.0.0.0/8")
+        assert not self.v.is_ipv4("256.1.1.1")
+        assert not self.v.is_ipv4("1.2.3.4/33")
+        assert not self.v.is_ipv4("1.2.3.4\n")
+        assert self.v.is_ipv6("2001:db8::1")
+        assert self.v.is_ipv6("2001:db8::/32")
+        assert not self.v.is_ipv6("2001:db8:::1")
+        assert not self.v.is_ipv6("127.0.0.1")
+        assert self.v.is_ip("::1") and self.v.is_ip("1.1.1.1")
+
+    def test_domain(self):
+        assert self.v.is_domain("example.com")
+        assert self.v.is_domain("_dmarc.example.com.")
+        assert self.v.is_domain("bücher.example")
+        assert not self.v.is_domain("-foo.example.com")
+        assert not self.v.is_domain("foo..com")
+        assert not self.v.is_domain("1.2.3.4")
+        assert not self.v.is_domain("a" * 64 + ".com")
+        assert not self.v.is_domain("localhost")
+
+    def test_timestamp(self):
+        assert self.v.is_timestamp("2021-09-21T10:11:12Z")
+        assert self.v.is_timestamp("2020-02-29T10:11:12.123Z")
+        assert not self.v.is_timestamp("2021-02-29T10:11:12Z")
+        assert not self.v.is_timestamp("2021-09-21T10:11:12+02:00")
+        assert not self.v.is_timestamp("2021-13-01T10:11:12Z")
+
+    def test_hashes(self):
+        assert self.v.is_hashes({"MD5": "d41d8cd98f00b204e9800998ecf8427e"})
+        assert self.v.is_hashes({"SHA-256": 64 * "a", "sha1": 40 * "F"})
+        assert self.v.is_hashes({"my-custom-hash": "whatever"})
+        assert not self.v.is_hashes({"MD5": "d41d8cd98f00b204e9800998ecf8427"})
+        assert not self.v.is_hashes({"MD5": "x41d8cd98f00b204e9800998ecf8427e"})
+        assert not self.v.is_hashes({"x": "too short a key"})
+        assert not self.v.is_hashes({})
+
+    def test_email(self):
+        assert self.v.is_email("foo.bar+baz@example.com")
+        assert not self.v.is_email("foo@bar@example.com")
+        assert not self.v.is_email("foo@-example.com")
+
+    def test_validate_payload(self):
+        assert self.v.validate_payload({"source.ip": "127.0.0.1", "source.fqdn": "example.com", "comment": "x"})
+        assert not self.v.validate_payload({"source.ip": "127.0.0.300"})
+        assert not self.v.validate_payload({"riskiq.domains": ["a.b.com"], "destination.url": "nope"})
+        assert self.v.validate_payload({"file.md5": "d41d8cd98f00b204e9800998ecf8427e", "time.observation": None})
+        assert self.v.validate_payload({"type": "domain-name", "value": "example.com"})
+        assert not self.v.validate_payload({"type": "ipv4-addr", "value": "example.com"})
+        assert not self.v.validate_payload("not a dict")
+
+    def test_validate_batch(self):
+        good = {"type": "event", "meta": {"uuid": "u"}, "payload": {"source.ip": "127.0.0.1"}}
+        bad = {"type": "event", "meta": {"uuid": "u"}, "payload": {"source.ip": "localhost"}}
+        self.assertEqual(self.v.validate_batch([good, bad, Message.from_dict(good)]), [True, False, True])
@@ -0,0 +1,181 @@
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import MagicMock
+import yaml
+from lib.config import ROOTDIR
+from lib.processor.pipeline import Pipeline
+from lib.processor.processor import Processor
+from lib.workflow import Binding, Workflow, load_processor_class
+
+
+def linear(n: int) -> dict:
+    """A linear workflow p0 -> p1 -> ... -> p<n-1>."""
+    ids = ["p%d" % i for i in range(n)]
+    return {
+        "Nodes": [{"enrichers": [{"gethostbyname": {"id": pid}} for pid in ids]}],
+        "Edges": [{"src": a, "dst": b} for a, b in zip(ids, ids[1:])],
+        "Workflow": [{"processor_id": pid, "src_queue": "q.%s" % pid if i else None,
+                      "dst_exchg": ["ex.%s" % pid] if i < n - 1 else []} for i, pid in enumerate(ids)]
+    }
+
+
+class TestWorkflow(TestCase):
+
+    def test_sample_workflow(self):
+        wf = Workflow(str(Path(ROOTDIR) / "etc/workflow.yml"))
+        self.assertEqual(wf.order[0], "url_collector")
+        self.assertEqual(wf.order[-1], "url_writer")
+        self.assertEqual(set(wf.exchanges), {"ex1", "ex2", "ex15"})
+        self.assertEqual(set(wf.queues), {"ex1.q1.sb", "ex15.q1.writer"})
+        # ex1.q1.sb is only bound to ex1, not ex2, and only once even though two processors consume from it
+        self.assertEqual(sorted(wf.bindings), [Binding("ex1.q1.sb", "ex1", None, None),
+                                               Binding("ex15.q1.writer", "ex15", None, None)])
+        specs = {s.processor_id: s for s in wf.launch_specs()}
+        self.assertEqual(specs["url_writer"].config, "etc/url_writer.yml")
+        self.assertEqual(specs["url_collector"].dst_exchanges, ("ex1", "ex2"))
+        self.assertIsNone(specs["url_collector"].src_queue)
+        # every type of the sample workflow can be started
+        for spec in specs.values():
+            self.assertTrue(issubclass(load_processor_class(spec.type), Processor), spec.type)
+
+    def test_provision_single_channel(self):
+        wf = Workflow.from_dict(linear(50))
+        mq = MagicMock()
+        wf.provision(mq)
+        self.assertEqual(mq.channel.exchange_declare.call_count, 49)
+        self.assertEqual(mq.channel.queue_declare.call_count, 49)
+        self.assertEqual(mq.channel.queue_bind.call_count, 49)
+        self.assertEqual(len(wf.launch_specs()), 50)
+
+    def test_invalid(self):
+        wf = linear(3)
+        wf["Edges"].append({"src": "p2", "dst": "p0"})
+        wf["Workflow"][0]["src_queue"] = "q.p0"
+        wf["Workflow"][2]["dst_exchg"] = ["ex.p2"]
+        with self.assertRaisesRegex(ValueError, "cycle"):
+            Workflow.from_dict(wf)
+
+        wf = linear(3)
+        wf["Edges"].append({"src": "p1", "dst": "nope"})
+        with self.assertRaisesRegex(ValueError, "unknown node"):
+            Workflow.from_dict(wf)
+
+        wf = linear(3)
+        wf["Workflow"][1]["src_queue"] = None
+        with self.assertRaisesRegex(ValueError, "no src_queue"):
+            Workflow.from_dict(wf)
+
+        wf = linear(3)
+        del wf["Workflow"][2]
+        with self.assertRaisesRegex(ValueError, "no Workflow entry"):
+            Workflow.from_dict(wf)
+
+        wf = linear(3)
+        wf["Nodes"][0]["enrichers"][1] = {"no_such_type": {"id": "p1"}}
+        with self.assertRaisesRegex(ValueError, "unknown processor type 'no_such_type'"):
+            Workflow.from_dict(wf)
+        self.assertEqual(Workflow.from_dict(wf, known_types = ["no_such_type"]).nodes["p1"]["type"], "no_such_type")
+        wf["Nodes"][0]["enrichers"][1] = {"my.module:MyEnricher": {"id": "p1"}}
+        Workflow.from_dict(wf)
+
+    def test_queue_limits_and_flow_control(self):
+        wf = linear(3)
+        wf["Workflow"][1].update(max_length = 1000, overflow = "reject-publish")
+        wf["Workflow"][0]["flow_control"] = {"max_delay": 2}
+        w = Workflow.from_dict(wf)
+        self.assertEqual(w.queues["q.p1"], {"x-max-length": 1000, "x-overflow": "reject-publish"})
+        self.assertEqual(w.queues["q.p2"], {})
+        specs = w.launch_specs()
+        self.assertEqual(specs[0].options["flow_control"], {"max_delay": 2, "queues": {"q.p1": 1000}})
+        self.assertNotIn("flow_control", specs[1].options)
+
+        wf["Workflow"][1]["overflow"] = "explode"
+        with self.assertRaisesRegex(ValueError, "overflow"):
+            Workflow.from_dict(wf)
+
+        wf = linear(3)
+        wf["Workflow"].append({"processor_id": "p3", "src_queue": "q.p1", "max_length": 5})
+        wf["Nodes"][0]["enrichers"].append({"gethostbyname": {"id": "p3"}})
+        wf["Workflow"][1]["max_length"] = 10
+        with self.assertRaisesRegex(ValueError, "different limits"):
+            Workflow.from_dict(wf)
+
+        for bad in (0, True, -1, "10"):
+            wf = linear(2)
+            wf["Workflow"][1]["max_length"] = bad
+            with self.assertRaisesRegex(ValueError, "positive integer"):
+                Workflow.from_dict(wf)
+
+    def test_flow_control_and_shared_exchange(self):
+        # p0 feeds q.p1 (reject-publish) and q.p2 through the same exchange: a retry would duplicate into q.p2
+        wf = linear(2)
+        wf["Nodes"][0]["enrichers"].append({"gethostbyname": {"id": "p2"}})
+        wf["Edges"].append({"src": "p0", "dst": "p2"})
+        wf["Workflow"].append({"processor_id": "p2", "src_queue": "q.p2", "dst_exchg": []})
+        wf["Workflow"][1].update(max_length = 10, overflow = "reject-publish")
+        Workflow.from_dict(wf)
+        wf["Workflow"][0]["flow_control"] = True
+        with self.assertRaisesRegex(ValueError, "twice"):
+            Workflow.from_dict(wf)
+        wf["Workflow"][0]["flow_control"] = {"confirm": False}
+        Workflow.from_dict(wf)
+
+    def test_fuse_linear_chain(self):
+        wf = linear(4)
+        wf["Options"] = {"fuse": True}
+        wf["Workflow"][3]["dst_exchg"] = ["out"]
+        w = Workflow.from_dict(wf)
+        # p0 has no src_queue: it can't be the head of a chain
+        self.assertEqual(w.chains, [["p0"], ["p1", "p2", "p3"]])
+        self.assertEqual(w.exchanges, {"ex.p0": "fanout", "out": "fanout"})
+        self.assertEqual(w.queues, {"q.p1": {}})
+        self.assertEqual(w.bindings, [Binding("q.p1", "ex.p0", None, None)])
+        source, spec = w.launch_specs()
+        self.assertIsNone(source.src_queue)
+        self.assertEqual(spec.processor_id, "p1+p2+p3")
+        self.assertEqual(spec.src_queue, "q.p1")
+        self.assertEqual(spec.dst_exchanges, ("out",))
+        self.assertEqual([m.processor_id for m in spec.chain], ["p1", "p2", "p3"])
+
+    def test_fuse_refuses_filtered_edges(self):
+        for change in ({"routing_key": "*.url"}, {"bind_arguments": {"x-match": "any"}}, {"max_length": 100}):
+            wf = linear(4)
+            wf["Options"] = {"fuse": True}
+            wf["Workflow"][2].update(change)
+            self.assertEqual(Workflow.from_dict(wf).chains, [["p0"], ["p1"], ["p2", "p3"]], change)
+        wf = linear(4)
+        wf["Options"] = {"fuse": True}
+        wf["Workflow"][2]["exchange_type"] = "topic"
+        self.assertEqual(Workflow.from_dict(wf).chains, [["p0"], ["p1", "p2"], ["p3"]])
+
+    def test_fuse_stops_at_fan_out_and_opt_out(self):
+        with open(Path(ROOTDIR) / "etc/workflow.yml") as f:
+            wf = yaml.safe_load(f)
+        wf["Options"] = {"fuse": True}
+        self.assertEqual(len(Workflow.from_dict(wf).chains), 4)    # fan-out and fan-in everywhere, nothing to fuse
+
+        wf = linear(4)
+        wf["Options"] = {"fuse": True}
+        wf["Workflow"][2]["fuse"] = False
+        w = Workflow.from_dict(wf)
+        self.assertEqual(w.chains, [["p0"], ["p1"], ["p2"], ["p3"]])
+        self.assertEqual(set(w.queues), {"q.p1", "q.p2", "q.p3"})
+
+        wf = linear(5)
+        wf["Options"] = {"fuse": True}
+        wf["Workflow"][3]["fuse"] = False
+        w = Workflow.from_dict(wf)
+        self.assertEqual(w.chains, [["p0"], ["p1", "p2"], ["p3"], ["p4"]])
+        self.assertEqual(set(w.queues), {"q.p1", "q.p3", "q.p4"})
+        self.assertEqual([s.processor_id for s in w.launch_specs()], ["p0", "p1+p2", "p3", "p4"])
+
+    def test_pipeline_run(self):
+        class Step:
+            def __init__(self, id, drop=False):
+                self.id, self.drop = id, drop
+
+            def handle(self, channel, method, properties, msg):
+                return None if self.drop else dict(msg, path=msg.get("path", []) + [self.id])
+
+        self.assertEqual(Pipeline([Step("a"), Step("b")]).run({"x": 1}), {"x": 1, "path": ["a", "b"]})
+        self.assertIsNone(Pipeline([Step("a", drop=True), Step("b")]).run({"x": 1}))
@@ -0,0 +1,48 @@
+import gc
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from lib.orchestrator import WorkerPool
+from lib.workflow import LaunchSpec
+from lib.zygote import Zygote
+
+
+def spec(pid, type = "gethostbyname", chain = ()):
+    return LaunchSpec(pid, type, "enrichers", "q", (), None, {}, chain)
+
+
+class TestZygote(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.zygote = Zygote(["no_such_type"])       # a broken processor type only logs a warning
+
+    @classmethod
+    def tearDownClass(cls):
+        gc.unfreeze()       # the preload froze everything the test process had allocated
+
+    def test_preload(self):
+        self.assertGreater(gc.get_freeze_count(), 0)
+        self.assertEqual(Zygote.processor_types([spec("a"), spec("b+c", "pipeline", (spec("b", "x"), spec("c", "y")))]),
+                         {"gethostbyname", "x", "y"})
+
+    def test_spawn_and_exit_codes(self):
+        with patch("lib.zygote.launch", lambda s: None):
+            w = self.zygote.spawn(spec("ok"))
+        w.join(5)
+        self.assertEqual(w.exitcode, 0)
+        with patch("lib.zygote.launch", lambda s: 1 / 0):
+            w = self.zygote.spawn(spec("broken"))
+        w.join(5)
+        self.assertEqual(w.exitcode, 1)
+
+    def test_pool_terminates_forked_workers(self):
+        with patch("lib.zygote.launch", lambda s: time.sleep(30)):
+            pool = WorkerPool(stop_timeout = 5, zygote = self.zygote)
+            pool.scale(spec("sleepy"), 2)
+        pids = [w.pid for w in pool.workers["sleepy"]]
+        self.assertTrue(all(w.is_alive() for w in pool.workers["sleepy"]))
+        self.assertNotIn(os.getpid(), pids)
+        pool.stop_all()
+        self.assertEqual(pool.workers, {})